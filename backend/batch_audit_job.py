@@ -1,120 +1,135 @@
 """
-BATCH AUDIT JOB - Complete Analysis of 8,218 supplier_items
+BATCH AUDIT JOB - Complete Analysis of ALL active supplier_items
 
 Performs comprehensive audit:
 1. Data Quality Audit - checks each item
-2. Matching Audit - simulates search
+2. Matching Audit - simulates search for EVERY active item (без сэмплинга)
 3. Bad Matches Detection - автовыявление проблем
+4. Diff против предыдущего прогона (audit_diff.json)
+
+Производительность:
+- Guards (FORBIDDEN / REQUIRED anchors) зависят только от (кандидат, super_class),
+  поэтому считаются один раз на super_class, а не на каждую пару reference×candidate
+- Fallback на 'other' использует token-blocking индекс (token → items) вместо
+  перебора всего каталога (было O(n²))
+- Анализ товаров и guards выполняются в пуле процессов
+- CSV пишутся построчно, в памяти не копятся списки результатов
 
 Output: CSV и JSON отчёты в /app/backend/audits/<timestamp>/
+
+Запуск:
+    python batch_audit_job.py                   # весь каталог, пул = cpu_count
+    python batch_audit_job.py --workers 8
+    python batch_audit_job.py --sample-every 8  # старый режим (каждый 8-й товар)
 """
 import os
-import sys
+import re
 import csv
 import json
-from pymongo import MongoClient
-from collections import Counter
+import argparse
+from collections import Counter, defaultdict
 from datetime import datetime
-import re
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import MongoClient
+
+AUDITS_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audits')
+
+ITEM_PROJECTION = {
+    '_id': 0, 'id': 1, 'name_raw': 1, 'name_norm': 1, 'super_class': 1, 'brand_id': 1,
+    'price': 1, 'supplier_company_id': 1, 'net_weight_kg': 1, 'net_volume_l': 1,
+}
+
+DATA_QUALITY_FIELDS = [
+    'supplier_item_id', 'supplier_id', 'name_raw', 'name_norm', 'super_class_db',
+    'super_class_runtime', 'sc_confidence', 'brand_id_db', 'brand_from_text',
+    'pack_db', 'pack_runtime', 'price', 'data_issues',
+]
+
+MATCHING_FIELDS = sorted([
+    'reference_name', 'ref_super_class', 'status', 'reason_code', 'candidates_total',
+    'after_super_class', 'selected_name', 'selected_super_class', 'price', 'match_percent',
+    'candidates_after_super_class_guards', 'rejected_by_forbidden', 'rejected_by_anchor',
+    'is_bad_match', 'bad_match_reason',
+])
+
+BAD_MATCH_FIELDS = [
+    'reference_name', 'ref_super_class', 'status', 'selected_name', 'selected_super_class',
+    'price', 'match_percent', 'candidates_after_super_class_guards', 'rejected_by_forbidden',
+    'rejected_by_anchor', 'is_bad_match', 'bad_match_reason',
+]
+
+BAD_MATCHES_LIMIT = 500
+
+GUARD_OK = 'ok'
+GUARD_FORBIDDEN = 'forbidden'
+GUARD_ANCHOR = 'anchor'
+
+_WORD_RE = re.compile(r'\w+')
+
+
+# ==================== WORKERS ====================
+
+_worker_brand_aliases: Dict[str, str] = {}
+
+
+def _init_worker(super_class_index, brand_aliases):
+    """Передаём прогретые в родителе индексы, чтобы воркеры не ходили в Mongo"""
+    global _worker_brand_aliases
+    from reference_data import reference_registry
+    reference_registry.install('super_class_index', super_class_index)
+    _worker_brand_aliases = brand_aliases
+
+
+def analyze_item(item: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str], Optional[str], float]:
+    """
+    Data quality для одного товара.
+
+    Returns: (csv_row, issue_codes, super_class_runtime, confidence)
+    """
+    from universal_super_class_mapper import detect_super_class
+    from p0_hotfix_stabilization import parse_pack_value, has_negative_keywords, extract_brand_from_text
 
-# Create audit directory
-timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-AUDIT_DIR = f'/app/backend/audits/{timestamp}'
-os.makedirs(AUDIT_DIR, exist_ok=True)
-
-DB_NAME = os.environ.get('DB_NAME', 'test_database')
-db = MongoClient(os.environ.get('MONGO_URL'))[DB_NAME]
-
-print("="*120)
-print(f"🔍 BATCH AUDIT JOB - Full Analysis")
-print("="*120)
-print(f"Output directory: {AUDIT_DIR}\n")
-
-# Load data
-all_items = list(db.supplier_items.find({'active': True}, {'_id': 0}))
-total = len(all_items)
-
-print(f"Loaded {total} ACTIVE supplier_items")
-
-# Import audit functions
-from universal_super_class_mapper import detect_super_class
-from p0_hotfix_stabilization import (
-    parse_pack_value,
-    has_negative_keywords,
-    has_required_anchors,  # ДОБАВЛЕНО
-    load_brand_aliases,
-    extract_brand_from_text
-)
-
-brand_aliases = load_brand_aliases()
-
-# ==================== 1) DATA QUALITY AUDIT ====================
-print(f"\n{'='*120}")
-print("1️⃣ DATA QUALITY AUDIT (каждый supplier_item)")
-print("="*120)
-
-data_quality_results = []
-issue_codes_counter = Counter()
-
-for i, item in enumerate(all_items):
-    if (i + 1) % 1000 == 0:
-        print(f"   Progress: {i + 1}/{total}")
-    
-    item_id = item.get('id')
     name_raw = item.get('name_raw', '')
-    name_norm = item.get('name_norm', '')
     super_class_db = item.get('super_class')
     brand_id_db = item.get('brand_id')
     price = item.get('price', 0)
-    
-    # Detect super_class at runtime
+
     super_class_runtime, sc_conf = detect_super_class(name_raw)
-    
-    # Parse pack
     pack_runtime = parse_pack_value(name_raw)
     pack_db = item.get('net_weight_kg') or item.get('net_volume_l')
-    
-    # Extract brand from text
-    brand_from_text = extract_brand_from_text(name_raw, brand_aliases)
-    
-    # Collect data issues
+    brand_from_text = extract_brand_from_text(name_raw, _worker_brand_aliases)
+
     data_issues = []
-    
+    issue_codes = []
+
     if super_class_db == 'other':
         data_issues.append('SUPER_CLASS_OTHER')
-        issue_codes_counter['SUPER_CLASS_OTHER'] += 1
-    
     if not super_class_db:
         data_issues.append('NO_SUPER_CLASS')
-        issue_codes_counter['NO_SUPER_CLASS'] += 1
-    
     if not pack_db:
         data_issues.append('NO_PACK')
-        issue_codes_counter['NO_PACK'] += 1
-    
     if not brand_id_db and not brand_from_text:
         data_issues.append('NO_BRAND')
-        issue_codes_counter['NO_BRAND'] += 1
-    
     if price <= 0:
         data_issues.append('INVALID_PRICE')
-        issue_codes_counter['INVALID_PRICE'] += 1
-    
-    # Check negative keywords
+    issue_codes.extend(data_issues)
+
     if super_class_db:
         try:
             has_neg, neg_kw = has_negative_keywords(name_raw, super_class_db)
             if has_neg:
                 data_issues.append(f'NEGATIVE_KEYWORD_{neg_kw}')
-                issue_codes_counter[f'NEGATIVE_KEYWORD'] += 1
-        except:
+                issue_codes.append('NEGATIVE_KEYWORD')
+        except Exception:
             pass  # SAFE
-    
-    data_quality_results.append({
-        'supplier_item_id': item_id,
+
+    row = {
+        'supplier_item_id': item.get('id'),
         'supplier_id': item.get('supplier_company_id'),
         'name_raw': name_raw[:100],
-        'name_norm': name_norm[:100],
+        'name_norm': item.get('name_norm', '')[:100],
         'super_class_db': super_class_db,
         'super_class_runtime': super_class_runtime,
         'sc_confidence': round(sc_conf, 2) if sc_conf else 0,
@@ -123,125 +138,160 @@ for i, item in enumerate(all_items):
         'pack_db': pack_db or '',
         'pack_runtime': pack_runtime or '',
         'price': price,
-        'data_issues': '|'.join(data_issues) if data_issues else 'OK'
-    })
-
-# Save data quality audit
-print(f"\n   Saving supplier_items_audit.csv...")
-with open(f'{AUDIT_DIR}/supplier_items_audit.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.DictWriter(f, fieldnames=data_quality_results[0].keys())
-    writer.writeheader()
-    writer.writerows(data_quality_results)
-
-print(f"   ✅ Saved {len(data_quality_results)} records")
-
-# ==================== 2) MATCHING AUDIT ====================
-print(f"\n{'='*120}")
-print("2️⃣ MATCHING AUDIT (симуляция поиска)")
-print("="*120)
-
-matching_results = []
-not_found_reasons = Counter()
-
-# Sample 1000 items for matching (full 8800 would be slow)
-sample_items = all_items[::8]  # Every 8th item
-print(f"Sampling {len(sample_items)} items for matching simulation...")
-
-for i, ref_item in enumerate(sample_items):
-    if (i + 1) % 100 == 0:
-        print(f"   Progress: {i + 1}/{len(sample_items)}")
-    
+        'data_issues': '|'.join(data_issues) if data_issues else 'OK',
+    }
+    return row, issue_codes, super_class_runtime, sc_conf or 0.0
+
+
+def evaluate_guards(args: Tuple[str, List[str]]) -> Tuple[str, List[str]]:
+    """GUARD 1 (FORBIDDEN) + GUARD 2 (REQUIRED anchors) для всех товаров одного super_class"""
+    from p0_hotfix_stabilization import has_negative_keywords, has_required_anchors
+
+    super_class, names = args
+    statuses = []
+    for name in names:
+        status = GUARD_OK
+        try:
+            has_neg, _ = has_negative_keywords(name, super_class)
+            if has_neg:
+                status = GUARD_FORBIDDEN
+        except Exception:
+            pass
+        if status == GUARD_OK:
+            try:
+                has_anchor, _ = has_required_anchors(name, super_class)
+                if not has_anchor:
+                    status = GUARD_ANCHOR
+            except Exception:
+                pass
+        statuses.append(status)
+    return super_class, statuses
+
+
+# ==================== CANDIDATE INDEXES ====================
+
+class ClassCandidates:
+    """
+    Кандидаты одного super_class после guards, отсортированные по цене.
+
+    Хранит счётчики отказов по id, чтобы исключение самого reference
+    давало те же числа, что и прямой перебор.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], statuses: List[str]):
+        self.passed = [item for item, status in zip(items, statuses) if status == GUARD_OK]
+        # Стабильная сортировка = как в исходном list.sort по цене
+        self.passed.sort(key=lambda x: x.get('price', 999999))
+        self.rejected_forbidden = statuses.count(GUARD_FORBIDDEN)
+        self.rejected_anchor = statuses.count(GUARD_ANCHOR)
+        self.status_by_id: Dict[Any, Counter] = defaultdict(Counter)
+        for item, status in zip(items, statuses):
+            self.status_by_id[item.get('id')][status] += 1
+
+    def for_reference(self, ref_id: Any) -> Tuple[Optional[Dict[str, Any]], int, int, int]:
+        """Returns: (winner, candidates_count, rejected_by_forbidden, rejected_by_anchor)"""
+        own = self.status_by_id.get(ref_id, Counter())
+        winner = next((c for c in self.passed if c.get('id') != ref_id), None)
+        return (
+            winner,
+            len(self.passed) - own[GUARD_OK],
+            self.rejected_forbidden - own[GUARD_FORBIDDEN],
+            self.rejected_anchor - own[GUARD_ANCHOR],
+        )
+
+
+def _keywords(name: str) -> set:
+    return {w for w in _WORD_RE.findall((name or '').lower()) if len(w) >= 4}
+
+
+class TokenBlockingIndex:
+    """
+    Inverted index token → позиции товаров для fallback на 'other'.
+
+    Вместо сравнения reference со всеми товарами смотрим только товары,
+    у которых есть хотя бы одно общее ключевое слово (len ≥ 4).
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        for pos, item in enumerate(items):
+            for token in _keywords(item.get('name_raw')):
+                self.postings[token].append(pos)
+
+    def candidates(self, ref_name: str, ref_id: Any, min_overlap: int = 2) -> List[Dict[str, Any]]:
+        overlap = Counter()
+        for token in _keywords(ref_name):
+            overlap.update(self.postings.get(token, ()))
+        positions = sorted(pos for pos, n in overlap.items() if n >= min_overlap)
+        return [self.items[pos] for pos in positions if self.items[pos].get('id') != ref_id]
+
+
+# ==================== MATCHING ====================
+
+def detect_bad_match(ref_name: str, winner_name: str) -> Tuple[bool, str]:
+    """Heuristics for bad matches"""
+    ref_name_lower = ref_name.lower()
+    winner_name = winner_name.lower()
+
+    if 'сыр' in ref_name_lower and 'сырник' in winner_name:
+        return True, "сыр→сырники"
+    if 'говядина' in ref_name_lower and 'растительн' in winner_name:
+        return True, "говядина→растительные"
+    if 'креветк' in ref_name_lower and 'креветк' not in winner_name:
+        return True, "креветки→без_креветок"
+    return False, ""
+
+
+def simulate_match(
+    ref_item: Dict[str, Any],
+    ref_super_class: Optional[str],
+    conf: float,
+    class_candidates: Dict[str, ClassCandidates],
+    other_index: TokenBlockingIndex,
+    total: int
+) -> Dict[str, Any]:
+    """Симуляция поиска для одного reference (логика синхронизирована с endpoint)"""
     ref_name = ref_item.get('name_raw', '')
-    ref_super_class, conf = detect_super_class(ref_name)
-    
+    ref_id = ref_item.get('id')
+
     if not ref_super_class:
-        matching_results.append({
+        return {
             'reference_name': ref_name[:100],
             'status': 'not_found',
             'reason_code': 'INSUFFICIENT_CLASSIFICATION',
-            'candidates_total': len(all_items),
-            'after_super_class': 0
-        })
-        not_found_reasons['INSUFFICIENT_CLASSIFICATION'] += 1
-        continue
-    
-    # Filter by super_class + GUARDS (СИНХРОНИЗИРОВАНО С ENDPOINT!)
-    candidates = []
-    rejected_by_forbidden = 0
-    rejected_by_missing_anchor = 0
-    
-    for c in all_items:
-        if c.get('id') == ref_item.get('id'):
-            continue  # Exclude self
-        
-        if c.get('super_class') != ref_super_class or c.get('price', 0) <= 0:
-            continue
-        
-        # GUARD 1: FORBIDDEN tokens (жёсткий запрет)
-        try:
-            has_neg, _ = has_negative_keywords(c.get('name_raw', ''), ref_super_class)
-            if has_neg:
-                rejected_by_forbidden += 1
-                continue  # REJECT
-        except:
-            pass
-        
-        # GUARD 2: REQUIRED anchors
-        try:
-            has_anchor, _ = has_required_anchors(c.get('name_raw', ''), ref_super_class)
-            if not has_anchor:
-                rejected_by_missing_anchor += 1
-                continue  # REJECT
-        except:
-            pass
-        
-        candidates.append(c)
-    
+            'candidates_total': total,
+            'after_super_class': 0,
+        }
+
+    bucket = class_candidates.get(ref_super_class)
+    if bucket:
+        winner, n_candidates, rejected_forbidden, rejected_anchor = bucket.for_reference(ref_id)
+    else:
+        winner, n_candidates, rejected_forbidden, rejected_anchor = None, 0, 0, 0
+
     # Fallback to 'other'
-    if len(candidates) == 0 and ref_super_class != 'other':
-        ref_keywords = {w for w in re.findall(r'\w+', ref_name.lower()) if len(w) >= 4}
-        candidates = [c for c in all_items 
-                     if c.get('super_class') == 'other'
-                     and c.get('id') != ref_item.get('id')
-                     and len({w for w in re.findall(r'\w+', (c.get('name_raw') or '').lower())} & ref_keywords) >= 2]
-    
-    if len(candidates) == 0:
-        matching_results.append({
+    if winner is None and ref_super_class != 'other':
+        fallback = other_index.candidates(ref_name, ref_id)
+        if fallback:
+            winner = min(fallback, key=lambda x: x.get('price', 999999))
+            n_candidates = len(fallback)
+
+    if winner is None:
+        return {
             'reference_name': ref_name[:100],
             'status': 'not_found',
             'reason_code': 'NO_CANDIDATES_AFTER_GUARDS',
             'ref_super_class': ref_super_class,
-            'candidates_total': len(all_items),
+            'candidates_total': total,
             'after_super_class': 0,
-            'rejected_by_forbidden': rejected_by_forbidden,
-            'rejected_by_anchor': rejected_by_missing_anchor
-        })
-        not_found_reasons['NO_CANDIDATES_AFTER_GUARDS'] += 1
-        continue
-    
-    # Sort by price
-    candidates.sort(key=lambda x: x.get('price', 999999))
-    winner = candidates[0]
-    
-    # Check if bad match
-    winner_name = winner.get('name_raw', '').lower()
-    ref_name_lower = ref_name.lower()
-    
-    is_bad_match = False
-    bad_match_reason = ""
-    
-    # Heuristics for bad matches
-    if 'сыр' in ref_name_lower and 'сырник' in winner_name:
-        is_bad_match = True
-        bad_match_reason = "сыр→сырники"
-    elif 'говядина' in ref_name_lower and 'растительн' in winner_name:
-        is_bad_match = True
-        bad_match_reason = "говядина→растительные"
-    elif 'креветк' in ref_name_lower and 'креветк' not in winner_name:
-        is_bad_match = True
-        bad_match_reason = "креветки→без_креветок"
-    
-    matching_results.append({
+            'rejected_by_forbidden': rejected_forbidden,
+            'rejected_by_anchor': rejected_anchor,
+        }
+
+    is_bad_match, bad_match_reason = detect_bad_match(ref_name, winner.get('name_raw', ''))
+
+    return {
         'reference_name': ref_name[:100],
         'ref_super_class': ref_super_class,
         'status': 'ok',
@@ -249,96 +299,262 @@ for i, ref_item in enumerate(sample_items):
         'selected_super_class': winner.get('super_class'),
         'price': winner.get('price'),
         'match_percent': min(100, int(conf * 100)),
-        'candidates_after_super_class_guards': len(candidates),
-        'rejected_by_forbidden': rejected_by_forbidden,
-        'rejected_by_anchor': rejected_by_missing_anchor,
+        'candidates_after_super_class_guards': n_candidates,
+        'rejected_by_forbidden': rejected_forbidden,
+        'rejected_by_anchor': rejected_anchor,
         'is_bad_match': is_bad_match,
-        'bad_match_reason': bad_match_reason
-    })
-    
-    if is_bad_match:
-        not_found_reasons[f'BAD_MATCH_{bad_match_reason}'] += 1
-
-# Save matching audit
-print(f"\n   Saving matching_audit.csv...")
-with open(f'{AUDIT_DIR}/matching_audit.csv', 'w', newline='', encoding='utf-8') as f:
-    if matching_results:
-        # Get all unique keys
-        all_keys = set()
-        for m in matching_results:
-            all_keys.update(m.keys())
-        
-        writer = csv.DictWriter(f, fieldnames=sorted(all_keys))
-        writer.writeheader()
-        writer.writerows(matching_results)
-
-print(f"   ✅ Saved {len(matching_results)} matching simulations")
-
-# ==================== 3) BAD MATCHES TOP 500 ====================
-bad_matches = [m for m in matching_results if m.get('is_bad_match')]
-
-if bad_matches:
-    print(f"\n   Saving bad_matches_top500.csv...")
-    with open(f'{AUDIT_DIR}/bad_matches_top500.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=bad_matches[0].keys())
-        writer.writeheader()
-        writer.writerows(bad_matches[:500])
-    
-    print(f"   ✅ Saved {len(bad_matches)} bad matches")
-
-# ==================== 4) SUMMARY ====================
-summary = {
-    'timestamp': timestamp,
-    'total_items': total,
-    'sampled_for_matching': len(sample_items),
-    'data_quality': {
-        'super_class_other': sum(1 for r in data_quality_results if r['super_class_db'] == 'other'),
-        'no_pack': sum(1 for r in data_quality_results if not r['pack_db']),
-        'no_brand': sum(1 for r in data_quality_results if not r['brand_id_db'] and not r['brand_from_text']),
-        'top_issues': dict(issue_codes_counter.most_common(20))
-    },
-    'matching_quality': {
-        'ok': sum(1 for m in matching_results if m.get('status') == 'ok'),
-        'not_found': sum(1 for m in matching_results if m.get('status') == 'not_found'),
-        'bad_matches': len(bad_matches),
-        'not_found_reasons': dict(not_found_reasons.most_common(20))
+        'bad_match_reason': bad_match_reason,
     }
-}
 
-with open(f'{AUDIT_DIR}/audit_summary.json', 'w', encoding='utf-8') as f:
-    json.dump(summary, f, ensure_ascii=False, indent=2)
-
-# ==================== REPORT ====================
-print(f"\n{'='*120}")
-print("📊 AUDIT SUMMARY")
-print("="*120)
-
-print(f"\n📋 Data Quality:")
-print(f"   super_class='other': {summary['data_quality']['super_class_other']} ({summary['data_quality']['super_class_other']/total*100:.1f}%)")
-print(f"   No pack:             {summary['data_quality']['no_pack']} ({summary['data_quality']['no_pack']/total*100:.1f}%)")
-print(f"   No brand:            {summary['data_quality']['no_brand']} ({summary['data_quality']['no_brand']/total*100:.1f}%)")
-
-print(f"\n🔍 Matching Quality ({len(sample_items)} sampled):")
-print(f"   OK:                  {summary['matching_quality']['ok']} ({summary['matching_quality']['ok']/len(sample_items)*100:.1f}%)")
-print(f"   NOT FOUND:           {summary['matching_quality']['not_found']} ({summary['matching_quality']['not_found']/len(sample_items)*100:.1f}%)")
-print(f"   Bad matches:         {summary['matching_quality']['bad_matches']} ({summary['matching_quality']['bad_matches']/len(sample_items)*100:.1f}%)")
-
-print(f"\n📋 Top NOT FOUND reasons:")
-for reason, count in not_found_reasons.most_common(10):
-    print(f"   {reason:50} : {count}")
-
-print(f"\n📋 Top Data Issues:")
-for issue, count in issue_codes_counter.most_common(10):
-    print(f"   {issue:50} : {count}")
-
-print(f"\n{'='*120}")
-print(f"✅ AUDIT COMPLETE")
-print("="*120)
-print(f"\n📁 Output files:")
-print(f"   1. {AUDIT_DIR}/audit_summary.json")
-print(f"   2. {AUDIT_DIR}/supplier_items_audit.csv ({len(data_quality_results)} rows)")
-print(f"   3. {AUDIT_DIR}/matching_audit.csv ({len(matching_results)} rows)")
-if bad_matches:
-    print(f"   4. {AUDIT_DIR}/bad_matches_top500.csv ({len(bad_matches)} rows)")
-
-print(f"\n✅ Done!")
+
+# ==================== SUMMARY DIFF ====================
+
+def _flatten(data: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def diff_summaries(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Diff числовых метрик двух audit_summary.json.
+
+    Returns: {metric.path: {'prev', 'curr', 'delta'}} только по изменившимся метрикам
+    """
+    prev_flat = _flatten(previous)
+    curr_flat = _flatten(current)
+    changes = {}
+    for key in sorted(set(prev_flat) | set(curr_flat)):
+        prev_value = prev_flat.get(key, 0)
+        curr_value = curr_flat.get(key, 0)
+        if prev_value != curr_value:
+            changes[key] = {
+                'prev': prev_value,
+                'curr': curr_value,
+                'delta': round(curr_value - prev_value, 4),
+            }
+    return changes
+
+
+def find_previous_summary(audits_root: str, current_timestamp: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Последний предыдущий прогон с audit_summary.json"""
+    if not os.path.isdir(audits_root):
+        return None, None
+    for name in sorted(os.listdir(audits_root), reverse=True):
+        if name >= current_timestamp:
+            continue
+        path = os.path.join(audits_root, name, 'audit_summary.json')
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                return name, json.load(f)
+    return None, None
+
+
+# ==================== MAIN ====================
+
+def run_audit(db, workers: int = 0, sample_every: int = 1, audits_root: str = AUDITS_ROOT) -> Dict[str, Any]:
+    from universal_super_class_mapper import get_super_class_index
+    from p0_hotfix_stabilization import load_brand_aliases
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    audit_dir = os.path.join(audits_root, timestamp)
+    os.makedirs(audit_dir, exist_ok=True)
+
+    print("=" * 120)
+    print("🔍 BATCH AUDIT JOB - Full Analysis")
+    print("=" * 120)
+    print(f"Output directory: {audit_dir}\n")
+
+    all_items = list(db.supplier_items.find({'active': True}, ITEM_PROJECTION))
+    total = len(all_items)
+    print(f"Loaded {total} ACTIVE supplier_items")
+
+    # Прогреваем индексы в родителе и раздаём воркерам
+    super_class_index = get_super_class_index()
+    brand_aliases = load_brand_aliases()
+    workers = workers or os.cpu_count() or 1
+    pool = Pool(workers, initializer=_init_worker, initargs=(super_class_index, brand_aliases))
+
+    try:
+        # ==================== 1) DATA QUALITY AUDIT ====================
+        print(f"\n{'=' * 120}")
+        print(f"1️⃣ DATA QUALITY AUDIT (каждый supplier_item, workers={workers})")
+        print("=" * 120)
+
+        issue_codes_counter = Counter()
+        dq_counts = Counter()
+        runtime_classes: List[Tuple[Optional[str], float]] = []
+
+        with open(os.path.join(audit_dir, 'supplier_items_audit.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=DATA_QUALITY_FIELDS)
+            writer.writeheader()
+            for i, (row, issues, sc_runtime, conf) in enumerate(
+                pool.imap(analyze_item, all_items, chunksize=256)
+            ):
+                writer.writerow(row)
+                issue_codes_counter.update(issues)
+                runtime_classes.append((sc_runtime, conf))
+                if row['super_class_db'] == 'other':
+                    dq_counts['super_class_other'] += 1
+                if not row['pack_db']:
+                    dq_counts['no_pack'] += 1
+                if not row['brand_id_db'] and not row['brand_from_text']:
+                    dq_counts['no_brand'] += 1
+                if (i + 1) % 1000 == 0:
+                    print(f"   Progress: {i + 1}/{total}")
+
+        print(f"   ✅ Saved {total} records")
+
+        # ==================== 2) MATCHING AUDIT ====================
+        print(f"\n{'=' * 120}")
+        print("2️⃣ MATCHING AUDIT (симуляция поиска)")
+        print("=" * 120)
+
+        by_class: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for item in all_items:
+            if item.get('price', 0) > 0 and item.get('super_class'):
+                by_class[item['super_class']].append(item)
+
+        needed_classes = {sc for sc, _ in runtime_classes if sc} & set(by_class)
+        class_candidates = {}
+        for super_class, statuses in pool.imap_unordered(
+            evaluate_guards,
+            [(sc, [c.get('name_raw', '') for c in by_class[sc]]) for sc in needed_classes]
+        ):
+            class_candidates[super_class] = ClassCandidates(by_class[super_class], statuses)
+
+        other_index = TokenBlockingIndex([c for c in all_items if c.get('super_class') == 'other'])
+        print(f"   Guards evaluated for {len(class_candidates)} super_classes, "
+              f"'other' index: {len(other_index.postings)} tokens")
+    finally:
+        pool.close()
+        pool.join()
+
+    ref_positions = range(0, total, max(1, sample_every))
+    n_refs = len(ref_positions)
+    print(f"Matching simulation for {n_refs} items...")
+
+    match_counts = Counter()
+    not_found_reasons = Counter()
+    bad_written = 0
+
+    with open(os.path.join(audit_dir, 'matching_audit.csv'), 'w', newline='', encoding='utf-8') as f_match, \
+            open(os.path.join(audit_dir, 'bad_matches_top500.csv'), 'w', newline='', encoding='utf-8') as f_bad:
+        match_writer = csv.DictWriter(f_match, fieldnames=MATCHING_FIELDS)
+        match_writer.writeheader()
+        bad_writer = csv.DictWriter(f_bad, fieldnames=BAD_MATCH_FIELDS, extrasaction='ignore')
+        bad_writer.writeheader()
+
+        for i, pos in enumerate(ref_positions):
+            if (i + 1) % 1000 == 0:
+                print(f"   Progress: {i + 1}/{n_refs}")
+
+            ref_super_class, conf = runtime_classes[pos]
+            result = simulate_match(all_items[pos], ref_super_class, conf, class_candidates, other_index, total)
+            match_writer.writerow(result)
+
+            match_counts[result['status']] += 1
+            if result['status'] == 'not_found':
+                not_found_reasons[result['reason_code']] += 1
+            elif result['is_bad_match']:
+                match_counts['bad_matches'] += 1
+                not_found_reasons[f"BAD_MATCH_{result['bad_match_reason']}"] += 1
+                if bad_written < BAD_MATCHES_LIMIT:
+                    bad_writer.writerow(result)
+                    bad_written += 1
+
+    print(f"   ✅ Saved {n_refs} matching simulations ({match_counts['bad_matches']} bad matches)")
+
+    # ==================== 3) SUMMARY + DIFF ====================
+    summary = {
+        'timestamp': timestamp,
+        'total_items': total,
+        'sampled_for_matching': n_refs,
+        'data_quality': {
+            'super_class_other': dq_counts['super_class_other'],
+            'no_pack': dq_counts['no_pack'],
+            'no_brand': dq_counts['no_brand'],
+            'top_issues': dict(issue_codes_counter.most_common(20)),
+        },
+        'matching_quality': {
+            'ok': match_counts['ok'],
+            'not_found': match_counts['not_found'],
+            'bad_matches': match_counts['bad_matches'],
+            'not_found_reasons': dict(not_found_reasons.most_common(20)),
+        },
+    }
+
+    with open(os.path.join(audit_dir, 'audit_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    prev_timestamp, prev_summary = find_previous_summary(audits_root, timestamp)
+    diff = None
+    if prev_summary:
+        diff = {
+            'previous': prev_timestamp,
+            'current': timestamp,
+            'changes': diff_summaries(prev_summary, summary),
+        }
+        with open(os.path.join(audit_dir, 'audit_diff.json'), 'w', encoding='utf-8') as f:
+            json.dump(diff, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    # ==================== REPORT ====================
+    print(f"\n{'=' * 120}")
+    print("📊 AUDIT SUMMARY")
+    print("=" * 120)
+
+    dq = summary['data_quality']
+    print(f"\n📋 Data Quality:")
+    print(f"   super_class='other': {dq['super_class_other']} ({dq['super_class_other'] / max(total, 1) * 100:.1f}%)")
+    print(f"   No pack:             {dq['no_pack']} ({dq['no_pack'] / max(total, 1) * 100:.1f}%)")
+    print(f"   No brand:            {dq['no_brand']} ({dq['no_brand'] / max(total, 1) * 100:.1f}%)")
+
+    mq = summary['matching_quality']
+    print(f"\n🔍 Matching Quality ({n_refs} items):")
+    print(f"   OK:                  {mq['ok']} ({mq['ok'] / max(n_refs, 1) * 100:.1f}%)")
+    print(f"   NOT FOUND:           {mq['not_found']} ({mq['not_found'] / max(n_refs, 1) * 100:.1f}%)")
+    print(f"   Bad matches:         {mq['bad_matches']} ({mq['bad_matches'] / max(n_refs, 1) * 100:.1f}%)")
+
+    print(f"\n📋 Top NOT FOUND reasons:")
+    for reason, count in not_found_reasons.most_common(10):
+        print(f"   {reason:50} : {count}")
+
+    print(f"\n📋 Top Data Issues:")
+    for issue, count in issue_codes_counter.most_common(10):
+        print(f"   {issue:50} : {count}")
+
+    if diff:
+        print(f"\n📈 Changes vs {prev_timestamp}:")
+        for key, change in diff['changes'].items():
+            print(f"   {key:60} : {change['prev']} → {change['curr']} ({change['delta']:+})")
+
+    print(f"\n{'=' * 120}")
+    print(f"✅ AUDIT COMPLETE")
+    print("=" * 120)
+    print(f"\n📁 Output files:")
+    print(f"   1. {audit_dir}/audit_summary.json")
+    print(f"   2. {audit_dir}/supplier_items_audit.csv ({total} rows)")
+    print(f"   3. {audit_dir}/matching_audit.csv ({n_refs} rows)")
+    print(f"   4. {audit_dir}/bad_matches_top500.csv ({bad_written} rows)")
+    if diff:
+        print(f"   5. {audit_dir}/audit_diff.json ({len(diff['changes'])} changed metrics)")
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Full-catalog matching audit')
+    parser.add_argument('--workers', type=int, default=0, help='Process pool size (default: cpu_count)')
+    parser.add_argument('--sample-every', type=int, default=1, help='Use every N-th item as reference')
+    args = parser.parse_args()
+
+    DB_NAME = os.environ.get('DB_NAME', 'test_database')
+    db = MongoClient(os.environ.get('MONGO_URL'))[DB_NAME]
+
+    run_audit(db, workers=args.workers, sample_every=args.sample_every)
+    print(f"\n✅ Done!")
@@ -0,0 +1,118 @@
+"""
+Benchmark Offer Store - память 100k офферов: dict против OfferStore
+===================================================================
+
+Строит синтетические документы supplier_items (все поля, как после импорта
+и обогащения: токены, служебные даты, ...) и сравнивает, сколько памяти
+держит процесс:
+- dicts       - полные документы, как раньше отдавал to_list();
+- projected   - dict только с MATCH_FIELDS (projection без store);
+- offer_store - OfferStore из CompactOffer (слоты + интернированные строки).
+
+Память считается tracemalloc: всё, что выделено при построении и
+остаётся живым. Исходные документы строятся заново для каждого варианта,
+как при чтении из Mongo (строки не разделяются между вариантами).
+Под tracemalloc построение медленное (100k - пара минут), время не
+сравнивается.
+
+Запуск:
+    python benchmark_offer_store.py
+    python benchmark_offer_store.py --offers 20000 --seed 7
+"""
+
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.offer_store import MATCH_FIELDS, OfferStore
+
+SUPER_CLASSES = ['seafood.shrimp', 'seafood.fish', 'meat.chicken', 'meat.beef', 'condiments.sauce',
+                 'condiments.broth', 'staples.rice', 'dairy.cheese', 'bakery.bread', 'frozen.vegetables']
+WORDS = ['филе', 'креветки', 'соус', 'рис', 'сыр', 'бульон', 'куриный', 'говяжий', 'с/м', 'охл',
+         'вакуум', 'премиум', 'басмати', 'моцарелла', 'терияки', 'очищенные', 'тигровые', 'кг', 'л']
+
+
+def make_doc(i: int, rng: random.Random) -> dict:
+    """Документ supplier_items; строки собираются заново, как после декодирования BSON."""
+    name = ' '.join(rng.sample(WORDS, 5)) + f' {rng.randint(1, 5)} кг'
+    supplier = f"supplier-{rng.randrange(40):04d}-{'x' * 28}"
+    core = rng.choice(SUPER_CLASSES) + f'.{rng.randrange(30)}'
+    return {
+        'id': f'{i:08d}-0000-4000-8000-{i:012d}',
+        'unique_key': f'{supplier}:{i}',
+        'supplier_company_id': ''.join(supplier),
+        'price_list_id': f'pl-{rng.randrange(200):05d}',
+        'supplier_item_code': f'A{i:07d}',
+        'product_id': f'p-{i:08d}',
+        'name_raw': name,
+        'name_norm': name.lower(),
+        'unit_supplier': ''.join(['кг']),
+        'unit_norm': ''.join(['kg']),
+        'unit_type': ''.join(['WEIGHT']),
+        'base_unit': ''.join(['kg']),
+        'calc_route': ''.join(['weight']),
+        'price': round(rng.uniform(50, 5000), 2),
+        'price_per_base_unit': round(rng.uniform(50, 5000), 2),
+        'pack_qty': rng.choice([1, 2, 5, 10]),
+        'min_order_qty': rng.choice([1, 2, 5]),
+        'net_weight_kg': rng.choice([0.5, 1.0, 2.0, 5.0]),
+        'super_class': ''.join(core.rsplit('.', 1)[:1]),
+        'product_core_id': ''.join(core),
+        'brand_id': rng.choice([None, ''.join(['knorr']), ''.join(['heinz']), ''.join(['barilla'])]),
+        'caliber': rng.choice([None, ''.join(['16/20']), ''.join(['21/25'])]),
+        'active': True,
+        'offer_status': 'ACTIVE',
+        'price_status': 'VALID',
+        'search_tokens': name.lower().split(),
+        'lemma_tokens': [w[:5] for w in name.lower().split()],
+        'created_at': f'2026-01-{rng.randint(1, 28):02d}T10:00:00+00:00',
+        'updated_at': f'2026-02-{rng.randint(1, 28):02d}T10:00:00+00:00',
+        'price_updated_at': f'2026-02-{rng.randint(1, 28):02d}T10:00:00+00:00',
+    }
+
+
+def measure(build) -> tuple:
+    tracemalloc.start()
+    value = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, current
+
+
+def run(offers: int, seed: int) -> dict:
+    def docs():
+        rng = random.Random(seed)
+        return (make_doc(i, rng) for i in range(offers))
+
+    dicts, dict_bytes = measure(lambda: list(docs()))
+    del dicts
+    projected, projected_bytes = measure(
+        lambda: [{k: d[k] for k in MATCH_FIELDS if k in d} for d in docs()])
+    del projected
+    store, store_bytes = measure(lambda: OfferStore.from_docs(docs()))
+
+    mb = 1024 * 1024
+    return {
+        'offers': len(store),
+        'dicts_mb': round(dict_bytes / mb, 1),
+        'projected_dicts_mb': round(projected_bytes / mb, 1),
+        'offer_store_mb': round(store_bytes / mb, 1),
+        'bytes_per_offer_dict': dict_bytes // offers,
+        'bytes_per_offer_store': store_bytes // offers,
+        'reduction_vs_dicts': round(dict_bytes / store_bytes, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory benchmark: supplier_items as dicts vs OfferStore')
+    parser.add_argument('--offers', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    for key, value in run(args.offers, args.seed).items():
+        print(f"  {key:<22} {value}")
@@ -0,0 +1,104 @@
+"""
+Benchmark Similarity - микро-бенчмарк similarity kernel NPC-матчинга
+====================================================================
+
+Сравнивает прежний calculate_similarity (set'ы + SequenceMatcher на каждую
+пару) с bestprice_v12.token_similarity на синтетических названиях рыбы и
+морепродуктов: один источник против пула кандидатов, как в similar-режиме.
+
+Проверяет, что точный путь даёт те же score, а решение по порогу 85%
+совпадает для всех пар.
+
+Запуск:
+    python benchmark_similarity.py
+    python benchmark_similarity.py --sources 50 --candidates 2000 --seed 7
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.npc_matching_v9 import SIMILARITY_THRESHOLD
+from bestprice_v12.token_similarity import token_profile, token_similarity, reference_similarity
+
+VOCAB = {
+    'species': ['лосось', 'семга', 'форель', 'треска', 'минтай', 'пикша', 'скумбрия', 'сельдь', 'окунь',
+                'тилапия', 'пангасиус', 'креветка', 'кальмар', 'мидии', 'горбуша', 'кета', 'нерка'],
+    'cut': ['филе', 'тушка', 'стейк', 'кусок', 'потрошеная', 'без', 'головы', 'кожи', 'на', 'коже'],
+    'state': ['мороженая', 'охлажденная', 'соленая', 'копченая', 'глазировка', 'вакуум', 'ломтики'],
+    'extra': ['премиум', 'отборная', 'атлантическая', 'дикая', 'чили', 'норвегия', 'китай', 'россия',
+              'фарерская', 'очищенная', 'королевская', 'тигровая', 'натуральная', 'слабосоленая'],
+}
+
+
+def random_tokens(rng: random.Random) -> list:
+    tokens = [rng.choice(VOCAB['species']), rng.choice(VOCAB['cut'])]
+    tokens += rng.sample(VOCAB['state'], rng.randint(0, 2))
+    tokens += rng.sample(VOCAB['extra'], rng.randint(0, 3))
+    rng.shuffle(tokens)
+    return tokens
+
+
+def near_duplicate(tokens: list, rng: random.Random) -> list:
+    """Тот же товар у другого поставщика: другой порядок слов или ±1 токен."""
+    tokens = list(tokens)
+    roll = rng.random()
+    if roll < 0.5:
+        rng.shuffle(tokens)
+    elif roll < 0.75 and len(tokens) > 2:
+        tokens.pop(rng.randrange(len(tokens)))
+    else:
+        tokens.append(rng.choice(VOCAB['extra']))
+    return tokens
+
+
+def timed(fn) -> tuple:
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run(sources: int, candidates: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    pool = [random_tokens(rng) for _ in range(candidates)]
+    queries = [random_tokens(rng) for _ in range(sources)]
+    # ~10% пула - почти дубли источников (должны пройти порог)
+    for i in range(0, candidates, 10):
+        pool[i] = near_duplicate(rng.choice(queries), rng)
+    pairs = [(q, c) for q in queries for c in pool]
+
+    reference, t_reference = timed(lambda: [reference_similarity(q, c) for q, c in pairs])
+    _, t_profiles = timed(lambda: [token_profile(t) for t in queries + pool])
+    exact, t_exact = timed(lambda: [token_similarity(q, c) for q, c in pairs])
+    gated, t_gated = timed(lambda: [token_similarity(q, c, SIMILARITY_THRESHOLD) for q, c in pairs])
+
+    passed = sum(s >= SIMILARITY_THRESHOLD for s in reference)
+    assert exact == reference, 'exact path diverged from reference'
+    assert all((g >= SIMILARITY_THRESHOLD) == (r >= SIMILARITY_THRESHOLD) for g, r in zip(gated, reference))
+    assert all(g == r for g, r in zip(gated, reference) if r >= SIMILARITY_THRESHOLD)
+
+    return {
+        'pairs': len(pairs),
+        'passed_threshold': passed,
+        'reference_ms': round(t_reference * 1000, 1),
+        'profiles_ms': round(t_profiles * 1000, 1),
+        'kernel_exact_ms': round(t_exact * 1000, 1),
+        'kernel_threshold_ms': round(t_gated * 1000, 1),
+        'speedup_threshold': round(t_reference / t_gated, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark for the NPC similarity kernel')
+    parser.add_argument('--sources', type=int, default=20)
+    parser.add_argument('--candidates', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    for key, value in run(args.sources, args.candidates, args.seed).items():
+        print(f"  {key:<22} {value}")
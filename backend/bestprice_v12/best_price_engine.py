@@ -0,0 +1,338 @@
+"""
+BestPrice v12 - Best Price Engine
+
+Set-based пересчёт catalog_references.
+
+Раньше update_best_prices делал на каждую карточку отдельный find по
+ядру, заново разбирал фасовку каждого оффера регуляркой и писал update_one;
+generate_catalog_references $push'ил в память целые массивы офферов.
+
+Теперь:
+1. supplier_items сканируется ОДИН раз (только нужные поля), офферы
+   группируются по (product_core_id, unit_type). Фасовка берётся из
+   предрасчитанных offer_pack_* (импорт / backfill стадия offer_pack),
+   разбор названия - только для старых документов.
+2. Победители считаются в памяти по тем же правилам, что
+   get_best_price_for_reference (STRICT pack, min_order_qty, первый минимум).
+3. Запись - unordered bulk_write, и только изменившихся карточек.
+4. Инкрементальный режим: импорт/правки прайсов пишут запись в
+   catalog_change_log (поставщик и/или ядра). Прогон берёт непрочитанные
+   записи, пересчитывает только затронутые ядра и помечает записи consumed_at
+   (TTL-индекс чистит их через неделю).
+
+Запуск:
+    python -m bestprice_v12.catalog --update-prices               # полный пересчёт
+    python -m bestprice_v12.catalog --update-prices --incremental # только изменившиеся ядра
+"""
+
+import uuid
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+from .catalog import (
+    extract_pack_from_name, get_offer_pack, check_strict_pack_match,
+    calculate_effective_qty, calculate_line_total, publishable_offer_query,
+)
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_COLLECTION = 'catalog_change_log'
+CHANGE_LOG_TTL_SECONDS = 7 * 24 * 3600
+BULK_BATCH_SIZE = 1000
+
+OFFER_SCAN_PROJECTION = {
+    '_id': 0, 'id': 1, 'product_core_id': 1, 'unit_type': 1, 'price': 1,
+    'supplier_company_id': 1, 'min_order_qty': 1, 'name_raw': 1, 'pack_qty': 1,
+    'offer_pack_value': 1, 'offer_pack_unit': 1, 'offer_pack_v': 1,
+}
+
+ANCHOR_FIELDS = ('id', 'name_raw', 'price', 'supplier_company_id', 'brand_id', 'origin_country', 'super_class')
+
+# Строка оффера в памяти: (price, min_order_qty, pack_value, pack_unit, item_id, supplier_id)
+OfferRow = Tuple[float, Any, Optional[float], Optional[str], Optional[str], Optional[str]]
+GroupKey = Tuple[str, str]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# === CHANGE LOG ===
+
+def change_log_entry(
+    source: str,
+    supplier_id: Optional[str] = None,
+    product_core_ids: Optional[Iterable[str]] = None,
+    **meta
+) -> Dict[str, Any]:
+    """
+    Запись об изменении офферов. supplier_id - пересчитать все ядра поставщика
+    (импорт прайса), product_core_ids - явный список (удаление, переклассификация).
+    """
+    return {
+        'id': str(uuid.uuid4()),
+        'source': source,
+        'supplier_id': supplier_id,
+        'product_core_ids': sorted({c for c in (product_core_ids or []) if c}),
+        'created_at': _now(),
+        'consumed_at': None,
+        **meta,
+    }
+
+
+def record_catalog_change(db: Database, source: str, supplier_id: Optional[str] = None,
+                          product_core_ids: Optional[Iterable[str]] = None, **meta) -> None:
+    db[CHANGE_LOG_COLLECTION].insert_one(change_log_entry(source, supplier_id, product_core_ids, **meta))
+
+
+def resolve_touched_cores(db: Database, entries: List[Dict[str, Any]]) -> Set[str]:
+    """Ядра, затронутые записями change log (поставщики раскрываются одним distinct)."""
+    cores: Set[str] = set()
+    supplier_ids = set()
+    for entry in entries:
+        cores.update(entry.get('product_core_ids') or [])
+        if entry.get('supplier_id'):
+            supplier_ids.add(entry['supplier_id'])
+    if supplier_ids:
+        # Включая неактивные офферы: деактивированный победитель тоже меняет карточку
+        cores.update(db.supplier_items.distinct(
+            'product_core_id', {'supplier_company_id': {'$in': sorted(supplier_ids)}}
+        ))
+    cores.discard(None)
+    return cores
+
+
+# === SCAN ===
+
+def _offer_query(cores: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = publishable_offer_query(product_core_id={'$ne': None})
+    if cores is not None:
+        query['product_core_id'] = {'$in': sorted(cores)}
+    return query
+
+
+def offer_row(offer: Dict[str, Any]) -> OfferRow:
+    pack_value, pack_unit = get_offer_pack(offer)
+    return (
+        offer['price'],
+        offer.get('min_order_qty') or 1,
+        pack_value,
+        pack_unit,
+        offer.get('id'),
+        offer.get('supplier_company_id'),
+    )
+
+
+def scan_offer_groups(db: Database, cores: Optional[Iterable[str]] = None) -> Tuple[Dict[GroupKey, List[OfferRow]], int]:
+    """
+    Один проход по активным офферам → {(product_core_id, unit_type): [OfferRow]}.
+    Порядок внутри группы - порядок курсора (как в get_best_price_for_reference).
+    """
+    groups: Dict[GroupKey, List[OfferRow]] = defaultdict(list)
+    scanned = 0
+    for offer in db.supplier_items.find(_offer_query(cores), OFFER_SCAN_PROJECTION):
+        groups[(offer['product_core_id'], offer.get('unit_type'))].append(offer_row(offer))
+        scanned += 1
+    return groups, scanned
+
+
+def pick_winner(
+    offers: List[OfferRow],
+    pack_value: Optional[float],
+    pack_unit: Optional[str],
+    user_qty: float = 1.0
+) -> Optional[Tuple[float, OfferRow]]:
+    """Лучший line_total среди офферов группы (STRICT pack, первый минимум)."""
+    best = None
+    for row in offers:
+        if not check_strict_pack_match(row[2], row[3], pack_value, pack_unit):
+            continue
+        line_total = calculate_line_total(calculate_effective_qty(user_qty, row[1]), row[0])
+        if best is None or line_total < best[0]:
+            best = (line_total, row)
+    return best
+
+
+def _bulk_write(collection, ops: List[UpdateOne]) -> Dict[str, int]:
+    totals = {'modified': 0, 'upserted': 0}
+    for i in range(0, len(ops), BULK_BATCH_SIZE):
+        result = collection.bulk_write(ops[i:i + BULK_BATCH_SIZE], ordered=False)
+        totals['modified'] += result.modified_count
+        totals['upserted'] += result.upserted_count
+    return totals
+
+
+def ensure_engine_indexes(db: Database) -> None:
+    db.catalog_references.create_index('reference_id', unique=True)
+    db.catalog_references.create_index([('product_core_id', 1), ('unit_type', 1)])
+    db.catalog_references.create_index('super_class')
+    db[CHANGE_LOG_COLLECTION].create_index('consumed_at', expireAfterSeconds=CHANGE_LOG_TTL_SECONDS)
+    # Версия каталога для мемоизации плана корзины (plan_snapshot.compute_catalog_version)
+    db[CHANGE_LOG_COLLECTION].create_index([('supplier_id', 1), ('created_at', -1)])
+    db[CHANGE_LOG_COLLECTION].create_index([('product_core_ids', 1), ('created_at', -1)])
+    # Последняя запись - версия кэша отчёта о качестве данных (offer_validator)
+    db[CHANGE_LOG_COLLECTION].create_index([('created_at', -1)])
+    # Горячие запросы офферов: publishable + ядро + единица, сортировка по цене
+    db.supplier_items.create_index(
+        [('publishable', 1), ('product_core_id', 1), ('unit_type', 1), ('price', 1)],
+        name='publishable_core_unit_price',
+    )
+
+
+# === GENERATE ===
+
+def scan_anchors(db: Database) -> Dict[GroupKey, Tuple[int, Dict[str, Any]]]:
+    """Один проход → {(core, unit_type): (count, anchor)}; anchor - первый оффер с минимальной ценой."""
+    projection = {'_id': 0, 'product_core_id': 1, 'unit_type': 1}
+    projection.update({f: 1 for f in ANCHOR_FIELDS})
+    anchors: Dict[GroupKey, Tuple[int, Dict[str, Any]]] = {}
+    for offer in db.supplier_items.find(_offer_query(), projection):
+        key = (offer['product_core_id'], offer.get('unit_type'))
+        count, anchor = anchors.get(key, (0, None))
+        if anchor is None or offer.get('price', float('inf')) < anchor.get('price', float('inf')):
+            anchor = offer
+        anchors[key] = (count + 1, anchor)
+    return anchors
+
+
+def build_reference(product_core_id: str, unit_type: str, anchor: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля карточки из anchor (без reference_id/created_at - они ставятся только при вставке)."""
+    pack_value, pack_unit = extract_pack_from_name(anchor.get('name_raw', ''))
+    return {
+        'product_core_id': product_core_id,
+        'unit_type': unit_type,
+        'pack_value': pack_value,
+        'pack_unit': pack_unit,
+        'brand_id': anchor.get('brand_id'),
+        'origin_country_id': anchor.get('origin_country'),
+        'critical_attrs': None,
+        'anchor_supplier_item_id': anchor['id'],
+        'name': anchor.get('name_raw', product_core_id),
+        'super_class': anchor.get('super_class'),
+        'best_price': anchor.get('price'),
+        'best_supplier_id': anchor.get('supplier_company_id'),
+        'updated_at': _now().isoformat(),
+    }
+
+
+def generate_references(db: Database, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    catalog_references из supplier_items: один скан + bulk upsert по (core, unit_type).
+    reference_id генерируется только для новых карточек - повторная генерация
+    не ломает ссылки из избранного.
+    """
+    logger.info("🔄 Generating catalog_references from supplier_items...")
+
+    anchors = scan_anchors(db)
+    ordered = sorted(anchors.items(), key=lambda kv: kv[1][0], reverse=True)
+    if limit:
+        ordered = ordered[:limit]
+    logger.info("   Found %d unique product_core + unit_type combinations", len(ordered))
+
+    now = _now().isoformat()
+    ops = []
+    for (core, unit_type), (_, anchor) in ordered:
+        ops.append(UpdateOne(
+            {'product_core_id': core, 'unit_type': unit_type},
+            {
+                '$set': build_reference(core, unit_type, anchor),
+                '$setOnInsert': {
+                    'reference_id': f"ref_{core}_{unit_type}_{uuid.uuid4().hex[:8]}",
+                    'created_at': now,
+                },
+            },
+            upsert=True
+        ))
+    written = _bulk_write(db.catalog_references, ops)
+    ensure_engine_indexes(db)
+
+    stats = {
+        'total_groups': len(ordered),
+        'created': len(ops),
+        'inserted': written['upserted'],
+        'skipped': 0,
+    }
+    logger.info("✅ Catalog references generated: %d upserted (%d new)", len(ops), written['upserted'])
+    return stats
+
+
+# === BEST PRICE RECOMPUTE ===
+
+REFERENCE_PROJECTION = {
+    '_id': 0, 'reference_id': 1, 'product_core_id': 1, 'unit_type': 1, 'pack_value': 1, 'pack_unit': 1,
+    'best_price': 1, 'best_supplier_id': 1, 'anchor_supplier_item_id': 1,
+}
+
+
+def recompute_best_prices(db: Database, cores: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Пересчитать best_price карточек (всех или только указанных ядер).
+    Пишутся только карточки, у которых сменился победитель или цена.
+    """
+    mode = 'full' if cores is None else 'incremental'
+    if cores is not None:
+        cores = sorted(set(cores))
+        if not cores:
+            return {'mode': mode, 'updated': 0, 'total': 0, 'written': 0, 'offers_scanned': 0}
+
+    logger.info("🔄 Updating best prices for catalog references (%s)...", mode)
+
+    ref_query = {} if cores is None else {'product_core_id': {'$in': cores}}
+    references = list(db.catalog_references.find(ref_query, REFERENCE_PROJECTION))
+    groups, scanned = scan_offer_groups(db, cores)
+
+    now = _now().isoformat()
+    updated = 0
+    ops = []
+    for ref in references:
+        winner = pick_winner(
+            groups.get((ref['product_core_id'], ref['unit_type']), []),
+            ref.get('pack_value'),
+            ref.get('pack_unit'),
+        )
+        if winner is None:
+            continue
+        updated += 1
+
+        line_total, row = winner
+        fields = {
+            'best_price': line_total,
+            'best_supplier_id': row[5],
+            'anchor_supplier_item_id': row[4] or ref.get('anchor_supplier_item_id'),
+        }
+        if all(ref.get(k) == v for k, v in fields.items()):
+            continue
+        ops.append(UpdateOne({'reference_id': ref['reference_id']}, {'$set': {**fields, 'updated_at': now}}))
+
+    _bulk_write(db.catalog_references, ops)
+
+    logger.info("✅ Updated %d catalog references (%d written, %d offers scanned)", updated, len(ops), scanned)
+    return {'mode': mode, 'updated': updated, 'total': len(references), 'written': len(ops), 'offers_scanned': scanned}
+
+
+def recompute_incremental(db: Database) -> Dict[str, Any]:
+    """
+    Пересчитать только ядра из непрочитанных записей catalog_change_log.
+    Записи, появившиеся во время прогона, останутся на следующий.
+    """
+    started = _now()
+    log = db[CHANGE_LOG_COLLECTION]
+    entries = list(log.find(
+        {'consumed_at': None, 'created_at': {'$lte': started}},
+        {'_id': 1, 'supplier_id': 1, 'product_core_ids': 1}
+    ))
+    if not entries:
+        return {'mode': 'incremental', 'changes': 0, 'cores': 0, 'updated': 0, 'total': 0, 'written': 0,
+                'offers_scanned': 0}
+
+    cores = resolve_touched_cores(db, entries)
+    stats = recompute_best_prices(db, cores)
+    log.update_many({'_id': {'$in': [e['_id'] for e in entries]}}, {'$set': {'consumed_at': _now()}})
+
+    stats.update({'changes': len(entries), 'cores': len(cores)})
+    return stats
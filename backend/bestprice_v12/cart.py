@@ -24,8 +24,9 @@ from .models import (
 from .catalog import (
     get_db, extract_pack_from_name, 
     calculate_effective_qty, calculate_line_total,
-    check_strict_pack_match, get_best_price_for_reference
+    check_strict_pack_match, get_best_price_for_reference, publishable_offer_query
 )
+from .offer_table import best_line_total_index
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +34,7 @@ logger = logging.getLogger(__name__)
 def get_anchor_offer(db: Database, anchor_id: str) -> Optional[Dict]:
     """Получает anchor оффер по ID"""
     return db.supplier_items.find_one(
-        {'id': anchor_id, 'active': True, 'price': {'$gt': 0}},
+        publishable_offer_query(id=anchor_id),
         {'_id': 0}
     )
 
@@ -49,18 +50,12 @@ def get_candidates_for_reference(
     Получает кандидатов по правилам п.5 ТЗ
     
     Жёсткие фильтры:
-    - active = true
-    - price > 0
+    - active = true, publishable = true (price > 0, unit_type, фасовка - проверены при импорте)
     - product_core_id == reference.product_core_id
     - unit_type == reference.unit_type
     - STRICT pack match
     """
-    query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'product_core_id': product_core_id,
-        'unit_type': unit_type,
-    }
+    query = publishable_offer_query(product_core_id=product_core_id, unit_type=unit_type)
     
     candidates = list(db.supplier_items.find(query, {'_id': 0}))
     
@@ -95,23 +90,18 @@ def find_best_candidate(
     """
     Находит лучшего кандидата по line_total
     
+    line_total всех кандидатов считается векторно (offer_table); при равенстве
+    выигрывает первый кандидат, как со строгим `<` в цикле.
+    
     Returns:
         (best_candidate, best_line_total)
     """
     if not candidates:
         return None, None
     
-    best_candidate = None
-    best_line_total = None
-    
-    for candidate in candidates:
-        min_order_qty = candidate.get('min_order_qty', 1)
-        effective_qty = calculate_effective_qty(user_qty, min_order_qty)
-        line_total = calculate_line_total(effective_qty, candidate['price'])
-        
-        if best_line_total is None or line_total < best_line_total:
-            best_line_total = line_total
-            best_candidate = candidate
+    best_candidate = candidates[best_line_total_index(candidates, user_qty)]
+    effective_qty = calculate_effective_qty(user_qty, best_candidate.get('min_order_qty', 1))
+    best_line_total = calculate_line_total(effective_qty, best_candidate['price'])
     
     return best_candidate, best_line_total
 
@@ -0,0 +1,302 @@
+"""
+BestPrice v12 - Batch Cart Mutations
+
+Пакетное изменение корзины (POST /v12/cart/intents:batch).
+
+Добавление всего избранного или повтор заказа шло через /v12/cart/intent
+по одному товару: на каждый - поиск оффера, избранного, поставщика и
+отдельная запись в cart_intents, а корзина (и cart_hash плана) менялась
+столько раз, сколько товаров. Теперь операции add / update / remove:
+- проверяются по общим чтениям: текущие intents, избранное, офферы и
+  поставщики читаются запросами с $in (замена неактивного anchor - один
+  find_one на ядро + unit_type);
+- применяются одним ordered bulk_write в cart_intents (порядок операций
+  сохраняется: add + remove одного товара в одном пакете работает);
+- cart_hash считается один раз - после записи.
+
+Семантика каждой операции - как у одиночных эндпоинтов
+(/cart/intent, PUT и DELETE /cart/intent/{item_id}). Невалидная операция
+не срывает пакет: она пропускается и возвращается с кодом и причиной.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.database import Database
+
+from .catalog import publishable_offer_query
+from .plan_snapshot import compute_cart_hash
+
+logger = logging.getLogger(__name__)
+
+CART_BATCH_MAX_OPERATIONS = 200
+CART_OPERATIONS = ('add', 'update', 'remove')
+
+
+class CartOperationError(Exception):
+    """Операция пакета отклонена (код и текст - как у одиночного эндпоинта)."""
+
+    def __init__(self, code: int, detail: str):
+        super().__init__(detail)
+        self.code = code
+        self.detail = detail
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# === ЧТЕНИЯ ПАКЕТОМ ===
+
+def _load_favorites(db: Database, reference_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Избранное для add по reference_id: favorites_v12 по reference_id, затем
+    по id, затем catalog_references (тот же порядок, что в /cart/intent).
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    lookups = (
+        ('favorites_v12', 'reference_id'),
+        ('favorites_v12', 'id'),
+        ('catalog_references', 'reference_id'),
+    )
+    for collection, key in lookups:
+        missing = [r for r in reference_ids if r not in found]
+        if not missing:
+            break
+        for doc in db[collection].find({key: {'$in': missing}}, {'_id': 0}):
+            found.setdefault(doc.get(key), doc)
+    return found
+
+
+def _load_offers(db: Database, ids: List[str], unique_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Активные офферы по id и (для прямых add) по unique_key - одним запросом."""
+    if not ids and not unique_keys:
+        return {}
+    query = {'active': True, '$or': [{'id': {'$in': ids}}, {'unique_key': {'$in': unique_keys}}]}
+    offers: Dict[str, Dict[str, Any]] = {}
+    for doc in db.supplier_items.find(query, {'_id': 0}):
+        offers[doc['id']] = doc
+        if doc.get('unique_key') in unique_keys:
+            offers.setdefault(f"unique_key:{doc['unique_key']}", doc)
+    return offers
+
+
+def _supplier_names(db: Database, supplier_ids: List[str]) -> Dict[str, str]:
+    names = {}
+    for company in db.companies.find({'id': {'$in': supplier_ids}}, {'_id': 0, 'id': 1, 'companyName': 1, 'name': 1}):
+        names[company['id']] = company.get('companyName', company.get('name', 'Unknown'))
+    return names
+
+
+# === РАЗБОР ОПЕРАЦИЙ ===
+
+def _resolve_direct(offers: Dict[str, Dict[str, Any]], supplier_item_id: str) -> Dict[str, Any]:
+    """Режим 1 /cart/intent: оффер по id или unique_key, активный, с ценой."""
+    item = offers.get(supplier_item_id) or offers.get(f"unique_key:{supplier_item_id}")
+    if not item:
+        raise CartOperationError(404, "Товар не найден или неактивен")
+    if item.get('price', 0) <= 0:
+        raise CartOperationError(400, "Товар недоступен (некорректная цена)")
+    return {
+        'supplier_item': item,
+        'product_name': item.get('name_raw', ''),
+        'unit_type': item.get('unit_type', 'PIECE'),
+        'super_class': item.get('super_class', ''),
+        'pack_qty': item.get('pack_qty'),
+        'brand_id': item.get('brand_id'),
+    }
+
+
+def _resolve_reference(
+    db: Database,
+    fav: Optional[Dict[str, Any]],
+    offers: Dict[str, Dict[str, Any]],
+    replacements: Dict[Tuple[str, str], Optional[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """Режим 2 /cart/intent: закреплённый anchor избранного или самый дешёвый оффер ядра."""
+    if not fav:
+        raise CartOperationError(404, "Reference не найден")
+
+    resolved = {
+        'supplier_item': None,
+        'product_name': fav.get('product_name', fav.get('name', '')),
+        'unit_type': fav.get('unit_type', 'PIECE'),
+        'super_class': fav.get('super_class', ''),
+        'pack_qty': fav.get('pack_value'),
+        'brand_id': fav.get('brand_id'),
+        'replaced': False,
+    }
+    anchor_id = fav.get('anchor_supplier_item_id') or fav.get('best_supplier_id')
+    item = offers.get(anchor_id) if anchor_id else None
+
+    if not item and fav.get('product_core_id'):
+        key = (fav['product_core_id'], fav.get('unit_type', 'PIECE'))
+        if key not in replacements:
+            replacements[key] = db.supplier_items.find_one(
+                publishable_offer_query(product_core_id=key[0], unit_type=key[1]),
+                {'_id': 0},
+                sort=[('price', 1)]  # Самый дешёвый
+            )
+        item = replacements[key]
+        resolved['replaced'] = item is not None
+
+    if not item:
+        raise CartOperationError(400, "Товар временно недоступен (нет активных офферов)")
+    resolved['supplier_item'] = item
+    resolved['product_name'] = item.get('name_raw', resolved['product_name'])
+    return resolved
+
+
+def _check_qty(op: Dict[str, Any]) -> float:
+    qty = op.get('qty')
+    if qty is None or qty <= 0:
+        raise CartOperationError(400, "Укажите qty > 0")
+    return qty
+
+
+def _find_intent(intents: List[Dict[str, Any]], item_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """item_id = supplier_item_id, иначе reference_id (как PUT/DELETE /cart/intent/{item_id})."""
+    for key in ('supplier_item_id', 'reference_id'):
+        for intent in intents:
+            if intent.get(key) == item_id:
+                return key, intent
+    return None
+
+
+# === ПРИМЕНЕНИЕ ===
+
+def apply_cart_operations(db: Database, user_id: str, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Проверяет и применяет пакет операций корзины пользователя.
+
+    operations: [{'op': 'add', 'supplier_item_id' | 'reference_id', 'qty', 'lock_offer'},
+                 {'op': 'update', 'item_id', 'qty'}, {'op': 'remove', 'item_id'}]
+
+    Returns: {'results': [...], 'applied', 'failed', 'cart_hash'}
+    """
+    intents = list(db.cart_intents.find(
+        {'user_id': user_id},
+        {'_id': 0, 'supplier_item_id': 1, 'reference_id': 1}
+    ))
+
+    adds = [op for op in operations if op.get('op') == 'add']
+    reference_ids = list(dict.fromkeys(
+        op['reference_id'] for op in adds if op.get('reference_id') and not op.get('supplier_item_id')))
+    direct_ids = list(dict.fromkeys(op['supplier_item_id'] for op in adds if op.get('supplier_item_id')))
+
+    favorites = _load_favorites(db, reference_ids) if reference_ids else {}
+    anchor_ids = [
+        fav.get('anchor_supplier_item_id') or fav.get('best_supplier_id') for fav in favorites.values()
+    ]
+    offers = _load_offers(db, list(dict.fromkeys(direct_ids + [a for a in anchor_ids if a])), direct_ids)
+    replacements: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+
+    results: List[Dict[str, Any]] = []
+    writes: List[Tuple[str, Dict[str, Any], Optional[Dict[str, Any]]]] = []  # (op, selector, $set)
+    favorite_writes: List[UpdateOne] = []
+    added: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []  # (result, intent): supplier_name после чтения
+    now = _now()
+
+    for index, op in enumerate(operations):
+        kind = op.get('op')
+        result: Dict[str, Any] = {'index': index, 'op': kind}
+        try:
+            if kind not in CART_OPERATIONS:
+                raise CartOperationError(400, f"Неизвестная операция: {kind}")
+
+            if kind == 'add':
+                qty = _check_qty(op)
+                if op.get('supplier_item_id'):
+                    resolved = _resolve_direct(offers, op['supplier_item_id'])
+                elif op.get('reference_id'):
+                    resolved = _resolve_reference(db, favorites.get(op['reference_id']), offers, replacements)
+                else:
+                    raise CartOperationError(400, "Укажите reference_id или supplier_item_id")
+
+                item = resolved['supplier_item']
+                supplier_item_id = item['id']
+                reference_id = op.get('reference_id') or f"direct_{supplier_item_id}"
+                if resolved.get('replaced'):
+                    # Обновляем избранное с новым anchor
+                    favorite_writes.append(UpdateOne(
+                        {'reference_id': op['reference_id']},
+                        {'$set': {
+                            'anchor_supplier_item_id': supplier_item_id,
+                            'best_price': item.get('price', 0),
+                            'best_supplier_id': item.get('supplier_company_id'),
+                            'updated_at': now,
+                        }}
+                    ))
+                intent = {
+                    'user_id': user_id,
+                    'reference_id': reference_id,
+                    'supplier_item_id': supplier_item_id,  # КЛЮЧЕВОЕ: сохраняем конкретный оффер
+                    'qty': qty,
+                    'product_name': resolved['product_name'],
+                    'price': item.get('price', 0),
+                    'unit_type': resolved['unit_type'],
+                    'supplier_id': item.get('supplier_company_id'),
+                    'supplier_name': '',
+                    'super_class': resolved['super_class'],
+                    'pack_qty': resolved['pack_qty'],
+                    'brand_id': resolved['brand_id'],
+                    'locked': op.get('lock_offer', True),
+                    'created_at': now,
+                    'updated_at': now,
+                }
+                writes.append(('add', {'user_id': user_id, 'supplier_item_id': supplier_item_id}, intent))
+                intents = [i for i in intents if i.get('supplier_item_id') != supplier_item_id]
+                intents.append({'supplier_item_id': supplier_item_id, 'reference_id': reference_id})
+                result.update({'status': 'ok', 'supplier_item_id': supplier_item_id, 'qty': qty})
+                added.append((result, intent))
+
+            else:
+                item_id = op.get('item_id')
+                if not item_id:
+                    raise CartOperationError(400, "Укажите item_id")
+                qty = _check_qty(op) if kind == 'update' else None
+                found = _find_intent(intents, item_id)
+                if not found:
+                    raise CartOperationError(404, "Intent не найден")
+                key, intent = found
+                selector = {'user_id': user_id, key: item_id}
+                if kind == 'update':
+                    writes.append(('update', selector, {'qty': qty, 'updated_at': now}))
+                    result['qty'] = qty
+                else:
+                    writes.append(('remove', selector, None))
+                    intents.remove(intent)
+                result.update({'status': 'ok', 'item_id': item_id})
+
+        except CartOperationError as e:
+            result.update({'status': 'error', 'code': e.code, 'detail': e.detail})
+        results.append(result)
+
+    # Имена поставщиков добавленных офферов - одним запросом
+    supplier_ids = list({intent['supplier_id'] for _, intent in added if intent['supplier_id']})
+    names = _supplier_names(db, supplier_ids) if supplier_ids else {}
+    for result, intent in added:
+        if intent['supplier_id']:
+            intent['supplier_name'] = names.get(intent['supplier_id'], 'Unknown')
+        result.update({'product_name': intent['product_name'], 'price': intent['price'],
+                       'supplier_name': intent['supplier_name']})
+
+    if favorite_writes:
+        db.favorites_v12.bulk_write(favorite_writes, ordered=False)
+    if writes:
+        db.cart_intents.bulk_write([
+            DeleteOne(selector) if kind == 'remove'
+            else UpdateOne(selector, {'$set': fields}, upsert=kind == 'add')
+            for kind, selector, fields in writes
+        ], ordered=True)
+
+    applied = sum(1 for r in results if r['status'] == 'ok')
+    logger.info(f"cart batch user={user_id}: {applied} applied, {len(results) - applied} failed")
+    return {
+        'results': results,
+        'applied': applied,
+        'failed': len(results) - applied,
+        'cart_hash': compute_cart_hash(db, user_id),
+    }
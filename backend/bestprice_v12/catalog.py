@@ -8,10 +8,8 @@ BestPrice v12 - Catalog Logic
 """
 
 import os
-import uuid
 import math
 import logging
-from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
@@ -24,6 +22,20 @@ logger = logging.getLogger(__name__)
 # === GLOBAL PARAMETERS (п.3 ТЗ) ===
 PACK_MATCH_MODE = "STRICT"
 
+# Оффер виден в каталоге/альтернативах/оптимизаторе, если активен и прошёл
+# валидацию при импорте (флаг publishable пишет offer_validator.publication_fields)
+PUBLISHABLE_OFFER_FILTER = {'active': True, 'publishable': True}
+
+
+def publishable_offer_query(**conditions: Any) -> Dict[str, Any]:
+    """
+    Фильтр публикуемых офферов + условия запроса.
+    
+    Ведущие поля совпадают с индексом (publishable, product_core_id, unit_type, price),
+    поэтому запрос по ядру/единице с сортировкой по цене обслуживается индексом.
+    """
+    return {**PUBLISHABLE_OFFER_FILTER, **conditions}
+
 
 def get_db() -> Database:
     """Get MongoDB connection"""
@@ -135,6 +147,53 @@ def calculate_line_total(effective_qty: float, price: float) -> float:
     return effective_qty * price
 
 
+# Версия правил offer_pack_*: при изменении extract_pack_from_name / pack_qty
+# override поднять, и сохранённые поля будут пересчитаны на лету (и backfill'ом)
+OFFER_PACK_VERSION = 1
+
+
+def compute_offer_pack(
+    name_raw: str,
+    pack_qty: Optional[float],
+    unit_type: Optional[str]
+) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Фасовка оффера для STRICT matching (п.5.2 ТЗ)
+    
+    pack из названия; если в supplier_item есть pack_qty > 1 - он важнее,
+    а unit определяется по unit_type.
+    """
+    pack_value, pack_unit = extract_pack_from_name(name_raw or '')
+    
+    if pack_qty and pack_qty > 1:
+        pack_value = float(pack_qty)
+        if unit_type == 'WEIGHT':
+            pack_unit = 'кг'
+        elif unit_type == 'VOLUME':
+            pack_unit = 'л'
+        else:
+            pack_unit = 'шт'
+    
+    return pack_value, pack_unit
+
+
+def offer_pack_fields(name_raw: str, pack_qty: Optional[float], unit_type: Optional[str]) -> Dict[str, Any]:
+    """Предрасчитанные поля фасовки для записи в supplier_items (импорт / backfill)"""
+    pack_value, pack_unit = compute_offer_pack(name_raw, pack_qty, unit_type)
+    return {
+        'offer_pack_value': pack_value,
+        'offer_pack_unit': pack_unit,
+        'offer_pack_v': OFFER_PACK_VERSION,
+    }
+
+
+def get_offer_pack(offer: Dict[str, Any]) -> Tuple[Optional[float], Optional[str]]:
+    """Фасовка оффера: предрасчитанная (если актуальна) или разбор названия"""
+    if offer.get('offer_pack_v') == OFFER_PACK_VERSION:
+        return offer.get('offer_pack_value'), offer.get('offer_pack_unit')
+    return compute_offer_pack(offer.get('name_raw', ''), offer.get('pack_qty'), offer.get('unit_type'))
+
+
 def check_strict_pack_match(
     offer_pack_value: Optional[float],
     offer_pack_unit: Optional[str],
@@ -208,12 +267,7 @@ def get_best_price_for_reference(
         (best_line_total, best_supplier_id, best_offer)
     """
     # Получаем кандидатов по правилам п.5.1
-    query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'product_core_id': product_core_id,
-        'unit_type': unit_type,
-    }
+    query = publishable_offer_query(product_core_id=product_core_id, unit_type=unit_type)
     
     candidates = list(db.supplier_items.find(query, {'_id': 0}))
     
@@ -226,18 +280,7 @@ def get_best_price_for_reference(
     
     for offer in candidates:
         # STRICT pack matching (п.5.2)
-        offer_pack_value, offer_pack_unit = extract_pack_from_name(offer.get('name_raw', ''))
-        
-        # Если в supplier_item есть pack_qty, используем его
-        if offer.get('pack_qty') and offer['pack_qty'] > 1:
-            offer_pack_value = float(offer['pack_qty'])
-            # Определяем unit по unit_type
-            if unit_type == 'WEIGHT':
-                offer_pack_unit = 'кг'
-            elif unit_type == 'VOLUME':
-                offer_pack_unit = 'л'
-            else:
-                offer_pack_unit = 'шт'
+        offer_pack_value, offer_pack_unit = get_offer_pack(offer)
         
         if not check_strict_pack_match(offer_pack_value, offer_pack_unit, pack_value, pack_unit):
             continue
@@ -264,103 +307,13 @@ def generate_catalog_references(db: Database, limit: Optional[int] = None) -> Di
     - Для каждой группы создаём одну reference карточку
     - anchor = оффер с лучшей ценой
     
+    Один проход по supplier_items + bulk upsert (best_price_engine).
+    
     Returns:
         Statistics dict
     """
-    logger.info("🔄 Generating catalog_references from supplier_items...")
-    
-    # Агрегация: группируем по product_core_id + unit_type
-    pipeline = [
-        {'$match': {'active': True, 'price': {'$gt': 0}, 'product_core_id': {'$ne': None}}},
-        {'$group': {
-            '_id': {
-                'product_core_id': '$product_core_id',
-                'unit_type': '$unit_type'
-            },
-            'items': {'$push': {
-                'id': '$id',
-                'name_raw': '$name_raw',
-                'price': '$price',
-                'supplier_company_id': '$supplier_company_id',
-                'brand_id': '$brand_id',
-                'origin_country': '$origin_country',
-                'super_class': '$super_class',
-                'min_order_qty': '$min_order_qty',
-                'pack_qty': '$pack_qty',
-            }},
-            'count': {'$sum': 1}
-        }},
-        {'$sort': {'count': -1}}
-    ]
-    
-    if limit:
-        pipeline.append({'$limit': limit})
-    
-    groups = list(db.supplier_items.aggregate(pipeline))
-    logger.info(f"   Found {len(groups)} unique product_core + unit_type combinations")
-    
-    # Создаём коллекцию catalog_references
-    created = 0
-    skipped = 0
-    
-    for group in groups:
-        product_core_id = group['_id']['product_core_id']
-        unit_type = group['_id']['unit_type']
-        items = group['items']
-        
-        if not items:
-            skipped += 1
-            continue
-        
-        # Находим anchor (лучшая цена)
-        best_item = min(items, key=lambda x: x.get('price', float('inf')))
-        
-        # Извлекаем pack из названия anchor
-        pack_value, pack_unit = extract_pack_from_name(best_item.get('name_raw', ''))
-        
-        # Генерируем reference_id
-        reference_id = f"ref_{product_core_id}_{unit_type}_{uuid.uuid4().hex[:8]}"
-        
-        # Создаём reference
-        reference = {
-            'reference_id': reference_id,
-            'product_core_id': product_core_id,
-            'unit_type': unit_type,
-            'pack_value': pack_value,
-            'pack_unit': pack_unit,
-            'brand_id': best_item.get('brand_id'),
-            'origin_country_id': best_item.get('origin_country'),
-            'critical_attrs': None,
-            'anchor_supplier_item_id': best_item['id'],
-            'name': best_item.get('name_raw', product_core_id),
-            'super_class': best_item.get('super_class'),
-            'best_price': best_item.get('price'),
-            'best_supplier_id': best_item.get('supplier_company_id'),
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'updated_at': datetime.now(timezone.utc).isoformat(),
-        }
-        
-        # Upsert в коллекцию
-        db.catalog_references.update_one(
-            {'product_core_id': product_core_id, 'unit_type': unit_type},
-            {'$set': reference},
-            upsert=True
-        )
-        created += 1
-    
-    # Создаём индексы
-    db.catalog_references.create_index('reference_id', unique=True)
-    db.catalog_references.create_index([('product_core_id', 1), ('unit_type', 1)])
-    db.catalog_references.create_index('super_class')
-    
-    stats = {
-        'total_groups': len(groups),
-        'created': created,
-        'skipped': skipped,
-    }
-    
-    logger.info(f"✅ Catalog references generated: {created} created, {skipped} skipped")
-    return stats
+    from .best_price_engine import generate_references
+    return generate_references(db, limit=limit)
 
 
 def get_catalog_items(
@@ -402,41 +355,17 @@ def get_catalog_items(
     return items
 
 
-def update_best_prices(db: Database) -> Dict[str, Any]:
+def update_best_prices(db: Database, incremental: bool = False) -> Dict[str, Any]:
     """
-    Обновляет best_price для всех catalog_references
+    Обновляет best_price для catalog_references
     
-    Вызывать периодически или после импорта прайсов
+    Вызывать периодически или после импорта прайсов.
+    incremental=True - только ядра из catalog_change_log с прошлого прогона.
     """
-    logger.info("🔄 Updating best prices for catalog references...")
-    
-    references = list(db.catalog_references.find({}, {'_id': 0}))
-    updated = 0
-    
-    for ref in references:
-        best_price, best_supplier_id, best_offer = get_best_price_for_reference(
-            db,
-            ref['product_core_id'],
-            ref['unit_type'],
-            ref.get('pack_value'),
-            ref.get('pack_unit'),
-            user_qty=1.0
-        )
-        
-        if best_price is not None:
-            db.catalog_references.update_one(
-                {'reference_id': ref['reference_id']},
-                {'$set': {
-                    'best_price': best_price,
-                    'best_supplier_id': best_supplier_id,
-                    'anchor_supplier_item_id': best_offer['id'] if best_offer else ref.get('anchor_supplier_item_id'),
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            updated += 1
-    
-    logger.info(f"✅ Updated {updated} catalog references")
-    return {'updated': updated, 'total': len(references)}
+    from .best_price_engine import recompute_best_prices, recompute_incremental
+    if incremental:
+        return recompute_incremental(db)
+    return recompute_best_prices(db)
 
 
 # === CLI ===
@@ -449,6 +378,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='BestPrice v12 Catalog Manager')
     parser.add_argument('--generate', action='store_true', help='Generate catalog references')
     parser.add_argument('--update-prices', action='store_true', help='Update best prices')
+    parser.add_argument('--incremental', action='store_true', help='Only cores from catalog_change_log')
     parser.add_argument('--limit', type=int, help='Limit number of references to generate')
     
     args = parser.parse_args()
@@ -460,5 +390,5 @@ if __name__ == '__main__':
         print(f"Generated: {stats}")
     
     if args.update_prices:
-        stats = update_best_prices(db)
+        stats = update_best_prices(db, incremental=args.incremental)
         print(f"Updated: {stats}")
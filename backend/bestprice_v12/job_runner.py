@@ -0,0 +1,353 @@
+"""
+BestPrice v12 - Admin Job Runner
+
+Фоновые задачи для долгих админских операций.
+
+Генерация каталога, пересчёт best price, cleanup-invalid, brand backfill и
+миграция избранного выполнялись внутри HTTP-запроса: держали воркер (часто
+и event loop) до конца и падали по таймауту прокси. Теперь:
+- эндпоинт ставит задачу (submit) и сразу отвечает job id;
+- задача выполняется в этом же процессе в потоке (sync pymongo),
+  с ограничением одновременных задач - общим и по виду (kind);
+- состояние хранится в admin_jobs: статус, прогресс, результат, ошибка -
+  его видит любой воркер (GET /v12/admin/jobs/{job_id});
+- отмена кооперативная: cancel ставит cancel_requested, задача замечает
+  его в JobContext.progress() / check_cancelled() и останавливается;
+- exclusive-вид не запускается второй раз, пока первая задача активна -
+  submit возвращает уже идущую. Гарантия на уровне Mongo, а не процесса:
+  активная exclusive-задача держит поле exclusive_kind под уникальным
+  partial-индексом, второй insert любого воркера получает DuplicateKeyError.
+
+Задачи не переживают рестарт процесса: задача обновляет updated_at
+(heartbeat) и пока ждёт слот в очереди, и пока выполняется. Активная задача
+без обновлений дольше STALE_JOB_SEC (несколько пропущенных heartbeat) или
+задача этого же воркера, которой нет в его памяти, - осталась от прошлого
+процесса: при старте fail_stale_jobs помечает такие failed, а submit
+exclusive-вида снимает зависшую задачу и ставит новую, не дожидаясь
+следующего рестарта.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+ADMIN_JOBS_COLLECTION = 'admin_jobs'
+ACTIVE_STATUSES = ('queued', 'running')
+# Есть только у активной exclusive-задачи (уникальный partial-индекс), снимается при завершении
+EXCLUSIVE_KIND_FIELD = 'exclusive_kind'
+DEFAULT_CONCURRENCY = 2
+CANCEL_CHECK_INTERVAL_SEC = 1.0
+HEARTBEAT_SEC = 60
+# Три пропущенных heartbeat подряд - процесс задачи мёртв
+STALE_JOB_SEC = 3 * HEARTBEAT_SEC
+JOB_LIST_LIMIT = 50
+
+_PROJECTION = {'_id': 0}
+
+# id задач этого процесса (любого раннера) от insert до завершения _run: активная задача
+# с worker этого процесса, которой здесь нет, осталась от прошлого запуска
+_live_jobs: set = set()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def ensure_job_indexes(db: Database) -> None:
+    db[ADMIN_JOBS_COLLECTION].create_index('id', unique=True)
+    db[ADMIN_JOBS_COLLECTION].create_index([('kind', 1), ('created_at', -1)])
+    db[ADMIN_JOBS_COLLECTION].create_index([('status', 1), ('updated_at', 1)])
+    db[ADMIN_JOBS_COLLECTION].create_index(EXCLUSIVE_KIND_FIELD, unique=True,
+                                           partialFilterExpression={EXCLUSIVE_KIND_FIELD: {'$exists': True}})
+
+
+class JobCancelled(Exception):
+    """Задача остановлена по cancel_requested."""
+
+
+# === CONTEXT (поток задачи) ===
+
+class JobContext:
+    """Передаётся функции задачи: db, прогресс и проверка отмены."""
+
+    def __init__(self, db: Database, job_id: str, runner: 'JobRunner'):
+        self.db = db
+        self.job_id = job_id
+        self._runner = runner
+        self._checked_at = 0.0
+
+    def cancelled(self) -> bool:
+        """Отмена из этого процесса видна сразу, из другого воркера - через Mongo (не чаще раза в секунду)."""
+        if self.job_id in self._runner._cancel_requested:
+            return True
+        now = time.monotonic()
+        if now - self._checked_at < CANCEL_CHECK_INTERVAL_SEC:
+            return False
+        self._checked_at = now
+        doc = self.db[ADMIN_JOBS_COLLECTION].find_one({'id': self.job_id}, {'_id': 0, 'cancel_requested': 1})
+        return bool(doc and doc.get('cancel_requested'))
+
+    def check_cancelled(self) -> None:
+        if self.cancelled():
+            raise JobCancelled(self.job_id)
+
+    def progress(self, **fields: Any) -> None:
+        """Сохраняет прогресс (progress.<поле>) и прерывает задачу, если её отменили."""
+        self.db[ADMIN_JOBS_COLLECTION].update_one(
+            {'id': self.job_id},
+            {'$set': {**{f'progress.{k}': v for k, v in fields.items()}, 'updated_at': _now()}},
+        )
+        self.check_cancelled()
+
+
+JobFn = Callable[..., Any]
+
+
+# === RUNNER ===
+
+class JobRunner:
+    """
+    In-process очередь задач.
+
+    concurrency - сколько задач выполняется одновременно в этом процессе;
+    limits - отдельный предел по виду (по умолчанию 1 задача вида за раз).
+    """
+
+    def __init__(self, db: Database, concurrency: int = DEFAULT_CONCURRENCY,
+                 limits: Optional[Dict[str, int]] = None):
+        self.db = db
+        self.concurrency = concurrency
+        self.limits = dict(limits or {})
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._kind_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+
+    def _semaphores(self, kind: str):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if kind not in self._kind_semaphores:
+            self._kind_semaphores[kind] = asyncio.Semaphore(self.limits.get(kind, 1))
+        return self._semaphore, self._kind_semaphores[kind]
+
+    def _create_job(self, kind: str, params: Optional[Dict[str, Any]], user_id: Optional[str],
+                    exclusive: bool) -> Dict[str, Any]:
+        collection = self.db[ADMIN_JOBS_COLLECTION]
+        now = _now()
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'status': 'queued',
+            'params': params or {},
+            'user_id': user_id,
+            'worker': self.worker,
+            'progress': {},
+            'result': None,
+            'error': None,
+            'cancel_requested': False,
+            'created_at': now,
+            'updated_at': now,
+            'started_at': None,
+            'finished_at': None,
+        }
+        _live_jobs.add(job['id'])
+        if not exclusive:
+            collection.insert_one(dict(job))
+            return job
+        job[EXCLUSIVE_KIND_FIELD] = kind
+        # Активная задача могла завершиться (или оказаться прерванной) между insert и find_one -
+        # тогда пробуем ещё раз
+        for _ in range(3):
+            try:
+                collection.insert_one(dict(job))
+                return job
+            except DuplicateKeyError:
+                active = collection.find_one({EXCLUSIVE_KIND_FIELD: kind}, _PROJECTION)
+                if active and not self._fail_if_interrupted(active):
+                    _live_jobs.discard(job['id'])
+                    return {**active, 'deduplicated': True}
+        _live_jobs.discard(job['id'])
+        raise RuntimeError(f"exclusive job {kind!r} could not be queued")
+
+    def _fail_if_interrupted(self, job: Dict[str, Any]) -> bool:
+        """
+        Помечает failed активную задачу прошлого процесса, державшую exclusive-вид.
+
+        Задача этого же воркера, которой нет в _live_jobs, прервана рестартом сразу;
+        задача другого воркера - если её heartbeat не обновлялся STALE_JOB_SEC.
+        """
+        query = {'id': job['id'], 'status': {'$in': list(ACTIVE_STATUSES)}}
+        if job.get('worker') != self.worker or job['id'] in _live_jobs:
+            query['updated_at'] = {'$lt': _stale_cutoff(STALE_JOB_SEC)}
+        failed = self.db[ADMIN_JOBS_COLLECTION].update_one(query, _stale_update()).modified_count > 0
+        if failed:
+            logger.warning("Job %s (%s) of %s interrupted, marked failed", job['id'], job.get('kind'), job.get('worker'))
+        return failed
+
+    async def submit(self, kind: str, fn: JobFn, *args: Any, params: Optional[Dict[str, Any]] = None,
+                     user_id: Optional[str] = None, exclusive: bool = True, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Ставит fn(ctx, *args, **kwargs) в очередь; возвращает документ задачи.
+
+        exclusive=True: пока задача этого вида queued/running, возвращается
+        она (deduplicated=True), новая не создаётся.
+        """
+        job = await asyncio.to_thread(self._create_job, kind, params, user_id, exclusive)
+        if job.get('deduplicated'):
+            return job
+        task = asyncio.create_task(self._run(job['id'], kind, fn, args, kwargs))
+        self._tasks[job['id']] = task
+        task.add_done_callback(lambda _t, job_id=job['id']: self._tasks.pop(job_id, None))
+        return job
+
+    def _update(self, job_id: str, fields: Dict[str, Any], only_if: Optional[Dict[str, Any]] = None):
+        update: Dict[str, Any] = {'$set': {**fields, 'updated_at': _now()}}
+        if fields.get('status', 'queued') not in ACTIVE_STATUSES:
+            # Завершённая задача освобождает exclusive-вид
+            update['$unset'] = {EXCLUSIVE_KIND_FIELD: ''}
+        return self.db[ADMIN_JOBS_COLLECTION].find_one_and_update(
+            {'id': job_id, **(only_if or {})}, update,
+            projection=_PROJECTION, return_document=ReturnDocument.AFTER,
+        )
+
+    def _start(self, job_id: str) -> bool:
+        """queued → running, если задачу не отменили в очереди."""
+        started = self._update(job_id, {'status': 'running', 'started_at': _now()},
+                               only_if={'status': 'queued', 'cancel_requested': False})
+        if started is None:
+            self._update(job_id, {'status': 'cancelled', 'finished_at': _now()}, only_if={'status': 'queued'})
+        return started is not None
+
+    async def _run(self, job_id: str, kind: str, fn: JobFn, args, kwargs) -> None:
+        semaphore, kind_semaphore = self._semaphores(kind)
+        # Heartbeat с момента постановки: задача, ждущая слот, тоже жива для fail_stale_jobs
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            # Сначала слот вида: задача, ждущая свой вид, не занимает общий слот
+            async with kind_semaphore, semaphore:
+                if not await asyncio.to_thread(self._start, job_id):
+                    return
+                ctx = JobContext(self.db, job_id, self)
+                started = time.monotonic()
+                try:
+                    result = await asyncio.to_thread(fn, ctx, *args, **kwargs)
+                except JobCancelled:
+                    await asyncio.to_thread(self._update, job_id, {'status': 'cancelled', 'finished_at': _now()})
+                    logger.info("Job %s (%s) cancelled", job_id, kind)
+                    return
+                except Exception as e:
+                    logger.error("Job %s (%s) failed: %s", job_id, kind, e)
+                    await asyncio.to_thread(self._update, job_id, {
+                        'status': 'failed', 'error': str(e), 'finished_at': _now()})
+                    return
+                done = {'status': 'succeeded', 'finished_at': _now(),
+                        'elapsed_sec': round(time.monotonic() - started, 2)}
+                try:
+                    await asyncio.to_thread(self._update, job_id, {**done, 'result': result})
+                except Exception as e:
+                    # Результат не сохраняется (не BSON, > 16 МБ): задача всё равно завершена
+                    logger.warning("Job %s (%s): result not stored: %s", job_id, kind, e)
+                    await asyncio.to_thread(self._update, job_id, {
+                        **done, 'result': None, 'error': f'result not stored: {e}'})
+                logger.info("Job %s (%s) succeeded in %.1fs", job_id, kind, time.monotonic() - started)
+        finally:
+            heartbeat.cancel()
+            self._cancel_requested.discard(job_id)
+            _live_jobs.discard(job_id)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """updated_at активной задачи (в очереди или выполняющейся), даже без прогресса (см. fail_stale_jobs)."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SEC)
+            await asyncio.to_thread(self.db[ADMIN_JOBS_COLLECTION].update_one,
+                                    {'id': job_id, 'status': {'$in': list(ACTIVE_STATUSES)}},
+                                    {'$set': {'updated_at': _now()}})
+
+    # --- запросы (sync, вызывать через asyncio.to_thread) ---
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.db[ADMIN_JOBS_COLLECTION].find_one({'id': job_id}, _PROJECTION)
+
+    def list(self, kind: Optional[str] = None, limit: int = JOB_LIST_LIMIT) -> List[Dict[str, Any]]:
+        query = {'kind': kind} if kind else {}
+        return list(self.db[ADMIN_JOBS_COLLECTION].find(query, _PROJECTION)
+                    .sort([('created_at', -1)]).limit(limit))
+
+    def active(self, kind: str) -> Optional[Dict[str, Any]]:
+        return self.db[ADMIN_JOBS_COLLECTION].find_one(
+            {'kind': kind, 'status': {'$in': list(ACTIVE_STATUSES)}}, _PROJECTION, sort=[('created_at', -1)])
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Запрашивает отмену активной задачи. Задача в очереди отменяется сразу,
+        выполняющаяся - при следующем progress()/check_cancelled().
+        """
+        job = self._update(job_id, {'cancel_requested': True}, only_if={'status': {'$in': list(ACTIVE_STATUSES)}})
+        if job is None:
+            return self.get(job_id)
+        self._cancel_requested.add(job_id)
+        if job['status'] == 'queued':
+            job = self._update(job_id, {'status': 'cancelled', 'finished_at': _now()},
+                               only_if={'status': 'queued'}) or self.get(job_id)
+        return job
+
+
+def _stale_cutoff(stale_after_sec: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=stale_after_sec)).isoformat()
+
+
+def _stale_update() -> Dict[str, Any]:
+    now = _now()
+    return {'$set': {'status': 'failed', 'error': 'stale: worker restarted', 'finished_at': now, 'updated_at': now},
+            '$unset': {EXCLUSIVE_KIND_FIELD: ''}}
+
+
+def fail_stale_jobs(db: Database, stale_after_sec: float = STALE_JOB_SEC, worker: Optional[str] = None) -> int:
+    """
+    Активные задачи без обновлений дольше stale_after_sec - failed (процесс перезапущен).
+
+    worker - воркер этого процесса при старте: его активные задачи остались
+    от прошлого запуска с тем же hostname:pid (контейнер) и failed сразу.
+    """
+    stale = {'updated_at': {'$lt': _stale_cutoff(stale_after_sec)}}
+    query = {'status': {'$in': list(ACTIVE_STATUSES)}, **stale}
+    if worker:
+        query = {'status': query['status'], '$or': [stale, {'worker': worker}]}
+    return db[ADMIN_JOBS_COLLECTION].update_many(query, _stale_update()).modified_count
+
+
+def admin_job_response(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Ответ эндпоинта, поставившего задачу: job id + где смотреть статус."""
+    return {
+        'status': job['status'],
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'deduplicated': job.get('deduplicated', False),
+        'status_url': f"/api/v12/admin/jobs/{job['id']}",
+    }
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner(db: Database) -> JobRunner:
+    """Один раннер на процесс (общие лимиты для /api и /v12 эндпоинтов)."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(db)
+        return _runner
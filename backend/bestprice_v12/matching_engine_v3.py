@@ -21,6 +21,8 @@ from typing import Dict, List, Optional, Tuple, Any, Set
 from dataclasses import dataclass, field
 from enum import Enum
 
+from .signature_cache import cached_signature
+
 logger = logging.getLogger(__name__)
 
 
@@ -796,7 +798,8 @@ def find_alternatives_v3(
     source_item: Dict,
     candidates: List[Dict],
     limit: int = 10,
-    strict_threshold: int = STRICT_THRESHOLD
+    strict_threshold: int = STRICT_THRESHOLD,
+    signatures: Optional[Dict[str, ProductSignature]] = None,
 ) -> AlternativesResult:
     """
     Находит альтернативы для товара по ТЗ v12.
@@ -810,6 +813,7 @@ def find_alternatives_v3(
         candidates: Список кандидатов
         limit: Максимум результатов на режим
         strict_threshold: Порог для включения Similar
+        signatures: Кэш сигнатур кандидатов по id (batch alternatives)
     
     Returns:
         AlternativesResult с Strict и Similar списками
@@ -824,7 +828,7 @@ def find_alternatives_v3(
         if cand.get('id') == source_item.get('id'):
             continue
         
-        cand_sig = extract_signature(cand)
+        cand_sig = cached_signature(cand, extract_signature, signatures)
         
         # Сначала пробуем Strict
         strict_match = match_candidate(source_sig, cand_sig, check_strict=True)
@@ -888,7 +892,7 @@ def find_alternatives_v3(
     def format_item(x, mode: str) -> Dict:
         item = x['item']
         result = x['result']
-        cand_sig = extract_signature(item)
+        cand_sig = cached_signature(item, extract_signature, signatures)
         
         return {
             'id': item.get('id'),
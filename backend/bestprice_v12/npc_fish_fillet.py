@@ -37,7 +37,9 @@ import logging
 from typing import Dict, List, Optional, Tuple, Any, Set
 from dataclasses import dataclass, field
 from enum import Enum
-from difflib import SequenceMatcher
+
+from .signature_cache import cached_signature
+from .token_similarity import token_similarity
 
 logger = logging.getLogger(__name__)
 
@@ -591,28 +593,8 @@ def extract_fish_fillet_signature(item: Dict) -> FishFilletSignature:
 # ============================================================================
 
 def calculate_similarity(source_tokens: List[str], candidate_tokens: List[str]) -> float:
-    """Вычисляет similarity score по токенам."""
-    if not source_tokens or not candidate_tokens:
-        return 0.0
-    
-    source_set = set(source_tokens)
-    candidate_set = set(candidate_tokens)
-    
-    intersection = source_set & candidate_set
-    union = source_set | candidate_set
-    
-    if not union:
-        return 0.0
-    
-    # Jaccard similarity
-    jaccard = len(intersection) / len(union)
-    
-    # Sequence similarity
-    source_str = ' '.join(sorted(source_tokens))
-    candidate_str = ' '.join(sorted(candidate_tokens))
-    seq_ratio = SequenceMatcher(None, source_str, candidate_str).ratio()
-    
-    return (jaccard + seq_ratio) / 2
+    """Вычисляет similarity score по токенам (Jaccard + SequenceMatcher) / 2."""
+    return token_similarity(source_tokens, candidate_tokens)
 
 
 # ============================================================================
@@ -921,7 +903,8 @@ def apply_fish_fillet_filter(
     source_item: Dict,
     candidates: List[Dict],
     limit: int = 10,
-    mode: str = 'strict'
+    mode: str = 'strict',
+    signatures: Optional[Dict[str, FishFilletSignature]] = None,
 ) -> Tuple[List[Dict], List[Dict], Dict[str, int]]:
     """
     Применяет FISH_FILLET фильтрацию (ZERO-TRASH).
@@ -944,6 +927,8 @@ def apply_fish_fillet_filter(
     8. country_match
     9. text_similarity
     10. ppu (цена за кг)
+    
+    signatures: общий кэш сигнатур кандидатов по id (batch alternatives).
     """
     source_sig = extract_fish_fillet_signature(source_item)
     
@@ -974,7 +959,7 @@ def apply_fish_fillet_filter(
         if cand.get('id') == source_item.get('id'):
             continue
         
-        cand_sig = extract_fish_fillet_signature(cand)
+        cand_sig = cached_signature(cand, extract_fish_fillet_signature, signatures)
         strict_result = check_fish_fillet_strict(source_sig, cand_sig)
         
         if strict_result.passed_strict:
@@ -36,10 +36,12 @@ from typing import Dict, List, Optional, Tuple, Any, Set
 from dataclasses import dataclass, field
 from pathlib import Path
 from enum import Enum
-from difflib import SequenceMatcher
 
 import pandas as pd
 
+from .signature_cache import cached_signature
+from .token_similarity import token_similarity, gated_similarity
+
 logger = logging.getLogger(__name__)
 
 
@@ -260,6 +262,7 @@ class NPCMatchResult:
     
     # v10: Similarity score
     similarity_score: float = 0.0
+    similarity_is_bound: bool = False   # 85% guard отсёк пару: score - верхняя оценка
     
     # Scoring
     npc_score: int = 0
@@ -359,30 +362,8 @@ def extract_semantic_tokens(name: str) -> List[str]:
 
 
 def calculate_similarity(source_tokens: List[str], candidate_tokens: List[str]) -> float:
-    """Вычисляет similarity score по токенам."""
-    if not source_tokens or not candidate_tokens:
-        return 0.0
-    
-    # Множественное пересечение
-    source_set = set(source_tokens)
-    candidate_set = set(candidate_tokens)
-    
-    intersection = source_set & candidate_set
-    union = source_set | candidate_set
-    
-    if not union:
-        return 0.0
-    
-    # Jaccard similarity
-    jaccard = len(intersection) / len(union)
-    
-    # Sequence similarity для более точной оценки
-    source_str = ' '.join(sorted(source_tokens))
-    candidate_str = ' '.join(sorted(candidate_tokens))
-    seq_ratio = SequenceMatcher(None, source_str, candidate_str).ratio()
-    
-    # Комбинированный score
-    return (jaccard + seq_ratio) / 2
+    """Вычисляет similarity score по токенам (Jaccard + SequenceMatcher) / 2."""
+    return token_similarity(source_tokens, candidate_tokens)
 
 
 # ============================================================================
@@ -1294,10 +1275,14 @@ def check_npc_strict(source: NPCSignature, candidate: NPCSignature) -> NPCMatchR
     
     # === 5. 85% GUARD (для не-SHRIMP, если нет бренда) ===
     if source.npc_domain != 'SHRIMP' and not source.brand_id:
-        similarity = calculate_similarity(source.semantic_tokens, candidate.semantic_tokens)
+        # Ниже порога - верхняя оценка score (точный SequenceMatcher не нужен), помечается "<="
+        similarity, is_bound = gated_similarity(source.semantic_tokens, candidate.semantic_tokens,
+                                                SIMILARITY_THRESHOLD)
         result.similarity_score = similarity
+        result.similarity_is_bound = is_bound
         if similarity < SIMILARITY_THRESHOLD:
-            result.block_reason = f"SIMILARITY_TOO_LOW:{similarity:.2f}<{SIMILARITY_THRESHOLD}"
+            shown = f"<={similarity:.2f}" if is_bound else f"{similarity:.2f}"
+            result.block_reason = f"SIMILARITY_TOO_LOW:{shown}<{SIMILARITY_THRESHOLD}"
             result.rejected_reason = result.block_reason
             return result
         result.passed_gates.append('SIMILARITY')
@@ -1504,7 +1489,8 @@ def apply_npc_filter(
     source_item: Dict,
     candidates: List[Dict],
     limit: int = 10,
-    mode: str = 'strict'
+    mode: str = 'strict',
+    signatures: Optional[Dict[str, NPCSignature]] = None,
 ) -> Tuple[List[Dict], List[Dict], Dict[str, int]]:
     """
     Применяет NPC фильтрацию v12 (ZERO-TRASH).
@@ -1523,6 +1509,9 @@ def apply_npc_filter(
     2. brand_match
     3. country_match
     4. text_similarity
+    
+    signatures: общий кэш сигнатур кандидатов по id (batch alternatives:
+    у товаров одного ядра одни и те же кандидаты).
     """
     source_sig = extract_npc_signature(source_item)
     
@@ -1567,7 +1556,7 @@ def apply_npc_filter(
         if cand.get('id') == source_item.get('id'):
             continue
         
-        cand_sig = extract_npc_signature(cand)
+        cand_sig = cached_signature(cand, extract_npc_signature, signatures)
         strict_result = check_npc_strict(source_sig, cand_sig)
         
         if strict_result.passed_strict:
@@ -1769,6 +1758,7 @@ def explain_npc_match(source_name: str, candidate_name: str) -> Dict:
             'rejected_reason': strict.rejected_reason,
             'npc_score': strict.npc_score,
             'similarity_score': strict.similarity_score,
+            'similarity_is_bound': strict.similarity_is_bound,
             # v11: Debug output
             'passed_gates': strict.passed_gates,
             'rank_features': strict.rank_features,
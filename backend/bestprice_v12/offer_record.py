@@ -0,0 +1,76 @@
+"""
+BestPrice v12 - Offer Overlays
+
+Слой запроса над общими офферами.
+
+Поисковые движки (EnhancedSearchEngine, SearchEngineV12) писали вычисленные
+поля (_pack_value, _token_score, ...) прямо в dict кандидата, поэтому
+каждый запрос строил кандидатов заново из свежих строк БД. Теперь:
+- OfferOverlay - лёгкий слой запроса над оффером (dict, CompactOffer из
+  OfferStore): запись идёт только в собственный dict слоя (copy-on-write),
+  чтение - сначала слой, потом оффер;
+- движки оборачивают кандидатов в overlay() перед записью вычисленных
+  полей, matching_engine_v3 и оптимизатор только читают.
+
+Вложенные значения (списки токенов и т.п.) не копируются - их, как и
+раньше, никто не меняет.
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+
+class OfferOverlay(Mapping):
+    """
+    Вид оффера в рамках одного запроса.
+
+    base не меняется никогда: item['x'] = v пишет в local.
+    """
+
+    __slots__ = ('base', 'local')
+
+    def __init__(self, base: Mapping, local: Optional[Dict[str, Any]] = None):
+        self.base = base
+        self.local = local if local is not None else {}
+
+    def __getitem__(self, key: str) -> Any:
+        local = self.local
+        if key in local:
+            return local[key]
+        return self.base[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        local = self.local
+        if key in local:
+            return local[key]
+        return self.base.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.local or key in self.base
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.local[key] = value
+
+    def pop(self, key: str, *default: Any) -> Any:
+        """Убирает только вычисленное поле; поля base не трогаются."""
+        return self.local.pop(key, *default)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.base
+        for key in self.local:
+            if key not in self.base:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self.base) + sum(1 for key in self.local if key not in self.base)
+
+    def __repr__(self) -> str:
+        return f"OfferOverlay({self.base!r}, {self.local!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.base, **self.local}
+
+
+def overlay(item: Mapping) -> OfferOverlay:
+    """Слой запроса над оффером (dict, CompactOffer или чужой overlay)."""
+    return OfferOverlay(item)
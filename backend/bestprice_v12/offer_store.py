@@ -0,0 +1,125 @@
+"""
+BestPrice v12 - Compact Offer Store
+
+Компактное in-memory представление supplier_items для горячих путей.
+
+Favorites v2, add-from-favorite и /orders держали в каждом воркере
+десятки тысяч полных документов supplier_items как dict (все поля, включая
+служебные: lemma_tokens, search_tokens, name_norm, даты импорта, ...).
+Теперь:
+- из Mongo читаются только поля MATCH_FIELDS (offer_projection);
+- каждый оффер - CompactOffer со __slots__ вместо dict;
+- категориальные строки (поставщик, единицы, super_class, product_core_id,
+  бренд) интернируются: одно значение на процесс, а не на оффер;
+- CompactOffer - неизменяемый Mapping (get / [] как у dict), поэтому
+  hybrid matcher и вызывающий код работают с ним без изменений;
+  вычисленные поля кладутся в overlay() (offer_record).
+
+Бенчмарк памяти: python benchmark_offer_store.py
+"""
+
+import sys
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+# Поля, которые читают find_best_match_hybrid и его вызывающие (winner)
+MATCH_FIELDS = (
+    'id', 'supplier_company_id', 'supplier_item_code', 'product_id', 'name_raw',
+    'price', 'price_per_base_unit', 'base_unit', 'calc_route', 'base_price_unknown',
+    'unit_norm', 'unit_type', 'super_class', 'product_core_id', 'brand_id', 'brand_strict',
+    'net_weight_kg', 'caliber', 'bulk_package', 'seafood_head_status', 'cooking_state', 'trim_grade',
+)
+
+# Низкая кардинальность - интернируем
+INTERNED_FIELDS = frozenset({
+    'supplier_company_id', 'base_unit', 'calc_route', 'unit_norm', 'unit_type', 'super_class',
+    'product_core_id', 'brand_id', 'caliber', 'seafood_head_status', 'cooking_state', 'trim_grade',
+})
+
+_FIELD_SET = frozenset(MATCH_FIELDS)
+
+
+def offer_projection(fields: Iterable[str] = MATCH_FIELDS) -> Dict[str, int]:
+    """Mongo projection: только нужные поля, без _id."""
+    return {'_id': 0, **{f: 1 for f in fields}}
+
+
+class CompactOffer(Mapping):
+    """
+    Оффер из MATCH_FIELDS.
+
+    Поля, которых не было в документе, остаются незаполненными слотами:
+    get() возвращает default, [] - KeyError, как у dict.
+    """
+
+    __slots__ = MATCH_FIELDS
+
+    def __init__(self, doc: Mapping):
+        set_slot = object.__setattr__
+        for key in MATCH_FIELDS:
+            if key in doc:
+                value = doc[key]
+                if key in INTERNED_FIELDS and type(value) is str:
+                    value = sys.intern(value)
+                set_slot(self, key, value)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        return default
+
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELD_SET and hasattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key in MATCH_FIELDS if hasattr(self, key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("CompactOffer is immutable")
+
+    def __repr__(self) -> str:
+        return f"CompactOffer(id={self.get('id')!r}, name_raw={self.get('name_raw')!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self}
+
+
+class OfferStore(Sequence):
+    """Неизменяемый список CompactOffer (ведёт себя как List[Dict])."""
+
+    __slots__ = ('offers',)
+
+    def __init__(self, offers: Iterable[CompactOffer]):
+        self.offers: Tuple[CompactOffer, ...] = tuple(offers)
+
+    @classmethod
+    def from_docs(cls, docs: Iterable[Mapping]) -> 'OfferStore':
+        return cls(CompactOffer(doc) for doc in docs)
+
+    @classmethod
+    async def from_cursor(cls, cursor) -> 'OfferStore':
+        """Из async-курсора motor: документы не копятся в промежуточном списке."""
+        return cls([CompactOffer(doc) async for doc in cursor])
+
+    def __len__(self) -> int:
+        return len(self.offers)
+
+    def __getitem__(self, i):
+        return self.offers[i]
+
+    def __iter__(self) -> Iterator[CompactOffer]:
+        return iter(self.offers)
+
+    def __repr__(self) -> str:
+        return f"OfferStore({len(self.offers)} offers)"
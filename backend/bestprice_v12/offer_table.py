@@ -0,0 +1,139 @@
+"""
+BestPrice v12 - Columnar Offer Table
+
+Колоночное представление кандидатов одного ядра для векторного скоринга.
+
+pick_best_offer / find_best_candidate раньше проходили офферы циклами
+Python по каждому фильтру. Теперь список офферов ядра один раз
+раскладывается в NumPy-массивы (цена, фасовка, min/step qty, жирность,
+коды поставщика/бренда/разделки), а фильтры и ранжирование - операции
+над массивами индексов.
+
+Порядок офферов сохраняется: индексы всегда идут в исходном порядке
+(или в порядке стабильной сортировки), а минимум берётся np.argmin -
+первый минимальный, как min() / строгое `<` в прежних циклах.
+"""
+
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Код для None / пустого значения и для значения, которого нет в таблице
+MISSING_CODE = -1
+UNKNOWN_CODE = -2
+
+
+def _encode(values: Iterable[Any], n: int, empty_is_missing: bool = True) -> Tuple[np.ndarray, Dict[Any, int]]:
+    """Категориальная колонка: значение → int-код (пустые → MISSING_CODE)."""
+    codes: Dict[Any, int] = {}
+    arr = np.fromiter(
+        (codes.setdefault(v, len(codes)) if v or not empty_is_missing else MISSING_CODE for v in values),
+        dtype=np.int32, count=n,
+    )
+    return arr, codes
+
+
+class OfferColumns:
+    """Колонки таблицы; строятся один раз и переиспользуются подтаблицами."""
+
+    __slots__ = ('price', 'pack_value', 'min_order_qty', 'step_qty', 'fat_pct',
+                 'supplier', 'supplier_codes', 'brand', 'brand_codes', 'cut', 'cut_codes')
+
+    def __init__(self, offers: Tuple[Any, ...]):
+        n = len(offers)
+        self.price = np.fromiter((o.price for o in offers), dtype=np.float64, count=n)
+        # Пустая фасовка (None / 0) = не проверяется, как в check_pack_tolerance
+        self.pack_value = np.fromiter((o.pack_value or np.nan for o in offers), dtype=np.float64, count=n)
+        self.min_order_qty = np.fromiter((o.min_order_qty or 1 for o in offers), dtype=np.float64, count=n)
+        self.step_qty = np.fromiter((o.step_qty or 1 for o in offers), dtype=np.float64, count=n)
+        self.fat_pct = np.fromiter(
+            (np.nan if o.fat_pct is None else o.fat_pct for o in offers), dtype=np.float64, count=n
+        )
+        self.supplier, self.supplier_codes = _encode((o.supplier_id for o in offers), n, empty_is_missing=False)
+        self.brand, self.brand_codes = _encode((o.brand_id for o in offers), n)
+        self.cut, self.cut_codes = _encode((o.cut.lower() if o.cut else None for o in offers), n)
+
+    def take(self, idx: np.ndarray) -> 'OfferColumns':
+        sub = object.__new__(OfferColumns)
+        for name in ('price', 'pack_value', 'min_order_qty', 'step_qty', 'fat_pct', 'supplier', 'brand', 'cut'):
+            setattr(sub, name, getattr(self, name)[idx])
+        sub.supplier_codes, sub.brand_codes, sub.cut_codes = self.supplier_codes, self.brand_codes, self.cut_codes
+        return sub
+
+    def supplier_mask(self, supplier_ids: Iterable[str]) -> np.ndarray:
+        codes = [self.supplier_codes[s] for s in supplier_ids if s in self.supplier_codes]
+        return np.isin(self.supplier, codes)
+
+
+class OfferTable(Sequence):
+    """
+    Неизменяемый список офферов ядра + лениво построенные колонки.
+
+    Ведёт себя как List[Offer] (len, индексы, итерация), поэтому его можно
+    передавать везде, где раньше был список кандидатов.
+    """
+
+    __slots__ = ('offers', '_columns')
+
+    def __init__(self, offers: Iterable[Any], columns: Optional[OfferColumns] = None):
+        self.offers = tuple(offers)
+        self._columns = columns
+
+    @classmethod
+    def of(cls, offers) -> 'OfferTable':
+        return offers if isinstance(offers, OfferTable) else cls(offers)
+
+    @property
+    def columns(self) -> OfferColumns:
+        if self._columns is None:
+            self._columns = OfferColumns(self.offers)
+        return self._columns
+
+    def __len__(self) -> int:
+        return len(self.offers)
+
+    def __getitem__(self, i):
+        return self.offers[i]
+
+    def __iter__(self):
+        return iter(self.offers)
+
+    def __repr__(self) -> str:
+        return f"OfferTable({len(self.offers)} offers)"
+
+    def take(self, idx: np.ndarray) -> 'OfferTable':
+        """Подтаблица по индексам (колонки режутся, а не строятся заново)."""
+        columns = self._columns.take(idx) if self._columns is not None else None
+        return OfferTable((self.offers[i] for i in idx.tolist()), columns)
+
+    def _filter_suppliers(self, supplier_ids, keep: bool) -> 'OfferTable':
+        if self._columns is None:
+            supplier_ids = set(supplier_ids)
+            return OfferTable(o for o in self.offers if (o.supplier_id in supplier_ids) == keep)
+        mask = self._columns.supplier_mask(supplier_ids)
+        return self.take(np.flatnonzero(mask if keep else ~mask))
+
+    def only_suppliers(self, supplier_ids) -> 'OfferTable':
+        return self._filter_suppliers(supplier_ids, True)
+
+    def exclude_suppliers(self, supplier_ids) -> 'OfferTable':
+        return self._filter_suppliers(supplier_ids, False)
+
+
+def effective_line_totals(prices: np.ndarray, min_order_qtys: np.ndarray, user_qty: float) -> np.ndarray:
+    """
+    Векторный calculate_line_total(calculate_effective_qty(user_qty, moq), price):
+    effective_qty = user_qty при moq <= 1, иначе ceil(user_qty / moq) * moq.
+    """
+    safe_moq = np.maximum(min_order_qtys, 1.0)
+    effective = np.where(min_order_qtys <= 1, user_qty, np.ceil(user_qty / safe_moq) * safe_moq)
+    return effective * prices
+
+
+def best_line_total_index(candidates: List[Dict[str, Any]], user_qty: float) -> int:
+    """Индекс кандидата (dict из supplier_items) с минимальным line_total; первый при равенстве."""
+    n = len(candidates)
+    prices = np.fromiter((c['price'] for c in candidates), dtype=np.float64, count=n)
+    moqs = np.fromiter((c.get('min_order_qty') or 1 for c in candidates), dtype=np.float64, count=n)
+    return int(np.argmin(effective_line_totals(prices, moqs, user_qty)))
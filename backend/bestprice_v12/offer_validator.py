@@ -14,13 +14,28 @@ Hard gate для качества данных офферов.
 Категорийные правила:
 - Продукты питания: требуется pack_qty > 0 для WEIGHT/VOLUME
 - Непищевые товары: допускается PIECE без pack_qty
+
+Правила публикации проверяются один раз при импорте: в строку пишутся
+publishable + publish_errors (коды ValidationError), а каталог, альтернативы
+и оптимизатор фильтруют только по флагу (индекс publishable_core_unit_price).
+
+Отчёт о качестве данных - одна $facet-агрегация по активным офферам
+(все счётчики, разбивка по поставщикам и примеры за один проход),
+кэшируется до следующей записи в catalog_change_log (импорт прайса и т.п.).
 """
 
 import logging
+import threading
+import time
 from typing import Dict, Any, List, Tuple, Optional
 from dataclasses import dataclass
 from enum import Enum
 
+from pymongo import UpdateOne
+
+from .best_price_engine import CHANGE_LOG_COLLECTION, record_catalog_change
+from .catalog import publishable_offer_query
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,6 +48,7 @@ class ValidationError(str, Enum):
     MISSING_SUPPLIER = "MISSING_SUPPLIER"
     MISSING_ID = "MISSING_ID"
     FOOD_WITHOUT_WEIGHT = "FOOD_WITHOUT_WEIGHT"
+    UNSUPPORTED_UNIT_TYPE = "UNSUPPORTED_UNIT_TYPE"
 
 
 @dataclass
@@ -180,26 +196,284 @@ def get_publishable_query() -> Dict[str, Any]:
     """
     Возвращает MongoDB query для фильтрации только публикуемых офферов.
     
-    Использовать в каталоге, поиске, избранном.
+    Использовать в каталоге, поиске, избранном. Правила проверяются при
+    импорте (publication_fields), на чтении остаётся только флаг.
     """
+    return publishable_offer_query()
+
+
+# === INGESTION-TIME PUBLICATION FLAG ===
+
+# При изменении правил строки с другой publish_v пересчитываются (refresh_publication_flags)
+PUBLISH_RULES_VERSION = 1
+PUBLISH_FIELDS = ('id', 'supplier_company_id', 'price', 'unit_type', 'pack_qty', 'publish_v')
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def publication_errors(offer: Dict[str, Any]) -> List[str]:
+    """
+    Коды причин, по которым оффер не публикуется (пустой список - публикуется).
+    
+    Правила - прежний фильтр get_publishable_query на чтении:
+    price > 0, unit_type, поставщик, id, pack_qty > 0 для WEIGHT/VOLUME.
+    """
+    errors = []
+    if not offer.get('id'):
+        errors.append(ValidationError.MISSING_ID.value)
+    if not offer.get('supplier_company_id'):
+        errors.append(ValidationError.MISSING_SUPPLIER.value)
+    
+    price = offer.get('price')
+    if price is None:
+        errors.append(ValidationError.MISSING_PRICE.value)
+    elif not _is_number(price) or price <= 0:
+        errors.append(ValidationError.INVALID_PRICE.value)
+    
+    unit_type = offer.get('unit_type')
+    if not unit_type:
+        errors.append(ValidationError.MISSING_UNIT_TYPE.value)
+    elif unit_type in ('WEIGHT', 'VOLUME'):
+        pack_qty = offer.get('pack_qty')
+        if not _is_number(pack_qty) or pack_qty <= 0:
+            errors.append(ValidationError.MISSING_PACK_SIZE.value)
+    elif unit_type != 'PIECE':
+        errors.append(ValidationError.UNSUPPORTED_UNIT_TYPE.value)
+    
+    return errors
+
+
+def publication_fields(offer: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля для записи в supplier_items при импорте / правке оффера."""
+    errors = publication_errors(offer)
     return {
-        'active': True,
-        'price': {'$gt': 0},
-        'unit_type': {'$exists': True, '$ne': None, '$ne': ''},
-        'supplier_company_id': {'$exists': True, '$ne': None, '$ne': ''},
-        'id': {'$exists': True, '$ne': None, '$ne': ''},
-        # pack_qty проверяется для WEIGHT/VOLUME, для PIECE опционально
-        '$or': [
-            {'unit_type': {'$in': ['WEIGHT', 'VOLUME']}, 'pack_qty': {'$gt': 0}},
-            {'unit_type': 'PIECE'}
-        ]
+        'publishable': not errors,
+        'publish_errors': errors,
+        'publish_v': PUBLISH_RULES_VERSION,
+    }
+
+
+def refresh_publication_flags(db, stale_only: bool = True, batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Пересчитывает publishable для строк, записанных мимо импорта (старые данные,
+    скрипты) или по прошлой версии правил. Ремонтный инструмент: в обычном
+    режиме флаг пишет импорт.
+    """
+    query = {'publish_v': {'$ne': PUBLISH_RULES_VERSION}} if stale_only else {}
+    projection = {'_id': 1, 'publishable': 1, 'publish_errors': 1, **{f: 1 for f in PUBLISH_FIELDS}}
+    
+    checked = updated = 0
+    affected = set()
+    ops = []
+    for offer in db.supplier_items.find(query, projection):
+        checked += 1
+        fields = publication_fields(offer)
+        if all(offer.get(k) == v for k, v in fields.items()):
+            continue
+        ops.append(UpdateOne({'_id': offer['_id']}, {'$set': fields}))
+        if offer.get('publishable') != fields['publishable']:
+            affected.add(offer.get('supplier_company_id'))
+        if len(ops) >= batch_size:
+            updated += db.supplier_items.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.supplier_items.bulk_write(ops, ordered=False).modified_count
+    
+    affected.discard(None)
+    affected.discard('')
+    for supplier_id in sorted(affected):
+        record_catalog_change(db, 'publication_flags', supplier_id=supplier_id)
+    if updated:
+        invalidate_data_quality_report()
+    
+    return {'checked': checked, 'updated': updated, 'suppliers_changed': len(affected)}
+
+
+# === DATA QUALITY REPORT ===
+
+# Страховка для записей в supplier_items мимо catalog_change_log (скрипты)
+DATA_QUALITY_CACHE_MAX_AGE_SEC = 600
+DATA_QUALITY_SAMPLE_LIMIT = 20
+CLEANUP_SAMPLE_LIMIT = 10
+
+
+def _is_missing(field: str) -> Dict[str, Any]:
+    """Поле отсутствует или null (как {field: None} в find)."""
+    return {'$in': [{'$type': f'${field}'}, ['missing', 'null']]}
+
+
+def _is_non_positive(field: str) -> Dict[str, Any]:
+    """Число <= 0 (как {'$lte': 0} в find - только числовые значения)."""
+    return {'$and': [{'$isNumber': f'${field}'}, {'$lte': [f'${field}', 0]}]}
+
+
+def _is_positive(field: str) -> Dict[str, Any]:
+    return {'$and': [{'$isNumber': f'${field}'}, {'$gt': [f'${field}', 0]}]}
+
+
+def _is_blank(field: str) -> Dict[str, Any]:
+    return {'$eq': [{'$ifNull': [f'${field}', '']}, '']}
+
+
+_WEIGHT_OR_VOLUME = {'$in': ['$unit_type', ['WEIGHT', 'VOLUME']]}
+
+# Предикаты отчёта - те же условия, что раньше были отдельными count_documents
+QUALITY_FLAGS = {
+    'no_price': {'$or': [_is_non_positive('price'), _is_missing('price')]},
+    'no_unit': _is_blank('unit_type'),
+    'weight_volume_no_pack': {'$and': [
+        _WEIGHT_OR_VOLUME, {'$or': [_is_non_positive('pack_qty'), _is_missing('pack_qty')]},
+    ]},
+    # get_publishable_query
+    'publishable': {'$and': [
+        _is_positive('price'),
+        {'$ne': [{'$type': '$unit_type'}, 'missing']}, {'$ne': ['$unit_type', '']},
+        {'$ne': [{'$type': '$supplier_company_id'}, 'missing']}, {'$ne': ['$supplier_company_id', '']},
+        {'$ne': [{'$type': '$id'}, 'missing']}, {'$ne': ['$id', '']},
+        {'$or': [
+            {'$and': [_WEIGHT_OR_VOLUME, _is_positive('pack_qty')]},
+            {'$eq': ['$unit_type', 'PIECE']},
+        ]},
+    ]},
+    # Условие mark_invalid_offers
+    'invalid': {'$or': [
+        _is_non_positive('price'), _is_missing('price'), _is_blank('unit_type'),
+        _is_missing('supplier_company_id'),
+        {'$and': [_WEIGHT_OR_VOLUME, {'$or': [_is_non_positive('pack_qty'), _is_missing('pack_qty')]}]},
+    ]},
+    # Примеры для отчёта (прежний find(...).limit(20))
+    'sample': {'$or': [
+        _is_non_positive('price'), _is_missing('price'), _is_blank('unit_type'),
+        {'$and': [_WEIGHT_OR_VOLUME, _is_non_positive('pack_qty')]},
+    ]},
+}
+
+_COUNTED_FLAGS = ('publishable', 'no_price', 'no_unit', 'weight_volume_no_pack', 'invalid')
+
+
+def data_quality_pipeline() -> List[Dict[str, Any]]:
+    """Один проход: флаги по офферу → $facet (разбивка по поставщикам + примеры)."""
+    flags = {name: {'$cond': [expr, 1, 0]} for name, expr in QUALITY_FLAGS.items()}
+    sample_fields = {'_id': 0, 'name_raw': 1, 'price': 1, 'unit_type': 1, 'pack_qty': 1, 'supplier_company_id': 1}
+    return [
+        {'$match': {'active': True}},
+        {'$project': {**{k: 1 for k in sample_fields if k != '_id'}, '_id': 0, **flags}},
+        {'$facet': {
+            'by_supplier': [{'$group': {
+                '_id': '$supplier_company_id',
+                'total_active': {'$sum': 1},
+                **{name: {'$sum': f'${name}'} for name in _COUNTED_FLAGS},
+            }}],
+            'invalid_samples': [
+                {'$match': {'sample': 1}}, {'$limit': DATA_QUALITY_SAMPLE_LIMIT}, {'$project': sample_fields},
+            ],
+            'cleanup_samples': [
+                {'$match': {'invalid': 1}}, {'$limit': CLEANUP_SAMPLE_LIMIT},
+                {'$project': {'_id': 0, 'name_raw': 1, 'price': 1, 'unit_type': 1, 'pack_qty': 1}},
+            ],
+        }},
+    ]
+
+
+def _quality_score(publishable: int, total_active: int) -> float:
+    return round(publishable / total_active * 100, 1) if total_active > 0 else 0
+
+
+def build_data_quality_report(db) -> Dict[str, Any]:
+    """Отчёт о качестве данных: одна агрегация + одно чтение companies для имён."""
+    facet = next(iter(db.supplier_items.aggregate(data_quality_pipeline(), allowDiskUse=True)), None) or {}
+    rows = facet.get('by_supplier', [])
+    samples = facet.get('invalid_samples', [])
+    
+    supplier_ids = {row['_id'] for row in rows} | {s.get('supplier_company_id') for s in samples}
+    supplier_ids.discard(None)
+    names = {
+        c['id']: c.get('companyName')
+        for c in db.companies.find({'id': {'$in': sorted(supplier_ids)}}, {'_id': 0, 'id': 1, 'companyName': 1})
+    } if supplier_ids else {}
+    
+    totals = {name: sum(row[name] for row in rows) for name in ('total_active',) + _COUNTED_FLAGS}
+    by_supplier = []
+    for row in rows:
+        by_supplier.append({
+            'supplier_id': row['_id'],
+            'supplier_name': names.get(row['_id']) or 'Unknown',
+            'total_active': row['total_active'],
+            'publishable': row['publishable'],
+            'hidden': row['total_active'] - row['publishable'],
+            'issues': {
+                'missing_or_invalid_price': row['no_price'],
+                'missing_unit_type': row['no_unit'],
+                'weight_volume_without_pack': row['weight_volume_no_pack'],
+            },
+            'invalid': row['invalid'],
+            'quality_score': _quality_score(row['publishable'], row['total_active']),
+        })
+    by_supplier.sort(key=lambda r: (-r['hidden'], str(r['supplier_id'])))
+    
+    for sample in samples:
+        sample['supplier_name'] = names.get(sample.get('supplier_company_id')) or 'Unknown'
+    
+    return {
+        'total_active': totals['total_active'],
+        'publishable': totals['publishable'],
+        'hidden': totals['total_active'] - totals['publishable'],
+        'issues': {
+            'missing_or_invalid_price': totals['no_price'],
+            'missing_unit_type': totals['no_unit'],
+            'weight_volume_without_pack': totals['weight_volume_no_pack'],
+        },
+        'invalid_samples': samples,
+        'quality_score': _quality_score(totals['publishable'], totals['total_active']),
+        'by_supplier': by_supplier,
+        'cleanup': {'would_mark_inactive': totals['invalid'], 'samples': facet.get('cleanup_samples', [])},
     }
 
 
+_report_lock = threading.Lock()
+_report_cache: Dict[str, Any] = {}
+
+
+def catalog_change_version(db) -> Optional[str]:
+    """Последняя запись catalog_change_log - меняется при каждом импорте/правке прайса."""
+    latest = db[CHANGE_LOG_COLLECTION].find_one({}, {'_id': 0, 'id': 1}, sort=[('created_at', -1)])
+    return latest.get('id') if latest else None
+
+
+def invalidate_data_quality_report() -> None:
+    with _report_lock:
+        _report_cache.clear()
+
+
+def get_data_quality_report(db, refresh: bool = False) -> Dict[str, Any]:
+    """
+    Кэшированный отчёт: пересобирается, если с момента сборки появилась
+    новая запись в catalog_change_log или прошло DATA_QUALITY_CACHE_MAX_AGE_SEC.
+    """
+    version = catalog_change_version(db)
+    now = time.monotonic()
+    with _report_lock:
+        cached = dict(_report_cache)
+    if (not refresh and cached and cached['version'] == version
+            and now - cached['built_at'] < DATA_QUALITY_CACHE_MAX_AGE_SEC):
+        return {**cached['report'], 'cached': True}
+    
+    report = build_data_quality_report(db)
+    with _report_lock:
+        _report_cache.update(version=version, built_at=now, report=report)
+    return {**report, 'cached': False}
+
+
 def mark_invalid_offers(db, dry_run: bool = True) -> Dict[str, Any]:
     """
     Помечает невалидные офферы как inactive.
     
+    Невалидные офферы и так не публикуются (флаг publishable ставится при
+    импорте), поэтому это ремонтный инструмент: при применении сначала
+    пересчитываются устаревшие флаги, затем строки деактивируются.
+    
     Args:
         db: MongoDB database
         dry_run: если True, только возвращает что будет помечено
@@ -207,6 +481,15 @@ def mark_invalid_offers(db, dry_run: bool = True) -> Dict[str, Any]:
     Returns:
         Статистика по операции
     """
+    if dry_run:
+        # Счётчик и примеры - из (кэшированного) отчёта, без отдельного скана
+        cleanup = get_data_quality_report(db)['cleanup']
+        return {
+            'dry_run': True,
+            'would_mark_inactive': cleanup['would_mark_inactive'],
+            'samples': cleanup['samples']
+        }
+    
     # Найти все невалидные офферы
     invalid_query = {
         'active': True,
@@ -228,20 +511,10 @@ def mark_invalid_offers(db, dry_run: bool = True) -> Dict[str, Any]:
         ]
     }
     
-    invalid_count = db.supplier_items.count_documents(invalid_query)
+    flags = refresh_publication_flags(db)
     
-    if dry_run:
-        # Показать примеры
-        samples = list(db.supplier_items.find(
-            invalid_query,
-            {'_id': 0, 'name_raw': 1, 'price': 1, 'unit_type': 1, 'pack_qty': 1}
-        ).limit(10))
-        
-        return {
-            'dry_run': True,
-            'would_mark_inactive': invalid_count,
-            'samples': samples
-        }
+    # Поставщики с невалидными офферами (для change log) - distinct по тому же фильтру
+    affected = [s for s in db.supplier_items.distinct('supplier_company_id', invalid_query) if s]
     
     # Пометить как inactive
     result = db.supplier_items.update_many(
@@ -249,9 +522,15 @@ def mark_invalid_offers(db, dry_run: bool = True) -> Dict[str, Any]:
         {'$set': {'active': False, 'inactive_reason': 'validation_failed'}}
     )
     
+    if result.modified_count:
+        for supplier_id in affected:
+            record_catalog_change(db, 'cleanup_invalid', supplier_id=supplier_id)
+    invalidate_data_quality_report()
+    
     return {
         'dry_run': False,
-        'marked_inactive': result.modified_count
+        'marked_inactive': result.modified_count,
+        'publication_flags': flags
     }
 
 
@@ -14,14 +14,20 @@ BestPrice v12 - Cart Optimizer (Phase 3)
 
 import logging
 import math
-from typing import List, Dict, Any, Optional, Tuple, Set
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Set, Sequence
 from dataclasses import dataclass, field
 from enum import Enum
 from datetime import datetime, timezone
 from copy import deepcopy
 
+import numpy as np
 from pymongo.database import Database
 
+from .catalog import publishable_offer_query
+from .offer_table import OfferTable, MISSING_CODE, UNKNOWN_CODE
+
 logger = logging.getLogger(__name__)
 
 
@@ -87,9 +93,9 @@ class CartIntent:
     super_class: str = ""
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Offer:
-    """Оффер поставщика"""
+    """Оффер поставщика (неизменяемый - можно делить между запросами)"""
     supplier_item_id: str
     supplier_id: str
     supplier_name: str
@@ -220,10 +226,13 @@ def find_candidates(
     db: Database,
     intent: CartIntent,
     exclude_suppliers: Set[str] = None
-) -> List[Offer]:
+) -> OfferTable:
     """
     Находит кандидатов для intent.
     
+    Возвращает OfferTable (ведёт себя как список Offer) - колонки для
+    pick_best_offer строятся один раз на список.
+    
     Жёсткие фильтры:
     - active = true
     - price > 0
@@ -234,14 +243,9 @@ def find_candidates(
     
     # Если нет product_core_id - не можем матчить
     if not intent.product_core_id:
-        return []
+        return OfferTable(())
     
-    query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'product_core_id': intent.product_core_id,
-        'unit_type': intent.unit_type,
-    }
+    query = publishable_offer_query(product_core_id=intent.product_core_id, unit_type=intent.unit_type)
     
     if exclude_suppliers:
         query['supplier_company_id'] = {'$nin': list(exclude_suppliers)}
@@ -258,6 +262,9 @@ def find_candidates(
             supplier_name = company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown'
         
         pack_value = item.get('pack_qty') or item.get('pack_value')
+        price_per_base_unit = None
+        if item['unit_type'] in ('WEIGHT', 'VOLUME') and pack_value and pack_value > 0:
+            price_per_base_unit = item['price'] / pack_value
         
         offer = Offer(
             supplier_item_id=item['id'],
@@ -272,21 +279,19 @@ def find_candidates(
             name_raw=item.get('name_raw', ''),
             min_order_qty=item.get('min_order_qty', 1),
             step_qty=item.get('step_qty', 1),
+            price_per_base_unit=price_per_base_unit,
             fat_pct=item.get('fat_pct'),
             cut=item.get('cut'),
         )
         
-        if offer.unit_type in ('WEIGHT', 'VOLUME') and pack_value and pack_value > 0:
-            offer.price_per_base_unit = offer.price / pack_value
-        
         offers.append(offer)
     
-    return offers
+    return OfferTable(offers)
 
 
 def pick_best_offer(
     intent: CartIntent,
-    candidates: List[Offer],
+    candidates: Sequence[Offer],
     prefer_supplier_id: Optional[str] = None
 ) -> Tuple[Optional[Offer], List[str]]:
     """
@@ -298,31 +303,39 @@ def pick_best_offer(
     4. Brand preference (если задан)
     5. Минимальная цена среди валидных
     
+    Фильтры - векторные операции над колонками OfferTable; idx хранит
+    индексы выживших офферов в исходном порядке, поэтому при равной цене
+    выигрывает тот же оффер, что и у min() по списку.
+    
     Returns: (offer, flags)
     """
     if not candidates:
         return None, [OptFlag.NO_OFFER_FOUND.value]
     
+    table = OfferTable.of(candidates)
+    cols = table.columns
     flags = []
     
-    # Фильтр 1: критические атрибуты
-    valid_candidates = []
-    for offer in candidates:
-        ok, reason = check_critical_attrs(intent, offer)
-        if ok:
-            valid_candidates.append(offer)
+    # Фильтр 1: критические атрибуты (см. check_critical_attrs; NaN/пустые не сравниваются)
+    keep = np.ones(len(table), dtype=bool)
+    if intent.fat_pct is not None:
+        keep &= ~(np.abs(cols.fat_pct - intent.fat_pct) > 1.0)
+    if intent.cut:
+        cut_code = cols.cut_codes.get(intent.cut.lower(), UNKNOWN_CODE)
+        keep &= (cols.cut == MISSING_CODE) | (cols.cut == cut_code)
+    idx = np.flatnonzero(keep)
     
-    if not valid_candidates:
+    if not idx.size:
         return None, [OptFlag.NO_OFFER_FOUND.value]
     
-    # Фильтр 2: pack tolerance ±20%
-    pack_ok = [o for o in valid_candidates 
-               if check_pack_tolerance(intent.pack_value, o.pack_value, intent.unit_type)]
-    
-    if pack_ok:
-        valid_candidates = pack_ok
-    else:
-        flags.append(OptFlag.PACK_TOLERANCE_USED.value)
+    # Фильтр 2: pack tolerance ±20% (см. check_pack_tolerance)
+    if intent.unit_type != 'PIECE' and intent.pack_value:
+        ratio = cols.pack_value[idx] / intent.pack_value
+        pack_ok = np.isnan(ratio) | (((1 - PACK_TOLERANCE_PCT) <= ratio) & (ratio <= (1 + PACK_TOLERANCE_PCT)))
+        if pack_ok.any():
+            idx = idx[pack_ok]
+        else:
+            flags.append(OptFlag.PACK_TOLERANCE_USED.value)
     
     # Фильтр 3: адекватность цены (КРИТИЧЕСКИ ВАЖНО!)
     # Если есть исходная цена, фильтруем замены с разницей более 50%
@@ -330,48 +343,46 @@ def pick_best_offer(
         price_min = intent.price * 0.5  # -50%
         price_max = intent.price * 2.0  # +100%
         
-        price_ok = [o for o in valid_candidates 
-                    if price_min <= o.price <= price_max]
+        prices = cols.price[idx]
+        price_ok = (price_min <= prices) & (prices <= price_max)
         
-        if price_ok:
-            valid_candidates = price_ok
+        if price_ok.any():
+            idx = idx[price_ok]
         else:
             # Нет адекватных по цене - ищем ближайшую по цене
             flags.append(OptFlag.PRICE_TOLERANCE_EXCEEDED.value)
-            # Сортируем по близости к исходной цене
-            valid_candidates = sorted(valid_candidates, 
-                                     key=lambda o: abs(o.price - intent.price))
-            # Берём только те, что ближе всего (топ-3)
-            valid_candidates = valid_candidates[:3]
+            # Сортируем по близости к исходной цене (стабильно, как sorted)
+            # и берём только те, что ближе всего (топ-3)
+            idx = idx[np.argsort(np.abs(prices - intent.price), kind='stable')[:3]]
     
     # Фильтр 4: brand preference
-    brand_matched = False
     if intent.brand_id:
-        brand_matches = [o for o in valid_candidates if o.brand_id == intent.brand_id]
-        if brand_matches:
-            valid_candidates = brand_matches
-            brand_matched = True
+        brand_code = cols.brand_codes.get(intent.brand_id, UNKNOWN_CODE)
+        brand_ok = cols.brand[idx] == brand_code
+        if brand_ok.any():
+            idx = idx[brand_ok]
         else:
             flags.append(OptFlag.BRAND_REPLACED.value)
     
     # Фильтр 5: prefer_supplier_id (если задан)
     if prefer_supplier_id:
-        preferred = [o for o in valid_candidates if o.supplier_id == prefer_supplier_id]
-        if preferred:
-            valid_candidates = preferred
-    
-    if not valid_candidates:
-        return None, [OptFlag.NO_OFFER_FOUND.value]
+        preferred = cols.supplier[idx] == cols.supplier_codes.get(prefer_supplier_id, UNKNOWN_CODE)
+        if preferred.any():
+            idx = idx[preferred]
     
-    # Выбираем минимум по цене среди валидных кандидатов
-    best = min(valid_candidates, key=lambda o: o.price)
+    # Выбираем минимум по цене среди валидных кандидатов (первый при равенстве)
+    best = idx[np.argmin(cols.price[idx])]
     
-    return best, flags
+    return table[int(best)], flags
 
 
 # === PLAN BUILDING ===
 
-def load_cart_intents(db: Database, user_id: str) -> List[CartIntent]:
+def load_cart_intents(
+    db: Database,
+    user_id: str,
+    state: Optional['OptimizerState'] = None
+) -> List[CartIntent]:
     """Загружает намерения из корзины"""
     intents_raw = list(db.cart_intents.find({'user_id': user_id}, {'_id': 0}))
     
@@ -386,7 +397,7 @@ def load_cart_intents(db: Database, user_id: str) -> List[CartIntent]:
         cut = None
         
         if supplier_item_id:
-            item = db.supplier_items.find_one({'id': supplier_item_id}, {'_id': 0})
+            item = _get_item(db, supplier_item_id, state)
             if item:
                 product_core_id = item.get('product_core_id')
                 brand_id = item.get('brand_id')
@@ -418,13 +429,17 @@ def load_cart_intents(db: Database, user_id: str) -> List[CartIntent]:
 
 def build_initial_plan(
     db: Database,
-    intents: List[CartIntent]
+    intents: List[CartIntent],
+    state: Optional['OptimizerState'] = None
 ) -> Tuple[List[PlanLine], List[PlanLine]]:
     """
     Строит начальный план: для каждого intent подбирает лучший offer.
     
     P0.2: При недоступности товара устанавливает unavailable_reason_code.
     
+    С state чтения каталога и выбор оффера берутся из прошлого решения,
+    заново считаются только новые/изменённые строки.
+    
     Returns: (assigned_lines, unfulfilled_lines)
     """
     assigned = []
@@ -436,10 +451,7 @@ def build_initial_plan(
         # Если есть конкретный supplier_item_id - используем его напрямую (locked offer)
         if intent.supplier_item_id:
             locked = True
-            item = db.supplier_items.find_one(
-                {'id': intent.supplier_item_id},
-                {'_id': 0}
-            )
+            item = _get_item(db, intent.supplier_item_id, state)
             
             # P0.2: Детальная проверка причин недоступности locked offer
             if not item:
@@ -495,10 +507,7 @@ def build_initial_plan(
             
             # Товар валиден - создаём offer
             supplier_id = item.get('supplier_company_id', '')
-            supplier_name = ''
-            if supplier_id:
-                company = db.companies.find_one({'id': supplier_id}, {'companyName': 1, 'name': 1})
-                supplier_name = company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown'
+            supplier_name = _company_name(db, supplier_id, state) if supplier_id else ''
             
             offer = Offer(
                 supplier_item_id=item['id'],
@@ -554,7 +563,7 @@ def build_initial_plan(
             unfulfilled.append(line)
             continue
         
-        candidates = find_candidates(db, intent)
+        candidates = _find_candidates(db, intent, None, state)
         
         if not candidates:
             # Нет подходящих офферов у поставщиков
@@ -573,7 +582,7 @@ def build_initial_plan(
             unfulfilled.append(line)
             continue
         
-        offer, flags = pick_best_offer(intent, candidates)
+        offer, flags = _pick_initial_offer(intent, candidates, state)
         
         if not offer:
             # Фильтры отсеяли всех кандидатов - определяем причину
@@ -613,7 +622,7 @@ def build_initial_plan(
         flags.extend(qty_flags)
         
         # Определяем флаги изменений
-        supplier_changed = (intent.supplier_id and offer.supplier_id != intent.supplier_id)
+        supplier_changed = bool(intent.supplier_id and offer.supplier_id != intent.supplier_id)
         brand_changed = OptFlag.BRAND_REPLACED.value in flags
         pack_changed = OptFlag.PACK_TOLERANCE_USED.value in flags
         
@@ -738,7 +747,8 @@ def redistribute_under_minimum(
     db: Database,
     groups: Dict[str, SupplierPlan],
     supplier_mins: Dict[str, float],
-    max_iterations: int = 10
+    max_iterations: int = 10,
+    state: Optional['OptimizerState'] = None
 ) -> Tuple[Dict[str, SupplierPlan], List[PlanLine]]:
     """
     Перераспределяет позиции от поставщиков < минималки к другим.
@@ -777,12 +787,12 @@ def redistribute_under_minimum(
                 intent = line.intent
                 
                 # Ищем альтернативы у ДРУГИХ поставщиков (не weak_sid)
-                candidates = find_candidates(db, intent, exclude_suppliers={weak_sid})
+                candidates = _find_candidates(db, intent, {weak_sid}, state)
                 
                 # Предпочитаем поставщиков которые уже в плане и над минималкой
                 good_suppliers = {sid for sid, p in groups.items() if p.meets_minimum and sid != weak_sid}
                 
-                preferred_candidates = [c for c in candidates if c.supplier_id in good_suppliers]
+                preferred_candidates = candidates.only_suppliers(good_suppliers)
                 
                 if preferred_candidates:
                     new_offer, flags = pick_best_offer(intent, preferred_candidates)
@@ -866,12 +876,174 @@ def redistribute_under_minimum(
     return groups, unfulfilled
 
 
+# === INCREMENTAL STATE ===
+
+# Сколько пользователей держим в памяти процесса (LRU)
+OPTIMIZER_STATE_MAX_USERS = 1000
+
+_PickKey = Tuple[Any, ...]
+
+
+class OptimizerState:
+    """
+    Состояние последнего решения для одного пользователя.
+    
+    - items: документы supplier_items строк корзины (locked-офферы, атрибуты intent)
+    - candidates: полный список кандидатов по (product_core_id, unit_type);
+      exclude_suppliers при перераспределении применяется фильтром,
+      порядок тот же, что у запроса с $nin
+    - picks: результат pick_best_offer для начального плана по атрибутам intent
+    
+    Всё это зависит только от каталога, поэтому состояние валидно, пока
+    не изменилась версия каталога ядер корзины (plan_snapshot.compute_catalog_version).
+    При изменении qty / добавлении / удалении строки в БД ходят только новые
+    строки; группировка, topup и перераспределение - проход в памяти по тем же
+    данным, поэтому план совпадает с полным пересчётом.
+    """
+
+    def __init__(self, catalog_version: Optional[str] = None):
+        self.catalog_version = catalog_version
+        self.items: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.companies: Dict[str, str] = {}
+        self.candidates: Dict[Tuple[str, str], OfferTable] = {}
+        self.picks: Dict[_PickKey, Tuple[Optional[Offer], List[str]]] = {}
+        self.db_reads = 0
+        self._used: Dict[str, Set] = {}
+
+    def begin_run(self):
+        """Начало прогона: всё, что не понадобится в этом прогоне, будет удалено в prune()."""
+        self.db_reads = 0
+        self._used = {'items': set(), 'companies': set(), 'candidates': set(), 'picks': set()}
+
+    def touch(self, kind: str, key):
+        if kind in self._used:
+            self._used[kind].add(key)
+
+    def prune(self):
+        """Удаляет данные строк, которых больше нет в корзине."""
+        for kind, used in self._used.items():
+            cache = getattr(self, kind)
+            for key in [k for k in cache if k not in used]:
+                del cache[key]
+
+
+def _get_item(db: Database, supplier_item_id: str, state: Optional[OptimizerState]) -> Optional[Dict[str, Any]]:
+    if state is None:
+        return db.supplier_items.find_one({'id': supplier_item_id}, {'_id': 0})
+    state.touch('items', supplier_item_id)
+    if supplier_item_id not in state.items:
+        state.db_reads += 1
+        state.items[supplier_item_id] = db.supplier_items.find_one({'id': supplier_item_id}, {'_id': 0})
+    return state.items[supplier_item_id]
+
+
+def _company_name(db: Database, supplier_id: str, state: Optional[OptimizerState]) -> str:
+    if state is not None:
+        state.touch('companies', supplier_id)
+        if supplier_id in state.companies:
+            return state.companies[supplier_id]
+        state.db_reads += 1
+    company = db.companies.find_one({'id': supplier_id}, {'companyName': 1, 'name': 1})
+    name = company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown'
+    if state is not None:
+        state.companies[supplier_id] = name
+    return name
+
+
+def _find_candidates(
+    db: Database,
+    intent: CartIntent,
+    exclude_suppliers: Optional[Set[str]],
+    state: Optional[OptimizerState]
+) -> OfferTable:
+    if state is None or not intent.product_core_id:
+        return find_candidates(db, intent, exclude_suppliers)
+    key = (intent.product_core_id, intent.unit_type)
+    state.touch('candidates', key)
+    if key not in state.candidates:
+        state.db_reads += 1
+        state.candidates[key] = find_candidates(db, intent)
+    offers = state.candidates[key]
+    if exclude_suppliers:
+        offers = offers.exclude_suppliers(exclude_suppliers)
+    return offers
+
+
+def _pick_initial_offer(
+    intent: CartIntent,
+    candidates: Sequence[Offer],
+    state: Optional[OptimizerState]
+) -> Tuple[Optional[Offer], List[str]]:
+    if state is None:
+        return pick_best_offer(intent, candidates)
+    # pick_best_offer зависит от кандидатов ядра и атрибутов intent, но не от qty
+    key = (intent.product_core_id, intent.unit_type, intent.pack_value, intent.price,
+           intent.brand_id, intent.fat_pct, intent.cut)
+    state.touch('picks', key)
+    if key not in state.picks:
+        state.picks[key] = pick_best_offer(intent, candidates)
+    offer, flags = state.picks[key]
+    return offer, list(flags)
+
+
+_states: 'OrderedDict[str, OptimizerState]' = OrderedDict()
+_states_lock = threading.Lock()
+
+
+def get_optimizer_state(user_id: str, catalog_version: Optional[str]) -> OptimizerState:
+    """Состояние пользователя; при смене версии каталога начинается заново."""
+    with _states_lock:
+        state = _states.get(user_id)
+        if state is None or state.catalog_version != catalog_version:
+            state = OptimizerState(catalog_version)
+            _states[user_id] = state
+        _states.move_to_end(user_id)
+        while len(_states) > OPTIMIZER_STATE_MAX_USERS:
+            _states.popitem(last=False)
+        return state
+
+
+def drop_optimizer_state(user_id: Optional[str] = None):
+    """Сбрасывает состояние пользователя (или всех)."""
+    with _states_lock:
+        if user_id is None:
+            _states.clear()
+        else:
+            _states.pop(user_id, None)
+
+
+def optimize_cart_incremental(
+    db: Database,
+    user_id: str,
+    catalog_version: Optional[str]
+) -> OptimizationResult:
+    """
+    optimize_cart поверх состояния прошлого решения пользователя.
+    
+    Дельта корзины (qty, новая/удалённая строка) определяется по cart_intents:
+    чтения каталога и выбор оффера выполняются только для строк, которых не
+    было в прошлом решении. Результат идентичен optimize_cart(db, user_id).
+    """
+    state = get_optimizer_state(user_id, catalog_version)
+    result = optimize_cart(db, user_id, state)
+    state.prune()
+    logger.debug(f"Incremental optimize for {user_id}: {state.db_reads} catalog reads")
+    return result
+
+
 # === MAIN OPTIMIZATION FUNCTION ===
 
-def optimize_cart(db: Database, user_id: str) -> OptimizationResult:
+def optimize_cart(
+    db: Database,
+    user_id: str,
+    state: Optional['OptimizerState'] = None
+) -> OptimizationResult:
     """
     Главная функция оптимизации корзины.
     
+    state - состояние прошлого решения (см. optimize_cart_incremental);
+    без него все чтения каталога идут в БД.
+    
     1. Загружает intents
     2. Строит начальный план (best offer per item)
     3. Группирует по поставщикам
@@ -880,7 +1052,9 @@ def optimize_cart(db: Database, user_id: str) -> OptimizationResult:
     6. Формирует результат
     """
     # 1. Загружаем данные
-    intents = load_cart_intents(db, user_id)
+    if state is not None:
+        state.begin_run()
+    intents = load_cart_intents(db, user_id, state)
     
     if not intents:
         return OptimizationResult(
@@ -892,7 +1066,7 @@ def optimize_cart(db: Database, user_id: str) -> OptimizationResult:
     supplier_mins = get_supplier_minimums(db)
     
     # 2. Строим начальный план
-    assigned_lines, unfulfilled_lines = build_initial_plan(db, intents)
+    assigned_lines, unfulfilled_lines = build_initial_plan(db, intents, state)
     
     if not assigned_lines:
         return OptimizationResult(
@@ -908,7 +1082,7 @@ def optimize_cart(db: Database, user_id: str) -> OptimizationResult:
     groups = apply_topup_10pct(groups)
     
     # 5. Перераспределяем от поставщиков < минималки
-    groups, extra_unfulfilled = redistribute_under_minimum(db, groups, supplier_mins)
+    groups, extra_unfulfilled = redistribute_under_minimum(db, groups, supplier_mins, state=state)
     unfulfilled_lines.extend(extra_unfulfilled)
     
     # 6. Финальная проверка и применение +10% ещё раз
@@ -0,0 +1,214 @@
+"""
+BestPrice v12 - Order History Read Model
+
+Денормализованная проекция истории заказов для /v12/orders.
+
+Раньше история читала orders_v12 и старую orders целиком, сортировала
+в Python и делала companies.find_one на каждый заказ. Теперь:
+- при checkout каждый заказ сразу пишется в order_history_v12 вместе
+  с именем поставщика (record_orders);
+- чтение - по индексу (customer_user_id, created_at, id); с limit -
+  страница с курсором вместо skip, без limit - вся история (как раньше);
+- старые заказы (orders_v12 до проекции и legacy orders) переносятся
+  migrate_legacy_orders: при старте сервера (идемпотентно, заодно
+  дописывает заказы, чья запись в проекцию при checkout не удалась)
+  или вручную через migrate_order_history.py.
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+ORDER_HISTORY_COLLECTION = 'order_history_v12'
+ORDER_HISTORY_PAGE_SIZE = 50
+ORDER_HISTORY_MAX_PAGE_SIZE = 200
+MIGRATION_BATCH_SIZE = 500
+
+# Поля заказа, которые отдаёт /v12/orders (+ служебные customer_user_id / source)
+HISTORY_FIELDS = (
+    'id', 'supplier_id', 'supplier_name', 'amount', 'status', 'items', 'items_count',
+    'created_at', 'delivery_address_id',
+)
+_RESPONSE_PROJECTION = {'_id': 0, **{f: 1 for f in HISTORY_FIELDS}}
+
+
+def ensure_order_history_indexes(db: Database) -> None:
+    db[ORDER_HISTORY_COLLECTION].create_index('id', unique=True)
+    db[ORDER_HISTORY_COLLECTION].create_index([('customer_user_id', 1), ('created_at', -1), ('id', -1)])
+
+
+# === ENTRY ===
+
+def _created_at(order: Dict[str, Any]) -> Any:
+    """ISO-строка: orders_v12 пишет isoformat, в legacy встречается datetime."""
+    created = order.get('created_at')
+    if isinstance(created, datetime):
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        return created.isoformat()
+    return created or ''
+
+
+def order_id_of(order: Dict[str, Any]) -> str:
+    """Старые заказы без id адресовались по created_at (как в get_order_details)."""
+    return order.get('id') or _created_at(order)
+
+
+def history_entry(order: Dict[str, Any], supplier_name: Optional[str], source: str = 'orders_v12') -> Dict[str, Any]:
+    items = order.get('items', [])
+    return {
+        'id': order_id_of(order),
+        'customer_user_id': order.get('customer_user_id'),
+        'supplier_id': order.get('supplier_company_id'),
+        'supplier_name': supplier_name or 'Unknown',
+        'amount': order.get('amount', 0),
+        'status': order.get('status', 'pending'),
+        'items': items,
+        'items_count': len(items),
+        'created_at': _created_at(order),
+        'delivery_address_id': order.get('delivery_address_id'),
+        'source': source,
+    }
+
+
+def supplier_names(db: Database, supplier_ids: Iterable[Optional[str]]) -> Dict[str, str]:
+    """Имена поставщиков одним $in (companyName, затем name)."""
+    ids = sorted({s for s in supplier_ids if s})
+    if not ids:
+        return {}
+    return {
+        c['id']: c.get('companyName', c.get('name', 'Unknown'))
+        for c in db.companies.find({'id': {'$in': ids}}, {'_id': 0, 'id': 1, 'companyName': 1, 'name': 1})
+    }
+
+
+# === WRITE (checkout) ===
+
+def record_orders(db: Database, orders: List[Dict[str, Any]], names: Optional[Dict[str, str]] = None) -> int:
+    """
+    Пишет только что созданные заказы в проекцию.
+
+    names - имена поставщиков, уже известные вызывающему (план корзины);
+    недостающие дочитываются одним запросом.
+    """
+    if not orders:
+        return 0
+    names = dict(names or {})
+    missing = {o.get('supplier_company_id') for o in orders} - set(names)
+    names.update(supplier_names(db, missing))
+    ops = [
+        UpdateOne({'id': order_id_of(o)}, {'$set': history_entry(o, names.get(o.get('supplier_company_id')))},
+                  upsert=True)
+        for o in orders
+    ]
+    db[ORDER_HISTORY_COLLECTION].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+# === READ ===
+
+def encode_cursor(entry: Dict[str, Any]) -> str:
+    raw = json.dumps([entry['created_at'], entry['id']], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Raises ValueError для битого курсора."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+    return created_at, order_id
+
+
+def list_order_history(
+    db: Database,
+    user_id: str,
+    limit: Optional[int] = ORDER_HISTORY_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Страница истории (новые первые) после курсора; limit=None - все заказы.
+
+    Returns: (orders, next_cursor) - next_cursor=None на последней странице.
+    """
+    query: Dict[str, Any] = {'customer_user_id': user_id}
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, 'id': {'$lt': order_id}},
+        ]
+    found = db[ORDER_HISTORY_COLLECTION].find(query, _RESPONSE_PROJECTION).sort([('created_at', -1), ('id', -1)])
+    if limit is None:
+        return list(found), None
+    limit = max(1, min(limit, ORDER_HISTORY_MAX_PAGE_SIZE))
+    page = list(found.limit(limit + 1))
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def count_order_history(db: Database, user_id: str) -> int:
+    return db[ORDER_HISTORY_COLLECTION].count_documents({'customer_user_id': user_id})
+
+
+def get_history_entry(db: Database, order_id: str) -> Optional[Dict[str, Any]]:
+    return db[ORDER_HISTORY_COLLECTION].find_one({'id': order_id}, _RESPONSE_PROJECTION)
+
+
+# === ONE-TIME MIGRATION ===
+
+def migrate_legacy_orders(
+    db: Database,
+    dry_run: bool = True,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Переносит orders_v12 и legacy orders (с customer_user_id) в проекцию.
+
+    Идемпотентно: $setOnInsert по id, уже записанные при checkout заказы
+    не перезаписываются. orders_v12 идёт первым - при совпадении id
+    выигрывает основная коллекция.
+    """
+    if not dry_run:
+        ensure_order_history_indexes(db)
+    stats: Dict[str, Any] = {'dry_run': dry_run}
+
+    for source in ('orders_v12', 'orders'):
+        scanned = inserted = 0
+        cursor = db[source].find({'customer_user_id': {'$exists': True, '$ne': None}}, {'_id': 0})
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> int:
+            names = supplier_names(db, (o.get('supplier_company_id') for o in batch))
+            ops = [
+                UpdateOne({'id': order_id_of(o)},
+                          {'$setOnInsert': history_entry(o, names.get(o.get('supplier_company_id')), source)},
+                          upsert=True)
+                for o in batch if order_id_of(o)
+            ]
+            if dry_run or not ops:
+                return 0
+            return db[ORDER_HISTORY_COLLECTION].bulk_write(ops, ordered=False).upserted_count
+
+        for order in cursor:
+            batch.append(order)
+            scanned += 1
+            if len(batch) >= batch_size:
+                inserted += flush()
+                batch = []
+        if batch:
+            inserted += flush()
+
+        stats[source] = {'scanned': scanned, 'inserted': inserted}
+        logger.info("Order history migration %s: scanned=%d inserted=%d", source, scanned, inserted)
+
+    return stats
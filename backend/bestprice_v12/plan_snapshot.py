@@ -8,21 +8,192 @@ BestPrice v12 - Plan Snapshot Management
 2. План сохраняется в БД с уникальным plan_id
 3. Checkout использует сохранённый план, а НЕ пересчитывает
 4. Если корзина изменилась - возвращаем PLAN_CHANGED
+5. Повторный /cart/plan без изменений возвращает тот же snapshot
+   (мемоизация по cart_hash + хэш минималок + версия каталога ядер корзины)
+6. Snapshot хранится компактно (id офферов + количества, цены и имена зафиксированы),
+   expires_at - datetime под TTL-индексом: просроченные планы удаляет Mongo.
+   Payload восстанавливается одним batched чтением supplier_items; строки
+   удалённых офферов помечаются unavailable, а не ломают checkout.
 """
 
 import hashlib
 import json
 import uuid
 import logging
+import threading
 from typing import Dict, Any, Optional, Tuple, List
 from datetime import datetime, timezone, timedelta
 from pymongo.database import Database
 
+from .best_price_engine import CHANGE_LOG_COLLECTION
+from .optimizer import OptimizationResult, OptFlag, UnavailableReason, plan_to_dict
+
 logger = logging.getLogger(__name__)
 
 # TTL для плана (в минутах)
 PLAN_TTL_MINUTES = 60
 
+# Предельный возраст переиспользуемого плана от created_at: попадания продлевают TTL,
+# но не дольше этого - изменения каталога мимо catalog_change_log не живут вечно
+PLAN_MAX_AGE_MINUTES = 120
+
+# Версия компактного формата snapshot['plan']
+PLAN_FORMAT_VERSION = 2
+
+
+def ensure_plan_indexes(db: Database) -> None:
+    """TTL по expires_at (datetime) + поиск плана пользователя / по plan_id."""
+    db.cart_plans_v12.create_index('expires_at', expireAfterSeconds=0)
+    db.cart_plans_v12.create_index('user_id')
+    db.cart_plans_v12.create_index('plan_id')
+
+
+def _as_utc(value) -> Optional[datetime]:
+    """expires_at/created_at: datetime (pymongo отдаёт naive UTC) или ISO-строка старых snapshot'ов."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _is_expired(snapshot: Dict[str, Any], now: datetime) -> bool:
+    expires_at = _as_utc(snapshot.get('expires_at'))
+    return bool(expires_at) and now > expires_at
+
+
+def _max_reuse_until(snapshot: Dict[str, Any]) -> Optional[datetime]:
+    created_at = _as_utc(snapshot.get('created_at'))
+    return created_at + timedelta(minutes=PLAN_MAX_AGE_MINUTES) if created_at else None
+
+
+# === COMPACT FORM ===
+
+_FLAG_CODES = {flag.value: i for i, flag in enumerate(OptFlag)}
+_FLAGS = [flag.value for flag in OptFlag]
+
+# Биты булевых полей строки плана
+_LINE_BITS = ('supplier_changed', 'brand_changed', 'pack_changed', 'qty_changed_by_topup', 'locked')
+
+
+def compact_plan(result: OptimizationResult) -> Dict[str, Any]:
+    """
+    Компактная форма плана для snapshot.
+    
+    Строка поставщика: [supplier_item_id, reference_id, requested_qty, final_qty,
+    price, original_price, [коды флагов], биты _LINE_BITS, product_name, unit_type].
+    price, product_name и unit_type зафиксированы на момент плана - checkout
+    не зависит от текущего документа оффера; line_total (= final_qty * price)
+    восстанавливается. Недоступные позиции (их мало) - как в plan_to_dict.
+    """
+    suppliers = []
+    for plan in result.suppliers:
+        lines = []
+        for line in plan.lines:
+            offer, intent = line.offer, line.intent
+            bits = 0
+            for i, name in enumerate(_LINE_BITS):
+                if getattr(line, name):
+                    bits |= 1 << i
+            lines.append([
+                offer.supplier_item_id, line.reference_id, line.requested_qty, line.final_qty,
+                offer.price, intent.price if intent else 0,
+                [_FLAG_CODES.get(f, f) for f in line.flags], bits,
+                intent.product_name if intent else '', offer.unit_type,
+            ])
+        suppliers.append([plan.supplier_id, plan.supplier_name, plan.subtotal, plan.min_order_amount, lines])
+    
+    return {
+        'v': PLAN_FORMAT_VERSION,
+        'success': result.success,
+        'total': result.total,
+        'blocked_reason': result.blocked_reason,
+        'suppliers': suppliers,
+        'unfulfilled': plan_to_dict(OptimizationResult(success=result.success, unfulfilled=result.unfulfilled))['unfulfilled'],
+    }
+
+
+def rehydrate_plan(db: Database, compact: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Восстанавливает payload plan_to_dict из компактной формы.
+    
+    Одно чтение supplier_items по всем id офферов плана: проверка, что офферы
+    не удалены (формат v1 без имени в строке дочитывает name_raw, unit_type).
+    Строка удалённого оффера остаётся с зафиксированными ценой и именем и
+    помечается unavailable (OFFER_INACTIVE).
+    
+    Returns: (plan_payload, missing_offer_ids)
+    """
+    ids = list({line[0] for supplier in compact['suppliers'] for line in supplier[4]})
+    fields = {'_id': 0, 'id': 1}
+    if compact.get('v', 1) < 2:
+        fields.update(name_raw=1, unit_type=1)
+    offers = {
+        doc['id']: doc for doc in db.supplier_items.find({'id': {'$in': ids}}, fields)
+    } if ids else {}
+    missing = [i for i in ids if i not in offers]
+    
+    suppliers_data = []
+    for supplier_id, supplier_name, subtotal, min_order_amount, lines in compact['suppliers']:
+        items_data = []
+        for item_id, reference_id, requested_qty, final_qty, price, original_price, flags, bits, name, *rest in lines:
+            offer = offers.get(item_id, {})
+            item = {
+                'reference_id': reference_id,
+                'product_name': offer.get('name_raw', '') if name is None else name,
+                'requested_qty': requested_qty,
+                'final_qty': final_qty,
+                'price': price,
+                'original_price': original_price,
+                'line_total': final_qty * price,
+                'unit_type': rest[0] if rest else offer.get('unit_type', 'PIECE'),
+                'supplier_item_id': item_id,
+                'flags': [_FLAGS[f] if isinstance(f, int) else f for f in flags],
+            }
+            for i, field_name in enumerate(_LINE_BITS):
+                item[field_name] = bool(bits & (1 << i))
+            if item_id not in offers:
+                item['unavailable'] = True
+                item['unavailable_reason_code'] = UnavailableReason.OFFER_INACTIVE.value
+            items_data.append(item)
+        
+        deficit = max(0, min_order_amount - subtotal)
+        suppliers_data.append({
+            'supplier_id': supplier_id,
+            'supplier_name': supplier_name,
+            'items': items_data,
+            'subtotal': subtotal,
+            'min_order_amount': min_order_amount,
+            'deficit': deficit,
+            'meets_minimum': deficit <= 0,
+        })
+    
+    return {
+        'success': compact['success'],
+        'suppliers': suppliers_data,
+        'unfulfilled': compact['unfulfilled'],
+        'total': compact['total'],
+        'blocked_reason': compact['blocked_reason'],
+    }, missing
+
+
+def snapshot_payload(db: Database, snapshot: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Payload snapshot'а: компактный формат или plan_payload старых документов."""
+    if 'plan' in snapshot:
+        return rehydrate_plan(db, snapshot['plan'])
+    return snapshot.get('plan_payload') or {}, []
+
+
+def _hash_intents(intents: List[Dict[str, Any]]) -> str:
+    """Хэш отсортированных по supplier_item_id intents (supplier_item_id:qty:locked)."""
+    hash_parts = []
+    for intent in intents:
+        part = f"{intent.get('supplier_item_id', '')}:{intent.get('qty', 0)}:{intent.get('locked', False)}"
+        hash_parts.append(part)
+    
+    hash_string = "|".join(hash_parts)
+    return hashlib.sha256(hash_string.encode()).hexdigest()[:32]
+
 
 def compute_cart_hash(db: Database, user_id: str) -> str:
     """
@@ -40,14 +211,7 @@ def compute_cart_hash(db: Database, user_id: str) -> str:
         {'_id': 0, 'supplier_item_id': 1, 'qty': 1, 'locked': 1}
     ).sort('supplier_item_id', 1))
     
-    # Формируем строку для хэширования
-    hash_parts = []
-    for intent in intents:
-        part = f"{intent.get('supplier_item_id', '')}:{intent.get('qty', 0)}:{intent.get('locked', False)}"
-        hash_parts.append(part)
-    
-    hash_string = "|".join(hash_parts)
-    return hashlib.sha256(hash_string.encode()).hexdigest()[:32]
+    return _hash_intents(intents)
 
 
 def get_min_order_map(db: Database) -> Dict[str, float]:
@@ -61,31 +225,211 @@ def get_min_order_map(db: Database) -> Dict[str, float]:
     return min_map
 
 
+def hash_min_order_map(min_order_map: Dict[str, float]) -> str:
+    """Хэш минималок (порядок поставщиков не важен)."""
+    payload = json.dumps(sorted(min_order_map.items()), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def compute_catalog_version(db: Database, intents: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Версия каталога офферов для ядер корзины.
+    
+    Версия = последняя запись catalog_change_log, затрагивающая ядра корзины
+    (явный product_core_ids) или поставщиков, у которых есть офферы этих ядер
+    или офферы из самой корзины (записи импорта прайса - по поставщику).
+    Любое изменение офферов пишет запись в лог, поэтому совпадение версии
+    означает, что кандидаты оптимизатора не менялись. Лишние совпадения по
+    поставщику дают только лишний пересчёт, но не устаревший план.
+    """
+    item_ids = [i['supplier_item_id'] for i in intents if i.get('supplier_item_id')]
+    suppliers = {i.get('supplier_id') for i in intents}
+    cores = set()
+    if item_ids:
+        for item in db.supplier_items.find(
+            {'id': {'$in': item_ids}},
+            {'_id': 0, 'product_core_id': 1, 'supplier_company_id': 1}
+        ):
+            cores.add(item.get('product_core_id'))
+            suppliers.add(item.get('supplier_company_id'))
+    cores.discard(None)
+    if cores:
+        suppliers.update(db.supplier_items.distinct(
+            'supplier_company_id', {'product_core_id': {'$in': sorted(cores)}}
+        ))
+    suppliers.discard(None)
+    
+    clauses = []
+    if cores:
+        clauses.append({'product_core_ids': {'$in': sorted(cores)}})
+    if suppliers:
+        clauses.append({'supplier_id': {'$in': sorted(suppliers)}})
+    if not clauses:
+        return None
+    
+    latest = db[CHANGE_LOG_COLLECTION].find_one(
+        {'$or': clauses}, {'_id': 0, 'id': 1, 'created_at': 1}, sort=[('created_at', -1)]
+    )
+    if not latest:
+        return ''
+    created_at = latest.get('created_at')
+    stamp = created_at.isoformat() if isinstance(created_at, datetime) else str(created_at)
+    return f"{stamp}:{latest.get('id', '')}"
+
+
+def compute_plan_keys(db: Database, user_id: str) -> Dict[str, Any]:
+    """
+    Ключ мемоизации плана: cart_hash, минималки и их хэш, версия каталога.
+    
+    Intents читаются один раз и для cart_hash, и для версии каталога.
+    """
+    intents = list(db.cart_intents.find(
+        {'user_id': user_id},
+        {'_id': 0, 'supplier_item_id': 1, 'qty': 1, 'locked': 1, 'supplier_id': 1}
+    ).sort('supplier_item_id', 1))
+    min_order_map = get_min_order_map(db)
+    return {
+        'cart_hash': _hash_intents(intents),
+        'min_order_map': min_order_map,
+        'min_order_hash': hash_min_order_map(min_order_map),
+        'catalog_version': compute_catalog_version(db, intents),
+    }
+
+
+# === MEMO METRICS ===
+
+_memo_lock = threading.Lock()
+_memo_stats = {'hits': 0, 'misses': 0, 'miss_reasons': {}, 'saved_optimizer_ms': 0.0, 'optimizer_ms': 0.0}
+
+
+def _record_memo(hit: bool, reason: Optional[str] = None, optimizer_ms: float = 0.0):
+    with _memo_lock:
+        if hit:
+            _memo_stats['hits'] += 1
+            _memo_stats['saved_optimizer_ms'] += optimizer_ms
+        else:
+            _memo_stats['misses'] += 1
+            _memo_stats['miss_reasons'][reason] = _memo_stats['miss_reasons'].get(reason, 0) + 1
+            _memo_stats['optimizer_ms'] += optimizer_ms
+
+
+def record_plan_optimized(reason: str, optimizer_ms: float):
+    """Учитывает промах мемоизации и время фактического запуска оптимизатора."""
+    _record_memo(False, reason, optimizer_ms)
+
+
+def get_plan_memo_metrics() -> Dict[str, Any]:
+    """Счётчики мемоизации /cart/plan (в процессе, с запуска или reset)."""
+    with _memo_lock:
+        stats = dict(_memo_stats, miss_reasons=dict(_memo_stats['miss_reasons']))
+    total = stats['hits'] + stats['misses']
+    stats['requests'] = total
+    stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0.0
+    stats['saved_optimizer_ms'] = round(stats['saved_optimizer_ms'], 1)
+    stats['optimizer_ms'] = round(stats['optimizer_ms'], 1)
+    return stats
+
+
+def reset_plan_memo_metrics():
+    with _memo_lock:
+        _memo_stats.update(hits=0, misses=0, miss_reasons={}, saved_optimizer_ms=0.0, optimizer_ms=0.0)
+
+
+def find_reusable_plan(
+    db: Database,
+    user_id: str,
+    keys: Dict[str, Any]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Ищет сохранённый план, который можно вернуть без пересчёта.
+    
+    Совпасть должны cart_hash, min_order_hash и catalog_version, план не
+    должен быть просрочен. При попадании TTL плана продлевается, но не
+    дальше created_at + PLAN_MAX_AGE_MINUTES.
+    
+    Returns: (snapshot, miss_reason) - snapshot=None при промахе;
+    snapshot['plan_payload'] - восстановленный payload
+    """
+    snapshot = db.cart_plans_v12.find_one({'user_id': user_id}, {'_id': 0})
+    now = datetime.now(timezone.utc)
+    reason = None
+    if not snapshot:
+        reason = 'no_snapshot'
+    elif snapshot.get('cart_hash') != keys['cart_hash']:
+        reason = 'cart_changed'
+    elif snapshot.get('min_order_hash') != keys['min_order_hash']:
+        reason = 'min_order_changed'
+    elif 'catalog_version' not in snapshot or snapshot['catalog_version'] != keys['catalog_version']:
+        reason = 'catalog_changed'
+    elif _is_expired(snapshot, now):
+        reason = 'expired'
+    elif (_max_reuse_until(snapshot) or now) < now:
+        reason = 'max_age'
+    else:
+        snapshot['plan_payload'], missing = snapshot_payload(db, snapshot)
+        if missing:
+            reason = 'offers_missing'
+    
+    if reason:
+        return None, reason
+    
+    expires_at = now + timedelta(minutes=PLAN_TTL_MINUTES)
+    max_reuse_until = _max_reuse_until(snapshot)
+    if max_reuse_until and max_reuse_until < expires_at:
+        expires_at = max_reuse_until
+    db.cart_plans_v12.update_one(
+        {'plan_id': snapshot['plan_id']},
+        {'$set': {'expires_at': expires_at}}
+    )
+    _record_memo(True, optimizer_ms=snapshot.get('optimize_ms') or 0.0)
+    return snapshot, None
+
+
+_indexes_ready = False
+
+
 def save_plan_snapshot(
     db: Database,
     user_id: str,
-    plan_payload: Dict[str, Any],
+    result: OptimizationResult,
     cart_hash: str,
-    min_order_map: Dict[str, float]
+    min_order_map: Dict[str, float],
+    min_order_hash: Optional[str] = None,
+    catalog_version: Optional[str] = None,
+    optimize_ms: Optional[float] = None
 ) -> str:
     """
     Сохраняет snapshot плана в БД.
     
+    План хранится в компактной форме (compact_plan), из минималок - только
+    поставщики плана. min_order_hash / catalog_version / optimize_ms - ключ
+    и цена мемоизации (см. find_reusable_plan); без них план не переиспользуется.
+    
     Returns: plan_id (UUID)
     """
+    global _indexes_ready
+    if not _indexes_ready:
+        ensure_plan_indexes(db)
+        _indexes_ready = True
+    
     plan_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc)
     expires_at = now + timedelta(minutes=PLAN_TTL_MINUTES)
     
+    plan_suppliers = {plan.supplier_id for plan in result.suppliers}
     snapshot = {
         'plan_id': plan_id,
         'user_id': user_id,
-        'created_at': now.isoformat(),
-        'expires_at': expires_at.isoformat(),
+        'created_at': now,
+        'expires_at': expires_at,
         'cart_hash': cart_hash,
-        'min_order_map': min_order_map,
-        'plan_payload': plan_payload,
+        'min_order_map': {sid: v for sid, v in min_order_map.items() if sid in plan_suppliers},
+        'plan': compact_plan(result),
     }
+    if min_order_hash is not None:
+        snapshot['min_order_hash'] = min_order_hash
+        snapshot['catalog_version'] = catalog_version
+        snapshot['optimize_ms'] = optimize_ms
     
     # Удаляем старые планы пользователя
     db.cart_plans_v12.delete_many({'user_id': user_id})
@@ -107,8 +451,12 @@ def load_plan_snapshot(
     Загружает snapshot плана из БД.
     
     Returns: (plan_data, error_message)
-    - plan_data: dict с plan_payload, cart_hash, min_order_map если найден
+    - plan_data: dict с plan_payload, cart_hash, min_order_map, missing_offer_ids
+      если найден; строки удалённых офферов в plan_payload помечены unavailable
     - error_message: строка с ошибкой если план не найден/истёк
+    
+    Просроченные планы удаляет TTL-индекс; проверка здесь закрывает
+    интервал до прохода TTL-монитора.
     """
     snapshot = db.cart_plans_v12.find_one(
         {'plan_id': plan_id, 'user_id': user_id},
@@ -119,19 +467,21 @@ def load_plan_snapshot(
         return None, "План не найден. Пожалуйста, сформируйте план заново."
     
     # Проверяем TTL
-    expires_at = snapshot.get('expires_at')
-    if expires_at:
-        expires_dt = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-        if datetime.now(timezone.utc) > expires_dt:
-            # Удаляем просроченный план
-            db.cart_plans_v12.delete_one({'plan_id': plan_id})
-            return None, "План устарел (прошло более 60 минут). Пожалуйста, сформируйте план заново."
+    if _is_expired(snapshot, datetime.now(timezone.utc)):
+        # Удаляем просроченный план
+        db.cart_plans_v12.delete_one({'plan_id': plan_id})
+        return None, "План устарел (прошло более 60 минут). Пожалуйста, сформируйте план заново."
+    
+    plan_payload, missing = snapshot_payload(db, snapshot)
+    if missing:
+        logger.warning(f"Plan {plan_id} references removed offers: {missing[:5]}")
     
     return {
-        'plan_payload': snapshot.get('plan_payload'),
+        'plan_payload': plan_payload,
         'cart_hash': snapshot.get('cart_hash'),
         'min_order_map': snapshot.get('min_order_map'),
         'created_at': snapshot.get('created_at'),
+        'missing_offer_ids': missing,
     }, None
 
 
@@ -164,9 +514,13 @@ def delete_plan_snapshot(db: Database, plan_id: str, user_id: str) -> bool:
 
 
 def cleanup_expired_plans(db: Database) -> int:
-    """Очищает просроченные планы. Можно вызывать периодически."""
+    """
+    Очищает просроченные планы со строковым expires_at (старый формат).
+    
+    Планы с datetime expires_at удаляет TTL-индекс (ensure_plan_indexes).
+    """
     now = datetime.now(timezone.utc).isoformat()
-    result = db.cart_plans_v12.delete_many({'expires_at': {'$lt': now}})
+    result = db.cart_plans_v12.delete_many({'expires_at': {'$lt': now, '$type': 'string'}})
     if result.deleted_count > 0:
         logger.info(f"Cleaned up {result.deleted_count} expired plan snapshots")
     return result.deleted_count
@@ -11,6 +11,7 @@ FastAPI роутер для v12 функционала
 
 import logging
 import re
+import time
 from typing import Optional, List
 from datetime import datetime, timezone
 
@@ -26,7 +27,7 @@ from .models import (
 )
 from .catalog import (
     get_db, generate_catalog_references, 
-    get_catalog_items, update_best_prices
+    get_catalog_items, update_best_prices, publishable_offer_query
 )
 from .cart import (
     add_to_cart, get_cart_summary, 
@@ -51,6 +52,8 @@ from search_utils import (
 )
 from russian_stemmer import stem_token_safe, generate_lemma_tokens
 from search_synonyms import get_synonyms, build_synonym_regex, expand_query_with_synonyms
+from request_profiler import profiled, lap
+from log_pipeline import hot_logger
 
 # Import search service (новый модуль)
 from .search_service import search_items, search_with_lemma_only, tokenize_query
@@ -135,18 +138,9 @@ async def get_catalog(
     super_class_filter = super_class or category
     
     # Базовый фильтр - только валидные офферы (publishable)
-    # Правила: active=true, price>0, unit_type exists, id exists
-    # Для WEIGHT/VOLUME требуется pack_qty > 0
-    query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'unit_type': {'$exists': True, '$ne': None, '$ne': ''},
-        'id': {'$exists': True, '$ne': None},
-        '$or': [
-            {'unit_type': {'$in': ['WEIGHT', 'VOLUME']}, 'pack_qty': {'$gt': 0}},
-            {'unit_type': 'PIECE'}
-        ]
-    }
+    # Правила (price>0, unit_type, id, pack_qty>0 для WEIGHT/VOLUME) проверяются
+    # один раз при импорте - offer_validator.publication_fields
+    query = publishable_offer_query()
     
     # Фильтр по категории
     if super_class_filter:
@@ -261,7 +255,7 @@ async def get_catalog(
             # === APPLY BRAND FILTER if confident ===
             if use_brand_filter and brand_detection.brand_ids:
                 # Build brand-filtered query
-                brand_query = {'active': True, 'price': {'$gt': 0}}
+                brand_query = publishable_offer_query()
                 if super_class_filter:
                     brand_query['super_class'] = query.get('super_class')
                 if supplier_id:
@@ -844,6 +838,36 @@ async def remove_cart_item(
     return result
 
 
+# === ADMIN JOBS ===
+
+from .job_runner import admin_job_response, get_job_runner
+
+
+@router.get("/admin/jobs", summary="Фоновые админские задачи")
+async def list_admin_jobs(kind: Optional[str] = None, limit: int = Query(20, ge=1, le=50)):
+    """Последние задачи (новые первые), опционально одного вида."""
+    runner = get_job_runner(get_db())
+    return {'jobs': runner.list(kind=kind, limit=limit)}
+
+
+@router.get("/admin/jobs/{job_id}", summary="Статус фоновой задачи")
+async def get_admin_job(job_id: str):
+    """status: queued | running | succeeded | failed | cancelled; progress, result, error."""
+    job = get_job_runner(get_db()).get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/admin/jobs/{job_id}/cancel", summary="Отменить фоновую задачу")
+async def cancel_admin_job(job_id: str):
+    """Задача в очереди отменяется сразу, выполняющаяся - на ближайшей контрольной точке."""
+    job = get_job_runner(get_db()).cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
 # === ADMIN ENDPOINTS ===
 
 @router.post("/admin/catalog/generate", summary="Сгенерировать каталог")
@@ -851,33 +875,27 @@ async def generate_catalog(limit: Optional[int] = None):
     """
     Генерирует catalog_references из supplier_items
     
-    Вызывать после импорта новых прайсов
+    Вызывать после импорта новых прайсов. Выполняется в фоне: ответ - job id,
+    статистика - в result задачи (GET /v12/admin/jobs/{job_id}).
     """
-    db = get_db()
-    
-    stats = generate_catalog_references(db, limit)
-    
-    return {
-        'status': 'ok',
-        'stats': stats
-    }
+    job = await get_job_runner(get_db()).submit(
+        'catalog_generate', lambda ctx: generate_catalog_references(ctx.db, limit), params={'limit': limit})
+    return admin_job_response(job)
 
 
 @router.post("/admin/catalog/update-prices", summary="Обновить Best Prices")
-async def update_prices():
+async def update_prices(incremental: bool = False):
     """
     Обновляет best_price для всех карточек
     
-    Вызывать периодически или после изменения прайсов
+    Вызывать периодически или после изменения прайсов.
+    incremental=true - только ядра, затронутые импортами с прошлого прогона.
+    Выполняется в фоне: ответ - job id (GET /v12/admin/jobs/{job_id}).
     """
-    db = get_db()
-    
-    stats = update_best_prices(db)
-    
-    return {
-        'status': 'ok',
-        'stats': stats
-    }
+    job = await get_job_runner(get_db()).submit(
+        'catalog_update_prices', lambda ctx: update_best_prices(ctx.db, incremental=incremental),
+        params={'incremental': incremental})
+    return admin_job_response(job)
 
 
 @router.post("/admin/test/favorites/random", summary="Добавить случайные карточки в избранное")
@@ -1030,12 +1048,10 @@ async def add_cart_intent(request: CartIntentRequest):
         # Если anchor неактивен - ищем замену по product_core_id + unit_type
         if not supplier_item_id and fav.get('product_core_id'):
             replacement = db.supplier_items.find_one(
-                {
-                    'active': True,
-                    'price': {'$gt': 0},
-                    'product_core_id': fav['product_core_id'],
-                    'unit_type': fav.get('unit_type', 'PIECE')
-                },
+                publishable_offer_query(
+                    product_core_id=fav['product_core_id'],
+                    unit_type=fav.get('unit_type', 'PIECE'),
+                ),
                 {'_id': 0},
                 sort=[('price', 1)]  # Самый дешёвый
             )
@@ -1165,7 +1181,45 @@ async def remove_cart_intent(
     return {'status': 'ok'}
 
 
+from .cart_batch import CART_BATCH_MAX_OPERATIONS, apply_cart_operations
+
+
+class CartIntentOperation(BaseModel):
+    """Операция пакета: add (как /cart/intent), update / remove (как PUT / DELETE /cart/intent/{item_id})"""
+    op: str = Field(..., pattern='^(add|update|remove)$')
+    reference_id: Optional[str] = None  # add: из избранного/catalog_references
+    supplier_item_id: Optional[str] = None  # add: напрямую из каталога
+    item_id: Optional[str] = None  # update / remove: supplier_item_id или reference_id
+    qty: Optional[float] = Field(None, gt=0, description="add / update: количество в единицах")
+    lock_offer: bool = Field(default=True, description="add: закрепить выбранный оффер без замены")
+
+
+class CartIntentBatchRequest(BaseModel):
+    """Пакет изменений корзины одного пользователя"""
+    user_id: str
+    operations: List[CartIntentOperation] = Field(..., min_length=1, max_length=CART_BATCH_MAX_OPERATIONS)
+
+
+@router.post("/cart/intents:batch", summary="Пакетно изменить корзину")
+async def batch_cart_intents(request: CartIntentBatchRequest):
+    """
+    Применяет много add / update / remove за один вызов (добавить избранное,
+    повторить заказ).
+    
+    Операции проверяются по общим чтениям (офферы, избранное, поставщики -
+    запросами с $in) и записываются одним bulk_write в порядке пакета;
+    cart_hash меняется один раз. Невалидные операции пропускаются:
+    results[i] = {status: 'error', code, detail}, остальные применяются.
+    """
+    db = get_db()
+    return {
+        'status': 'ok',
+        **apply_cart_operations(db, request.user_id, [op.model_dump() for op in request.operations]),
+    }
+
+
 @router.get("/cart/plan", summary="Получить оптимизированный план")
+@profiled('v12_cart_plan')
 async def get_cart_plan(user_id: str = Query(..., description="ID пользователя")):
     """
     Запускает оптимизатор и возвращает план распределения по поставщикам.
@@ -1173,28 +1227,51 @@ async def get_cart_plan(user_id: str = Query(..., description="ID пользов
     НОВОЕ (P0.1): Сохраняет snapshot плана в БД и возвращает plan_id.
     Checkout должен использовать этот plan_id, а не пересчитывать план.
     
+    Если корзина, минималки и версия каталога ядер корзины не менялись,
+    возвращается сохранённый план (тот же plan_id) без запуска оптимизатора.
+    
     Вызывать ТОЛЬКО при нажатии "Оформить заказ".
     До этого корзина отображается как есть (без оптимизации).
     """
     db = get_db()
     
-    from .optimizer import optimize_cart, plan_to_dict
+    from .optimizer import optimize_cart_incremental
     from .plan_snapshot import (
-        compute_cart_hash, get_min_order_map, save_plan_snapshot
+        compute_plan_keys, find_reusable_plan, save_plan_snapshot, record_plan_optimized
     )
     
-    # 1. Запускаем оптимизацию
-    result = optimize_cart(db, user_id)
+    # 1. Ключ мемоизации: хэш корзины, минималки, версия каталога ядер корзины.
+    # Считается ДО оптимизации: если корзина изменится во время расчёта,
+    # checkout увидит несовпадение хэша, а не примет устаревший план.
+    keys = compute_plan_keys(db, user_id)
+    lap('plan_keys')
+    
+    # 2. Ничего не изменилось - возвращаем сохранённый план без пересчёта
+    snapshot, miss_reason = find_reusable_plan(db, user_id, keys)
+    lap('plan_lookup')
+    if snapshot:
+        plan_payload = snapshot['plan_payload']
+        plan_payload['plan_id'] = snapshot['plan_id']
+        return plan_payload
+    
+    # 3. Запускаем оптимизацию: поверх прошлого решения, пока версия каталога та же
+    started = time.perf_counter()
+    result = optimize_cart_incremental(db, user_id, keys['catalog_version'])
+    optimize_ms = (time.perf_counter() - started) * 1000
+    record_plan_optimized(miss_reason, optimize_ms)
+    lap('optimize')
     plan_payload = plan_to_dict(result)
+    lap('serialize')
     
-    # 2. Вычисляем хэш корзины и получаем минималки
-    cart_hash = compute_cart_hash(db, user_id)
-    min_order_map = get_min_order_map(db)
-    
-    # 3. Сохраняем snapshot
-    plan_id = save_plan_snapshot(db, user_id, plan_payload, cart_hash, min_order_map)
+    # 4. Сохраняем snapshot (компактно, см. plan_snapshot.compact_plan)
+    plan_id = save_plan_snapshot(
+        db, user_id, result, keys['cart_hash'], keys['min_order_map'],
+        min_order_hash=keys['min_order_hash'], catalog_version=keys['catalog_version'],
+        optimize_ms=round(optimize_ms, 1),
+    )
+    lap('save_snapshot')
     
-    # 4. Добавляем plan_id в ответ
+    # 5. Добавляем plan_id в ответ
     plan_payload['plan_id'] = plan_id
     
     return plan_payload
@@ -1219,7 +1296,8 @@ async def checkout_cart(
     1. Загружает plan snapshot по plan_id
     2. Проверяет что корзина не изменилась (cart_hash)
     3. Если изменилась → возвращает PLAN_CHANGED (409)
-    4. Создаёт заказы из сохранённого плана
+    4. Создаёт заказы из сохранённого плана; позиции удалённых после
+       планирования офферов (unavailable) пропускаются и возвращаются в ответе
     5. Очищает корзину ТОЛЬКО после успешной записи заказов
     """
     import uuid as uuid_module
@@ -1232,6 +1310,7 @@ async def checkout_cart(
         load_plan_snapshot, validate_cart_unchanged, 
         delete_plan_snapshot, compute_cart_hash
     )
+    from .order_history import record_orders
     
     # 1. Загружаем snapshot плана
     plan_data, error = load_plan_snapshot(db, request.plan_id, user_id)
@@ -1279,15 +1358,36 @@ async def checkout_cart(
             'message': 'План пуст. Добавьте товары в корзину.'
         }
     
+    # Позиции удалённых офферов в заказ не попадают
+    unavailable_items = [
+        {'supplier_item_id': item.get('supplier_item_id'), 'product_name': item.get('product_name', ''),
+         'supplier_name': supplier_data.get('supplier_name'), 'reason_code': item.get('unavailable_reason_code')}
+        for supplier_data in suppliers for item in supplier_data.get('items', []) if item.get('unavailable')
+    ]
+    if unavailable_items and len(unavailable_items) == sum(len(sd.get('items', [])) for sd in suppliers):
+        return {
+            'status': 'error',
+            'code': 'OFFERS_UNAVAILABLE',
+            'message': 'Товары плана больше не доступны. Пожалуйста, сформируйте план заново.',
+            'unavailable_items': unavailable_items,
+            'need_replan': True
+        }
+    
     # 4. Создаём заказы из сохранённого плана
     created_orders = []
+    history_orders = []
+    history_names = {}
     total_amount = 0
     
     try:
         for supplier_data in suppliers:
             order_items = []
+            supplier_subtotal = supplier_data.get('subtotal', 0)
             
             for item in supplier_data.get('items', []):
+                if item.get('unavailable'):
+                    supplier_subtotal -= item.get('line_total', 0)
+                    continue
                 order_items.append({
                     'productName': item.get('product_name', ''),
                     'article': item.get('supplier_item_id', ''),
@@ -1301,8 +1401,10 @@ async def checkout_cart(
                     'qty_changed_by_topup': item.get('qty_changed_by_topup', False),
                 })
             
+            if not order_items:
+                continue
+            
             order_id = str(uuid_module.uuid4())
-            supplier_subtotal = supplier_data.get('subtotal', 0)
             
             order_data = {
                 'id': order_id,
@@ -1318,6 +1420,8 @@ async def checkout_cart(
             
             # Сохраняем в orders_v12 (основная коллекция заказов)
             db.orders_v12.insert_one(order_data)
+            history_orders.append(dict(order_data))
+            history_names[supplier_data.get('supplier_id')] = supplier_data.get('supplier_name')
             logger.info(f"Created order {order_id} for supplier {supplier_data.get('supplier_name')}, amount={supplier_subtotal}")
             
             total_amount += supplier_subtotal
@@ -1330,6 +1434,14 @@ async def checkout_cart(
                 'items_count': len(order_items),
             })
         
+        # Проекция истории заказов (имя поставщика уже есть в плане).
+        # Заказы уже созданы: сбой проекции не должен превращаться в ошибку checkout,
+        # пропущенные записи дописывает миграция при старте
+        try:
+            record_orders(db, history_orders, history_names)
+        except Exception as e:
+            logger.error(f"Order history projection failed for {len(history_orders)} orders: {e}")
+        
         # 5. Очищаем корзину ТОЛЬКО после успешного создания заказов
         db.cart_intents.delete_many({'user_id': user_id})
         db.cart_items_v12.delete_many({'user_id': user_id})
@@ -1343,7 +1455,8 @@ async def checkout_cart(
             'status': 'ok',
             'message': f'Создано {len(created_orders)} заказов',
             'orders': created_orders,
-            'total': total_amount
+            'total': total_amount,
+            'unavailable_items': unavailable_items
         }
         
     except Exception as e:
@@ -1404,61 +1517,37 @@ async def set_supplier_minimum(
 
 # === ORDERS HISTORY ===
 
+from .order_history import (
+    list_order_history, count_order_history, get_history_entry,
+    ORDER_HISTORY_MAX_PAGE_SIZE
+)
+
 @router.get("/orders", summary="Получить историю заказов")
-async def get_orders_history(user_id: str = Query(..., description="ID пользователя")):
+async def get_orders_history(
+    user_id: str = Query(..., description="ID пользователя"),
+    limit: Optional[int] = Query(None, ge=1, le=ORDER_HISTORY_MAX_PAGE_SIZE,
+                                 description="Размер страницы; без limit - вся история"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+):
     """
     Возвращает историю заказов пользователя.
     Заказы отсортированы по дате (новые первые).
     
-    ВАЖНО (P0.3): Читает из orders_v12 (основная коллекция).
+    Читает проекцию order_history_v12 (заказы orders_v12 + legacy orders,
+    имя поставщика уже в записи). С limit - постранично, следующая страница
+    по next_cursor; без limit - вся история одним ответом.
     """
     db = get_db()
     
-    # Читаем из orders_v12 (основная коллекция) + fallback на orders (старая)
-    orders_v12 = list(db.orders_v12.find(
-        {'customer_user_id': user_id},
-        {'_id': 0}
-    ).sort('created_at', -1))
-    
-    # Также проверяем старую коллекцию orders для обратной совместимости
-    orders_old = list(db.orders.find(
-        {'customer_user_id': user_id},
-        {'_id': 0}
-    ).sort('created_at', -1))
-    
-    # Объединяем и сортируем
-    all_orders_raw = orders_v12 + orders_old
-    all_orders_raw.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    
-    # Enrich with supplier names
-    orders = []
-    seen_ids = set()  # Избегаем дубликатов
-    
-    for order in all_orders_raw:
-        order_id = order.get('id', order.get('created_at', ''))
-        if order_id in seen_ids:
-            continue
-        seen_ids.add(order_id)
-        
-        supplier_id = order.get('supplier_company_id')
-        company = db.companies.find_one({'id': supplier_id}, {'companyName': 1, 'name': 1})
-        supplier_name = company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown'
-        
-        orders.append({
-            'id': order_id,
-            'supplier_id': supplier_id,
-            'supplier_name': supplier_name,
-            'amount': order.get('amount', 0),
-            'status': order.get('status', 'pending'),
-            'items': order.get('items', []),
-            'items_count': len(order.get('items', [])),
-            'created_at': order.get('created_at'),
-            'delivery_address_id': order.get('delivery_address_id'),
-        })
+    try:
+        orders, next_cursor = list_order_history(db, user_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
     
     return {
         'orders': orders,
-        'total_count': len(orders)
+        'total_count': count_order_history(db, user_id),
+        'next_cursor': next_cursor
     }
 
 
@@ -1467,6 +1556,10 @@ async def get_order_details(order_id: str):
     """Возвращает детали конкретного заказа"""
     db = get_db()
     
+    entry = get_history_entry(db, order_id)
+    if entry:
+        return entry
+    
     # Ищем сначала в orders_v12, потом в orders
     order = db.orders_v12.find_one(
         {'id': order_id},
@@ -1645,123 +1738,86 @@ def calculate_relevance_score(source_comps: dict, candidate_comps: dict,
     return score
 
 
-@router.get("/item/{item_id}/alternatives", summary="Получить альтернативные офферы")
-async def get_item_alternatives(
-    item_id: str, 
-    limit: int = Query(10, le=20),
-    mode: str = Query('strict', description="Режим: 'strict' (по умолчанию) или 'similar' (по кнопке)"),
-    include_similar: bool = Query(False, description="DEPRECATED: используйте mode='similar'"),
-    ts: int = Query(None, description="Cache-bust timestamp")
-):
+ALTERNATIVES_CANDIDATES_LIMIT = 200  # topK кандидатов ядра на товар
+# Порядок topK: дешёвые первыми (price из индекса publishable_core_unit_price), id - для
+# стабильности; одинаков в single и batch, иначе при >200 офферах ядра выдачи расходятся
+ALTERNATIVES_CANDIDATES_SORT = [('price', 1), ('id', 1)]
+
+# v12: Anti-cache headers
+ALTERNATIVES_NO_CACHE_HEADERS = {
+    "Cache-Control": "no-store, no-cache, max-age=0, must-revalidate",
+    "Pragma": "no-cache",
+    "Expires": "0",
+    "Vary": "Authorization, Cookie"
+}
+
+
+def _supplier_info(company: Optional[dict]) -> dict:
+    return {
+        'name': company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown',
+        'min_order': company.get('min_order_amount', 10000) if company else 10000
+    }
+
+
+def _alternatives_not_found(debug_id: str) -> dict:
+    return {
+        'source': None,
+        'strict_after_gates': [],  # P0 ZERO-TRASH
+        'strict': [],
+        'similar': [],
+        'alternatives': [],
+        'total': 0,
+        'ruleset_version': 'npc_shrimp_v12',
+        'ref_parsed': None,
+        'rejected_reasons': {},
+        'debug_id': debug_id
+    }
+
+
+def _alternatives_no_core(source_item: dict, debug_id: str) -> dict:
+    return {
+        'source': {
+            'id': source_item.get('id'),
+            'name': source_item.get('name_raw', ''),
+            'price': source_item.get('price', 0),
+            'product_core_id': None,
+        },
+        'strict_after_gates': [],  # P0 ZERO-TRASH
+        'strict': [],
+        'similar': [],
+        'alternatives': [],
+        'total': 0,
+        'reason': 'no_product_core_id',
+        'ruleset_version': 'npc_shrimp_v12',
+        'ref_parsed': None,
+        'rejected_reasons': {},
+        'debug_id': debug_id
+    }
+
+
+def _item_alternatives(
+    db,
+    source_item: dict,
+    raw_candidates: List[dict],
+    limit: int,
+    mode: str,
+    include_similar: bool,
+    debug_id: str,
+    logger,
+    supplier_cache: dict,
+    signatures: Optional[dict] = None,
+) -> dict:
     """
-    Возвращает альтернативные офферы для товара (v12 - NPC SHRIMP Zero-Trash).
-    
-    РЕЖИМЫ ВЫДАЧИ:
+    Strict / similar альтернативы для загруженного source_item и его кандидатов.
     
-    1. mode='strict' (по умолчанию):
-       - Только точные аналоги
-       - Если нет — возвращает пустой список
-       - Similar не возвращается
-    
-    2. mode='similar' (по кнопке):
-       - Возвращает Strict + Similar
-       - Similar с лейблами отличий
-    
-    HARD-ПРАВИЛА (Strict 1-в-1):
-    - PROCESSING_FORM: CANNED ≠ SMOKED ≠ FROZEN_RAW
-    - CUT_TYPE: FILLET ≠ WHOLE_TUSHKA ≠ STEAK
-    - SPECIES: окунь ≠ сибас ≠ скумбрия
-    - IS_BOX: короб исключается если REF не короб
-    - Креветки: state/form/caliber строго 1-в-1
-    
-    РАНЖИРОВАНИЕ:
-    1. Близость размера/калибра
-    2. Совпадение бренда
-    3. ppu_value
+    Общая часть /item/{item_id}/alternatives и /items/alternatives:batch.
+    supplier_cache - поставщики по id (batch заполняет его одним запросом),
+    signatures - кэш сигнатур кандидатов по матчеру ('npc', 'fish_fillet', 'v3'):
+    в batch товары одного ядра делят кандидатов, и каждый подписывается один раз.
     """
-    # v12: Anti-cache headers
-    anti_cache_headers = {
-        "Cache-Control": "no-store, no-cache, max-age=0, must-revalidate",
-        "Pragma": "no-cache",
-        "Expires": "0",
-        "Vary": "Authorization, Cookie"
-    }
-    
-    def make_response(data: dict) -> JSONResponse:
-        """Helper to create response with anti-cache headers."""
-        return JSONResponse(content=data, headers=anti_cache_headers)
-    
-    # Backward compatibility: include_similar=true → mode='similar'
-    if include_similar and mode == 'strict':
-        mode = 'similar'
-    
-    db = get_db()
-    
-    # v12 P0: Генерируем debug_id для трассировки
-    import uuid
-    debug_id = str(uuid.uuid4())[:8]
-    
-    # Получаем исходный товар
-    source_item = db.supplier_items.find_one(
-        {'id': item_id, 'active': True},
-        {'_id': 0}
-    )
-    
-    if not source_item:
-        logger.info(f"[{debug_id}] item_id={item_id} NOT_FOUND")
-        return make_response({
-            'source': None,
-            'strict_after_gates': [],  # P0 ZERO-TRASH
-            'strict': [],
-            'similar': [],
-            'alternatives': [],
-            'total': 0,
-            'ruleset_version': 'npc_shrimp_v12',
-            'ref_parsed': None,
-            'rejected_reasons': {},
-            'debug_id': debug_id
-        })
-    
+    item_id = source_item.get('id')
     product_core_id = source_item.get('product_core_id')
     
-    # Получаем кандидатов из БД
-    candidates_query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'id': {'$ne': item_id},
-    }
-    
-    if product_core_id:
-        candidates_query['product_core_id'] = product_core_id
-    else:
-        logger.info(f"[{debug_id}] item_id={item_id} NO_PRODUCT_CORE_ID")
-        return make_response({
-            'source': {
-                'id': source_item.get('id'),
-                'name': source_item.get('name_raw', ''),
-                'price': source_item.get('price', 0),
-                'product_core_id': None,
-            },
-            'strict_after_gates': [],  # P0 ZERO-TRASH
-            'strict': [],
-            'similar': [],
-            'alternatives': [],
-            'total': 0,
-            'reason': 'no_product_core_id',
-            'ruleset_version': 'npc_shrimp_v12',
-            'ref_parsed': None,
-            'rejected_reasons': {},
-            'debug_id': debug_id
-        })
-    
-    # Получаем кандидатов (увеличенный лимит для NPC фильтрации)
-    raw_candidates = list(db.supplier_items.find(
-        candidates_query,
-        {'_id': 0}
-    ).limit(200))  # topK=200 как в ТЗ
-    
-    logger.info(f"[{debug_id}] item_id={item_id} raw_candidates={len(raw_candidates)} product_core_id={product_core_id}")
-    
     # === NPC MATCHING (для SHRIMP/FISH/SEAFOOD/MEAT) ===
     # Проверяем, относится ли source к NPC домену
     source_npc_domain = get_item_npc_domain(source_item)
@@ -1777,7 +1833,7 @@ async def get_item_alternatives(
     
     if (is_shrimp_like or has_caliber) and not use_npc:
         # ZERO-TRASH: REF выглядит как креветки, но domain не определён → НЕ fallback на legacy
-        logger.info(f"[{debug_id}] ZERO-TRASH: REF shrimp-like but no npc_domain, returning empty strict")
+        logger.info("[%s] ZERO-TRASH: REF shrimp-like but no npc_domain, returning empty strict", debug_id)
         use_npc = True  # Принудительно используем NPC path (который вернёт пустой strict)
     
     # === FISH_FILLET DOMAIN CHECK (v1 ZERO-TRASH) ===
@@ -1787,12 +1843,11 @@ async def get_item_alternatives(
     
     # ZERO-TRASH: Если REF fish_fillet-like → принудительно NPC FISH_FILLET path
     if is_fish_fillet_like and not use_fish_fillet:
-        logger.info(f"[{debug_id}] ZERO-TRASH: REF fish_fillet-like but not classified")
+        logger.info("[%s] ZERO-TRASH: REF fish_fillet-like but not classified", debug_id)
         use_fish_fillet = True  # Принудительно FISH_FILLET path
+    lap('classify_ref')
     
     # Обогащаем данными поставщика (общая функция)
-    supplier_cache = {}
-    
     def get_supplier_info(supplier_id: str) -> dict:
         if not supplier_id:
             return {'name': 'Unknown', 'min_order': 10000}
@@ -1801,23 +1856,22 @@ async def get_item_alternatives(
                 {'id': supplier_id}, 
                 {'companyName': 1, 'name': 1, 'min_order_amount': 1}
             )
-            supplier_cache[supplier_id] = {
-                'name': company.get('companyName', company.get('name', 'Unknown')) if company else 'Unknown',
-                'min_order': company.get('min_order_amount', 10000) if company else 10000
-            }
+            supplier_cache[supplier_id] = _supplier_info(company)
         return supplier_cache[supplier_id]
     
     # === FISH_FILLET PATH (v1 ZERO-TRASH) ===
     if use_fish_fillet:
-        logger.info(f"[{debug_id}] Using FISH_FILLET matching v1 for item {item_id}")
+        logger.info("[%s] Using FISH_FILLET matching v1 for item %s", debug_id, item_id)
         
         # Применяем FISH_FILLET фильтр
         ff_strict, ff_similar, ff_rejected = apply_fish_fillet_filter(
             source_item=source_item,
             candidates=raw_candidates,
             limit=limit,
-            mode=mode
+            mode=mode,
+            signatures=None if signatures is None else signatures.setdefault('fish_fillet', {})
         )
+        lap('fish_fillet_filter')
         
         # FISH_FILLET ref_debug
         ff_ref_debug = build_fish_fillet_ref_debug(source_item)
@@ -1832,10 +1886,10 @@ async def get_item_alternatives(
         
         if ff_rejected and any(r in ff_rejected for r in ff_zero_trash_reasons):
             reason = next((r for r in ff_zero_trash_reasons if r in ff_rejected), 'UNKNOWN')
-            logger.info(f"[{debug_id}] item_id={item_id} FISH_FILLET {reason} strict_count=0")
+            logger.info("[%s] item_id=%s FISH_FILLET %s strict_count=0", debug_id, item_id, reason)
             source_supplier_id = source_item.get('supplier_company_id')
             source_sup_info = get_supplier_info(source_supplier_id)
-            return make_response({
+            return {
                 'source': {
                     'id': source_item.get('id'),
                     'name': source_item.get('name_raw', ''),
@@ -1865,7 +1919,7 @@ async def get_item_alternatives(
                 'ref_parsed': {'npc_domain': 'FISH_FILLET', 'reason': reason},
                 'ref_debug': ff_ref_debug,
                 'debug_id': debug_id
-            })
+            }
         
         # Извлекаем ref_parsed для FISH_FILLET
         source_ff_sig = extract_fish_fillet_signature(source_item)
@@ -1966,9 +2020,9 @@ async def get_item_alternatives(
             'is_box': source_ff_sig.is_box,
         }
         
-        logger.info(f"[{debug_id}] FISH_FILLET item_id={item_id} species={ff_ref_parsed.get('fish_species')} cut={ff_ref_parsed.get('cut_type')} strict_count={len(enriched_ff_strict)} rejected={ff_rejected}")
+        logger.info("[%s] FISH_FILLET item_id=%s species=%s cut=%s strict_count=%s rejected=%s", debug_id, item_id, ff_ref_parsed.get('fish_species'), ff_ref_parsed.get('cut_type'), len(enriched_ff_strict), ff_rejected)
         
-        return make_response({
+        return {
             'source': enriched_ff_source,
             'strict_after_gates': enriched_ff_strict,
             'strict': enriched_ff_strict,
@@ -1985,11 +2039,11 @@ async def get_item_alternatives(
             'ref_parsed': ff_ref_parsed,
             'ref_debug': ff_ref_debug,
             'debug_id': debug_id
-        })
+        }
     
     if use_npc:
         # === NPC PATH: применяем NPC фильтрацию НАПРЯМУЮ к raw_candidates ===
-        logger.info(f"Using NPC matching v12 for item {item_id}, domain={source_npc_domain}")
+        logger.info("Using NPC matching v12 for item %s, domain=%s", item_id, source_npc_domain)
         
         # v12: Применяем NPC фильтр НАПРЯМУЮ к raw_candidates (без v3 preprocessing)
         # Это гарантирует, что hard gates применяются ДО любого ранжирования
@@ -1997,8 +2051,10 @@ async def get_item_alternatives(
             source_item=source_item,
             candidates=raw_candidates,
             limit=limit,
-            mode=mode  # 'strict' или 'similar'
+            mode=mode,  # 'strict' или 'similar'
+            signatures=None if signatures is None else signatures.setdefault('npc', {})
         )
+        lap('npc_filter')
         
         # v12 FIX: NPC больше не возвращает None — всегда возвращает пустой список
         # при неклассифицируемом REF (REF_NOT_CLASSIFIED). Это гарантирует "нулевой мусор".
@@ -2015,11 +2071,11 @@ async def get_item_alternatives(
         
         if npc_rejected and any(r in npc_rejected for r in zero_trash_reasons):
             reason = next((r for r in zero_trash_reasons if r in npc_rejected), 'UNKNOWN')
-            logger.info(f"[{debug_id}] item_id={item_id} {reason} strict_count=0")
+            logger.info("[%s] item_id=%s %s strict_count=0", debug_id, item_id, reason)
             # Возвращаем пустой результат с информацией о причине
             source_supplier_id = source_item.get('supplier_company_id')
             source_sup_info = get_supplier_info(source_supplier_id)
-            return make_response({
+            return {
                 'source': {
                     'id': source_item.get('id'),
                     'name': source_item.get('name_raw', ''),
@@ -2049,7 +2105,7 @@ async def get_item_alternatives(
                 'ref_parsed': {'npc_domain': None, 'reason': reason},
                 'ref_debug': ref_debug,  # ZERO-TRASH DEBUG
                 'debug_id': debug_id
-            })
+            }
         
         # REF успешно классифицирован — обрабатываем результаты
         # v12: Извлекаем ref_parsed для debug output
@@ -2163,9 +2219,9 @@ async def get_item_alternatives(
         all_alternatives = enriched_strict + enriched_similar
         
         # v12 P0: Логируем NPC результат ПЕРЕД return
-        logger.info(f"[{debug_id}] item_id={item_id} ref_caliber={ref_parsed.get('shrimp_caliber')} strict_count={len(enriched_strict)} rejected={npc_rejected}")
+        logger.info("[%s] item_id=%s ref_caliber=%s strict_count=%s rejected=%s", debug_id, item_id, ref_parsed.get('shrimp_caliber'), len(enriched_strict), npc_rejected)
         
-        return make_response({
+        return {
             'source': enriched_source,
             # P0 ZERO-TRASH: strict_after_gates — ЕДИНСТВЕННЫЙ массив для UI в strict режиме
             'strict_after_gates': enriched_strict,
@@ -2184,15 +2240,17 @@ async def get_item_alternatives(
             'ref_parsed': ref_parsed,
             'ref_debug': ref_debug,  # ZERO-TRASH DEBUG
             'debug_id': debug_id
-        })
+        }
     
     # === LEGACY PATH: используем matching_engine_v3 ===
     result = find_alternatives_v3(
         source_item=source_item,
         candidates=raw_candidates,
         limit=limit,
-        strict_threshold=4 if include_similar else 999
+        strict_threshold=4 if include_similar else 999,
+        signatures=None if signatures is None else signatures.setdefault('v3', {})
     )
+    lap('legacy_v3_filter')
     
     def enrich_item(alt: dict) -> dict:
         supplier_id = alt.get('supplier_company_id')
@@ -2263,9 +2321,9 @@ async def get_item_alternatives(
     }
     
     # v12 P0: Логируем Legacy path
-    logger.info(f"[{debug_id}] item_id={item_id} LEGACY_PATH strict_count={result.strict_count}")
+    logger.info("[%s] item_id=%s LEGACY_PATH strict_count=%s", debug_id, item_id, result.strict_count)
     
-    return make_response({
+    return {
         'source': enriched_source,
         'strict_after_gates': enriched_strict,  # P0 ZERO-TRASH
         'strict': enriched_strict,
@@ -2282,7 +2340,190 @@ async def get_item_alternatives(
         'ref_parsed': legacy_ref_parsed,
         'ref_debug': ref_debug,  # ZERO-TRASH DEBUG
         'debug_id': debug_id
-    })
+    }
+
+
+@router.get("/item/{item_id}/alternatives", summary="Получить альтернативные офферы")
+@profiled('v12_alternatives')
+async def get_item_alternatives(
+    item_id: str, 
+    limit: int = Query(10, le=20),
+    mode: str = Query('strict', description="Режим: 'strict' (по умолчанию) или 'similar' (по кнопке)"),
+    include_similar: bool = Query(False, description="DEPRECATED: используйте mode='similar'"),
+    ts: int = Query(None, description="Cache-bust timestamp")
+):
+    """
+    Возвращает альтернативные офферы для товара (v12 - NPC SHRIMP Zero-Trash).
+    
+    РЕЖИМЫ ВЫДАЧИ:
+    
+    1. mode='strict' (по умолчанию):
+       - Только точные аналоги
+       - Если нет — возвращает пустой список
+       - Similar не возвращается
+    
+    2. mode='similar' (по кнопке):
+       - Возвращает Strict + Similar
+       - Similar с лейблами отличий
+    
+    HARD-ПРАВИЛА (Strict 1-в-1):
+    - PROCESSING_FORM: CANNED ≠ SMOKED ≠ FROZEN_RAW
+    - CUT_TYPE: FILLET ≠ WHOLE_TUSHKA ≠ STEAK
+    - SPECIES: окунь ≠ сибас ≠ скумбрия
+    - IS_BOX: короб исключается если REF не короб
+    - Креветки: state/form/caliber строго 1-в-1
+    
+    РАНЖИРОВАНИЕ:
+    1. Близость размера/калибра
+    2. Совпадение бренда
+    3. ppu_value
+    """
+    def make_response(data: dict) -> JSONResponse:
+        """Helper to create response with anti-cache headers."""
+        return JSONResponse(content=data, headers=ALTERNATIVES_NO_CACHE_HEADERS)
+    
+    # Backward compatibility: include_similar=true → mode='similar'
+    if include_similar and mode == 'strict':
+        mode = 'similar'
+    
+    db = get_db()
+    
+    # v12 P0: Генерируем debug_id для трассировки
+    import uuid
+    debug_id = str(uuid.uuid4())[:8]
+    # Сэмплируемый логгер запроса (очередь + лимит байт, см. log_pipeline)
+    logger = hot_logger('alternatives', __name__, request_id=debug_id)
+    
+    # Получаем исходный товар
+    source_item = db.supplier_items.find_one(
+        {'id': item_id, 'active': True},
+        {'_id': 0}
+    )
+    lap('load_source')
+    
+    if not source_item:
+        logger.info("[%s] item_id=%s NOT_FOUND", debug_id, item_id)
+        return make_response(_alternatives_not_found(debug_id))
+    
+    product_core_id = source_item.get('product_core_id')
+    
+    # Получаем кандидатов из БД
+    candidates_query = publishable_offer_query(id={'$ne': item_id})
+    
+    if product_core_id:
+        candidates_query['product_core_id'] = product_core_id
+    else:
+        logger.info("[%s] item_id=%s NO_PRODUCT_CORE_ID", debug_id, item_id)
+        return make_response(_alternatives_no_core(source_item, debug_id))
+    
+    # Получаем кандидатов (увеличенный лимит для NPC фильтрации)
+    raw_candidates = list(db.supplier_items.find(
+        candidates_query,
+        {'_id': 0}
+    ).sort(ALTERNATIVES_CANDIDATES_SORT).limit(ALTERNATIVES_CANDIDATES_LIMIT))  # topK=200 как в ТЗ
+    lap('load_candidates')
+    
+    logger.info("[%s] item_id=%s raw_candidates=%s product_core_id=%s", debug_id, item_id, len(raw_candidates), product_core_id)
+    
+    return make_response(_item_alternatives(
+        db, source_item, raw_candidates, limit, mode, include_similar, debug_id, logger, supplier_cache={}))
+
+
+ALTERNATIVES_BATCH_MAX_ITEMS = 100
+
+
+class AlternativesBatchRequest(BaseModel):
+    """Запрос альтернатив для нескольких товаров (корзина, избранное)"""
+    item_ids: List[str] = Field(..., min_length=1, max_length=ALTERNATIVES_BATCH_MAX_ITEMS)
+    limit: int = Field(10, ge=1, le=20)
+    mode: str = Field('strict', description="Режим: 'strict' или 'similar', как у /item/{item_id}/alternatives")
+
+
+@router.post("/items/alternatives:batch", summary="Альтернативные офферы для нескольких товаров")
+@profiled('v12_alternatives_batch')
+async def get_items_alternatives_batch(request: AlternativesBatchRequest):
+    """
+    Альтернативы для многих товаров за один вызов (та же выдача, что у
+    /item/{item_id}/alternatives для каждого товара).
+    
+    Вместо запроса на карточку:
+    - исходные товары загружаются одним запросом;
+    - товары группируются по product_core_id: кандидаты ядра читаются один
+      раз и подписываются один раз (общий кэш сигнатур);
+    - поставщики всех товаров и кандидатов читаются одним запросом.
+    
+    results - в порядке item_ids (повторы схлопываются), у каждого item_id.
+    """
+    db = get_db()
+    
+    import uuid
+    debug_id = str(uuid.uuid4())[:8]
+    logger = hot_logger('alternatives', __name__, request_id=debug_id)
+    
+    item_ids = list(dict.fromkeys(request.item_ids))
+    sources = {
+        doc['id']: doc
+        for doc in db.supplier_items.find({'id': {'$in': item_ids}, 'active': True}, {'_id': 0})
+    }
+    lap('load_sources')
+    
+    by_core = {}
+    for item_id in item_ids:
+        core = sources.get(item_id, {}).get('product_core_id')
+        if core:
+            by_core.setdefault(core, []).append(item_id)
+    
+    # Кандидаты ядра: с запасом на сами товары группы (исключаются ниже, как $ne в single)
+    core_candidates = {
+        core: list(db.supplier_items.find(
+            publishable_offer_query(product_core_id=core),
+            {'_id': 0}
+        ).sort(ALTERNATIVES_CANDIDATES_SORT).limit(ALTERNATIVES_CANDIDATES_LIMIT + len(group)))
+        for core, group in by_core.items()
+    }
+    lap('load_candidates')
+    
+    supplier_ids = {d.get('supplier_company_id') for d in sources.values()}
+    supplier_ids |= {c.get('supplier_company_id') for cands in core_candidates.values() for c in cands}
+    supplier_ids.discard(None)
+    supplier_cache = {
+        c['id']: _supplier_info(c)
+        for c in db.companies.find(
+            {'id': {'$in': list(supplier_ids)}},
+            {'_id': 0, 'id': 1, 'companyName': 1, 'name': 1, 'min_order_amount': 1}
+        )
+    }
+    for supplier_id in supplier_ids - supplier_cache.keys():
+        supplier_cache[supplier_id] = _supplier_info(None)
+    lap('load_suppliers')
+    
+    signatures = {core: {} for core in by_core}
+    results = []
+    for item_id in item_ids:
+        item_debug_id = f"{debug_id}-{len(results)}"
+        source_item = sources.get(item_id)
+        if not source_item:
+            result = _alternatives_not_found(item_debug_id)
+        elif not source_item.get('product_core_id'):
+            result = _alternatives_no_core(source_item, item_debug_id)
+        else:
+            core = source_item['product_core_id']
+            raw_candidates = [
+                c for c in core_candidates[core] if c.get('id') != item_id
+            ][:ALTERNATIVES_CANDIDATES_LIMIT]
+            result = _item_alternatives(
+                db, source_item, raw_candidates, request.limit, request.mode, False,
+                item_debug_id, logger, supplier_cache, signatures=signatures[core])
+        results.append({'item_id': item_id, **result})
+    
+    logger.info("[%s] batch items=%s cores=%s suppliers=%s", debug_id, len(item_ids), len(by_core), len(supplier_cache))
+    
+    return JSONResponse(content={
+        'results': results,
+        'count': len(results),
+        'cores': len(by_core),
+        'debug_id': debug_id,
+    }, headers=ALTERNATIVES_NO_CACHE_HEADERS)
 
 
 # === DATA QUALITY / VALIDATION ===
@@ -2290,73 +2531,21 @@ async def get_item_alternatives(
 from .offer_validator import (
     validate_offer, validate_offers_batch, 
     mark_invalid_offers, cleanup_favorites_invalid,
-    validate_cart_before_checkout, get_publishable_query
+    validate_cart_before_checkout
 )
+from .offer_validator import get_data_quality_report as cached_data_quality_report
 
 
 @router.get("/admin/data-quality", summary="Анализ качества данных")
-async def get_data_quality_report():
+async def get_data_quality_report(refresh: bool = Query(False, description="Пересобрать отчёт, минуя кэш")):
     """
     Возвращает отчёт о качестве данных офферов.
-    Показывает сколько офферов невалидны и почему.
+    Показывает сколько офферов невалидны и почему, с разбивкой по поставщикам.
+    
+    Одна $facet-агрегация; результат кэшируется до следующего импорта.
     """
     db = get_db()
-    
-    total_active = db.supplier_items.count_documents({'active': True})
-    
-    # Count by validation issues
-    no_price = db.supplier_items.count_documents({
-        'active': True,
-        '$or': [{'price': {'$lte': 0}}, {'price': None}, {'price': {'$exists': False}}]
-    })
-    
-    no_unit = db.supplier_items.count_documents({
-        'active': True,
-        '$or': [{'unit_type': None}, {'unit_type': ''}, {'unit_type': {'$exists': False}}]
-    })
-    
-    weight_volume_no_pack = db.supplier_items.count_documents({
-        'active': True,
-        'unit_type': {'$in': ['WEIGHT', 'VOLUME']},
-        '$or': [{'pack_qty': {'$lte': 0}}, {'pack_qty': None}, {'pack_qty': {'$exists': False}}]
-    })
-    
-    # Count publishable
-    publishable_query = get_publishable_query()
-    publishable = db.supplier_items.count_documents(publishable_query)
-    
-    # Get sample invalid items
-    invalid_samples = list(db.supplier_items.find(
-        {
-            'active': True,
-            '$or': [
-                {'price': {'$lte': 0}},
-                {'price': None},
-                {'unit_type': None},
-                {'unit_type': ''},
-                {'unit_type': {'$in': ['WEIGHT', 'VOLUME']}, 'pack_qty': {'$lte': 0}}
-            ]
-        },
-        {'_id': 0, 'name_raw': 1, 'price': 1, 'unit_type': 1, 'pack_qty': 1, 'supplier_company_id': 1}
-    ).limit(20))
-    
-    # Enrich with supplier names
-    for sample in invalid_samples:
-        company = db.companies.find_one({'id': sample.get('supplier_company_id')}, {'companyName': 1})
-        sample['supplier_name'] = company.get('companyName') if company else 'Unknown'
-    
-    return {
-        'total_active': total_active,
-        'publishable': publishable,
-        'hidden': total_active - publishable,
-        'issues': {
-            'missing_or_invalid_price': no_price,
-            'missing_unit_type': no_unit,
-            'weight_volume_without_pack': weight_volume_no_pack
-        },
-        'invalid_samples': invalid_samples,
-        'quality_score': round(publishable / total_active * 100, 1) if total_active > 0 else 0
-    }
+    return cached_data_quality_report(db, refresh=refresh)
 
 
 @router.post("/admin/cleanup-invalid", summary="Пометить невалидные офферы как inactive")
@@ -2364,11 +2553,18 @@ async def cleanup_invalid_offers(dry_run: bool = Query(True, description="Тол
     """
     Помечает невалидные офферы как inactive.
     
+    Ремонтный инструмент: невалидные офферы скрыты флагом publishable с момента
+    импорта. dry_run=False также пересчитывает устаревшие флаги.
+    
     ВНИМАНИЕ: dry_run=False применит изменения!
+    dry_run=False выполняется в фоне: ответ - job id (GET /v12/admin/jobs/{job_id}).
     """
     db = get_db()
-    result = mark_invalid_offers(db, dry_run=dry_run)
-    return result
+    if dry_run:
+        return mark_invalid_offers(db, dry_run=True)
+    job = await get_job_runner(db).submit(
+        'cleanup_invalid', lambda ctx: mark_invalid_offers(ctx.db, dry_run=False), params={'dry_run': False})
+    return admin_job_response(job)
 
 
 @router.post("/admin/cleanup-favorites", summary="Очистить невалидные позиции из избранного")
@@ -13,6 +13,8 @@ import logging
 from typing import List, Dict, Optional, Tuple
 from pymongo.database import Database
 
+from .catalog import publishable_offer_query
+
 logger = logging.getLogger(__name__)
 
 # Русские окончания для стемминга
@@ -195,12 +197,7 @@ def search_items(
         (items, total_count)
     """
     # Базовый фильтр
-    base_query = {
-        'active': True,
-        'price': {'$gt': 0},
-        'unit_type': {'$exists': True, '$ne': None},
-        'id': {'$exists': True, '$ne': None}
-    }
+    base_query = publishable_offer_query()
     
     if super_class:
         base_query['super_class'] = {'$regex': f'^{re.escape(super_class)}', '$options': 'i'}
@@ -0,0 +1,26 @@
+"""
+BestPrice v12 - Candidate Signature Cache
+
+Сигнатура кандидата (v3 / NPC / FISH_FILLET) зависит только от самого
+оффера. В batch alternatives одни и те же кандидаты проверяются для многих
+исходных товаров, поэтому матчеры принимают кэш signatures (id → сигнатура)
+на время одного запроса и берут сигнатуру через cached_signature.
+"""
+
+from typing import Callable, Dict, Optional, TypeVar
+
+Signature = TypeVar('Signature')
+
+
+def cached_signature(
+    cand: Dict,
+    extract: Callable[[Dict], Signature],
+    signatures: Optional[Dict[str, Signature]] = None,
+) -> Signature:
+    """extract(cand) через кэш по id; signatures=None - без кэша."""
+    if signatures is None:
+        return extract(cand)
+    sig = signatures.get(cand.get('id'))
+    if sig is None:
+        sig = signatures[cand.get('id')] = extract(cand)
+    return sig
@@ -0,0 +1,132 @@
+"""
+BestPrice v12 - Token Similarity Kernel
+
+Similarity score для NPC-матчинга (npc_matching_v9, npc_fish_fillet):
+
+    score = (jaccard(set токенов) + SequenceMatcher(sorted-join).ratio()) / 2
+
+Раньше на каждого кандидата заново строились set'ы, строки и полный
+SequenceMatcher, хотя 85% guard отсекает большинство пар. Теперь:
+- у каждого списка токенов один раз считается профиль (frozenset
+  токенов, строка, гистограмма символов) - lru_cache;
+- jaccard - пересечение frozenset'ов (без пересборки set на кандидата);
+- при заданном пороге пара сначала отсекается дешёвыми верхними оценками
+  ratio(): по длинам строк (как real_quick_ratio) и по общим символам
+  (как quick_ratio); SequenceMatcher запускается только если порог ещё
+  достижим.
+
+Точный путь даёт тот же score, что reference_similarity. Отсечённая пара
+получает верхнюю оценку score - она заведомо ниже порога; gated_similarity
+возвращает её вместе с флагом bound, чтобы вызывающий не выдавал оценку
+за точный score.
+
+Бенчмарк: python benchmark_similarity.py
+"""
+
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+PROFILE_CACHE_SIZE = 65536
+
+
+@dataclass(frozen=True)
+class TokenProfile:
+    """Предвычисленные данные одного списка токенов."""
+    tokens: FrozenSet[str]           # множество токенов
+    size: int                        # число уникальных токенов
+    text: str                        # ' '.join(sorted(tokens)) - вход SequenceMatcher
+    chars: Tuple[Tuple[str, int], ...]  # гистограмма символов text
+
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def _profile(tokens: Tuple[str, ...]) -> TokenProfile:
+    unique = frozenset(tokens)
+    text = ' '.join(sorted(tokens))
+    chars: Dict[str, int] = {}
+    for ch in text:
+        chars[ch] = chars.get(ch, 0) + 1
+    return TokenProfile(tokens=unique, size=len(unique), text=text, chars=tuple(chars.items()))
+
+
+def token_profile(tokens: Sequence[str]) -> TokenProfile:
+    return _profile(tuple(tokens))
+
+
+def _common_chars(a: TokenProfile, b: TokenProfile) -> int:
+    if len(a.chars) > len(b.chars):
+        a, b = b, a
+    other = dict(b.chars)
+    return sum(min(n, other.get(ch, 0)) for ch, n in a.chars)
+
+
+def _gated_score(source: TokenProfile, candidate: TokenProfile, threshold: Optional[float]) -> Tuple[float, bool]:
+    """(score, bound): bound=True - верхняя оценка ниже порога, а не точный score."""
+    if not source.size or not candidate.size:
+        return 0.0, False
+
+    small, large = sorted((source.tokens, candidate.tokens), key=len)
+    common = sum(1 for token in small if token in large)
+    jaccard = common / (source.size + candidate.size - common)
+
+    if threshold is not None:
+        total = len(source.text) + len(candidate.text)
+        # Верхние оценки ratio() = 2*M/T: M <= min(длин) и M <= общих символов
+        bound = (jaccard + 2.0 * min(len(source.text), len(candidate.text)) / total) / 2
+        if bound < threshold:
+            return bound, True
+        bound = (jaccard + 2.0 * _common_chars(source, candidate) / total) / 2
+        if bound < threshold:
+            return bound, True
+
+    seq_ratio = SequenceMatcher(None, source.text, candidate.text).ratio()
+    return (jaccard + seq_ratio) / 2, False
+
+
+def profile_similarity(source: TokenProfile, candidate: TokenProfile, threshold: Optional[float] = None) -> float:
+    """
+    Score пары профилей.
+
+    threshold=None - всегда точный score. С порогом: если верхняя оценка
+    ниже порога, возвращается она (SequenceMatcher не запускается).
+    """
+    return _gated_score(source, candidate, threshold)[0]
+
+
+def token_similarity(
+    source_tokens: List[str],
+    candidate_tokens: List[str],
+    threshold: Optional[float] = None,
+) -> float:
+    """Score по спискам токенов (профили берутся из кэша)."""
+    if not source_tokens or not candidate_tokens:
+        return 0.0
+    return profile_similarity(token_profile(source_tokens), token_profile(candidate_tokens), threshold)
+
+
+def gated_similarity(source_tokens: List[str], candidate_tokens: List[str], threshold: float) -> Tuple[float, bool]:
+    """
+    Score для решения по порогу: (score, bound).
+
+    bound=True - пара отсечена, score - верхняя оценка (точный ниже неё).
+    """
+    if not source_tokens or not candidate_tokens:
+        return 0.0, False
+    return _gated_score(token_profile(source_tokens), token_profile(candidate_tokens), threshold)
+
+
+def reference_similarity(source_tokens: List[str], candidate_tokens: List[str]) -> float:
+    """Прежняя реализация calculate_similarity - эталон для тестов и бенчмарка."""
+    if not source_tokens or not candidate_tokens:
+        return 0.0
+
+    source_set = set(source_tokens)
+    candidate_set = set(candidate_tokens)
+    jaccard = len(source_set & candidate_set) / len(source_set | candidate_set)
+
+    source_str = ' '.join(sorted(source_tokens))
+    candidate_str = ' '.join(sorted(candidate_tokens))
+    seq_ratio = SequenceMatcher(None, source_str, candidate_str).ratio()
+
+    return (jaccard + seq_ratio) / 2
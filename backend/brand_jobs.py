@@ -0,0 +1,339 @@
+"""
+Brand Jobs - потоковый backfill брендов и отчёт о покрытии брендами
+====================================================================
+
+/admin/brands/backfill грузил до 20 000 products списком и делал
+update_one на каждое совпадение, /admin/search/quality-report на каждый
+запрос поднимал в память 20k products и 30k pricelists. Теперь оба -
+фоновые задачи поверх курсора:
+
+1. run_brand_backfill - products батчами по _id (bulk_backfill.iter_id_batches),
+   detect_brand, изменившиеся строки одним unordered bulk_write на батч.
+   Прогресс и итог - в backfill_checkpoints (job_id='brands_products').
+2. build_brand_quality_report - pricelists батчами, бренды продуктов батча
+   одним $in; результат хранится в brand_quality_reports.
+3. refresh_brand_report - инкрементальное обновление сохранённого отчёта
+   по продуктам, у которых бренд появился или пропал (после backfill),
+   без полного пересчёта: $inc счётчиков строк и $pull/$push образцов
+   только для той сборки, что была прочитана (built_at) - полный
+   пересчёт, прошедший в это время, не перезаписывается и не
+   учитывается дважды.
+
+Запросы отчёта отвечают из сохранённого документа (format_brand_report).
+
+Запуск:
+    python brand_jobs.py --backfill            # dry run: только подсчёт
+    python brand_jobs.py --backfill --apply
+    python brand_jobs.py --report
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bulk_backfill import iter_id_batches, load_checkpoint, save_checkpoint, DEFAULT_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+BRAND_BACKFILL_JOB = 'brands_products'
+BRAND_REPORT_JOB = 'brand_quality_report'
+BRAND_REPORT_COLLECTION = 'brand_quality_reports'
+BRAND_REPORT_ID = 'products'
+BRAND_REPORT_MAX_AGE_SEC = 6 * 3600
+SAMPLE_LIMIT = 50           # хранится; в ответе - первые 20 (как generate_brand_quality_report)
+SAMPLE_RESPONSE_LIMIT = 20
+TOP_BRANDS_LIMIT = 20
+
+DetectBrand = Callable[[str], Tuple[Optional[str], bool]]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _bulk_update(collection, ops: List[UpdateOne]) -> Tuple[int, Set[int]]:
+    """Unordered bulk_write. Returns: (written, индексы ops с ошибкой записи)"""
+    if not ops:
+        return 0, set()
+    try:
+        collection.bulk_write(ops, ordered=False)
+        return len(ops), set()
+    except BulkWriteError as e:
+        failed = {err['index'] for err in (e.details or {}).get('writeErrors', [])}
+        logger.warning(f"bulk_write: {len(failed)} write errors")
+        return len(ops) - len(failed), failed
+
+
+# === BRAND BACKFILL ===
+
+def run_brand_backfill(
+    db,
+    detect_brand: DetectBrand,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+    dictionary_stats: Optional[Dict[str, Any]] = None,
+    progress: Optional[Callable[..., None]] = None,
+) -> Dict[str, Any]:
+    """
+    brand_id / brand_strict для всех products по текущему словарю брендов.
+
+    Пишутся только изменившиеся строки. Продукты, у которых бренд появился
+    или пропал (и запись удалась), передаются в refresh_brand_report.
+    progress(**stats) вызывается после каждого батча (JobContext.progress
+    админской задачи).
+    """
+    stats: Dict[str, Any] = {
+        'total_products': 0, 'branded': 0, 'strict': 0, 'no_brand': 0,
+        'updated': 0, 'errors': 0,
+    }
+    brand_counts: Dict[str, int] = {}
+    flipped: Dict[str, bool] = {}       # product id → бренд теперь есть
+    started = time.monotonic()
+
+    if not dry_run:
+        save_checkpoint(db, BRAND_BACKFILL_JOB, {
+            'status': 'running', 'started_at': _now(), 'progress': stats, 'result': None, 'error': None,
+        })
+
+    projection = {'_id': 1, 'id': 1, 'name': 1, 'brand_id': 1, 'brand_strict': 1}
+    for docs in iter_id_batches(db.products, {}, projection, batch_size=batch_size):
+        ops = []
+        batch_flips: Dict[int, Tuple[str, bool]] = {}     # индекс op → (product id, бренд теперь есть)
+        for product in docs:
+            brand_id, brand_strict = detect_brand(product.get('name', ''))
+            if brand_id:
+                stats['branded'] += 1
+                stats['strict'] += bool(brand_strict)
+                brand_counts[brand_id] = brand_counts.get(brand_id, 0) + 1
+            else:
+                stats['no_brand'] += 1
+
+            old_brand = product.get('brand_id')
+            if brand_id != old_brand or product.get('brand_strict') != brand_strict:
+                if bool(brand_id) != bool(old_brand) and product.get('id'):
+                    batch_flips[len(ops)] = (product['id'], bool(brand_id))
+                ops.append(UpdateOne({'_id': product['_id']},
+                                     {'$set': {'brand_id': brand_id, 'brand_strict': brand_strict}}))
+
+        stats['total_products'] += len(docs)
+        if dry_run:
+            stats['updated'] += len(ops)
+            continue
+        written, failed = _bulk_update(db.products, ops)
+        stats['updated'] += written
+        stats['errors'] += len(failed)
+        # Продукт, который не записался, в отчёте не меняется
+        flipped.update(flip for index, flip in batch_flips.items() if index not in failed)
+        save_checkpoint(db, BRAND_BACKFILL_JOB, {'progress': stats, 'last_id': docs[-1]['_id']})
+        if progress:
+            progress(**stats)
+
+    top_brands = sorted(brand_counts.items(), key=lambda x: -x[1])[:TOP_BRANDS_LIMIT]
+    result = {
+        'stats': {**stats, 'strict_branded': stats['strict'], 'brand_counts': brand_counts,
+                  'brand_dictionary': dictionary_stats},
+        'top_brands': [{'brand_id': b, 'count': c} for b, c in top_brands],
+        'brand_flips': len(flipped),
+        'elapsed_sec': round(time.monotonic() - started, 2),
+    }
+
+    if not dry_run:
+        result['report_refreshed'] = refresh_brand_report(db, flipped, batch_size) is not None
+        save_checkpoint(db, BRAND_BACKFILL_JOB, {
+            'status': 'completed', 'completed_at': _now(), 'progress': stats, 'result': result,
+        })
+
+    logger.info(f"✅ Brand backfill: {stats['updated']} updated, {stats['branded']} branded "
+                f"({stats['total_products']} products, {result['elapsed_sec']}s)")
+    return result
+
+
+# === BRAND QUALITY REPORT ===
+
+def _empty_row(supplier_id: Optional[str]) -> Dict[str, Any]:
+    return {'supplier_id': supplier_id, 'total': 0, 'with_brand': 0, 'without_brand': 0}
+
+
+def _product_brands(db, product_ids: Iterable[Optional[str]]) -> Dict[str, Dict[str, Any]]:
+    ids = [pid for pid in set(product_ids) if pid]
+    if not ids:
+        return {}
+    return {p['id']: p for p in db.products.find({'id': {'$in': ids}}, {'_id': 0, 'id': 1, 'name': 1, 'brand_id': 1})}
+
+
+def build_brand_quality_report(db, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Покрытие брендами строк pricelists по поставщикам (полный пересчёт).
+
+    Те же счётчики, что generate_brand_quality_report, но pricelists
+    читаются батчами, а бренды продуктов - одним $in на батч.
+    """
+    rows: Dict[Optional[str], Dict[str, Any]] = {}
+    samples: List[Dict[str, Any]] = []
+    started = time.monotonic()
+
+    projection = {'_id': 1, 'supplierId': 1, 'productId': 1}
+    for docs in iter_id_batches(db.pricelists, {}, projection, batch_size=batch_size):
+        products = _product_brands(db, (pl.get('productId') for pl in docs))
+        for pl in docs:
+            supplier_id = pl.get('supplierId')
+            product = products.get(pl.get('productId'), {})
+            row = rows.setdefault(supplier_id, _empty_row(supplier_id))
+            row['total'] += 1
+            if product.get('brand_id'):
+                row['with_brand'] += 1
+            else:
+                row['without_brand'] += 1
+                if len(samples) < SAMPLE_LIMIT:
+                    samples.append({'product_id': pl.get('productId'), 'name': product.get('name', 'N/A'),
+                                    'supplier_id': supplier_id})
+
+    doc = {
+        '_id': BRAND_REPORT_ID,
+        'rows': list(rows.values()),
+        'samples': samples,
+        'built_at': _now(),
+        'refreshed_at': _now(),
+        'build_sec': round(time.monotonic() - started, 2),
+    }
+    db[BRAND_REPORT_COLLECTION].replace_one({'_id': BRAND_REPORT_ID}, doc, upsert=True)
+    logger.info(f"✅ Brand quality report: {sum(r['total'] for r in doc['rows'])} pricelist rows, {doc['build_sec']}s")
+    return doc
+
+
+def refresh_brand_report(
+    db,
+    flipped: Dict[str, bool],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Optional[Dict[str, Any]]:
+    """
+    Инкрементально обновляет сохранённый отчёт.
+
+    flipped: product id → True (бренд появился) / False (бренд пропал).
+    Пересчитываются только строки pricelists этих продуктов. Без
+    сохранённого отчёта ничего не делает (None) - нужен полный build.
+    """
+    doc = load_brand_report(db)
+    if doc is None:
+        return None
+    if not flipped:
+        return doc
+
+    suppliers = {r['supplier_id'] for r in doc['rows']}
+    deltas: Dict[Optional[str], int] = {}       # supplier → изменение with_brand
+    lost: List[Dict[str, Any]] = []             # новые образцы без бренда
+    ids = list(flipped)
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        names = {pid: p.get('name', 'N/A') for pid, p in _product_brands(db, chunk).items()}
+        cursor = db.pricelists.find({'productId': {'$in': chunk}}, {'_id': 0, 'supplierId': 1, 'productId': 1})
+        for pl in cursor:
+            supplier_id, product_id = pl.get('supplierId'), pl.get('productId')
+            if supplier_id not in suppliers:    # строка прайса появилась после сборки - попадёт в следующий build
+                continue
+            deltas[supplier_id] = deltas.get(supplier_id, 0) + (1 if flipped[product_id] else -1)
+            if not flipped[product_id] and len(lost) < SAMPLE_LIMIT:
+                lost.append({'product_id': product_id, 'name': names.get(product_id, 'N/A'),
+                             'supplier_id': supplier_id})
+
+    # Только поверх прочитанной сборки: прошедший тем временем полный пересчёт уже всё учёл
+    same_build = {'_id': BRAND_REPORT_ID, 'built_at': doc['built_at']}
+    ops = [
+        UpdateOne({**same_build, 'rows.supplier_id': supplier_id},
+                  {'$inc': {'rows.$.with_brand': delta, 'rows.$.without_brand': -delta}})
+        for supplier_id, delta in deltas.items() if delta
+    ]
+    gained = [pid for pid, has_brand in flipped.items() if has_brand]
+    if gained:
+        ops.append(UpdateOne(same_build, {'$pull': {'samples': {'product_id': {'$in': gained}}}}))
+    if lost:
+        ops.append(UpdateOne(same_build, {'$push': {'samples': {'$each': lost, '$slice': SAMPLE_LIMIT}}}))
+    ops.append(UpdateOne(same_build, {'$set': {'refreshed_at': _now()}}))
+    db[BRAND_REPORT_COLLECTION].bulk_write(ops, ordered=True)
+    return load_brand_report(db)
+
+
+def run_brand_report_job(db, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """Полный пересчёт отчёта с прогрессом в backfill_checkpoints."""
+    save_checkpoint(db, BRAND_REPORT_JOB, {'status': 'running', 'started_at': _now(), 'error': None})
+    doc = build_brand_quality_report(db, batch_size)
+    save_checkpoint(db, BRAND_REPORT_JOB, {'status': 'completed', 'completed_at': _now(),
+                                           'build_sec': doc['build_sec']})
+    return doc
+
+
+def load_brand_report(db) -> Optional[Dict[str, Any]]:
+    return db[BRAND_REPORT_COLLECTION].find_one({'_id': BRAND_REPORT_ID})
+
+
+def brand_report_is_stale(doc: Dict[str, Any], max_age_sec: int = BRAND_REPORT_MAX_AGE_SEC) -> bool:
+    built_at = datetime.fromisoformat(doc['built_at'])
+    return (datetime.now(timezone.utc) - built_at).total_seconds() > max_age_sec
+
+
+def format_brand_report(doc: Dict[str, Any], company_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Ответ /admin/search/quality-report из сохранённого документа."""
+    company_map = company_map or {}
+    by_supplier = {}
+    for row in doc['rows']:
+        total = row['total']
+        by_supplier[row['supplier_id']] = {
+            'total': total,
+            'with_brand': row['with_brand'],
+            'without_brand': row['without_brand'],
+            'brand_coverage_pct': round(100 * row['with_brand'] / total, 1) if total > 0 else 0,
+            'supplier_name': company_map.get(row['supplier_id'], 'Unknown'),
+        }
+    total_items = sum(r['total'] for r in doc['rows'])
+    total_with_brand = sum(r['with_brand'] for r in doc['rows'])
+    return {
+        'overall': {
+            'total_items': total_items,
+            'with_brand': total_with_brand,
+            'without_brand': total_items - total_with_brand,
+            'brand_coverage_pct': round(100 * total_with_brand / max(total_items, 1), 1),
+        },
+        'by_supplier': by_supplier,
+        'sample_without_brand': doc['samples'][:SAMPLE_RESPONSE_LIMIT],
+        'built_at': doc['built_at'],
+        'refreshed_at': doc.get('refreshed_at'),
+    }
+
+
+def job_status(db, job_id: str) -> Optional[Dict[str, Any]]:
+    return load_checkpoint(db, job_id)
+
+
+# === CLI ===
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Streaming brand backfill and brand quality report')
+    parser.add_argument('--backfill', action='store_true', help='Re-detect brand_id for all products')
+    parser.add_argument('--report', action='store_true', help='Rebuild the stored brand quality report')
+    parser.add_argument('--apply', action='store_true', help='Write backfill changes (default: dry run)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    args = parser.parse_args()
+
+    from bulk_backfill import get_db
+    from brand_master import reload_brand_master
+
+    database = get_db()
+    if args.backfill:
+        bm = reload_brand_master()
+        print(run_brand_backfill(database, bm.detect_brand, args.batch_size, dry_run=not args.apply,
+                                 dictionary_stats=bm.get_stats()))
+    if args.report:
+        report = format_brand_report(run_brand_report_job(database, args.batch_size))
+        print(f"Overall: {report['overall']}")
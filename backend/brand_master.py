@@ -128,20 +128,32 @@ def extract_base_brand(brand_id: str) -> Optional[str]:
 
 
 class BrandMaster:
-    """Singleton for brand dictionary with aliases and family support"""
-    _instance = None
+    """Brand dictionary with aliases and family support; BrandMaster() is the current registry snapshot"""
     
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._load_brands()
-        return cls._instance
+        return get_brand_master()
     
     @classmethod
-    def reload(cls):
-        """Force reload brand dictionary (clear cache)"""
-        cls._instance = None
-        return cls()
+    def load_fresh(cls) -> 'BrandMaster':
+        """Build a new dictionary from BRANDS_FILE without touching the singleton (reference_data registry)"""
+        instance = super().__new__(cls)
+        instance._load_brands()
+        return instance
+    
+    @classmethod
+    def empty(cls) -> 'BrandMaster':
+        """Empty dictionary (fallback when BRANDS_FILE can't be loaded)"""
+        instance = super().__new__(cls)
+        instance.brands_by_id = {}
+        instance.alias_to_id = {}
+        instance.family_to_members = {}
+        instance._sorted_aliases = ()
+        return instance
+    
+    @classmethod
+    def reload(cls) -> 'BrandMaster':
+        """Force reload brand dictionary (see reload_brand_master)"""
+        return reload_brand_master()
     
     def _load_brands(self):
         """Load brand dictionary from Excel (UNIFIED RF HORECA ULTRA SAFE)"""
@@ -152,6 +164,7 @@ class BrandMaster:
             self.brands_by_id = {}
             self.alias_to_id = {}
             self.family_to_members = {}
+            self._sorted_aliases = ()
             return
         
         # Load BRANDS_MASTER sheet
@@ -240,6 +253,9 @@ class BrandMaster:
             if norm and target_brand_id in self.brands_by_id:
                 self.alias_to_id[norm] = target_brand_id
         
+        # Longest first - detect_brand checks aliases in this order
+        self._sorted_aliases = tuple(sorted(self.alias_to_id.keys(), key=len, reverse=True))
+        
         print(f"✅ Loaded {len(self.brands_by_id)} brands")
         print(f"   Total aliases: {len(self.alias_to_id)}")
         print(f"   Brand families: {len(self.family_to_members)}")
@@ -262,10 +278,7 @@ class BrandMaster:
         name_norm = normalize_alias(product_name)
         name_words = set(name_norm.split())
         
-        # Sort aliases by length (longest first) for better matching
-        sorted_aliases = sorted(self.alias_to_id.keys(), key=len, reverse=True)
-        
-        for alias in sorted_aliases:
+        for alias in self._sorted_aliases:
             # For short aliases (< 4 chars), require exact word match
             if len(alias) < 4:
                 if alias in name_words:
@@ -358,27 +371,16 @@ class BrandMaster:
         }
 
 
-# Global instance - lazy load to avoid import errors
-brand_master = None
-
 def get_brand_master() -> BrandMaster:
-    """Get or create brand master instance"""
-    global brand_master
-    if brand_master is None:
-        try:
-            brand_master = BrandMaster()
-        except Exception as e:
-            print(f"⚠️ Warning: Could not load brand master: {e}")
-            brand_master = BrandMaster()  # Empty instance
-    return brand_master
+    """Current brand master snapshot (reference_data registry, reloaded when BRANDS_FILE changes)"""
+    from reference_data import reference_registry
+    return reference_registry.get('brand_master')
 
 
-# For backward compatibility
-try:
-    brand_master = BrandMaster()
-except Exception as e:
-    print(f"⚠️ Warning: Could not load brand master: {e}")
-    brand_master = None
+def reload_brand_master() -> BrandMaster:
+    """Re-read BRANDS_FILE now and swap the registry snapshot (every get_brand_master() caller sees it)"""
+    from reference_data import reference_registry
+    return reference_registry.reload('brand_master').data
 
 
 # Testing
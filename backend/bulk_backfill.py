@@ -0,0 +1,528 @@
+"""
+Bulk Backfill - единый фреймворк массового обогащения supplier_items
+
+Заменяет разрозненные скрипты (mass_reclassifier, create_lemma_index,
+backfill_brands, backfill_geography, backfill_v12_enrichment,
+backfill_critical_attrs, search_utils.backfill_search_tokens), каждый из
+которых сканировал коллекцию целиком и делал update_one на документ.
+Стадия brand пишет в supplier_items - из неё читают матчинг и корзина;
+старые скрипты обогащали products/pricelists. offer_status/price_status из
+backfill_v12_enrichment никто не читает - видимость оффера задаёт стадия
+publishable, поэтому отдельной стадии для них нет.
+
+Как работает:
+1. Документы читаются батчами по диапазону _id (_id > last_id, sort _id)
+2. Зарегистрированные стадии обогащения выполняются в пуле процессов
+3. Записываются только реально изменившиеся поля - unordered bulk_write
+4. После каждого записанного батча сохраняется чекпоинт в backfill_checkpoints,
+   поэтому прогон можно прервать (Ctrl+C) и продолжить с того же места
+5. В лог пишется пропускная способность (docs/s)
+
+Запуск:
+    python bulk_backfill.py --list
+    python bulk_backfill.py --stages lemma_tokens,search_tokens --dry-run
+    python bulk_backfill.py --stages all --apply --workers 4
+    python bulk_backfill.py --stages geography --apply --reset   # начать заново
+    python bulk_backfill.py --stages publishable --apply         # флаг publishable для строк до импорта с валидацией
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.best_price_engine import record_catalog_change
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_COLLECTION = 'backfill_checkpoints'
+DEFAULT_BATCH_SIZE = 1000
+
+
+# === STAGE REGISTRY ===
+
+@dataclass(frozen=True)
+class EnrichmentStage:
+    """Стадия обогащения: doc -> {field: value} (или None если нечего менять)"""
+    name: str
+    fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    fields: Tuple[str, ...]  # Поля, которые стадия читает и пишет (для projection)
+    description: str = ''
+
+
+STAGES: Dict[str, EnrichmentStage] = {}
+
+
+def register_stage(name: str, fields: Sequence[str], description: str = ''):
+    """
+    Декоратор регистрации стадии.
+
+    Функция стадии должна быть объявлена на уровне модуля: воркеры пула
+    находят её по имени в STAGES после импорта этого модуля.
+    """
+    def decorator(fn):
+        STAGES[name] = EnrichmentStage(name=name, fn=fn, fields=tuple(fields), description=description)
+        return fn
+    return decorator
+
+
+def resolve_stages(names: Sequence[str]) -> List[EnrichmentStage]:
+    """Имена стадий -> объекты (с проверкой). 'all' = все зарегистрированные."""
+    if not names or list(names) == ['all']:
+        return list(STAGES.values())
+    unknown = [n for n in names if n not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(unknown)}. Available: {', '.join(STAGES)}")
+    return [STAGES[n] for n in names]
+
+
+def build_projection(stages: Sequence[EnrichmentStage]) -> Dict[str, int]:
+    projection = {'_id': 1}
+    for stage in stages:
+        for f in stage.fields:
+            projection[f] = 1
+    return projection
+
+
+# === BUILT-IN STAGES ===
+
+@register_stage('reclassify', ('name_raw', 'super_class', 'product_core_id'),
+                'Переклассификация по CLASSIFICATION_RULES (mass_reclassifier)')
+def stage_reclassify(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from mass_reclassifier import classify_product
+
+    new_class, priority = classify_product(doc.get('name_raw', ''))
+    old_class = doc.get('super_class', '')
+    if not new_class or priority < 75 or new_class == old_class:
+        return None
+    return {
+        'super_class': new_class,
+        'product_core_id': new_class,
+        'reclassified_from': old_class,
+    }
+
+
+@register_stage('lemma_tokens', ('name_raw', 'name_norm', 'lemma_tokens'),
+                'lemma_tokens простым стеммером (create_lemma_index)')
+def stage_lemma_tokens(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from create_lemma_index import tokenize
+
+    name = doc.get('name_raw') or doc.get('name_norm', '')
+    if not name:
+        return None
+    # tokenize возвращает list(set(...)) - сортируем, чтобы diff был стабильным
+    return {'lemma_tokens': sorted(tokenize(name))}
+
+
+@register_stage('search_tokens',
+                ('name_raw', 'brand_id', 'super_class', 'product_core_id', 'search_tokens', 'lemma_tokens'),
+                'search_tokens + lemma_tokens (search_utils)')
+def stage_search_tokens(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from search_utils import generate_search_tokens, generate_lemma_tokens_for_item
+
+    kwargs = {
+        'name_raw': doc.get('name_raw', ''),
+        'brand_id': doc.get('brand_id'),
+        'super_class': doc.get('super_class'),
+        'product_core_id': doc.get('product_core_id'),
+    }
+    return {
+        'search_tokens': generate_search_tokens(**kwargs),
+        'lemma_tokens': generate_lemma_tokens_for_item(**kwargs),
+    }
+
+
+@register_stage('geography', ('name_raw', 'origin_country', 'origin_region', 'origin_city'),
+                'origin_country/region/city из названия (только если не заполнено)')
+def stage_geography(doc: Dict[str, Any], min_confidence: float = 0.8) -> Optional[Dict[str, Any]]:
+    from geography_extractor import extract_geography_from_text
+
+    if doc.get('origin_country'):
+        return None
+    name = doc.get('name_raw', '')
+    if not name:
+        return None
+
+    geo = extract_geography_from_text(name)
+    if geo['geo_confidence'] < min_confidence:
+        return None
+
+    update = {k: geo[k] for k in ('origin_country', 'origin_region', 'origin_city') if geo[k]}
+    return update or None
+
+
+@register_stage('critical_attrs', ('name_raw', 'super_class', 'fat_pct', 'cut'),
+                'fat_pct (dairy) и cut (seafood/meat) (backfill_critical_attrs)')
+def stage_critical_attrs(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from backfill_critical_attrs import extract_fat_pct, extract_cut
+
+    name = doc.get('name_raw') or ''
+    super_class = doc.get('super_class') or ''
+    update = {}
+
+    if super_class.startswith('dairy'):
+        fat_pct = extract_fat_pct(name)
+        if fat_pct is not None:
+            update['fat_pct'] = fat_pct
+
+    if super_class.startswith(('seafood', 'meat')):
+        cut = extract_cut(name, super_class)
+        if cut is not None:
+            update['cut'] = cut
+
+    return update or None
+
+
+@register_stage('offer_pack', ('name_raw', 'pack_qty', 'unit_type', 'offer_pack_value', 'offer_pack_unit', 'offer_pack_v'),
+                'Предрасчёт фасовки для best price (bestprice_v12.catalog.offer_pack_fields)')
+def stage_offer_pack(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from bestprice_v12.catalog import offer_pack_fields
+
+    return offer_pack_fields(doc.get('name_raw') or '', doc.get('pack_qty'), doc.get('unit_type'))
+
+
+@register_stage('publishable', ('id', 'supplier_company_id', 'price', 'unit_type', 'pack_qty', 'product_core_id',
+                                'publishable', 'publish_errors', 'publish_v'),
+                'Флаг publishable + коды причин (bestprice_v12.offer_validator.publication_fields)')
+def stage_publishable(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from bestprice_v12.offer_validator import publication_fields
+
+    return publication_fields(doc)
+
+
+@register_stage('brand', ('name_raw', 'brand_id', 'brand_strict'),
+                'brand_id/brand_strict по словарю брендов (backfill_brands, для supplier_items)')
+def stage_brand(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    from brand_master import get_brand_master
+
+    name = doc.get('name_raw') or ''
+    if not name:
+        return None
+    brand_id, brand_strict = get_brand_master().detect_brand(name)
+    return {'brand_id': brand_id, 'brand_strict': bool(brand_strict)}
+
+
+# === BATCH PROCESSING ===
+
+def diff_fields(doc: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставляет только поля, значение которых реально отличается от документа"""
+    return {k: v for k, v in update.items() if doc.get(k) != v}
+
+
+def apply_stages(
+    doc: Dict[str, Any],
+    stages: Sequence[EnrichmentStage]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Прогоняет документ через стадии по порядку.
+
+    Каждая следующая стадия видит результат предыдущих (например, search_tokens
+    после reclassify строится уже по новому super_class).
+
+    Returns: ({field: value} изменений, [имена сработавших стадий])
+    """
+    current = dict(doc)
+    changes: Dict[str, Any] = {}
+    touched: List[str] = []
+
+    for stage in stages:
+        update = stage.fn(current)
+        if not update:
+            continue
+        update = diff_fields(current, update)
+        if not update:
+            continue
+        current.update(update)
+        changes.update(update)
+        touched.append(stage.name)
+
+    return changes, touched
+
+
+def process_batch(
+    stage_names: Sequence[str],
+    docs: List[Dict[str, Any]]
+) -> Tuple[List[Tuple[Any, Dict[str, Any]]], Dict[str, int], int]:
+    """
+    Обрабатывает батч (выполняется в воркере пула).
+
+    Returns: ([(_id, changes)], {stage: count}, errors)
+    """
+    stages = resolve_stages(stage_names)
+    results = []
+    stage_counts: Dict[str, int] = {}
+    errors = 0
+
+    for doc in docs:
+        try:
+            changes, touched = apply_stages(doc, stages)
+        except Exception as e:
+            logger.warning(f"Stage failed for {doc.get('_id')}: {e}")
+            errors += 1
+            continue
+        if not changes:
+            continue
+        results.append((doc['_id'], changes))
+        for name in touched:
+            stage_counts[name] = stage_counts.get(name, 0) + 1
+
+    return results, stage_counts, errors
+
+
+def iter_id_batches(
+    collection,
+    query: Dict[str, Any],
+    projection: Dict[str, int],
+    start_after: Any = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+):
+    """
+    Стримит коллекцию батчами по диапазону _id.
+
+    Каждый батч - отдельный короткий запрос {_id: {$gt: last_id}}, поэтому
+    курсор не живёт долго и прогон можно продолжить с любого last_id.
+    """
+    last_id = start_after
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query['_id'] = {'$gt': last_id}
+        docs = list(collection.find(batch_query, projection).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return
+        yield docs
+        last_id = docs[-1]['_id']
+        if len(docs) < batch_size:
+            return
+
+
+def write_changes(collection, results: List[Tuple[Any, Dict[str, Any]]]) -> Tuple[int, int]:
+    """Unordered bulk_write изменений. Returns: (modified, errors)"""
+    if not results:
+        return 0, 0
+
+    now = datetime.now(timezone.utc).isoformat()
+    ops = [
+        UpdateOne({'_id': _id}, {'$set': {**changes, 'enriched_at': now}})
+        for _id, changes in results
+    ]
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        return result.modified_count, 0
+    except BulkWriteError as e:
+        details = e.details or {}
+        errors = len(details.get('writeErrors', []))
+        logger.warning(f"bulk_write: {errors} write errors")
+        return details.get('nModified', 0), errors
+
+
+# === CHECKPOINTS ===
+
+def load_checkpoint(db, job_id: str) -> Optional[Dict[str, Any]]:
+    return db[CHECKPOINT_COLLECTION].find_one({'job_id': job_id}, {'_id': 0})
+
+
+def save_checkpoint(db, job_id: str, fields: Dict[str, Any]) -> None:
+    db[CHECKPOINT_COLLECTION].update_one(
+        {'job_id': job_id},
+        {'$set': {**fields, 'updated_at': datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+
+
+# === RUNNER ===
+
+def run_backfill(
+    db,
+    stage_names: Sequence[str],
+    job_id: Optional[str] = None,
+    query: Optional[Dict[str, Any]] = None,
+    collection_name: str = 'supplier_items',
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 0,
+    dry_run: bool = True,
+    reset: bool = False,
+) -> Dict[str, Any]:
+    """
+    Запускает (или продолжает) backfill.
+
+    Args:
+        db: pymongo Database
+        stage_names: имена стадий из STAGES (['all'] = все)
+        job_id: ключ чекпоинта; по умолчанию - имена стадий через '+'
+        query: дополнительный фильтр (например {'active': True})
+        workers: размер пула процессов; 0/1 - обработка в текущем процессе
+        dry_run: ничего не пишет (ни изменения, ни чекпоинт)
+        reset: игнорировать сохранённый чекпоинт и начать с начала
+
+    Returns: статистика прогона
+    """
+    stages = resolve_stages(stage_names)
+    names = [s.name for s in stages]
+    job_id = job_id or '+'.join(names)
+    collection = db[collection_name]
+    query = query or {}
+
+    start_after = None
+    stats = {
+        'job_id': job_id,
+        'stages': names,
+        'processed': 0,
+        'changed': 0,
+        'modified': 0,
+        'errors': 0,
+        'by_stage': {},
+    }
+
+    if not reset and not dry_run:
+        checkpoint = load_checkpoint(db, job_id)
+        if checkpoint and checkpoint.get('status') != 'completed':
+            start_after = checkpoint.get('last_id')
+            for key in ('processed', 'changed', 'modified', 'errors'):
+                stats[key] = checkpoint.get(key, 0)
+            stats['by_stage'] = dict(checkpoint.get('by_stage') or {})
+            logger.info(f"Resuming {job_id} after _id={start_after} ({stats['processed']} already processed)")
+
+    if not dry_run:
+        save_checkpoint(db, job_id, {
+            'stages': names,
+            'collection': collection_name,
+            'status': 'running',
+            'last_id': start_after,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+        })
+
+    batches = iter_id_batches(collection, query, build_projection(stages), start_after, batch_size)
+    started = time.monotonic()
+    processed_this_run = 0
+
+    def handle(docs, outcome):
+        nonlocal processed_this_run
+        results, stage_counts, errors = outcome
+        modified, write_errors = (0, 0) if dry_run else write_changes(collection, results)
+
+        stats['processed'] += len(docs)
+        stats['changed'] += len(results)
+        stats['modified'] += modified
+        stats['errors'] += errors + write_errors
+        for name, count in stage_counts.items():
+            stats['by_stage'][name] = stats['by_stage'].get(name, 0) + count
+        processed_this_run += len(docs)
+
+        if not dry_run:
+            # Смена product_core_id → старое и новое ядро в catalog_change_log (инкрементальный best price);
+            # смена publishable или brand_id → ядро оффера (меняется выдача и brand-critical best price)
+            old_cores = {d['_id']: d.get('product_core_id') for d in docs}
+            moved = set()
+            for _id, changes in results:
+                if 'product_core_id' in changes:
+                    moved.update((old_cores.get(_id), changes['product_core_id']))
+                elif 'publishable' in changes or 'brand_id' in changes:
+                    moved.add(old_cores.get(_id))
+            moved.discard(None)
+            if moved:
+                record_catalog_change(db, 'backfill', product_core_ids=moved, job_id=job_id)
+
+            save_checkpoint(db, job_id, {
+                'last_id': docs[-1]['_id'],
+                'processed': stats['processed'],
+                'changed': stats['changed'],
+                'modified': stats['modified'],
+                'errors': stats['errors'],
+                'by_stage': stats['by_stage'],
+            })
+
+        elapsed = time.monotonic() - started
+        rate = processed_this_run / elapsed if elapsed > 0 else 0.0
+        logger.info(f"[{job_id}] processed={stats['processed']} changed={stats['changed']} ({rate:.0f} docs/s)")
+
+    if workers and workers > 1:
+        # Батчи обрабатываются параллельно, но записываются строго по порядку _id:
+        # чекпоинт двигается только после того, как все предыдущие батчи записаны.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
+            for docs in batches:
+                in_flight.append((docs, pool.submit(process_batch, names, docs)))
+                if len(in_flight) >= workers * 2:
+                    head_docs, future = in_flight.popleft()
+                    handle(head_docs, future.result())
+            while in_flight:
+                head_docs, future = in_flight.popleft()
+                handle(head_docs, future.result())
+    else:
+        for docs in batches:
+            handle(docs, process_batch(names, docs))
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_sec'] = round(elapsed, 2)
+    stats['docs_per_sec'] = round(processed_this_run / elapsed, 1) if elapsed > 0 else 0.0
+
+    if not dry_run:
+        save_checkpoint(db, job_id, {
+            'status': 'completed',
+            'completed_at': datetime.now(timezone.utc).isoformat(),
+            'docs_per_sec': stats['docs_per_sec'],
+        })
+
+    logger.info(
+        f"✅ {job_id}: processed={stats['processed']} changed={stats['changed']} "
+        f"modified={stats['modified']} errors={stats['errors']} "
+        f"({stats['docs_per_sec']} docs/s, {stats['elapsed_sec']}s)"
+    )
+    return stats
+
+
+def get_db():
+    """MongoDB из backend/.env (как в остальных скриптах)"""
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+    client = MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    return client[os.environ.get('DB_NAME', 'test_database')]
+
+
+# === CLI ===
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Resumable bulk backfill for supplier_items')
+    parser.add_argument('--stages', default='all', help='Comma-separated stage names or "all"')
+    parser.add_argument('--list', action='store_true', help='List registered stages')
+    parser.add_argument('--apply', action='store_true', help='Write changes (default: dry run)')
+    parser.add_argument('--dry-run', action='store_true', help='Do not write anything')
+    parser.add_argument('--reset', action='store_true', help='Ignore saved checkpoint')
+    parser.add_argument('--job-id', help='Checkpoint key (default: stage names)')
+    parser.add_argument('--active-only', action='store_true', help='Only active supplier_items')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    args = parser.parse_args()
+
+    if args.list:
+        for stage in STAGES.values():
+            print(f"  {stage.name:<16} {stage.description}")
+        sys.exit(0)
+
+    stats = run_backfill(
+        get_db(),
+        [s.strip() for s in args.stages.split(',') if s.strip()],
+        job_id=args.job_id,
+        query={'active': True} if args.active_only else None,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        dry_run=args.dry_run or not args.apply,
+        reset=args.reset,
+    )
+    print(f"Stats: {stats}")
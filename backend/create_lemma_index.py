@@ -3,12 +3,14 @@
 
 lemma_tokens - это массив лемматизированных слов из названия товара,
 который позволяет делать быстрый поиск по морфологии без regex.
+
+Для возобновляемого параллельного прогона: python bulk_backfill.py --stages lemma_tokens --apply
 """
 
 import os
 import re
 import logging
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from typing import List
 
 logging.basicConfig(level=logging.INFO)
@@ -126,22 +128,20 @@ def create_lemma_tokens(db, batch_size=500, dry_run=True):
         
         if len(batch) >= batch_size:
             # Обновляем батч
-            for item in batch:
-                db.supplier_items.update_one(
-                    {'_id': item['_id']},
-                    {'$set': {'lemma_tokens': item['lemma_tokens']}}
-                )
+            db.supplier_items.bulk_write([
+                UpdateOne({'_id': item['_id']}, {'$set': {'lemma_tokens': item['lemma_tokens']}})
+                for item in batch
+            ], ordered=False)
             processed += len(batch)
             logger.info(f'Обработано: {processed}/{total}')
             batch = []
     
     # Остаток
     if batch:
-        for item in batch:
-            db.supplier_items.update_one(
-                {'_id': item['_id']},
-                {'$set': {'lemma_tokens': item['lemma_tokens']}}
-            )
+        db.supplier_items.bulk_write([
+            UpdateOne({'_id': item['_id']}, {'$set': {'lemma_tokens': item['lemma_tokens']}})
+            for item in batch
+        ], ordered=False)
         processed += len(batch)
     
     logger.info(f'\nВсего обработано: {processed}')
@@ -14,6 +14,7 @@ import sys
 import re
 import pandas as pd
 from pymongo import MongoClient, UpdateOne
+from reference_data import bump_version
 from collections import Counter
 import time
 
@@ -78,6 +79,7 @@ for _, row in df_aliases.iterrows():
 
 if alias_docs:
     db.brand_aliases.insert_many(alias_docs)
+    bump_version(db, 'brand_aliases')  # воркеры API перечитают справочник
     db.brand_aliases.create_index('alias_norm')
     print(f"   ✅ ALIASES: {len(alias_docs)}")
 
@@ -98,6 +100,7 @@ for _, row in df_seed.iterrows():
 
 if seed_docs:
     db.seed_dict_rules.insert_many(seed_docs)
+    bump_version(db, 'seed_dict_rules')  # воркеры API перечитают справочник
     db.seed_dict_rules.create_index('raw')
     db.seed_dict_rules.create_index('canonical')
     print(f"   ✅ SEED RULES: {len(seed_docs)}")
@@ -19,6 +19,9 @@ import pandas as pd
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from bestprice_v12.best_price_engine import record_catalog_change
+from bestprice_v12.offer_validator import publication_fields
+
 # Load environment
 load_dotenv(Path('/app/backend/.env'))
 
@@ -158,6 +161,7 @@ class GoldMigrator:
                 existing = self.db.supplier_items.find_one({'unique_key': unique_key})
                 
                 if existing:
+                    item_data.update(publication_fields({**existing, **item_data}))
                     self.db.supplier_items.update_one(
                         {'unique_key': unique_key},
                         {'$set': item_data}
@@ -166,6 +170,7 @@ class GoldMigrator:
                 else:
                     item_data['id'] = str(uuid.uuid4())
                     item_data['created_at'] = datetime.now(timezone.utc)
+                    item_data.update(publication_fields(item_data))
                     self.db.supplier_items.insert_one(item_data)
                     stats['created'] += 1
                     
@@ -240,6 +245,10 @@ class GoldMigrator:
         deactivated = self.deactivate_old_items(supplier_id, import_stats['import_batch_id'])
         print(f"🔄 Deactivated old items: {deactivated}")
         
+        # Upsert-ы и деактивация поставщика → catalog_change_log (инкрементальный best price, план корзины)
+        record_catalog_change(self.db, 'gold_migration', supplier_id=supplier_id,
+                              import_batch_id=import_stats['import_batch_id'])
+        
         # Verify
         after_active = self.get_active_count(supplier_id)
         print(f"📊 Active items AFTER: {after_active}")
@@ -0,0 +1,349 @@
+"""
+Index Catalog - управляемый каталог индексов MongoDB
+====================================================
+
+Индексы раньше создавались кто где: search_utils.ensure_search_indexes
+(только руками из CLI), ensure_engine_indexes (только при генерации
+каталога), разовые скрипты миграций. Горячие запросы supplier_items
+({publishable, product_core_id, unit_type}, {id, active},
+{supplier_company_id, active}, unique_key) могли идти COLLSCAN.
+
+Каталог:
+1. INDEX_CATALOG - все индексы, которые нужны горячим формам запросов.
+   Имена совпадают с теми, что создают ensure_*_indexes, поэтому повторное
+   создание из любого места идемпотентно.
+2. apply_index_catalog(db) - создаёт недостающие (при старте сервера).
+   Существующий индекс с теми же ключами под другим именем считается
+   присутствующим; индекс с тем же именем, но другими ключами/опциями -
+   конфликт (в отчёт, без удаления).
+3. QUERY_SHAPES - формы запросов из роутов (фильтр + сортировка).
+   audit_query_shapes(db) прогоняет explain() и сообщает о COLLSCAN и
+   SORT в памяти - недостающий индекс виден до продакшена.
+
+Запуск:
+    python index_catalog.py --apply
+    python index_catalog.py --audit          # exit code 1, если есть проблемы
+    python index_catalog.py --list
+"""
+
+import os
+import sys
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.best_price_engine import CHANGE_LOG_COLLECTION, CHANGE_LOG_TTL_SECONDS
+from bestprice_v12.catalog import publishable_offer_query
+from bestprice_v12.order_history import ORDER_HISTORY_COLLECTION
+from bestprice_v12.job_runner import ADMIN_JOBS_COLLECTION, EXCLUSIVE_KIND_FIELD
+
+logger = logging.getLogger(__name__)
+
+IndexKeys = Tuple[Tuple[str, Any], ...]
+
+
+# ============================================================================
+# INDEX CATALOG
+# ============================================================================
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """Индекс коллекции; name=None - имя по умолчанию MongoDB (field_1_other_-1)."""
+    collection: str
+    keys: IndexKeys
+    name: Optional[str] = None
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None
+    partial_filter: Optional[Dict[str, Any]] = None
+    group: str = 'core'
+    reason: str = ''
+
+    @property
+    def index_name(self) -> str:
+        return self.name or '_'.join(f'{k}_{d}' for k, d in self.keys)
+
+    def options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {'name': self.index_name}
+        if self.unique:
+            options['unique'] = True
+        if self.expire_after_seconds is not None:
+            options['expireAfterSeconds'] = self.expire_after_seconds
+        if self.partial_filter is not None:
+            options['partialFilterExpression'] = self.partial_filter
+        return options
+
+
+def _keys(*pairs: Any) -> IndexKeys:
+    """_keys('a', ('b', -1)) → (('a', 1), ('b', -1))"""
+    return tuple(p if isinstance(p, tuple) else (p, 1) for p in pairs)
+
+
+INDEX_CATALOG: Tuple[IndexSpec, ...] = (
+    # --- supplier_items: офферы ---
+    IndexSpec('supplier_items', _keys('publishable', 'product_core_id', 'unit_type', 'price'),
+              name='publishable_core_unit_price',
+              reason='кандидаты ядра: оптимизатор, корзина, best price, альтернативы, замена избранного'),
+    IndexSpec('supplier_items', _keys('id'), reason='точечное чтение оффера {id, active}'),
+    IndexSpec('supplier_items', _keys('unique_key'), reason='upsert строк прайса при импорте'),
+    IndexSpec('supplier_items', _keys('supplier_company_id', 'active'),
+              reason='прайс поставщика, деактивация при импорте'),
+    IndexSpec('supplier_items', _keys('price_list_id', 'active'), reason='счётчики и деактивация прайс-листа'),
+    IndexSpec('supplier_items', _keys('active', 'product_core_id'),
+              reason='кандидаты ядер пакета: /cart/add-from-favorite:batch'),
+    # --- supplier_items: поиск (search_utils.ensure_search_indexes) ---
+    IndexSpec('supplier_items', _keys('active', 'search_tokens'), name='active_search_tokens', group='search'),
+    IndexSpec('supplier_items', _keys('active', 'lemma_tokens'), name='active_lemma_tokens', group='search'),
+    IndexSpec('supplier_items', _keys('active', 'name_norm'), name='active_name_norm', group='search'),
+    IndexSpec('supplier_items', _keys('active', 'super_class', 'search_tokens'),
+              name='active_super_class_search_tokens', group='search'),
+    IndexSpec('supplier_items', _keys('active', 'brand_id'), name='active_brand_id', group='search'),
+    IndexSpec('brand_aliases', _keys('alias_norm'), name='alias_norm_1', group='search'),
+    # --- каталог и best price (best_price_engine.ensure_engine_indexes) ---
+    IndexSpec('catalog_references', _keys('reference_id'), unique=True),
+    IndexSpec('catalog_references', _keys('product_core_id', 'unit_type')),
+    IndexSpec('catalog_references', _keys('super_class')),
+    IndexSpec(CHANGE_LOG_COLLECTION, _keys('consumed_at'), expire_after_seconds=CHANGE_LOG_TTL_SECONDS),
+    IndexSpec(CHANGE_LOG_COLLECTION, _keys('supplier_id', ('created_at', -1))),
+    IndexSpec(CHANGE_LOG_COLLECTION, _keys('product_core_ids', ('created_at', -1))),
+    IndexSpec(CHANGE_LOG_COLLECTION, _keys(('created_at', -1))),
+    # --- корзина, план, избранное ---
+    IndexSpec('cart_intents', _keys('user_id', 'supplier_item_id'), reason='upsert строки и хэш корзины'),
+    IndexSpec('cart_intents', _keys('user_id', 'reference_id')),
+    IndexSpec('cart_plans_v12', _keys('expires_at'), expire_after_seconds=0),
+    IndexSpec('cart_plans_v12', _keys('user_id')),
+    IndexSpec('cart_plans_v12', _keys('plan_id')),
+    IndexSpec('favorites_v12', _keys('user_id', 'reference_id'), unique=True),
+    IndexSpec('favorites_v12', _keys('user_id')),
+    # --- заказы ---
+    IndexSpec(ORDER_HISTORY_COLLECTION, _keys('id'), unique=True, reason='запись при checkout, детали заказа'),
+    IndexSpec(ORDER_HISTORY_COLLECTION, _keys('customer_user_id', ('created_at', -1), ('id', -1)),
+              reason='/v12/orders: страница по курсору'),
+    IndexSpec('orders_v12', _keys('customer_user_id', ('created_at', -1)), reason='история заказов'),
+    IndexSpec('orders_v12', _keys('user_id', ('created_at', -1)), reason='список заказов с пагинацией'),
+    IndexSpec('orders', _keys('customer_user_id', ('created_at', -1)), reason='история заказов (старая коллекция)'),
+    # --- админские задачи (job_runner.ensure_job_indexes) ---
+    IndexSpec(ADMIN_JOBS_COLLECTION, _keys('id'), unique=True, reason='статус и отмена задачи'),
+    IndexSpec(ADMIN_JOBS_COLLECTION, _keys('kind', ('created_at', -1)), reason='активная задача вида, список'),
+    IndexSpec(ADMIN_JOBS_COLLECTION, _keys('status', 'updated_at'), reason='fail_stale_jobs при старте'),
+    IndexSpec(ADMIN_JOBS_COLLECTION, _keys(EXCLUSIVE_KIND_FIELD), unique=True,
+              partial_filter={EXCLUSIVE_KIND_FIELD: {'$exists': True}},
+              reason='одна активная exclusive-задача вида на все воркеры'),
+)
+
+
+def _index_options(info: Dict[str, Any]) -> Tuple[bool, Optional[int], Optional[Dict[str, Any]]]:
+    partial = info.get('partialFilterExpression')
+    return bool(info.get('unique')), info.get('expireAfterSeconds'), dict(partial) if partial is not None else None
+
+
+def apply_index_catalog(
+    db,
+    catalog: Iterable[IndexSpec] = INDEX_CATALOG,
+    groups: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Создаёт недостающие индексы каталога (sync pymongo; идемпотентно).
+
+    Returns: {'created': [...], 'present': int, 'conflicts': [...], 'failed': [...]}
+    """
+    report: Dict[str, Any] = {'created': [], 'present': 0, 'conflicts': [], 'failed': []}
+    existing: Dict[str, Dict[str, Any]] = {}
+
+    for spec in catalog:
+        if groups and spec.group not in groups:
+            continue
+        label = f'{spec.collection}.{spec.index_name}'
+        collection = db[spec.collection]
+        try:
+            if spec.collection not in existing:
+                existing[spec.collection] = collection.index_information()
+            indexes = existing[spec.collection]
+
+            by_keys = {tuple(tuple(k) for k in info['key']): (name, info) for name, info in indexes.items()}
+            wanted = (spec.unique, spec.expire_after_seconds, spec.partial_filter)
+            if spec.index_name in indexes:
+                info = indexes[spec.index_name]
+                same = tuple(tuple(k) for k in info['key']) == spec.keys and _index_options(info) == wanted
+            elif spec.keys in by_keys:
+                # Тот же индекс под другим именем (создан вручную / старым скриптом)
+                same = _index_options(by_keys[spec.keys][1]) == wanted
+            else:
+                collection.create_index(list(spec.keys), **spec.options())
+                indexes[spec.index_name] = {'key': list(spec.keys), **spec.options()}
+                report['created'].append(label)
+                continue
+
+            if same:
+                report['present'] += 1
+            else:
+                report['conflicts'].append(label)
+        except Exception as e:
+            logger.warning("Index %s not created: %s", label, e)
+            report['failed'].append({'index': label, 'error': str(e)})
+
+    if report['created'] or report['conflicts'] or report['failed']:
+        logger.info("Index catalog applied: %d created, %d present, %d conflicts, %d failed",
+                    len(report['created']), report['present'], len(report['conflicts']), len(report['failed']))
+    return report
+
+
+# ============================================================================
+# QUERY SHAPES + EXPLAIN AUDIT
+# ============================================================================
+
+@dataclass(frozen=True)
+class QueryShape:
+    """Форма запроса из роута: значения - заглушки, важны поля и операторы."""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+    source: str = ''
+    limit: int = 0
+    projection: Dict[str, Any] = field(default_factory=lambda: {'_id': 0})
+
+
+QUERY_SHAPES: Tuple[QueryShape, ...] = (
+    QueryShape('offer_candidates', 'supplier_items',
+               publishable_offer_query(product_core_id='core', unit_type='WEIGHT'),
+               source='optimizer.find_candidates, cart.get_candidates_for_reference, catalog.get_best_price_for_reference'),
+    QueryShape('offer_candidates_excluding_suppliers', 'supplier_items',
+               publishable_offer_query(product_core_id='core', unit_type='WEIGHT',
+                                       supplier_company_id={'$nin': ['s1']}),
+               source='optimizer.find_candidates (redistribution)'),
+    QueryShape('favorite_replacement', 'supplier_items',
+               publishable_offer_query(product_core_id='core', unit_type='PIECE'),
+               sort=[('price', 1)], limit=1, source='routes.add_from_favorite'),
+    QueryShape('alternatives_candidates', 'supplier_items',
+               publishable_offer_query(id={'$ne': 'item'}, product_core_id='core'),
+               source='routes.get_item_alternatives'),
+    QueryShape('best_price_incremental_scan', 'supplier_items',
+               publishable_offer_query(product_core_id={'$in': ['core']}),
+               source='best_price_engine.scan_offer_groups(cores)'),
+    QueryShape('favorite_batch_candidates', 'supplier_items', {'active': True, 'product_core_id': {'$in': ['core']}},
+               source='server.add_from_favorite_batch'),
+    QueryShape('offer_by_id', 'supplier_items', {'id': 'item', 'active': True},
+               limit=1, source='routes.add_to_cart, routes.get_item_alternatives'),
+    QueryShape('anchor_offer', 'supplier_items', publishable_offer_query(id='item'),
+               limit=1, source='cart.get_anchor_offer'),
+    QueryShape('offer_by_unique_key', 'supplier_items', {'unique_key': 'key'},
+               limit=1, source='server.upload_price_list, pricelist_importer_v2'),
+    QueryShape('supplier_price_list', 'supplier_items', {'supplier_company_id': 's1', 'active': True},
+               source='server.get_supplier_price_lists'),
+    QueryShape('import_deactivate_stale', 'supplier_items',
+               {'supplier_company_id': 's1', 'price_list_id': {'$ne': 'pl'}, 'active': True},
+               source='server.upload_price_list'),
+    QueryShape('price_list_counts', 'supplier_items', {'price_list_id': 'pl', 'active': True},
+               source='server.get_supplier_pricelists'),
+    QueryShape('reference_by_id', 'catalog_references', {'reference_id': 'ref'}, limit=1,
+               source='cart / favorites'),
+    QueryShape('reference_by_core', 'catalog_references', {'product_core_id': 'core', 'unit_type': 'WEIGHT'},
+               source='best_price_engine'),
+    QueryShape('cart_intents', 'cart_intents', {'user_id': 'u'}, sort=[('supplier_item_id', 1)],
+               source='plan_snapshot.compute_cart_hash, optimizer.load_cart_intents'),
+    QueryShape('cart_intent_upsert', 'cart_intents', {'user_id': 'u', 'supplier_item_id': 'item'},
+               limit=1, source='routes.add_to_cart'),
+    QueryShape('plan_by_user', 'cart_plans_v12', {'user_id': 'u'}, limit=1,
+               source='plan_snapshot.find_reusable_plan'),
+    QueryShape('plan_by_id', 'cart_plans_v12', {'plan_id': 'p', 'user_id': 'u'}, limit=1,
+               source='plan_snapshot.load_plan_snapshot'),
+    QueryShape('catalog_version', CHANGE_LOG_COLLECTION,
+               {'$or': [{'product_core_ids': {'$in': ['core']}}, {'supplier_id': {'$in': ['s1']}}]},
+               sort=[('created_at', -1)], limit=1, source='plan_snapshot.compute_catalog_version'),
+    QueryShape('latest_catalog_change', CHANGE_LOG_COLLECTION, {}, sort=[('created_at', -1)], limit=1,
+               source='offer_validator.catalog_change_version'),
+    QueryShape('favorites_by_user', 'favorites_v12', {'user_id': 'u'}, source='favorites'),
+    QueryShape('orders_history', ORDER_HISTORY_COLLECTION, {'customer_user_id': 'u'},
+               sort=[('created_at', -1), ('id', -1)], limit=51, source='order_history.list_order_history'),
+    QueryShape('orders_list', 'orders_v12', {'user_id': 'u', 'status': 'pending'}, sort=[('created_at', -1)],
+               limit=20, source='orders_routes.list_orders'),
+)
+
+
+def _winning_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    planner = explain.get('queryPlanner') or {}
+    plan = planner.get('winningPlan') or {}
+    # SBE (MongoDB 5+): {'queryPlan': {...}, 'slotBasedPlan': {...}}
+    return plan.get('queryPlan', plan)
+
+
+def plan_stages(plan: Any) -> List[Tuple[str, Optional[str]]]:
+    """Все стадии дерева плана: [(stage, indexName)]."""
+    stages: List[Tuple[str, Optional[str]]] = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append((plan['stage'], plan.get('indexName')))
+        for key in ('inputStage', 'inputStages', 'shards', 'winningPlan'):
+            if key in plan:
+                stages.extend(plan_stages(plan[key]))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def explain_shape(db, shape: QueryShape) -> Dict[str, Any]:
+    cursor = db[shape.collection].find(shape.filter, shape.projection)
+    if shape.sort:
+        cursor = cursor.sort(shape.sort)
+    if shape.limit:
+        cursor = cursor.limit(shape.limit)
+    stages = plan_stages(_winning_plan(cursor.explain()))
+    names = [s for s, _ in stages]
+    problems = []
+    if 'COLLSCAN' in names:
+        problems.append('COLLSCAN')
+    if 'SORT' in names:
+        problems.append('IN_MEMORY_SORT')
+    return {
+        'shape': shape.name,
+        'collection': shape.collection,
+        'source': shape.source,
+        'stages': names,
+        'indexes': sorted({i for _, i in stages if i}),
+        'problems': problems,
+    }
+
+
+def audit_query_shapes(db, shapes: Iterable[QueryShape] = QUERY_SHAPES) -> Dict[str, Any]:
+    """explain() всех форм запросов → отчёт с COLLSCAN / SORT в памяти."""
+    results = []
+    for shape in shapes:
+        try:
+            results.append(explain_shape(db, shape))
+        except Exception as e:
+            results.append({'shape': shape.name, 'collection': shape.collection, 'source': shape.source,
+                            'stages': [], 'indexes': [], 'problems': ['EXPLAIN_FAILED'], 'error': str(e)})
+    failing = [r['shape'] for r in results if r['problems']]
+    return {'checked': len(results), 'failing': failing, 'ok': not failing, 'shapes': results}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Managed MongoDB index catalog')
+    parser.add_argument('--apply', action='store_true', help='Create missing catalog indexes')
+    parser.add_argument('--audit', action='store_true', help='explain() recorded query shapes')
+    parser.add_argument('--list', action='store_true', help='Print catalog indexes')
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'test_database')]
+
+    if args.list:
+        for spec in INDEX_CATALOG:
+            print(f"{spec.group:7} {spec.collection}.{spec.index_name}  {spec.reason}")
+    if args.apply:
+        print(json.dumps(apply_index_catalog(db), ensure_ascii=False, indent=2))
+    if args.audit:
+        audit = audit_query_shapes(db)
+        for r in audit['shapes']:
+            status = ', '.join(r['problems']) or 'ok'
+            print(f"{r['shape']:40} {status:25} {','.join(r['indexes'])}")
+        sys.exit(0 if audit['ok'] else 1)
@@ -10,6 +10,7 @@ This is the single source of truth for all brand, alias, and product classificat
 """
 import pandas as pd
 from pymongo import MongoClient
+from reference_data import bump_version
 import os
 from pathlib import Path
 import sys
@@ -106,6 +107,7 @@ for _, row in df_aliases.iterrows():
 
 if alias_docs:
     db.brand_aliases.insert_many(alias_docs)
+    bump_version(db, 'brand_aliases')  # воркеры API перечитают справочник
     print(f"   ✅ Inserted {len(alias_docs)} aliases into 'brand_aliases' collection")
     
     # Create indexes
@@ -147,6 +149,7 @@ for _, row in df_seed.iterrows():
 
 if seed_docs:
     db.seed_dict_rules.insert_many(seed_docs)
+    bump_version(db, 'seed_dict_rules')  # воркеры API перечитают справочник
     print(f"   ✅ Inserted {len(seed_docs)} rules into 'seed_dict_rules' collection")
     
     # Create index
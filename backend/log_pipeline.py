@@ -0,0 +1,295 @@
+"""
+Log Pipeline - неблокирующее сэмплированное логирование горячих эндпоинтов
+==========================================================================
+
+add-from-favorite / select-offer / alternatives пишут по строке на каждое
+решение о кандидате. Раньше это шло синхронно через обработчики root
+logger'а (I/O в потоке запроса), а f-строки форматировались даже когда
+строка никому не нужна.
+
+Что делает модуль:
+1. setup_async_logging() - root-обработчики переезжают за очередь
+   (QueueHandler → QueueListener в фоновом потоке). Запрос только кладёт
+   LogRecord в очередь; форматирование и I/O - в потоке listener'а.
+   Очередь ограничена: при переполнении запись отбрасывается (счётчик
+   `dropped`), запрос никогда не ждёт.
+2. hot_logger(endpoint, __name__) - логгер запроса с сэмплированием:
+   info/debug/event пишутся только для доли запросов LOG_SAMPLE_RATES[endpoint],
+   warning/error/summary - всегда. Аргументы передаются %-стилем, так что
+   несэмплированный запрос не тратит время на форматирование.
+3. Жёсткий лимит байт на запрос (LOG_MAX_BYTES_PER_REQUEST): записи с
+   request_id сверх лимита отбрасываются в listener'е, вместо них - одна
+   строка LOG_BUDGET_EXCEEDED.
+
+Env:
+    LOG_ASYNC=0                                   - выключить очередь
+    LOG_SAMPLE_RATES=add_from_favorite=0.05,...   - доли сэмплирования
+    LOG_MAX_BYTES_PER_REQUEST=32768
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+DEFAULT_SAMPLE_RATES = {
+    'add_from_favorite': 0.1,
+    'select_offer': 0.1,
+    'alternatives': 0.1,
+}
+
+QUEUE_MAX_SIZE = 10000
+BUDGET_TRACKED_REQUESTS = 4096
+
+
+def _parse_sample_rates(raw: str) -> Dict[str, float]:
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for part in (raw or '').split(','):
+        name, _, value = part.partition('=')
+        if not name.strip() or not value.strip():
+            continue
+        try:
+            rates[name.strip()] = min(max(float(value), 0.0), 1.0)
+        except ValueError:
+            pass
+    return rates
+
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+LOG_MAX_BYTES_PER_REQUEST = int(os.environ.get('LOG_MAX_BYTES_PER_REQUEST', '32768'))
+LOG_ASYNC_ENABLED = os.environ.get('LOG_ASYNC', '1').strip().lower() not in {'0', 'false', 'no', 'off'}
+
+
+# ============================================================================
+# STRUCTURED EVENTS
+# ============================================================================
+
+class StructuredEvent:
+    """Сообщение-событие: JSON строится только при форматировании записи."""
+
+    __slots__ = ('name', 'fields')
+
+    def __init__(self, name: str, fields: Dict):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        return f"{self.name}: {json.dumps(self.fields, ensure_ascii=False, default=str)}"
+
+
+# ============================================================================
+# REQUEST LOGGER
+# ============================================================================
+
+_current_request_log: ContextVar[Optional['HotLogger']] = ContextVar('hot_request_logger', default=None)
+
+
+class HotLogger:
+    """
+    Логгер одного запроса горячего эндпоинта. Решение о сэмплировании
+    принимается один раз на запрос - строки запроса либо все, либо никаких.
+    """
+
+    __slots__ = ('endpoint', 'request_id', 'sampled', '_logger', '_extra')
+
+    def __init__(self, endpoint: str, logger: logging.Logger, request_id: Optional[str] = None,
+                 sampled: Optional[bool] = None):
+        self.endpoint = endpoint
+        self.request_id = request_id or uuid.uuid4().hex[:8]
+        if sampled is None:
+            rate = LOG_SAMPLE_RATES.get(endpoint, 1.0)
+            sampled = rate >= 1.0 or (rate > 0 and random.random() < rate)
+        self.sampled = sampled
+        self._logger = logger
+        self._extra = {'request_id': self.request_id, 'endpoint': endpoint}
+
+    def _log(self, level: int, msg, args, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger._log(level, msg, args, exc_info=exc_info, extra=self._extra, stacklevel=3)
+
+    # --- сэмплируемые ---
+    def debug(self, msg, *args):
+        if self.sampled:
+            self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        if self.sampled:
+            self._log(logging.INFO, msg, args)
+
+    def event(self, name: str, **fields):
+        if self.sampled:
+            self._log(logging.INFO, StructuredEvent(name, fields), ())
+
+    # --- всегда ---
+    def warning(self, msg, *args):
+        self._log(logging.WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self._log(logging.ERROR, msg, args)
+
+    def exception(self, msg, *args):
+        self._log(logging.ERROR, msg, args, exc_info=True)
+
+    def summary(self, name: str, payload: Dict):
+        """Итоговое событие запроса (пишется всегда, но под лимитом байт)."""
+        self._log(logging.INFO, StructuredEvent(name, dict(payload)), ())
+
+
+def hot_logger(endpoint: str, logger_name: str = __name__, request_id: Optional[str] = None) -> HotLogger:
+    """Создать логгер запроса и сделать его текущим (для SearchLogger и т.п.)."""
+    hot = HotLogger(endpoint, logging.getLogger(logger_name), request_id=request_id)
+    _current_request_log.set(hot)
+    return hot
+
+
+def current_request_logger() -> Optional[HotLogger]:
+    return _current_request_log.get()
+
+
+# ============================================================================
+# QUEUE PIPELINE
+# ============================================================================
+
+class _Stats:
+    """Счётчики пайплайна (приблизительные, без блокировок)."""
+
+    __slots__ = ('enqueued', 'dropped', 'budget_truncated')
+
+    def __init__(self):
+        self.enqueued = 0
+        self.dropped = 0
+        self.budget_truncated = 0
+
+
+_stats = _Stats()
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в потоке запроса (штатный prepare()
+    форматирует сообщение заранее) и без блокировки на полной очереди.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            _stats.enqueued += 1
+        except queue.Full:
+            _stats.dropped += 1
+
+
+class BudgetedQueueListener(QueueListener):
+    """QueueListener с лимитом байт на request_id."""
+
+    def __init__(self, log_queue, *handlers, max_bytes: int = LOG_MAX_BYTES_PER_REQUEST):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.max_bytes = max_bytes
+        self._spent: 'OrderedDict[str, int]' = OrderedDict()
+
+    def handle(self, record):
+        request_id = getattr(record, 'request_id', None)
+        if request_id is None or self.max_bytes <= 0:
+            super().handle(record)
+            return
+
+        spent = self._spent.get(request_id, 0)
+        if spent >= self.max_bytes:
+            return
+
+        try:
+            message = record.getMessage()
+        except Exception:
+            super().handle(record)  # пусть обработчик сообщит об ошибке формата
+            return
+        record.msg, record.args = message, None
+
+        spent += len(message.encode('utf-8', 'replace'))
+        if spent > self.max_bytes:
+            self._remember(request_id, self.max_bytes)
+            _stats.budget_truncated += 1
+            super().handle(logging.makeLogRecord({
+                'name': record.name,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'LOG_BUDGET_EXCEEDED: request_id=%s endpoint=%s limit=%d bytes, further records dropped',
+                'args': (request_id, getattr(record, 'endpoint', '?'), self.max_bytes),
+            }))
+            return
+
+        self._remember(request_id, spent)
+        super().handle(record)
+
+    def _remember(self, request_id: str, spent: int):
+        self._spent[request_id] = spent
+        self._spent.move_to_end(request_id)
+        while len(self._spent) > BUDGET_TRACKED_REQUESTS:
+            self._spent.popitem(last=False)
+
+
+_listener: Optional[BudgetedQueueListener] = None
+_queue_handler: Optional[LazyQueueHandler] = None
+
+
+def setup_async_logging(root: Optional[logging.Logger] = None) -> bool:
+    """
+    Перенести обработчики root logger'а за очередь. Идемпотентно.
+    Вызывать после logging.basicConfig().
+    """
+    global _listener, _queue_handler
+    if _listener is not None or not LOG_ASYNC_ENABLED:
+        return False
+
+    root = root or logging.getLogger()
+    handlers = [h for h in root.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return False
+
+    log_queue = queue.Queue(maxsize=QUEUE_MAX_SIZE)
+    _queue_handler = LazyQueueHandler(log_queue)
+    for h in handlers:
+        root.removeHandler(h)
+    root.addHandler(_queue_handler)
+
+    _listener = BudgetedQueueListener(log_queue, *handlers)
+    _listener.start()
+    return True
+
+
+def stop_async_logging():
+    """Дописать очередь и вернуть обработчики root logger'у."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for h in _listener.handlers:
+        root.addHandler(h)
+    _listener = None
+    _queue_handler = None
+
+
+def get_log_pipeline_stats() -> Dict:
+    return {
+        'async_enabled': _listener is not None,
+        'queue_size': _queue_handler.queue.qsize() if _queue_handler else 0,
+        'enqueued': _stats.enqueued,
+        'dropped_queue_full': _stats.dropped,
+        'budget_truncated_requests': _stats.budget_truncated,
+        'sample_rates': dict(LOG_SAMPLE_RATES),
+        'max_bytes_per_request': LOG_MAX_BYTES_PER_REQUEST,
+    }
@@ -1,5 +1,5 @@
 """Hybrid Matching Engine - Best of Spec + Simple Approach + Contract Rules"""
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 import re
 
 WEIGHT_TOLERANCE = 0.20  # ±20%
@@ -107,9 +107,31 @@ def extract_key_identifiers(name: str) -> set:
     return found_identifiers
 
 
+def item_match_features(name: str) -> Dict[str, Any]:
+    """Name-derived features of a candidate item used by the per-item gates
+    
+    They depend only on the item name, so a caller that matches many queries
+    against the same items can compute them once (see build_item_features).
+    """
+    return {
+        'identifiers': extract_key_identifiers(name),
+        'meat_type': extract_meat_type(name),
+        'rice_type': extract_rice_type(name),
+        'subtypes': extract_product_subtype(name),
+        'is_prepared': is_prepared_dish(name),
+        'words': set(name.lower().split()),
+    }
+
+
+def build_item_features(all_items: List[Dict]) -> List[Dict[str, Any]]:
+    """Pre-parsed candidate table: item_match_features for each item, same order as all_items"""
+    return [item_match_features(item.get('name_raw', '')) for item in all_items]
+
+
 def find_best_match_hybrid(query_product_name: str, original_price: float, 
                            all_items: List[Dict], strict_brand_override: bool = False,
-                           similarity_threshold: float = None) -> Optional[Dict]:
+                           similarity_threshold: float = None,
+                           item_features: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict]:
     """Hybrid matching: Spec infrastructure + Simple logic + STRICT validation
     
     Rules:
@@ -127,6 +149,7 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         all_items: List of supplier items to search
         strict_brand_override: If True, only match same brand
         similarity_threshold: Override default similarity threshold (0.85 = 85%)
+        item_features: Optional build_item_features(all_items) - skips re-parsing item names
     
     Returns winner or None
     """
@@ -161,10 +184,13 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
     
     # For broad categories, prepare word set for similarity check
     query_words = set(query_product_name.lower().split())
+    query_is_prepared = is_prepared_dish(query_product_name)
     
     matches = []
     
-    for item in all_items:
+    for idx, item in enumerate(all_items):
+        features = item_features[idx] if item_features is not None else None
+        
         # Gate 1: super_class match
         if item.get('super_class') != query_super_class:
             continue
@@ -213,7 +239,10 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
                 continue
         
         # Gate 8: Key identifying words - STRICTER logic
-        item_identifiers = extract_key_identifiers(item.get('name_raw', ''))
+        if features is not None:
+            item_identifiers = features['identifiers']
+        else:
+            item_identifiers = extract_key_identifiers(item.get('name_raw', ''))
         
         # If EITHER side has identifiers, they MUST overlap
         if query_identifiers or item_identifiers:
@@ -246,9 +275,8 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
             query_brand_id = None
             
             try:
-                from brand_master import brand_master
-                if brand_master:
-                    query_brand_id, _ = brand_master.detect_brand(query_product_name)
+                from brand_master import get_brand_master
+                query_brand_id, _ = get_brand_master().detect_brand(query_product_name)
             except:
                 pass
             
@@ -263,12 +291,11 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         elif item.get('brand_strict') and item.get('brand_id'):
             # Item is strict brand (like Mutti, Knorr) - check if query matches
             try:
-                from brand_master import brand_master
-                if brand_master:
-                    query_brand_id, _ = brand_master.detect_brand(query_product_name)
-                    
-                    if query_brand_id != item.get('brand_id'):
-                        continue
+                from brand_master import get_brand_master
+                query_brand_id, _ = get_brand_master().detect_brand(query_product_name)
+                
+                if query_brand_id != item.get('brand_id'):
+                    continue
             except:
                 pass
         
@@ -287,7 +314,10 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         
         # Gate 11: MEAT TYPE STRICT (NEW! курин ≠ говяд ≠ свин)
         if query_meat_type:
-            item_meat_type = extract_meat_type(item.get('name_raw', ''))
+            if features is not None:
+                item_meat_type = features['meat_type']
+            else:
+                item_meat_type = extract_meat_type(item.get('name_raw', ''))
             if item_meat_type != query_meat_type:
                 continue
         
@@ -305,8 +335,7 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
             }
             
             query_flavors = query_identifiers & flavor_keywords
-            item_identifiers_full = extract_key_identifiers(item.get('name_raw', ''))
-            item_flavors = item_identifiers_full & flavor_keywords
+            item_flavors = item_identifiers & flavor_keywords
             
             # MUST have same flavor (грибной=грибной, куриный=куриный)
             # If query has flavor, item MUST have SAME flavor (or none)
@@ -321,7 +350,10 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         # Gate 14: RICE TYPE STRICT (NEW! басмати ≠ жасмин ≠ для суши)
         if query_super_class == 'staples.rice' or 'рис' in query_product_name.lower():
             if query_rice_type:
-                item_rice_type = extract_rice_type(item.get('name_raw', ''))
+                if features is not None:
+                    item_rice_type = features['rice_type']
+                else:
+                    item_rice_type = extract_rice_type(item.get('name_raw', ''))
                 # If query specifies rice type, item MUST match or have no type specified
                 if item_rice_type and item_rice_type != query_rice_type:
                     continue
@@ -329,7 +361,10 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         # Gate 15: PRODUCT SUBTYPE STRICT (NEW! молочный≠горький, льна≠чиа, темная≠светлая)
         # If query has specific subtypes (chocolate type, seed type, bread color), they MUST overlap
         if query_subtypes:
-            item_subtypes = extract_product_subtype(item.get('name_raw', ''))
+            if features is not None:
+                item_subtypes = features['subtypes']
+            else:
+                item_subtypes = extract_product_subtype(item.get('name_raw', ''))
             
             # If both have subtypes, they MUST overlap
             # This prevents: молочный шоколад ≠ горький шоколад
@@ -339,15 +374,20 @@ def find_best_match_hybrid(query_product_name: str, original_price: float,
         # Gate 16: PREPARED vs RAW INGREDIENT (NEW!)
         # Prepared dishes should NOT match with raw ingredients
         # Example: котлета с сыром ≠ сыр, пельмени с мясом ≠ мясо
-        query_is_prepared = is_prepared_dish(query_product_name)
-        item_is_prepared = is_prepared_dish(item.get('name_raw', ''))
+        if features is not None:
+            item_is_prepared = features['is_prepared']
+        else:
+            item_is_prepared = is_prepared_dish(item.get('name_raw', ''))
         
         # If one is prepared and other is raw ingredient, block
         if query_is_prepared != item_is_prepared:
             continue
         
         # Gate 13: NAME SIMILARITY - Category-specific thresholds
-        item_words = set(item.get('name_raw', '').lower().split())
+        if features is not None:
+            item_words = features['words']
+        else:
+            item_words = set(item.get('name_raw', '').lower().split())
         
         # Remove common generic words
         generic_words = {'кг', 'гр', 'г', 'л', 'мл', 'шт', 'упак', 'пакет', 'кор', 
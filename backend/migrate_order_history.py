@@ -0,0 +1,36 @@
+"""
+Migrate Order History - разовый перенос заказов в order_history_v12
+====================================================================
+
+/v12/orders читает только проекцию order_history_v12, которую пишет
+checkout. Заказы, созданные до проекции (orders_v12 и старая orders),
+переносятся при старте сервера; скрипт - для ручного прогона и dry run.
+Повторный запуск ничего не меняет.
+
+Запуск:
+    python migrate_order_history.py            # dry run: только подсчёт
+    python migrate_order_history.py --apply
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.catalog import get_db
+from bestprice_v12.order_history import migrate_legacy_orders, MIGRATION_BATCH_SIZE
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Copy legacy orders into the order_history_v12 read model')
+    parser.add_argument('--apply', action='store_true', help='Write changes (default: dry run)')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+
+    args = parser.parse_args()
+
+    stats = migrate_legacy_orders(get_db(), dry_run=not args.apply, batch_size=args.batch_size)
+    print(f"Stats: {stats}")
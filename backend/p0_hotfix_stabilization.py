@@ -8,55 +8,20 @@ P0 HOTFIX - Критические исправления v12
 5. Structured logging
 6. SEED_DICT_RULES support for mandatory attributes
 """
-import os
 import re
-import json
 import logging
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
-from pymongo import MongoClient
+
+from log_pipeline import StructuredEvent, current_request_logger
+from reference_data import reference_registry, AliasIndex, match_alias
 
 logger = logging.getLogger(__name__)
 
-# Cache for seed_dict_rules
-_seed_dict_rules_cache = None
 
 def load_seed_dict_rules():
-    """Load seed_dict_rules from MongoDB (cached)"""
-    global _seed_dict_rules_cache
-    if _seed_dict_rules_cache is not None:
-        return _seed_dict_rules_cache
-    
-    try:
-        client = MongoClient(os.environ.get('MONGO_URL'))
-        db = client[os.environ.get('DB_NAME', 'test_database')]
-        rules = list(db.seed_dict_rules.find({}, {'_id': 0}))
-        
-        # Build lookup by type -> raw values (with action 'оставить' or 'обязательно')
-        _seed_dict_rules_cache = {
-            'fat': [],      # жирность: 0%, 1%, 3.2%, etc.
-            'grade': [],    # сорт: choice, prime, первый_сорт, etc.
-            'size': [],     # размер: 16/20, 21/25, etc. (for shrimp)
-            'form': [],     # форма: без_головы, очищенная, etc.
-            'process': [],  # обработка: сыровялен, варено_копчен, etc.
-        }
-        
-        for rule in rules:
-            rule_type = rule.get('type', '').lower()
-            raw_value = rule.get('raw', '').lower()
-            action = rule.get('action', '')
-            
-            if rule_type in _seed_dict_rules_cache and raw_value:
-                # Include rules with actions that mean "keep/mandatory"
-                if action in ['оставить', 'обязательно', 'учитывать']:
-                    _seed_dict_rules_cache[rule_type].append(raw_value)
-        
-        logger.info(f"Loaded seed_dict_rules: fat={len(_seed_dict_rules_cache['fat'])}, grade={len(_seed_dict_rules_cache['grade'])}, size={len(_seed_dict_rules_cache['size'])}")
-        return _seed_dict_rules_cache
-    except Exception as e:
-        logger.error(f"Failed to load seed_dict_rules: {e}")
-        _seed_dict_rules_cache = {'fat': [], 'grade': [], 'size': [], 'form': [], 'process': []}
-        return _seed_dict_rules_cache
+    """seed_dict_rules by type (snapshot from reference_data registry, hot-reloaded)"""
+    return reference_registry.get('seed_dict_rules')
 
 
 def extract_seed_dict_attributes(text: str) -> Dict[str, str]:
@@ -761,6 +726,10 @@ def extract_brand_from_text(product_name: str, brand_aliases: dict) -> Optional[
     name_norm = normalize_brand_text(product_name)
     name_words = set(name_norm.split())
     
+    # Registry snapshot: order and patterns are prebuilt
+    if isinstance(brand_aliases, AliasIndex):
+        return match_alias(brand_aliases, name_norm, name_words)
+    
     # Sort by length (longest first) for better matching
     sorted_aliases = sorted(brand_aliases.items(), key=lambda x: len(x[0]), reverse=True)
     
@@ -780,39 +749,13 @@ def extract_brand_from_text(product_name: str, brand_aliases: dict) -> Optional[
     return None
 
 
-# Global brand aliases cache
-_brand_aliases_cache = None
-
 def load_brand_aliases() -> dict:
-    """Load brand aliases from MongoDB
+    """Brand aliases from MongoDB (snapshot from reference_data registry, hot-reloaded)
     
     Returns:
-        dict {alias_norm: brand_id}
+        AliasIndex {alias_norm: brand_id} (read-only mapping)
     """
-    global _brand_aliases_cache
-    
-    if _brand_aliases_cache is not None:
-        return _brand_aliases_cache
-    
-    try:
-        from pymongo import MongoClient
-        import os
-        
-        DB_NAME = os.environ.get('DB_NAME', 'test_database')
-        db = MongoClient(os.environ.get('MONGO_URL'))[DB_NAME]
-        
-        # Load from brand_aliases collection
-        aliases_cursor = db.brand_aliases.find({}, {'_id': 0, 'alias_norm': 1, 'brand_id': 1})
-        _brand_aliases_cache = {doc['alias_norm']: doc['brand_id'] 
-                                for doc in aliases_cursor if doc.get('alias_norm')}
-        
-        logger.info(f"📚 Loaded {len(_brand_aliases_cache)} brand aliases for text extraction")
-        
-    except Exception as e:
-        logger.warning(f"⚠️ Could not load brand aliases: {e}")
-        _brand_aliases_cache = {}
-    
-    return _brand_aliases_cache
+    return reference_registry.get('brand_aliases')
 
 
 # ==================== 4) STRUCTURED LOGGING ====================
@@ -876,7 +819,7 @@ class SearchLogger:
     def log(self):
         """SAFE: Write structured log (never raises)"""
         try:
-            logger.info(f"SEARCH_LOG: {json.dumps(self.log_data, ensure_ascii=False)}")
+            self._emit()
         except Exception as e:
             # Fallback: minimal log
             try:
@@ -898,9 +841,18 @@ class SearchLogger:
     def get_log(self) -> Dict:
         return self.log_data
     
+    def _emit(self):
+        # JSON собирается лениво в потоке log_pipeline; в рамках запроса
+        # запись идёт через его логгер (request_id + лимит байт на запрос)
+        request_log = current_request_logger()
+        if request_log is not None:
+            request_log.summary('SEARCH_LOG', self.log_data)
+        else:
+            logger.info(StructuredEvent('SEARCH_LOG', dict(self.log_data)))
+    
     def log(self):
         """Write structured log"""
-        logger.info(f"SEARCH_LOG: {json.dumps(self.log_data, ensure_ascii=False)}")
+        self._emit()
 
 
 # ==================== TESTING ====================
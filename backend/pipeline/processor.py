@@ -12,14 +12,10 @@ from .enricher import (
     extract_seafood_head_status, extract_cooking_state, extract_trim_grade
 )
 from .calculator import determine_base_unit, calculate_price_per_base_unit, calculate_calc_confidence
+from bestprice_v12.offer_validator import publication_fields
 
-# Import brand master
-try:
-    from brand_master import brand_master
-    BRAND_MASTER_LOADED = brand_master is not None
-except:
-    BRAND_MASTER_LOADED = False
-    brand_master = None
+# Brand master: current reference_data snapshot (empty dictionary when BRANDS_FILE can't be loaded)
+from brand_master import get_brand_master
 
 logger = logging.getLogger(__name__)
 
@@ -71,14 +67,16 @@ def process_price_list_item(raw_item: Dict, supplier_company_id: str, price_list
     brand_id = None
     brand_strict = False
     
-    if BRAND_MASTER_LOADED:
+    brand_master = get_brand_master()
+    brand_master_loaded = bool(brand_master.brands_by_id)
+    if brand_master_loaded:
         brand_id, brand_strict = brand_master.detect_brand(name_raw)
         if brand_id:
             brand_info = brand_master.get_brand_info(brand_id)
             brand = brand_info.get('brand_en') if brand_info else None
     
     # Fallback to old method only if brand_master not loaded
-    if not brand and not BRAND_MASTER_LOADED:
+    if not brand and not brand_master_loaded:
         brand = extract_brand(name_raw)
     
     super_class = extract_super_class(name_norm)
@@ -160,6 +158,8 @@ def process_price_list_item(raw_item: Dict, supplier_company_id: str, price_list
         'active': True,
         'updated_at': datetime.now(timezone.utc)
     }
+    # Read paths filter on publishable - set it wherever the row is written
+    supplier_item.update(publication_fields(supplier_item))
     
     return supplier_item
 
@@ -22,6 +22,9 @@ import pandas as pd
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from bestprice_v12.best_price_engine import record_catalog_change
+from bestprice_v12.offer_validator import publication_fields
+
 # Load environment
 load_dotenv(Path('/app/backend/.env'))
 
@@ -182,7 +185,12 @@ class PricelistImporter:
         if keep_pricelist_id:
             items_query['price_list_id'] = {'$ne': keep_pricelist_id}
         
+        # Ядра удаляемых строк - до удаления: distinct по поставщику их уже не найдёт
+        deleted_cores = self.db.supplier_items.distinct('product_core_id', items_query)
         items_result = self.db.supplier_items.delete_many(items_query)
+        if items_result.deleted_count:
+            record_catalog_change(self.db, 'pricelist_delete', product_core_ids=deleted_cores,
+                                  supplier_id=supplier_id)
         
         pricelists_query = {'supplierId': supplier_id}
         if keep_pricelist_id:
@@ -205,6 +213,7 @@ class PricelistImporter:
         if existing:
             # Update existing
             item_data['updated_at'] = datetime.now(timezone.utc)
+            item_data.update(publication_fields({**existing, **item_data}))
             self.db.supplier_items.update_one(
                 {'unique_key': unique_key},
                 {'$set': item_data}
@@ -215,6 +224,7 @@ class PricelistImporter:
             item_data['id'] = str(uuid.uuid4())
             item_data['created_at'] = datetime.now(timezone.utc)
             item_data['updated_at'] = datetime.now(timezone.utc)
+            item_data.update(publication_fields(item_data))
             self.db.supplier_items.insert_one(item_data)
             return True, item_data['id']
     
@@ -423,6 +433,10 @@ class PricelistImporter:
             print(f"⚠️  Ошибка переклассификации: {e}")
             stats['reclassification_errors'] = str(e)
         
+        # Одна запись change log на импорт: upsert-ы, деактивация и переклассификация
+        # поставщика раскрываются в ядра при инкрементальном пересчёте best price
+        record_catalog_change(self.db, 'price_list_import', supplier_id=supplier_id, pricelist_id=pricelist_id)
+        
         # Print summary
         print(f"\n✅ Результат импорта:")
         print(f"   Создано: {stats['created']}")
@@ -0,0 +1,436 @@
+"""
+Reference Data Registry - версионированные справочники с горячей перезагрузкой
+==============================================================================
+
+Справочники (brand_aliases, seed_dict_rules, super_class index, BrandMaster)
+раньше жили в глобальных кэшах модулей: каждый открывал свой MongoClient при
+первом обращении и никогда не обновлялся - новые алиасы/правила доходили до
+воркеров uvicorn только после рестарта.
+
+Реестр:
+1. Владеет всеми наборами как неизменяемыми снапшотами (MappingProxyType,
+   tuple) и одним общим MongoClient (DB_NAME из env).
+2. load_all() при старте грузит предзагружаемые наборы параллельно (пул потоков).
+3. Версия набора = версии его источников: документы reference_data_versions
+   ({_id: source, version}) и mtime файлов (Excel BrandMaster). Фоновый поток
+   каждого воркера опрашивает версии одним find; при изменении набор
+   пересобирается в этом потоке (вместе с производными структурами -
+   отсортированными алиасами, скомпилированными паттернами) и подменяется
+   атомарно. Читатели видят либо старый, либо новый снапшот целиком.
+4. Писатели справочников вызывают bump_version(db, source) - все воркеры
+   подхватят изменение за REFERENCE_DATA_POLL_SEC.
+
+Использование:
+    from reference_data import reference_registry
+    aliases = reference_registry.get('brand_aliases')
+
+Запуск:
+    python reference_data.py --status
+    python reference_data.py --bump brand_aliases
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_COLLECTION = 'reference_data_versions'
+POLL_INTERVAL_SEC = float(os.environ.get('REFERENCE_DATA_POLL_SEC', '30'))
+LOAD_WORKERS = 4
+
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+@dataclass(frozen=True)
+class ReferenceDataset:
+    """Набор справочных данных: load(db) -> неизменяемое значение."""
+    name: str
+    load: Callable[[Any], Any]
+    sources: Tuple[str, ...] = ()          # ключи reference_data_versions
+    files: Tuple[Any, ...] = ()            # файлы (путь или функция → путь), чей mtime входит в версию
+    empty: Callable[[], Any] = dict        # значение, если загрузка не удалась
+    preload: bool = True                   # грузить в load_all() при старте
+
+
+@dataclass(frozen=True)
+class ReferenceSnapshot:
+    name: str
+    version: Tuple
+    data: Any
+    loaded_at: str
+    load_ms: float
+    error: Optional[str] = None
+
+
+class AliasIndex(Mapping):
+    """
+    Неизменяемый словарь alias_norm → brand_id с предсобранным порядком
+    проверки (длинные алиасы первыми) и паттернами границ слов.
+    """
+
+    __slots__ = ('_aliases', 'ordered')
+
+    def __init__(self, aliases: Dict[str, str]):
+        self._aliases = dict(aliases)
+        self.ordered = tuple(
+            (alias, brand_id, None if len(alias) < 4 else re.compile(r'(^|\s)' + re.escape(alias) + r'($|\s)'))
+            for alias, brand_id in sorted(self._aliases.items(), key=lambda x: len(x[0]), reverse=True)
+        )
+
+    def __getitem__(self, key):
+        return self._aliases[key]
+
+    def __iter__(self):
+        return iter(self._aliases)
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def __reduce__(self):
+        return (AliasIndex, (self._aliases,))
+
+
+def match_alias(index: AliasIndex, name_norm: str, name_words: Optional[set] = None) -> Optional[str]:
+    """Первый (самый длинный) алиас, найденный в нормализованном названии."""
+    if name_words is None:
+        name_words = set(name_norm.split())
+    for alias, brand_id, pattern in index.ordered:
+        if pattern is None:
+            if alias in name_words:
+                return brand_id
+        elif alias in name_norm and pattern.search(name_norm):
+            return brand_id
+    return None
+
+
+# ============================================================================
+# DATASET LOADERS
+# ============================================================================
+
+SEED_RULE_TYPES = ('fat', 'grade', 'size', 'form', 'process')
+
+
+def load_brand_aliases(db) -> AliasIndex:
+    cursor = db.brand_aliases.find({}, {'_id': 0, 'alias_norm': 1, 'brand_id': 1})
+    return AliasIndex({doc['alias_norm']: doc['brand_id'] for doc in cursor if doc.get('alias_norm')})
+
+
+def load_seed_dict_rules(db) -> Mapping:
+    """type → raw-значения правил с действием 'оставить'/'обязательно'/'учитывать'."""
+    rules: Dict[str, List[str]] = {t: [] for t in SEED_RULE_TYPES}
+    for rule in db.seed_dict_rules.find({}, {'_id': 0, 'type': 1, 'raw': 1, 'action': 1}):
+        rule_type = (rule.get('type') or '').lower()
+        raw_value = (rule.get('raw') or '').lower()
+        if rule_type in rules and raw_value and rule.get('action', '') in ('оставить', 'обязательно', 'учитывать'):
+            rules[rule_type].append(raw_value)
+    return MappingProxyType({t: tuple(values) for t, values in rules.items()})
+
+
+def empty_seed_dict_rules() -> Mapping:
+    return MappingProxyType({t: () for t in SEED_RULE_TYPES})
+
+
+def load_v12_seed_rules(db) -> Mapping:
+    """seed_rules (normalized raw → canonical/type) и product_cores для search_engine_v12."""
+    from search_engine_v12 import normalize_text
+
+    seed_rules = {}
+    product_cores = set()
+    cursor = db.seed_dict_rules.find(
+        {'action': {'$nin': ['удалить', 'skip']}},
+        {'_id': 0, 'raw': 1, 'canonical': 1, 'type': 1}
+    )
+    for doc in cursor:
+        raw = doc.get('raw', '')
+        canonical = doc.get('canonical', '')
+        rule_type = doc.get('type', '')
+        if raw and canonical and canonical.lower() != 'nan':
+            seed_rules[normalize_text(raw)] = MappingProxyType({'canonical': canonical, 'type': rule_type})
+            if rule_type in ('category', 'product', 'ingredient'):
+                product_cores.add(canonical.lower())
+    return MappingProxyType({
+        'seed_rules': MappingProxyType(seed_rules),
+        'product_cores': frozenset(product_cores),
+    })
+
+
+def empty_v12_seed_rules() -> Mapping:
+    return MappingProxyType({'seed_rules': MappingProxyType({}), 'product_cores': frozenset()})
+
+
+def load_super_class_index(db) -> Dict:
+    # Обычный dict (не MappingProxyType): batch_audit_job передаёт индекс воркерам через pickle
+    from universal_super_class_mapper import build_super_class_index
+    return build_super_class_index(db)
+
+
+def load_brand_master(db):
+    from brand_master import BrandMaster
+    return BrandMaster.load_fresh()
+
+
+def empty_brand_master():
+    from brand_master import BrandMaster
+    return BrandMaster.empty()
+
+
+def _brands_file() -> str:
+    from brand_master import BRANDS_FILE
+    return str(BRANDS_FILE)
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+class ReferenceRegistry:
+    """
+    Реестр справочников одного процесса. Снапшоты хранятся в dict, замена -
+    одно присваивание элемента (атомарно для читателей).
+    """
+
+    def __init__(self, datasets: Iterable[ReferenceDataset] = (), db=None):
+        self._datasets: Dict[str, ReferenceDataset] = {}
+        self._snapshots: Dict[str, ReferenceSnapshot] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._db = db
+        self._client = None
+        self._stop = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        self.reloads = 0
+        for dataset in datasets:
+            self.register(dataset)
+
+    def register(self, dataset: ReferenceDataset) -> None:
+        self._datasets[dataset.name] = dataset
+        self._locks[dataset.name] = threading.Lock()
+
+    # --- DB ---
+
+    @property
+    def db(self):
+        """Общая синхронная БД реестра (один MongoClient на процесс)."""
+        if self._db is None:
+            from pymongo import MongoClient
+            self._client = MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+            self._db = self._client[os.environ.get('DB_NAME', 'test_database')]
+        return self._db
+
+    def configure(self, db) -> None:
+        """Подставить БД (тесты / скрипты со своим подключением)."""
+        self._db = db
+
+    # --- versions ---
+
+    def _source_versions(self, sources: Sequence[str]) -> Dict[str, Any]:
+        if not sources:
+            return {}
+        docs = self.db[VERSIONS_COLLECTION].find({'_id': {'$in': list(sources)}}, {'version': 1})
+        return {doc['_id']: doc.get('version', 0) for doc in docs}
+
+    @staticmethod
+    def _file_version(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+    def _files(self, dataset: ReferenceDataset) -> Tuple[str, ...]:
+        return tuple(f() if callable(f) else f for f in dataset.files)
+
+    def _version(self, dataset: ReferenceDataset, source_versions: Dict[str, Any]) -> Tuple:
+        return (
+            tuple(source_versions.get(s, 0) for s in dataset.sources),
+            tuple(self._file_version(f) for f in self._files(dataset)),
+        )
+
+    # --- load / swap ---
+
+    def _build(self, dataset: ReferenceDataset, version: Tuple) -> ReferenceSnapshot:
+        started = time.perf_counter()
+        try:
+            data = dataset.load(self.db)
+            error = None
+        except Exception as e:
+            logger.error("Reference data %s failed to load: %s", dataset.name, e)
+            previous = self._snapshots.get(dataset.name)
+            if previous is not None:
+                return previous          # оставляем рабочий снапшот, повторим на следующем опросе
+            # Пустой набор с "битой" версией - следующий опрос попробует снова
+            data, error, version = dataset.empty(), str(e), ('error',)
+        return ReferenceSnapshot(
+            name=dataset.name,
+            version=version,
+            data=data,
+            loaded_at=datetime.now(timezone.utc).isoformat(),
+            load_ms=round((time.perf_counter() - started) * 1000, 1),
+            error=error,
+        )
+
+    def reload(self, name: str, source_versions: Optional[Dict[str, Any]] = None) -> ReferenceSnapshot:
+        """Пересобрать набор и атомарно подменить снапшот."""
+        dataset = self._datasets[name]
+        with self._locks[name]:
+            if source_versions is None:
+                source_versions = self._safe_source_versions(dataset.sources)
+            snapshot = self._build(dataset, self._version(dataset, source_versions))
+            if snapshot is not self._snapshots.get(name):
+                self._snapshots[name] = snapshot
+                self.reloads += 1
+                logger.info("Reference data %s loaded (version=%s, %.1f ms)", name, snapshot.version, snapshot.load_ms)
+            return snapshot
+
+    def _safe_source_versions(self, sources: Sequence[str]) -> Dict[str, Any]:
+        try:
+            return self._source_versions(sources)
+        except Exception as e:
+            logger.warning("Reference data versions unavailable: %s", e)
+            return {}
+
+    def get(self, name: str) -> Any:
+        """Текущий снапшот набора (при первом обращении - синхронная загрузка)."""
+        snapshot = self._snapshots.get(name)
+        if snapshot is None:
+            snapshot = self.reload(name)
+        return snapshot.data
+
+    def install(self, name: str, data: Any) -> None:
+        """Поставить готовое значение (воркеры пула получают снапшот от родителя, без Mongo)."""
+        self._snapshots[name] = ReferenceSnapshot(
+            name=name, version=((), ()), data=data,
+            loaded_at=datetime.now(timezone.utc).isoformat(), load_ms=0.0,
+        )
+
+    def load_all(self, names: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """Параллельная загрузка наборов (по умолчанию - preload=True). Returns: {name: load_ms}"""
+        names = list(names or [n for n, d in self._datasets.items() if d.preload])
+        sources = sorted({s for n in names for s in self._datasets[n].sources})
+        versions = self._safe_source_versions(sources)
+        with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, max(len(names), 1))) as pool:
+            snapshots = list(pool.map(lambda n: self.reload(n, versions), names))
+        return {s.name: s.load_ms for s in snapshots}
+
+    # --- polling ---
+
+    def poll_once(self) -> List[str]:
+        """Сверить версии загруженных наборов; изменившиеся пересобрать. Returns: имена перезагруженных."""
+        loaded = [self._datasets[n] for n in list(self._snapshots) if n in self._datasets]
+        if not loaded:
+            return []
+        versions = self._source_versions(sorted({s for d in loaded for s in d.sources}))
+        changed = [
+            d.name for d in loaded
+            if self._version(d, versions) != self._snapshots[d.name].version
+        ]
+        for name in changed:
+            self.reload(name, versions)
+        return changed
+
+    def _poll_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                changed = self.poll_once()
+                if changed:
+                    logger.info("Reference data hot-reloaded: %s", ', '.join(changed))
+            except Exception as e:
+                logger.warning("Reference data poll failed: %s", e)
+
+    def start_polling(self, interval: float = POLL_INTERVAL_SEC) -> bool:
+        if self._poller is not None or interval <= 0:
+            return False
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll_loop, args=(interval,),
+                                        name='reference-data-poller', daemon=True)
+        self._poller.start()
+        return True
+
+    def stop_polling(self) -> None:
+        if self._poller is None:
+            return
+        self._stop.set()
+        self._poller.join(timeout=5)
+        self._poller = None
+
+    # --- introspection ---
+
+    def status(self) -> Dict[str, Any]:
+        datasets = {}
+        for name, dataset in self._datasets.items():
+            snapshot = self._snapshots.get(name)
+            data = snapshot.data if snapshot else None
+            datasets[name] = {
+                'loaded': snapshot is not None,
+                'sources': list(dataset.sources),
+                'version': snapshot.version if snapshot else None,
+                'size': len(data) if isinstance(data, (Mapping, tuple, list, frozenset)) else None,
+                'loaded_at': snapshot.loaded_at if snapshot else None,
+                'load_ms': snapshot.load_ms if snapshot else None,
+                'error': snapshot.error if snapshot else None,
+            }
+        return {
+            'polling': self._poller is not None,
+            'poll_interval_sec': POLL_INTERVAL_SEC,
+            'reloads': self.reloads,
+            'datasets': datasets,
+        }
+
+
+def version_bump_update(source: str) -> Tuple[Dict, Dict]:
+    """(filter, update) для инкремента версии источника - для pymongo и motor."""
+    return {'_id': source}, {'$inc': {'version': 1}, '$set': {'updated_at': datetime.now(timezone.utc)}}
+
+
+def bump_version(db, source: str) -> None:
+    """Отметить изменение источника справочника (sync pymongo / скрипты)."""
+    db[VERSIONS_COLLECTION].update_one(*version_bump_update(source), upsert=True)
+
+
+# ============================================================================
+# DEFAULT REGISTRY
+# ============================================================================
+
+DEFAULT_DATASETS = (
+    ReferenceDataset('brand_aliases', load_brand_aliases, sources=('brand_aliases',),
+                     empty=lambda: AliasIndex({})),
+    ReferenceDataset('seed_dict_rules', load_seed_dict_rules, sources=('seed_dict_rules',),
+                     empty=empty_seed_dict_rules),
+    ReferenceDataset('v12_seed_rules', load_v12_seed_rules, sources=('seed_dict_rules',),
+                     empty=empty_v12_seed_rules),
+    # Строится по всем активным supplier_items - только по требованию и по явному bump
+    ReferenceDataset('super_class_index', load_super_class_index, sources=('super_class_index',),
+                     preload=False),
+    ReferenceDataset('brand_master', load_brand_master, sources=('brand_master',), files=(_brands_file,),
+                     empty=empty_brand_master),
+)
+
+reference_registry = ReferenceRegistry(DEFAULT_DATASETS)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Reference data registry')
+    parser.add_argument('--status', action='store_true', help='Load all datasets and print status')
+    parser.add_argument('--bump', help='Bump version of a source (all workers reload it)')
+    args = parser.parse_args()
+
+    if args.bump:
+        bump_version(reference_registry.db, args.bump)
+        print(f"Bumped {args.bump}")
+    if args.status:
+        reference_registry.load_all()
+        print(json.dumps(reference_registry.status(), ensure_ascii=False, indent=2, default=str))
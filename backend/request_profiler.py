@@ -0,0 +1,345 @@
+"""
+Request Profiler - лёгкие спаны для замера стадий запроса
+==========================================================
+
+SearchLogger / SearchDebugEvent пишут счётчики пайплайна, но не время.
+Этот модуль отвечает на вопрос "где запрос провёл время": загрузка из
+Mongo, классификация, guards или скоринг.
+
+Использование:
+    @profiled('add_from_favorite')          # открывает профиль на весь запрос
+    async def endpoint(...):
+        doc = await db.x.find_one(...)
+        lap('mongo_load')                   # время с прошлой отметки → стадия
+        with span('guards'):                # явный блок (можно вкладывать)
+            ...
+
+Время - time.perf_counter() (монотонные часы), текущий профиль живёт в
+contextvars, поэтому спаны работают и в async-роутах, и в коде, который
+FastAPI запускает в threadpool (контекст копируется). Вне профиля
+span()/lap() - no-op.
+
+Агрегация: все длительности пишутся в in-process гистограммы
+`<endpoint>.<stage>` с фиксированными бакетами (мс).
+    GET /api/debug/metrics/stages
+
+Полная трасса (список спанов с offset/duration) собирается только для
+сэмплированных запросов - заголовок `X-Profile-Trace: 1` или доля
+PROFILE_TRACE_SAMPLE_RATE (env). Трасса возвращается в заголовке
+Server-Timing и кладётся в кольцевой буфер:
+    GET /api/debug/metrics/traces
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# CONFIG
+# ============================================================================
+
+TRACE_HEADER = b'x-profile-trace'
+TRACE_SAMPLE_RATE = float(os.environ.get('PROFILE_TRACE_SAMPLE_RATE', '0') or 0)
+TRACE_BUFFER_SIZE = 100
+
+# Верхние границы бакетов, мс (последний бакет - всё что выше)
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+# ============================================================================
+# HISTOGRAMS
+# ============================================================================
+
+class StageHistogram:
+    """Гистограмма латентности одной стадии (фиксированные бакеты)."""
+
+    __slots__ = ('buckets', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.buckets[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе бакета (для хвоста - max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                if i < len(BUCKET_BOUNDS_MS):
+                    return float(min(BUCKET_BOUNDS_MS[i], self.max_ms))
+                return self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50), 3),
+            'p95_ms': round(self.quantile(0.95), 3),
+            'p99_ms': round(self.quantile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': self.buckets[:],
+        }
+
+
+_histograms: Dict[str, StageHistogram] = {}
+_histograms_lock = threading.Lock()
+_recent_traces: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def observe(key: str, ms: float):
+    """Записать длительность стадии в гистограмму `key`."""
+    with _histograms_lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = StageHistogram()
+        hist.observe(ms)
+
+
+def get_stage_metrics(prefix: Optional[str] = None) -> Dict:
+    """Снимок всех гистограмм (опционально - только с префиксом endpoint)."""
+    with _histograms_lock:
+        stages = {
+            key: hist.to_dict()
+            for key, hist in sorted(_histograms.items())
+            if not prefix or key.startswith(prefix)
+        }
+    return {
+        'bucket_bounds_ms': list(BUCKET_BOUNDS_MS),
+        'stages': stages,
+    }
+
+
+def get_recent_traces(limit: int = 20) -> List[Dict]:
+    """Последние сэмплированные трассы (новые первыми)."""
+    return list(_recent_traces)[-limit:][::-1]
+
+
+def reset_stage_metrics():
+    with _histograms_lock:
+        _histograms.clear()
+    _recent_traces.clear()
+
+
+# ============================================================================
+# PROFILE / SPANS
+# ============================================================================
+
+# Профиль текущего запроса
+_current_profile: ContextVar[Optional['RequestProfile']] = ContextVar('request_profile', default=None)
+# Состояние HTTP-запроса из middleware: {'forced': bool, 'traces': [...]}
+_trace_request: ContextVar[Optional[Dict]] = ContextVar('profile_trace_request', default=None)
+
+
+class RequestProfile:
+    """Профиль одного запроса: отметки стадий + (если сэмплирован) трасса."""
+
+    __slots__ = ('endpoint', 'trace_id', 'sampled', 'started', 'last_mark', 'depth', 'spans', 'finished')
+
+    def __init__(self, endpoint: str, sampled: bool = False):
+        self.endpoint = endpoint
+        self.trace_id = uuid.uuid4().hex[:12] if sampled else None
+        self.sampled = sampled
+        self.started = perf_counter()
+        self.last_mark = self.started
+        self.depth = 0
+        self.spans: List[Dict] = []
+        self.finished = False
+
+    def record(self, stage: str, start: float, end: float):
+        ms = (end - start) * 1000.0
+        observe(f"{self.endpoint}.{stage}", ms)
+        if self.sampled:
+            self.spans.append({
+                'stage': stage,
+                'offset_ms': round((start - self.started) * 1000.0, 3),
+                'duration_ms': round(ms, 3),
+                'depth': self.depth,
+            })
+
+    def lap(self, stage: str):
+        now = perf_counter()
+        self.record(stage, self.last_mark, now)
+        self.last_mark = now
+
+    def finish(self) -> Optional[Dict]:
+        if self.finished:
+            return None
+        self.finished = True
+        end = perf_counter()
+        total_ms = (end - self.started) * 1000.0
+        observe(f"{self.endpoint}.total", total_ms)
+        if not self.sampled:
+            return None
+        return {
+            'trace_id': self.trace_id,
+            'endpoint': self.endpoint,
+            'total_ms': round(total_ms, 3),
+            'spans': self.spans,
+        }
+
+
+def _should_sample() -> bool:
+    request_state = _trace_request.get()
+    if request_state is not None and request_state['forced']:
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+def start_profile(endpoint: str):
+    """Открыть профиль запроса. Возвращает (profile, token) для finish_profile."""
+    profile = RequestProfile(endpoint, sampled=_should_sample())
+    return profile, _current_profile.set(profile)
+
+
+def finish_profile(profile: RequestProfile, token) -> Optional[Dict]:
+    """Закрыть профиль; для сэмплированного запроса - сохранить трассу."""
+    _current_profile.reset(token)
+    trace = profile.finish()
+    if trace is not None:
+        _recent_traces.append(trace)
+        request_state = _trace_request.get()
+        if request_state is not None:
+            request_state['traces'].append(trace)
+        logger.info(f"PROFILE_TRACE: {json.dumps(trace, ensure_ascii=False)}")
+    return trace
+
+
+@contextmanager
+def profile_request(endpoint: str):
+    profile, token = start_profile(endpoint)
+    try:
+        yield profile
+    finally:
+        finish_profile(profile, token)
+
+
+def profiled(endpoint: str):
+    """Декоратор эндпоинта: весь вызов - один профиль `endpoint`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                profile, token = start_profile(endpoint)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    finish_profile(profile, token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args, **kwargs):
+            profile, token = start_profile(endpoint)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish_profile(profile, token)
+        return sync_wrapper
+    return decorator
+
+
+@contextmanager
+def span(stage: str):
+    """Замерить блок как стадию текущего профиля (no-op вне профиля)."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = perf_counter()
+    profile.depth += 1
+    try:
+        yield
+    finally:
+        profile.depth -= 1
+        end = perf_counter()
+        profile.record(stage, start, end)
+        profile.last_mark = end
+
+
+def lap(stage: str):
+    """Закрыть стадию: время с предыдущей отметки (или начала профиля)."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.lap(stage)
+
+
+def mark():
+    """Сбросить точку отсчёта lap() без записи (пропустить неинтересный участок)."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.last_mark = perf_counter()
+
+
+# ============================================================================
+# ASGI MIDDLEWARE
+# ============================================================================
+
+def format_server_timing(traces: List[Dict]) -> str:
+    parts = []
+    for trace in traces:
+        for s in trace['spans']:
+            parts.append(f"{s['stage']};dur={s['duration_ms']}")
+        parts.append(f"{trace['endpoint']}.total;dur={trace['total_ms']}")
+    return ', '.join(parts)
+
+
+class ProfileTraceMiddleware:
+    """
+    ASGI middleware: читает `X-Profile-Trace` и, если по запросу собрана
+    трасса, добавляет в ответ Server-Timing + X-Profile-Trace-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        forced = any(
+            k == TRACE_HEADER and v not in (b'', b'0', b'false')
+            for k, v in scope.get('headers', ())
+        )
+        request_state = {'forced': forced, 'traces': []}
+        token = _trace_request.set(request_state)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start' and request_state['traces']:
+                traces = request_state['traces']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', format_server_timing(traces).encode('latin-1', 'replace')))
+                headers.append((b'x-profile-trace-id', ','.join(t['trace_id'] for t in traces).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace_request.reset(token)
@@ -28,6 +28,7 @@ import os
 import sys
 import pandas as pd
 from pymongo import MongoClient
+from reference_data import bump_version
 from pathlib import Path
 
 # MongoDB connection
@@ -128,6 +129,7 @@ for _, row in df_aliases.iterrows():
 
 if alias_docs:
     db.brand_aliases.insert_many(alias_docs)
+    bump_version(db, 'brand_aliases')  # воркеры API перечитают справочник
     db.brand_aliases.create_index('alias_norm')
     db.brand_aliases.create_index('brand_id')
     import_counts['brand_aliases'] = len(alias_docs)
@@ -156,6 +158,7 @@ for _, row in df_seed.iterrows():
 
 if seed_docs:
     db.seed_dict_rules.insert_many(seed_docs)
+    bump_version(db, 'seed_dict_rules')  # воркеры API перечитают справочник
     db.seed_dict_rules.create_index('raw')
     db.seed_dict_rules.create_index('canonical')
     import_counts['seed_dict_rules'] = len(seed_docs)
@@ -41,6 +41,8 @@ from typing import Optional, List, Dict, Any, Set, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 
+from bestprice_v12.offer_record import overlay
+
 logger = logging.getLogger(__name__)
 
 
@@ -581,8 +583,10 @@ class EnhancedSearchEngine:
                 is_valid, reason = is_pack_in_range(ref_pack, cand_pack)
                 
                 if is_valid:
-                    c['_pack_value'] = cand_pack  # Store for later
-                    pack_filtered.append(c)
+                    # Вычисленные поля - в слой запроса, общий оффер не меняется
+                    view = overlay(c)
+                    view['_pack_value'] = cand_pack  # Store for later
+                    pack_filtered.append(view)
                 else:
                     # Track rejections for debug
                     if len(debug.pack_rejections) < 10:
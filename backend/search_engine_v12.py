@@ -23,10 +23,10 @@ import uuid
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
-from pymongo import MongoClient
-import os
 import math
 
+from bestprice_v12.offer_record import overlay
+
 logger = logging.getLogger(__name__)
 
 
@@ -130,73 +130,37 @@ def is_pack_in_tolerance(ref_pack: Optional[float], cand_pack: Optional[float],
 # ==================== DATABASE ACCESS ====================
 
 class V12DataLoader:
-    """Loads v12 data from MongoDB (brands, aliases, seed_rules)"""
+    """v12 data (brands, aliases, seed_rules) - views over reference_data registry snapshots
     
-    def __init__(self):
-        mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-        self.client = MongoClient(mongo_url)
-        self.db = self.client['bestprice']
-        
-        # Load data into memory
-        self._load_brand_aliases()
-        self._load_seed_rules()
-    
-    def _load_brand_aliases(self):
-        """Load brand aliases into memory"""
-        cursor = self.db.brand_aliases.find({}, {'_id': 0, 'alias_norm': 1, 'brand_id': 1})
-        self.aliases = {doc['alias_norm']: doc['brand_id'] for doc in cursor if doc.get('alias_norm')}
-        logger.info(f"Loaded {len(self.aliases)} brand aliases")
-    
-    def _load_seed_rules(self):
-        """Load seed_dict_rules (product core classification)"""
-        cursor = self.db.seed_dict_rules.find(
-            {'action': {'$nin': ['удалить', 'skip']}},
-            {'_id': 0, 'raw': 1, 'canonical': 1, 'type': 1}
-        )
-        self.seed_rules = {}
-        self.product_cores = set()  # Core product categories
-        
-        for doc in cursor:
-            raw = doc.get('raw', '')
-            canonical = doc.get('canonical', '')
-            rule_type = doc.get('type', '')
-            
-            if raw and canonical and canonical.lower() != 'nan':
-                self.seed_rules[normalize_text(raw)] = {
-                    'canonical': canonical,
-                    'type': rule_type
-                }
-                
-                # Collect core product categories (e.g., 'кетчуп', 'лосось')
-                if rule_type in ['category', 'product', 'ingredient']:
-                    self.product_cores.add(canonical.lower())
-        
-        logger.info(f"Loaded {len(self.seed_rules)} seed rules, {len(self.product_cores)} product cores")
+    Data is hot-reloaded by the registry; every access sees the current snapshot.
+    """
+    
+    def __init__(self, registry=None):
+        from reference_data import reference_registry
+        self.registry = registry or reference_registry
+    
+    @property
+    def aliases(self):
+        """Brand aliases {alias_norm: brand_id}"""
+        return self.registry.get('brand_aliases')
+    
+    @property
+    def seed_rules(self):
+        """seed_dict_rules (product core classification): normalized raw → {canonical, type}"""
+        return self.registry.get('v12_seed_rules')['seed_rules']
+    
+    @property
+    def product_cores(self):
+        """Core product categories (e.g., 'кетчуп', 'лосось')"""
+        return self.registry.get('v12_seed_rules')['product_cores']
     
     def detect_brand_id(self, product_name: str) -> Optional[str]:
         """Detect brand_id from product name using aliases"""
         if not product_name:
             return None
         
-        name_norm = normalize_text(product_name)
-        name_words = set(name_norm.split())
-        
-        # Sort aliases by length (longest first) for better matching
-        sorted_aliases = sorted(self.aliases.items(), key=lambda x: len(x[0]), reverse=True)
-        
-        for alias_norm, brand_id in sorted_aliases:
-            # For short aliases (< 4 chars), require exact word match
-            if len(alias_norm) < 4:
-                if alias_norm in name_words:
-                    return brand_id
-            else:
-                # For longer aliases, check substring match at word boundary
-                if alias_norm in name_norm:
-                    pattern = r'(^|\s)' + re.escape(alias_norm) + r'($|\s)'
-                    if re.search(pattern, name_norm):
-                        return brand_id
-        
-        return None
+        from reference_data import match_alias
+        return match_alias(self.aliases, normalize_text(product_name))
     
     def get_anchor_terms(self, product_core_id: str) -> List[str]:
         """Get anchor terms (core_terms) for a product_core_id
@@ -419,13 +383,15 @@ class SearchEngineV12:
                     is_valid, reason = is_pack_in_tolerance(ref_pack, cand_pack, ref_pack_tolerance)
                     
                     if is_valid:
-                        c['_pack_value'] = cand_pack
-                        pack_filtered.append(c)
+                        view = overlay(c)   # copy-on-write: кандидат не меняется
+                        view['_pack_value'] = cand_pack
+                        pack_filtered.append(view)
                 else:
                     # If ref_pack unknown but candidate has price_per_base_unit, allow
                     if c.get('price_per_base_unit'):
-                        c['_pack_value'] = cand_pack
-                        pack_filtered.append(c)
+                        view = overlay(c)
+                        view['_pack_value'] = cand_pack
+                        pack_filtered.append(view)
             
             explanation['counts']['after_pack_filter'] = len(pack_filtered)
             if ref_pack:
@@ -9,6 +9,7 @@ Search Utilities for BestPrice v12 Catalog
 import re
 import unicodedata
 from typing import List, Optional, Set, Tuple
+from pymongo import UpdateOne
 from pymongo.database import Database
 
 # Import Russian stemmer
@@ -345,6 +346,8 @@ def backfill_search_tokens(db: Database, batch_size: int = 500, include_lemmas:
     """
     Backfill search_tokens and lemma_tokens fields for all supplier_items.
     Returns statistics.
+
+    For resumable / parallel runs use bulk_backfill.py (stage 'search_tokens').
     """
     from datetime import datetime, timezone
     
@@ -391,8 +394,9 @@ def backfill_search_tokens(db: Database, batch_size: int = 500, include_lemmas:
         
         if len(batch) >= batch_size:
             try:
-                for op in batch:
-                    db.supplier_items.update_one(op['filter'], op['update'])
+                db.supplier_items.bulk_write(
+                    [UpdateOne(op['filter'], op['update']) for op in batch], ordered=False
+                )
                 updated += len(batch)
             except Exception as e:
                 errors += len(batch)
@@ -402,8 +406,9 @@ def backfill_search_tokens(db: Database, batch_size: int = 500, include_lemmas:
     # Process remaining
     if batch:
         try:
-            for op in batch:
-                db.supplier_items.update_one(op['filter'], op['update'])
+            db.supplier_items.bulk_write(
+                [UpdateOne(op['filter'], op['update']) for op in batch], ordered=False
+            )
             updated += len(batch)
         except Exception as e:
             errors += len(batch)
@@ -419,70 +424,16 @@ def backfill_search_tokens(db: Database, batch_size: int = 500, include_lemmas:
 def ensure_search_indexes(db: Database) -> dict:
     """
     Create necessary indexes for search.
+
+    The indexes are declared in index_catalog.INDEX_CATALOG (group 'search')
+    and are also applied at server startup.
     """
-    indexes_created = []
-    
-    # Main search index
-    try:
-        db.supplier_items.create_index(
-            [('active', 1), ('search_tokens', 1)],
-            name='active_search_tokens'
-        )
-        indexes_created.append('active_search_tokens')
-    except Exception as e:
-        print(f"Index active_search_tokens: {e}")
-    
-    # Lemma tokens index (for RU morphology search)
-    try:
-        db.supplier_items.create_index(
-            [('active', 1), ('lemma_tokens', 1)],
-            name='active_lemma_tokens'
-        )
-        indexes_created.append('active_lemma_tokens')
-    except Exception as e:
-        print(f"Index active_lemma_tokens: {e}")
-    
-    # Name norm index (for prefix search)
-    try:
-        db.supplier_items.create_index(
-            [('active', 1), ('name_norm', 1)],
-            name='active_name_norm'
-        )
-        indexes_created.append('active_name_norm')
-    except Exception as e:
-        print(f"Index active_name_norm: {e}")
-    
-    # Compound index with super_class for filtered searches
-    try:
-        db.supplier_items.create_index(
-            [('active', 1), ('super_class', 1), ('search_tokens', 1)],
-            name='active_super_class_search_tokens'
-        )
-        indexes_created.append('active_super_class_search_tokens')
-    except Exception as e:
-        print(f"Index active_super_class_search_tokens: {e}")
-    
-    # Index on brand_id for brand boost
-    try:
-        db.supplier_items.create_index(
-            [('active', 1), ('brand_id', 1)],
-            name='active_brand_id'
-        )
-        indexes_created.append('active_brand_id')
-    except Exception as e:
-        print(f"Index active_brand_id: {e}")
-    
-    # Index for brand_aliases lookup
-    try:
-        db.brand_aliases.create_index(
-            [('alias_norm', 1)],
-            name='alias_norm_1'
-        )
-        indexes_created.append('brand_aliases.alias_norm_1')
-    except Exception as e:
-        print(f"Index brand_aliases.alias_norm: {e}")
-    
-    return {'indexes_created': indexes_created}
+    from index_catalog import apply_index_catalog
+
+    report = apply_index_catalog(db, groups=('search',))
+    for failed in report['failed']:
+        print(f"Index {failed['index']}: {failed['error']}")
+    return {'indexes_created': report['created'], 'present': report['present'], 'conflicts': report['conflicts']}
 
 
 # =====================
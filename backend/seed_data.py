@@ -11,6 +11,8 @@ import bcrypt
 from datetime import datetime, timezone
 import uuid
 
+from supplier_links import LINKS_COLLECTION, VIEW_COLLECTION, VIEW_STATE_COLLECTION, link_upsert_ops, sync_view
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -32,7 +34,9 @@ async def seed_data():
     await db.price_lists.delete_many({})
     await db.orders.delete_many({})
     await db.documents.delete_many({})
-    await db.supplier_restaurant_settings.delete_many({})
+    await db[LINKS_COLLECTION].delete_many({})
+    await db[VIEW_COLLECTION].delete_many({})
+    await db[VIEW_STATE_COLLECTION].delete_many({})
 
     pw_hash = hash_password("password123")  # тот же bcrypt, что и auth/login
     supplier_created = 0
@@ -310,15 +314,18 @@ async def seed_data():
     
     # Supplier-restaurant links: "Ресторан Вкусно" has contract accepted with Supplier 1
     print("Creating supplier-restaurant links...")
-    await db.supplier_restaurant_settings.insert_one({
-        "id": str(uuid.uuid4()),
-        "supplierId": supplier1_company_id,
-        "restaurantId": customer1_company_id,
-        "contract_accepted": True,
-        "is_paused": False,
-        "ordersEnabled": True,
-        "updatedAt": datetime.now(timezone.utc).isoformat()
-    })
+    await db[LINKS_COLLECTION].bulk_write(link_upsert_ops(
+        [(supplier1_company_id, customer1_company_id)],
+        {
+            "contract_accepted": True,
+            "is_paused": False,
+            "ordersEnabled": True,
+            "updatedAt": datetime.now(timezone.utc).isoformat()
+        },
+        {"id": str(uuid.uuid4())},
+    ))
+    # Витрина поставщиков - тем же sync_view, что и API (все поставщики x все рестораны)
+    await sync_view(db)
     
     print("✅ Seed data created successfully!")
     print("\nSeed completed.")
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Request, BackgroundTasks
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -11,6 +11,7 @@ import asyncio
 import hashlib
 import secrets
 import re
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any, Annotated, Union
@@ -36,6 +37,47 @@ from unit_normalizer import (
 # P1: Rules Validation at startup
 from rules_validator import validate_all_rules, print_validation_report
 
+# Per-stage request profiling (histograms + sampled traces)
+from request_profiler import (
+    profiled, lap,
+    ProfileTraceMiddleware, get_stage_metrics, get_recent_traces, reset_stage_metrics,
+)
+
+# Queue-backed, sampled logging for hot endpoints
+from log_pipeline import hot_logger, setup_async_logging, stop_async_logging, get_log_pipeline_stats
+
+# Supplier<->restaurant links: bulk linking + denormalized per-supplier view
+from supplier_links import (
+    REQUISITES_WHITELIST,
+    link_supplier_to_all_restaurants, link_restaurant_to_all_suppliers, add_restaurant_to_view, run_link_job,
+    sync_view, refresh_restaurant_in_view, ensure_supplier_view, ensure_view_indexes,
+)
+
+# Best price: precomputed offer pack fields + change log for incremental recompute
+from bestprice_v12.catalog import offer_pack_fields
+# Ingestion-time validation: publishable flag + reason codes written once per row
+from bestprice_v12.offer_validator import publication_fields, catalog_change_version, refresh_publication_flags
+from bestprice_v12.order_history import migrate_legacy_orders
+from bestprice_v12.best_price_engine import CHANGE_LOG_COLLECTION, change_log_entry
+# Cart plan memoization counters (/v12/cart/plan)
+from bestprice_v12.plan_snapshot import get_plan_memo_metrics, reset_plan_memo_metrics
+from bestprice_v12.offer_store import OfferStore, offer_projection
+
+# Versioned reference data (brand aliases, seed rules, brand master) with hot reload
+from reference_data import reference_registry, VERSIONS_COLLECTION, version_bump_update
+# Managed index catalog: applied at startup, explain() audit of recorded query shapes
+from index_catalog import apply_index_catalog, audit_query_shapes
+# Brand backfill + brand quality report as streamed background jobs
+from brand_jobs import (
+    BRAND_BACKFILL_JOB, BRAND_REPORT_JOB, run_brand_backfill, run_brand_report_job,
+    load_brand_report, brand_report_is_stale, format_brand_report, job_status,
+)
+from bulk_backfill import save_checkpoint
+# Memory-mapped active-offer snapshot shared by all workers (optional)
+from shared_catalog import PUBLISH_INTERVAL_SEC, SharedCatalogPublisher, SharedCatalogReader
+# Long admin operations (brand jobs, favorites migration) as Mongo-tracked background jobs
+from bestprice_v12.job_runner import JobCancelled, admin_job_response, get_job_runner, fail_stale_jobs
+
 # Build info for debugging
 ROOT_DIR = Path(__file__).parent
 BUILD_SHA = os.popen(f"cd {ROOT_DIR} && git rev-parse --short HEAD 2>/dev/null").read().strip() or "unknown"
@@ -507,24 +549,13 @@ async def get_version():
 
 # ==================== AUTH ROUTES ====================
 
-async def _auto_link_supplier_to_all_restaurants(supplier_company_id: str) -> None:
-    """Create supplier_restaurant_settings for all restaurants (pending)."""
-    restaurants = await db.companies.find({"type": "customer"}, {"_id": 0, "id": 1}).to_list(500)
-    now = datetime.now(timezone.utc).isoformat()
-    for r in restaurants:
-        await db.supplier_restaurant_settings.update_one(
-            {"supplierId": supplier_company_id, "restaurantId": r["id"]},
-            {"$set": {
-                "contract_accepted": False,
-                "is_paused": False,
-                "updatedAt": now
-            }},
-            upsert=True
-        )
+def _schedule_supplier_auto_link(background_tasks: BackgroundTasks, supplier_company_id: str) -> None:
+    """Link new supplier to all restaurants (pending) after the response: one bulk_write, see supplier_links."""
+    background_tasks.add_task(run_link_job, link_supplier_to_all_restaurants, db, supplier_company_id)
 
 
 @api_router.post("/auth/register/supplier", response_model=TokenResponse)
-async def register_supplier(data: SupplierRegistration):
+async def register_supplier(data: SupplierRegistration, background_tasks: BackgroundTasks):
     # Check if user exists
     existing_user = await db.users.find_one({"email": data.email})
     if existing_user:
@@ -568,8 +599,8 @@ async def register_supplier(data: SupplierRegistration):
     settings_dict['updatedAt'] = settings_dict['updatedAt'].isoformat()
     await db.supplier_settings.insert_one(settings_dict)
 
-    # Auto-link new supplier to all existing restaurants (pending)
-    await _auto_link_supplier_to_all_restaurants(company.id)
+    # Auto-link new supplier to all existing restaurants (pending, background)
+    _schedule_supplier_auto_link(background_tasks, company.id)
     
     # Create token
     token = create_access_token({"sub": user.id, "role": user.role})
@@ -585,7 +616,7 @@ async def register_supplier(data: SupplierRegistration):
     )
 
 @api_router.post("/auth/register/customer", response_model=TokenResponse)
-async def register_customer(data: CustomerRegistration):
+async def register_customer(data: CustomerRegistration, background_tasks: BackgroundTasks):
     # Check if user exists
     existing_user = await db.users.find_one({"email": data.email})
     if existing_user:
@@ -623,6 +654,9 @@ async def register_customer(data: CustomerRegistration):
     company_dict['createdAt'] = company_dict['createdAt'].isoformat()
     company_dict['updatedAt'] = company_dict['updatedAt'].isoformat()
     await db.companies.insert_one(company_dict)
+
+    # New restaurant shows up as pending in supplier views (background, no links created)
+    background_tasks.add_task(run_link_job, add_restaurant_to_view, db, company.id)
     
     # Create token
     token = create_access_token({"sub": user.id, "role": user.role})
@@ -667,7 +701,7 @@ async def dev_evidence(payload: dict):
 
 
 @api_router.post("/dev/login", response_model=TokenResponse)
-async def dev_login(data: DevLoginRequest):
+async def dev_login(data: DevLoginRequest, background_tasks: BackgroundTasks):
     """DEV-only: login without password. Returns 404 when DEV_AUTH_BYPASS != 1."""
     if not DEV_AUTH_BYPASS:
         raise HTTPException(status_code=404, detail="Not Found")
@@ -720,7 +754,9 @@ async def dev_login(data: DevLoginRequest):
             "minOrderAmount": 0, "deliveryDays": [], "deliveryTime": "", "orderReceiveDeadline": "",
             "logisticsType": "own", "updatedAt": now
         })
-        await _auto_link_supplier_to_all_restaurants(company_id)
+        _schedule_supplier_auto_link(background_tasks, company_id)
+    else:
+        background_tasks.add_task(run_link_job, add_restaurant_to_view, db, company_id)
     token = create_access_token({"sub": user_id, "role": role})
     return TokenResponse(
         access_token=token,
@@ -1078,6 +1114,8 @@ async def update_my_company(data: CompanyUpdate, current_user: dict = Depends(ge
         raise HTTPException(status_code=404, detail="Company not found")
     
     company = await db.companies.find_one({"userId": current_user['id']}, {"_id": 0})
+    if company.get('type') == CompanyType.customer:
+        await refresh_restaurant_in_view(db, company['id'])
     return company
 
 @api_router.get("/companies/{company_id}", response_model=Company)
@@ -1183,6 +1221,15 @@ async def _require_supplier_not_paused(company_id: str):
         raise HTTPException(status_code=403, detail="Поставщик на паузе. Редактирование отключено.")
 
 
+async def _record_catalog_change(source: str, supplier_id: Optional[str] = None,
+                                 product_core_ids: Optional[List[str]] = None, **meta):
+    """Mark supplier offers as changed so the incremental best-price recompute picks up their cores."""
+    try:
+        await db[CHANGE_LOG_COLLECTION].insert_one(change_log_entry(source, supplier_id, product_core_ids, **meta))
+    except Exception as e:
+        logger.warning("catalog_change_log write failed (%s): %s", source, e)
+
+
 @api_router.get("/supplier/price-list")
 @api_router.get("/price-lists/my")
 async def get_my_price_lists(current_user: dict = Depends(get_current_user)):
@@ -1259,6 +1306,8 @@ async def create_price_list(data: PriceListCreate, current_user: dict = Depends(
         "created_at": now,
         "updated_at": now,
     }
+    item_data.update(offer_pack_fields(name_raw, item_data["pack_qty"], item_data["unit_type"]))
+    item_data.update(publication_fields(item_data))
     await db.supplier_items.insert_one(item_data)
     pricelist_meta = {
         "id": pricelist_id,
@@ -1270,6 +1319,7 @@ async def create_price_list(data: PriceListCreate, current_user: dict = Depends(
         "active": True,
     }
     await db.pricelists.insert_one(pricelist_meta)
+    await _record_catalog_change("price_list_create", supplier_id=company_id)
     return PriceList(
         id=item_id,
         supplierCompanyId=company_id,
@@ -1317,10 +1367,18 @@ async def update_price_list(price_id: str, data: PriceListUpdate, current_user:
     if data.active is not None:
         set_fields["active"] = data.active
     match = {"id": price_id, "$or": [{"supplier_company_id": company_id}, {"supplierCompanyId": company_id}]}
-    result = await db.supplier_items.update_one(match, {"$set": set_fields})
+    update = {"$set": set_fields}
+    if data.name is not None or data.pack_quantity is not None:
+        # Pack is re-derived from name/pack_qty on the next read (or by the offer_pack backfill)
+        update["$unset"] = {"offer_pack_v": ""}
+    result = await db.supplier_items.update_one(match, update)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Price list item not found")
     si = await db.supplier_items.find_one(match, {"_id": 0})
+    publication = publication_fields(si)
+    if any(si.get(k) != v for k, v in publication.items()):
+        await db.supplier_items.update_one(match, {"$set": publication})
+    await _record_catalog_change("price_list_update", supplier_id=company_id)
     created = si.get("created_at") or si.get("updated_at")
     updated = si.get("updated_at")
     return {
@@ -1360,6 +1418,7 @@ async def delete_price_list(price_id: str, current_user: dict = Depends(get_curr
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Price list not found")
+    await _record_catalog_change("price_list_delete", supplier_id=company_id)
     return {"message": "Price list deleted"}
 
 
@@ -1386,6 +1445,8 @@ async def bulk_delete_price_list_items(data: BulkDeleteBody, current_user: dict
         },
         {"$set": {"active": False, "updated_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await _record_catalog_change("price_list_bulk_delete", supplier_id=company_id)
     return {"deletedCount": result.modified_count}
 
 
@@ -1821,6 +1882,7 @@ def _default_unit_from_row(row: dict, df_columns: List[str], mapping: dict) -> s
 
 
 @api_router.post("/price-lists/import")
+@profiled('price_list_import')
 async def import_price_list(
     request: Request,
     current_user: dict = Depends(get_current_user)
@@ -1859,8 +1921,10 @@ async def import_price_list(
     await _require_supplier_not_paused(supplier_id)
     supplier_name = company.get('companyName', company.get('name', 'Unknown'))
     correlation_id = str(uuid.uuid4())
+    lap('load_company')
 
     contents = await file.read()
+    lap('read_file')
     _MAX_IMPORT_FILE_BYTES = 50 * 1024 * 1024  # 50 MB
     if len(contents) > _MAX_IMPORT_FILE_BYTES:
         raise HTTPException(
@@ -1874,6 +1938,7 @@ async def import_price_list(
         )
     try:
         df = _parse_price_list_dataframe(contents, file.filename or '')
+        lap('parse_file')
     except Exception as e:
         logger.warning(f"Parse price list file failed: {e}", extra={"correlation_id": correlation_id})
         raise HTTPException(status_code=400, detail="Only CSV and Excel files are supported")
@@ -1944,6 +2009,7 @@ async def import_price_list(
             )
 
         new_pricelist_id = str(uuid.uuid4())
+        lap('column_mapping')
 
         # Helper functions for P0.1 unique key
         def normalize_text(text: str) -> str:
@@ -1979,6 +2045,7 @@ async def import_price_list(
         # Import products with upsert (P0.1). Diagnostics: why rows were skipped.
         created_count = 0
         updated_count = 0
+        unpublishable_count = 0
         skipped_count = 0
         skipped_reasons = {
             "empty_name": 0,
@@ -2056,10 +2123,12 @@ async def import_price_list(
                     'min_order_qty': min_order_qty,
                     'active': True,
                     'updated_at': datetime.now(timezone.utc),
+                    **offer_pack_fields(product_name, pack_qty, unit_type),
                 }
 
                 existing = await db.supplier_items.find_one({'unique_key': unique_key})
                 if existing:
+                    item_data.update(publication_fields({**existing, **item_data}))
                     await db.supplier_items.update_one(
                         {'unique_key': unique_key},
                         {'$set': item_data}
@@ -2068,12 +2137,16 @@ async def import_price_list(
                 else:
                     item_data['id'] = str(uuid.uuid4())
                     item_data['created_at'] = datetime.now(timezone.utc)
+                    item_data.update(publication_fields(item_data))
                     await db.supplier_items.insert_one(item_data)
                     created_count += 1
+                if not item_data['publishable']:
+                    unpublishable_count += 1
             except Exception as e:
                 logger.warning(f"Error importing row: {e}")
                 skipped_count += 1
                 skipped_reasons["other"] += 1
+        lap('upsert_rows')
 
         # P0.2: Deactivate old items from this supplier (not in new pricelist)
         deactivate_result = await db.supplier_items.update_many(
@@ -2085,6 +2158,7 @@ async def import_price_list(
             {'$set': {'active': False, 'deactivated_at': datetime.now(timezone.utc)}}
         )
         deactivated_count = deactivate_result.modified_count
+        lap('deactivate_stale')
 
         pricelist_meta = {
             'id': new_pricelist_id,
@@ -2096,6 +2170,8 @@ async def import_price_list(
             'active': True,
         }
         await db.pricelists.insert_one(pricelist_meta)
+        await _record_catalog_change("price_list_import", supplier_id=supplier_id, pricelist_id=new_pricelist_id)
+        lap('save_pricelist')
 
         imported_count = created_count + updated_count
         logger.info(
@@ -2108,6 +2184,7 @@ async def import_price_list(
                 "updated": updated_count,
                 "skipped": skipped_count,
                 "skipped_reasons": skipped_reasons,
+                "unpublishable": unpublishable_count,
                 "deactivated": deactivated_count,
             }
         )
@@ -2145,6 +2222,7 @@ async def import_price_list(
             "updated": updated_count,
             "skipped": skipped_count,
             "skipped_reasons": skipped_reasons,
+            "unpublishable": unpublishable_count,
             "total_rows_read": total_rows_read,
             "deactivated": deactivated_count,
             "pricelist_id": new_pricelist_id,
@@ -2187,6 +2265,9 @@ async def deactivate_pricelist(
         {'$set': {'active': False, 'deactivated_at': datetime.now(timezone.utc)}}
     )
     
+    await _record_catalog_change("pricelist_deactivate", supplier_id=pricelist.get('supplierId'),
+                                 pricelist_id=pricelist_id)
+
     # Deactivate pricelist metadata
     await db.pricelists.update_one(
         {'id': pricelist_id},
@@ -2216,8 +2297,10 @@ async def delete_pricelist(
     if not pricelist:
         raise HTTPException(status_code=404, detail="Pricelist not found")
     
-    # Delete all items from this pricelist
+    # Delete all items from this pricelist (cores first: deleted offers can't be resolved later)
+    cores = await db.supplier_items.distinct('product_core_id', {'price_list_id': pricelist_id})
     items_result = await db.supplier_items.delete_many({'price_list_id': pricelist_id})
+    await _record_catalog_change("pricelist_delete", product_core_ids=cores, pricelist_id=pricelist_id)
     
     # Delete pricelist metadata
     await db.pricelists.delete_one({'id': pricelist_id})
@@ -2346,19 +2429,11 @@ async def upload_document(
     env_val = os.environ.get('ENV', 'production').lower()
     is_dev = env_val in ('development', 'local', 'dev', '') or 'local' in db_name or 'test' in db_name
     if auto_accept and is_dev:
-        suppliers = await db.companies.find({"type": "supplier"}, {"_id": 0, "id": 1}).to_list(500)
-        now = datetime.now(timezone.utc).isoformat()
-        for s in suppliers:
-            await db.supplier_restaurant_settings.update_one(
-                {"supplierId": s["id"], "restaurantId": company["id"]},
-                {"$set": {
-                    "contract_accepted": True,
-                    "is_paused": False,
-                    "ordersEnabled": True,
-                    "updatedAt": now
-                }},
-                upsert=True
-            )
+        # One bulk_write for all suppliers; also rebuilds this restaurant's view rows
+        await link_restaurant_to_all_suppliers(db, company["id"], accept=True)
+    else:
+        # Documents / requisites in supplier views
+        await refresh_restaurant_in_view(db, company["id"])
 
     return document
 
@@ -3438,7 +3513,7 @@ async def update_my_profile(data: dict, current_user: dict = Depends(get_current
 @api_router.post("/favorites")
 async def add_to_favorites(data: dict, current_user: dict = Depends(get_current_user)):
     """Add product to favorites with SCHEMA V2 (brand_critical + origin support)"""
-    from brand_master import brand_master
+    from brand_master import get_brand_master
     from search_engine import extract_tokens, extract_pack_value
     
     # Get user's company
@@ -3470,7 +3545,8 @@ async def add_to_favorites(data: dict, current_user: dict = Depends(get_current_
     brand_name = None
     brand_strict = False
     
-    if brand_master:
+    brand_master = get_brand_master()
+    if brand_master.brands_by_id:
         brand_id, brand_strict = brand_master.detect_brand(product['name'])
         if brand_id:
             brand_info = brand_master.get_brand_info(brand_id)
@@ -3630,6 +3706,59 @@ async def update_favorite_brand_mode(favorite_id: str, data: dict, current_user:
     return {"message": "Brand mode updated", "brandMode": brand_mode, "brand_critical": brand_critical}
 
 
+# supplier_items fields read by add-from-favorite candidate building
+ADD_FROM_FAVORITE_FIELDS = (
+    'id', 'supplier_company_id', 'name_raw', 'price', 'super_class', 'product_core_id', 'unit_norm',
+    'brand_id', 'origin_country', 'origin_region', 'origin_city', 'net_weight_kg', 'net_volume_l',
+    'base_unit', 'min_order_qty', 'pack_qty', 'active',
+)
+
+
+# Hybrid matcher table (favorites v2, add-from-favorite, orders): compact supplier_items +
+# pre-parsed features + per-favorite winners, valid for one catalog version
+FAVORITES_MATCH_CACHE_MAX_AGE_SEC = 600
+FAVORITES_MATCH_MEMO_SIZE = 20000
+_favorites_match_cache: Dict[str, Any] = {}
+_favorites_match_lock = asyncio.Lock()
+# Republished by the workers when catalog_change_log moves (SHARED_CATALOG_PUBLISH_SEC, 0 = only
+# `python shared_catalog.py --root $SHARED_CATALOG_DIR`); unset dir = per-worker OfferStore
+SHARED_CATALOG_DIR = os.environ.get('SHARED_CATALOG_DIR')
+SHARED_CATALOG_PUBLISH_SEC = float(os.environ.get('SHARED_CATALOG_PUBLISH_SEC', PUBLISH_INTERVAL_SEC))
+_shared_catalog = SharedCatalogReader(SHARED_CATALOG_DIR) if SHARED_CATALOG_DIR else None
+_shared_catalog_publisher = SharedCatalogPublisher(db.delegate, SHARED_CATALOG_DIR) if SHARED_CATALOG_DIR else None
+
+
+async def _favorites_match_table() -> Dict[str, Any]:
+    """Active supplier_items with build_item_features, rebuilt when the catalog version moves.
+    
+    Items come from the shared memory-mapped snapshot when one is published for
+    the current catalog version, otherwise (no snapshot, or one behind
+    catalog_change_log) from Mongo into a per-worker OfferStore. Both paths
+    hold the same set: every active offer with offer_projection().
+    """
+    from matching.hybrid_matcher import build_item_features
+    
+    version = await asyncio.to_thread(catalog_change_version, db.delegate)
+    shared = await asyncio.to_thread(_shared_catalog.current_for, version) if _shared_catalog else None
+    if shared is not None:
+        version = f"shared:{shared.name}"
+    async with _favorites_match_lock:
+        cached = _favorites_match_cache
+        if (cached and cached['version'] == version
+                and time.monotonic() - cached['built_at'] < FAVORITES_MATCH_CACHE_MAX_AGE_SEC):
+            return cached
+        if shared is not None:
+            items = shared
+        else:
+            items = await OfferStore.from_cursor(
+                db.supplier_items.find({"active": True}, offer_projection()))
+        features = await asyncio.to_thread(build_item_features, items)
+        _favorites_match_cache.clear()
+        _favorites_match_cache.update(version=version, built_at=time.monotonic(),
+                                      items=items, features=features, winners={})
+        return _favorites_match_cache
+
+
 # NEW UNIVERSAL MATCHING ENGINE ENDPOINT
 @api_router.get("/favorites/v2")
 async def get_favorites_v2(current_user: dict = Depends(get_current_user)):
@@ -3645,17 +3774,23 @@ async def get_favorites_v2(current_user: dict = Depends(get_current_user)):
     all_companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
     companies_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in all_companies}
     
-    # Load ALL supplier_items once (NEW collection with price_per_base_unit)
-    all_items = await db.supplier_items.find({"active": True}, {"_id": 0}).to_list(15000)
+    # Original products and price lists for all favorites in two queries
+    product_ids = list({fav['productId'] for fav in favorites})
+    products = await db.products.find({"id": {"$in": product_ids}}, {"_id": 0}).to_list(len(product_ids))
+    products_map = {p['id']: p for p in products}
+    price_lists_map = {}
+    async for pl in db.price_lists.find({"productId": {"$in": product_ids}}, {"_id": 0}):
+        price_lists_map.setdefault(pl['productId'], pl)
     
+    table = None
     enriched = []
     
     for fav in favorites:
         mode = fav.get('mode', 'exact')
         
         # Get original product
-        original_product = await db.products.find_one({"id": fav['productId']}, {"_id": 0})
-        original_pl = await db.price_lists.find_one({"productId": fav['productId']}, {"_id": 0})
+        original_product = products_map.get(fav['productId'])
+        original_pl = price_lists_map.get(fav['productId'])
         original_price = fav.get('originalPrice') or (original_pl['price'] if original_pl else None)
         
         if not original_product or not original_price:
@@ -3668,13 +3803,23 @@ async def get_favorites_v2(current_user: dict = Depends(get_current_user)):
             # - When unchecked: strictBrand=false → KEEP brand (search same brand only)
             ignore_brand = fav.get('strictBrand', False)
             
-            # Use HYBRID matcher
-            winner = find_best_match_hybrid(
-                query_product_name=original_product['name'],
-                original_price=original_price,
-                all_items=all_items,
-                strict_brand_override=not ignore_brand  # Invert: if ignore=True, strict=False
-            )
+            # Use HYBRID matcher (memoized per catalog version)
+            if table is None:
+                table = await _favorites_match_table()
+            memo_key = (original_product['name'], original_price, not ignore_brand)
+            if memo_key in table['winners']:
+                winner = table['winners'][memo_key]
+            else:
+                winner = find_best_match_hybrid(
+                    query_product_name=original_product['name'],
+                    original_price=original_price,
+                    all_items=table['items'],
+                    strict_brand_override=not ignore_brand,  # Invert: if ignore=True, strict=False
+                    item_features=table['features']
+                )
+                if len(table['winners']) >= FAVORITES_MATCH_MEMO_SIZE:
+                    table['winners'].clear()
+                table['winners'][memo_key] = winner
             
             if winner:
                 enriched.append({
@@ -3740,135 +3885,6 @@ async def get_favorites_simple(current_user: dict = Depends(get_current_user)):
     
     # Return simple data - NO matching, NO prices
     return favorites
-    
-    if not favorites:
-        return []
-    
-    # Get companies map
-    all_companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
-    companies_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in all_companies}
-    
-    enriched = []
-    
-    for fav in favorites:
-        mode = fav.get('mode', 'exact')
-        
-        # Get original product info
-        original_product = await db.products.find_one({"id": fav['productId']}, {"_id": 0})
-        original_pl = await db.price_lists.find_one({"productId": fav['productId']}, {"_id": 0})
-        original_price = fav.get('originalPrice') or (original_pl['price'] if original_pl else None)
-        
-        if not original_product or not original_price:
-            continue
-        
-        if mode == 'cheapest':
-            # CHEAPEST MODE: Find products with same type AND similar weight/attributes
-            original_type = extract_product_type(original_product['name'].lower())
-            original_weight = extract_weight_kg(original_product['name'])
-            original_caliber = extract_caliber(original_product['name'])
-            
-            # Find all products with same type
-            all_products = await db.price_lists.find(
-                {"price": {"$gt": 0}},  # Exclude 0 price items
-                {"_id": 0}
-            ).to_list(10000)
-            
-            matches = []
-            for prod in all_products:
-                prod_type = extract_product_type(prod['productName'].lower())
-                
-                # PRIMARY TYPE MUST MATCH EXACTLY
-                if prod_type != original_type:
-                    continue
-                
-                # Skip if price not cheaper
-                if prod['price'] >= original_price:
-                    continue
-                
-                # For products with CALIBER: caliber MUST match
-                # Caliber represents important attributes: shrimp size, fish size, fat %, piece count
-                # Examples: 16/20 (shrimp), 4/5 (salmon), 90/10 (beef fat %), 100/110 (cucumber size)
-                if original_caliber:
-                    prod_caliber = extract_caliber(prod['productName'])
-                    # If original has caliber, found product MUST have same caliber
-                    if not prod_caliber or prod_caliber != original_caliber:
-                        continue
-                
-                # Check weight similarity (±20% tolerance)
-                prod_weight = extract_weight_kg(prod['productName'])
-                
-                # STRICT: Both products must have weight info for comparison
-                if original_weight and prod_weight:
-                    weight_diff = abs(original_weight - prod_weight) / original_weight
-                    # Skip if weight difference > 20%
-                    if weight_diff > 0.20:
-                        continue
-                elif original_weight or prod_weight:
-                    # One has weight, one doesn't - skip to avoid false matches
-                    continue
-                # If both have no weight info, allow match (rare edge case)
-                
-                # Get supplier info
-                supplier_id = prod.get('supplierId')
-                supplier_name = companies_map.get(supplier_id, 'Unknown')
-                
-                matches.append({
-                    'productName': prod['productName'],
-                    'price': prod['price'],
-                    'supplierId': supplier_id,
-                    'supplierName': supplier_name,
-                    'productId': prod.get('productId'),
-                    'article': prod.get('article'),
-                    'weight': prod_weight
-                })
-            
-            # Sort by price (cheapest first)
-            matches.sort(key=lambda x: x['price'])
-            
-            if matches:
-                best = matches[0]
-                enriched.append({
-                    **fav,
-                    "mode": mode,
-                    "originalPrice": original_price,
-                    "bestPrice": best['price'],
-                    "bestSupplier": best['supplierName'],
-                    "productName": fav.get('productName', original_product['name']),
-                    "productCode": fav.get('productCode', original_product.get('article', '')),
-                    "unit": fav.get('unit', original_product.get('unit', 'шт')),
-                    "foundProduct": {
-                        "name": best['productName'],
-                        "price": best['price'],
-                        "weight": best.get('weight')
-                    },
-                    "hasCheaperMatch": True,
-                    "matchCount": len(matches)
-                })
-            else:
-                enriched.append({
-                    **fav,
-                    "mode": mode,
-                    "bestPrice": original_price,
-                    "bestSupplier": companies_map.get(fav.get('originalSupplierId', ''), 'Unknown'),
-                    "productName": fav.get('productName', original_product['name']),
-                    "productCode": fav.get('productCode', original_product.get('article', '')),
-                    "unit": fav.get('unit', original_product.get('unit', 'шт')),
-                    "fallbackMessage": "Аналоги найдены, но текущая цена уже лучшая",
-                    "hasCheaperMatch": False
-                })
-        else:
-            # EXACT MODE
-            enriched.append({
-                **fav,
-                "mode": mode,
-                "bestPrice": original_price,
-                "bestSupplier": companies_map.get(fav.get('originalSupplierId', ''), 'Unknown'),
-                "productName": fav.get('productName', original_product['name']),
-                "productCode": fav.get('productCode', original_product.get('article', '')),
-                "unit": fav.get('unit', original_product.get('unit', 'шт'))
-            })
-    
-    return enriched
 
 @api_router.put("/favorites/{favorite_id}/position")
 async def update_favorite_position(favorite_id: str, data: dict, current_user: dict = Depends(get_current_user)):
@@ -3946,15 +3962,16 @@ async def resolve_favorite_price(data: dict, current_user: dict = Depends(get_cu
     
     # ALWAYS use hybrid matcher to find best price!
     # Even for same product - different suppliers may have different prices
-    all_items = await db.supplier_items.find({"active": True}, {"_id": 0}).to_list(15000)
+    table = await _favorites_match_table()
     
     # Use matcher with strict_brand based on brandCritical flag
     winner = find_best_match_hybrid(
         query_product_name=product['name'],
         original_price=float('inf'),  # No price limit - find cheapest overall
-        all_items=all_items,
+        all_items=table['items'],
         strict_brand_override=brand_critical,  # Respect brandCritical flag
-        similarity_threshold=0.65  # 65% threshold as per requirements
+        similarity_threshold=0.65,  # 65% threshold as per requirements
+        item_features=table['features']
     )
     
     if winner:
@@ -3993,6 +4010,9 @@ async def resolve_favorite_price(data: dict, current_user: dict = Depends(get_cu
 
 
 # ==================== NEW: SELECT BEST OFFER ENDPOINT ====================
+# References per /cart/select-offer:batch and /cart/add-from-favorite:batch call
+CART_BATCH_MAX_REFERENCES = 100
+
 class ReferenceItem(BaseModel):
     """Reference item (эталон) from favorites"""
     name_raw: str
@@ -4185,32 +4205,78 @@ def calculate_match_score(reference: dict, candidate: dict, brand_critical: bool
 
 
 
-@api_router.post("/cart/select-offer", response_model=SelectOfferResponse)
-async def select_best_offer(request: SelectOfferRequest, current_user: dict = Depends(get_current_user)):
-    """Select best offer (cheapest matching item) from all suppliers
+async def _select_offer_catalog() -> Dict[str, Any]:
+    """Company names + products joined with pricelists, ready for calculate_match_score.
     
-    This is the CORE endpoint for automatic best price selection.
+    Names are normalized and weights parsed once per product, not per pricelist.
+    'items' is None when there are no products or no pricelists.
+    """
+    from pipeline.normalizer import normalize_name
+    from pipeline.enricher import extract_super_class, extract_weights
+    logger = hot_logger('select_offer', __name__)
     
-    Logic:
-    1. Find candidates among all products + pricelists
-    2. Score each candidate (brand_weight=0 when brand_critical=false!)
-    3. Apply threshold (default 0.85)
-    4. If brand_critical=true: filter by brand_id
-    5. Select cheapest by total_cost
+    companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
+    company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
     
-    IMPORTANT (brand_critical rule):
-    - brand_critical=false: brand is COMPLETELY NEUTRAL (no filter, no score bonus)
-    - brand_critical=true: brand is required (filter + bonus)
+    # Load ALL products and pricelists (actual data source)
+    all_products = await db.products.find({}, {"_id": 0}).to_list(10000)
+    all_pricelists = await db.pricelists.find({}, {"_id": 0}).to_list(20000)
+    if not all_products or not all_pricelists:
+        return {'company_map': company_map, 'items': None}
     
-    NULL-SAFE: Returns structured response, never 500 error.
-    Possible statuses in 'reason' field:
-    - None (success)
-    - NO_MATCH_OVER_THRESHOLD
-    - INSUFFICIENT_DATA
-    - NOT_FOUND
-    """
-    import logging
-    logger = logging.getLogger(__name__)
+    product_map = {p['id']: p for p in all_products}
+    parsed: Dict[str, tuple] = {}
+    
+    # Build items list with price info (products + pricelists joined)
+    all_items = []
+    for pl in all_pricelists:
+        product = product_map.get(pl['productId'])
+        if not product:
+            continue
+        
+        if product['id'] not in parsed:
+            name = product.get('name', '')
+            name_norm = normalize_name(name)
+            parsed[product['id']] = (name_norm, extract_super_class(name_norm), extract_weights(name).get('net_weight_kg'))
+        name_norm, super_class, net_weight = parsed[product['id']]
+        
+        # Enrich product with pricelist data
+        item = {
+            'id': pl['id'],
+            'product_id': product['id'],
+            'name_raw': product.get('name', ''),
+            'name_norm': name_norm,
+            'price': pl['price'],
+            'price_per_base_unit': pl['price'],  # Default - will be recalculated if weight found
+            'supplier_company_id': pl['supplierId'],
+            'unit_norm': product.get('unit', 'kg'),
+            'super_class': super_class,
+            # USE brand_id from product (set by backfill from new brand master)
+            'brand_id': product.get('brand_id'),
+            'brand_strict': product.get('brand_strict', False),
+        }
+        
+        # Weight → price_per_base_unit
+        if net_weight and net_weight > 0:
+            item['net_weight_kg'] = net_weight
+            item['price_per_base_unit'] = pl['price'] / net_weight
+        
+        all_items.append(item)
+    
+    logger.info("📊 Loaded %s items from products+pricelists", len(all_items))
+    
+    # DEBUG: Check barco items
+    barco_items = [i for i in all_items if i.get('brand_id') == 'barco']
+    logger.info("🏷️ DEBUG: Found %s items with brand_id='barco'", len(barco_items))
+    for bi in barco_items[:3]:
+        logger.info("   - %s: price=%s", bi['name_raw'][:40], bi['price'])
+    
+    return {'company_map': company_map, 'items': all_items}
+
+
+async def _select_best_offer(request: SelectOfferRequest, catalog: Optional[Dict[str, Any]] = None) -> SelectOfferResponse:
+    """select-offer for one reference; `catalog` from _select_offer_catalog() is loaded here when None"""
+    logger = hot_logger('select_offer', __name__)
     
     try:
         ref = request.reference_item.model_dump()
@@ -4228,11 +4294,11 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
         
         # DEBUG: Log brand_critical status (null-safe)
         brand_weight = 0.10 if brand_critical else 0.0
-        logger.info(f"🔍 SELECT_BEST_OFFER:")
-        logger.info(f"   ref='{ref_name[:50] if ref_name else 'N/A'}'")
-        logger.info(f"   brand_critical={brand_critical}, brand_weight={brand_weight}")
-        logger.info(f"   brand_id filter applied: {'YES' if brand_critical else 'NO'}")
-        logger.info(f"   threshold={threshold}")
+        logger.info("🔍 SELECT_BEST_OFFER:")
+        logger.info("   ref='%s'", ref_name[:50] if ref_name else 'N/A')
+        logger.info("   brand_critical=%s, brand_weight=%s", brand_critical, brand_weight)
+        logger.info("   brand_id filter applied: %s", 'YES' if brand_critical else 'NO')
+        logger.info("   threshold=%s", threshold)
         
         # Enrich reference item if needed
         from pipeline.normalizer import normalize_name
@@ -4248,63 +4314,17 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
             weight_data = extract_weights(ref_name)
             ref['pack_value'] = weight_data.get('net_weight_kg')
         
-        # Load company names map
-        companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
-        company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
-        
-        # Load ALL products and pricelists (actual data source)
-        all_products = await db.products.find({}, {"_id": 0}).to_list(10000)
-        all_pricelists = await db.pricelists.find({}, {"_id": 0}).to_list(20000)
-        
-        if not all_products or not all_pricelists:
+        # Companies + products×pricelists: shared by the whole batch when preloaded
+        if catalog is None:
+            catalog = await _select_offer_catalog()
+        if catalog['items'] is None:
             logger.warning("❌ SELECT_BEST_OFFER: No products or pricelists in database")
             return SelectOfferResponse(
                 selected_offer=None,
                 reason="NOT_FOUND"
             )
-        
-        # Build product lookup
-        product_map = {p['id']: p for p in all_products}
-    
-        # Build items list with price info (products + pricelists joined)
-        all_items = []
-        for pl in all_pricelists:
-            product = product_map.get(pl['productId'])
-            if not product:
-                continue
-            
-            # Enrich product with pricelist data
-            item = {
-                'id': pl['id'],
-                'product_id': product['id'],
-                'name_raw': product.get('name', ''),
-                'name_norm': normalize_name(product.get('name', '')),
-                'price': pl['price'],
-                'price_per_base_unit': pl['price'],  # Default - will be recalculated if weight found
-                'supplier_company_id': pl['supplierId'],
-                'unit_norm': product.get('unit', 'kg'),
-                'super_class': extract_super_class(normalize_name(product.get('name', ''))),
-                # USE brand_id from product (set by backfill from new brand master)
-                'brand_id': product.get('brand_id'),
-                'brand_strict': product.get('brand_strict', False),
-            }
-            
-            # Extract weight for price_per_base_unit calculation
-            weight_data = extract_weights(product.get('name', ''))
-            net_weight = weight_data.get('net_weight_kg')
-            if net_weight and net_weight > 0:
-                item['net_weight_kg'] = net_weight
-                item['price_per_base_unit'] = pl['price'] / net_weight
-            
-            all_items.append(item)
-        
-        logger.info(f"📊 Loaded {len(all_items)} items from products+pricelists")
-        
-        # DEBUG: Check barco items
-        barco_items = [i for i in all_items if i.get('brand_id') == 'barco']
-        logger.info(f"🏷️ DEBUG: Found {len(barco_items)} items with brand_id='barco'")
-        for bi in barco_items[:3]:
-            logger.info(f"   - {bi['name_raw'][:40]}: price={bi['price']}")
+        company_map = catalog['company_map']
+        all_items = catalog['items']
         
         # Filter and score candidates
         candidates = []
@@ -4343,7 +4363,7 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
         if debug_scores:
             debug_scores.sort(key=lambda x: -x['score'])
             ref_name_short = (ref.get('name_raw') or '')[:30]
-            logger.info(f"🎯 Top-10 candidates for '{ref_name_short}' (brand_critical={brand_critical}):")
+            logger.info("🎯 Top-10 candidates for '%s' (brand_critical=%s):", ref_name_short, brand_critical)
             
             # Count unique brands in top scores
             brands_in_top = set()
@@ -4352,13 +4372,13 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
                 price_str = f"{d['price']:>8.2f}" if d.get('price') is not None else "     N/A"
                 brand_str = str(d.get('brand_id') or 'none')[:12]
                 name_str = str(d.get('name') or '')[:35]
-                logger.info(f"   {d['score']:.2f} | {price_str}₽ | brand={brand_str:12} | {name_str}")
+                logger.info("   %.2f | %s₽ | brand=%-12s | %s", d['score'], price_str, brand_str, name_str)
             
-            logger.info(f"📊 Unique brands in top-10: {len(brands_in_top)} ({', '.join(str(b) for b in brands_in_top)})")
+            logger.info("📊 Unique brands in top-10: %s (%s)", len(brands_in_top), ', '.join(str(b) for b in brands_in_top))
         
         if not candidates:
             ref_name_short = (ref.get('name_raw') or '')[:50]
-            logger.warning(f"❌ NO MATCH for '{ref_name_short}' with threshold {threshold}")
+            logger.warning("❌ NO MATCH for '%s' with threshold %s", ref_name_short, threshold)
             return SelectOfferResponse(
                 selected_offer=None,
                 reason="NO_MATCH_OVER_THRESHOLD"
@@ -4397,7 +4417,7 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
         ))
         
         winner = candidates[0]
-        logger.info(f"✅ Found {len(candidates)} candidates. Winner: {winner['item']['price']:.2f}₽ x {winner['units_needed']:.1f} = {winner['total_cost']:.2f}₽ total for {required_volume} units")
+        logger.info("✅ Found %s candidates. Winner: %.2f₽ x %.1f = %.2f₽ total for %s units", len(candidates), winner['item']['price'], winner['units_needed'], winner['total_cost'], required_volume)
         
         # Select winner
         winner_item = winner['item']
@@ -4442,7 +4462,7 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
         # NULL-SAFE: Catch any unexpected errors and return structured response
         import traceback
         logger = logging.getLogger(__name__)
-        logger.error(f"❌ SELECT_BEST_OFFER error: {str(e)}")
+        logger.error("❌ SELECT_BEST_OFFER error: %s", str(e))
         logger.error(traceback.format_exc())
         
         return SelectOfferResponse(
@@ -4451,6 +4471,53 @@ async def select_best_offer(request: SelectOfferRequest, current_user: dict = De
         )
 
 
+@api_router.post("/cart/select-offer", response_model=SelectOfferResponse)
+async def select_best_offer(request: SelectOfferRequest, current_user: dict = Depends(get_current_user)):
+    """Select best offer (cheapest matching item) from all suppliers
+    
+    This is the CORE endpoint for automatic best price selection.
+    
+    Logic:
+    1. Find candidates among all products + pricelists
+    2. Score each candidate (brand_weight=0 when brand_critical=false!)
+    3. Apply threshold (default 0.85)
+    4. If brand_critical=true: filter by brand_id
+    5. Select cheapest by total_cost
+    
+    IMPORTANT (brand_critical rule):
+    - brand_critical=false: brand is COMPLETELY NEUTRAL (no filter, no score bonus)
+    - brand_critical=true: brand is required (filter + bonus)
+    
+    NULL-SAFE: Returns structured response, never 500 error.
+    Possible statuses in 'reason' field:
+    - None (success)
+    - NO_MATCH_OVER_THRESHOLD
+    - INSUFFICIENT_DATA
+    - NOT_FOUND
+    """
+    return await _select_best_offer(request)
+
+
+class SelectOfferBatchRequest(BaseModel):
+    """Several select-offer references scored against one catalog load"""
+    items: List[SelectOfferRequest] = Field(..., min_length=1, max_length=CART_BATCH_MAX_REFERENCES)
+
+
+@api_router.post("/cart/select-offer:batch", response_model=List[SelectOfferResponse])
+async def select_best_offers_batch(request: SelectOfferBatchRequest, current_user: dict = Depends(get_current_user)):
+    """Batch /cart/select-offer: one response per reference, in request order.
+    
+    Companies, products and pricelists are loaded and parsed once for the whole
+    batch; every reference is then scored against that shared table.
+    """
+    try:
+        catalog = await _select_offer_catalog()
+    except Exception as e:
+        logging.getLogger(__name__).error("❌ SELECT_BEST_OFFER batch load error: %s", str(e))
+        return [SelectOfferResponse(selected_offer=None, reason=f"ERROR: {str(e)}") for _ in request.items]
+    return await asyncio.gather(*(_select_best_offer(item, catalog) for item in request.items))
+
+
 # ==================== ADD FROM FAVORITE TO CART ====================
 
 class AddFromFavoriteRequest(BaseModel):
@@ -4479,45 +4546,63 @@ class AddFromFavoriteResponse(BaseModel):
     actual_qty: Optional[float] = None
 
 
-@api_router.post("/cart/add-from-favorite", response_model=AddFromFavoriteResponse)
-async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_user: dict = Depends(get_current_user)):
-    """Add item from favorites to cart with ENHANCED BEST PRICE SEARCH
+async def _add_lines_to_cart(user_id: str, lines: List[dict]):
+    """Merge cart lines into the user's db.cart document (one read + one replace)"""
+    user_cart = await db.cart.find_one({"userId": user_id}, {"_id": 0})
     
-    VERSION 4.0 (P0 Guards Fix):
-    - Guards applied to CANDIDATE, not reference
-    - Fixed active filter: offer_status="ACTIVE"
-    - Diagnostic fields: build_sha, request_id, counts, guards_applied
-    - SEARCH_SUMMARY log for tracing
+    if not user_cart:
+        user_cart = {
+            "userId": user_id,
+            "items": []
+        }
     
-    CRITICAL RULES:
-    1. NEVER use supplier_item_id from favorite directly
-    2. ALWAYS run full search
-    3. Guards check CANDIDATE.name_raw (forbidden + required_anchors)
-    4. brand_critical=false: brand COMPLETELY IGNORED
-    5. brand_critical=true: filter by brand_id
-    6. Pack must be in range: ±20% of reference
-    7. Return structured response (never 500)
+    for line in lines:
+        # Check if item already in cart
+        existing_item = next((item for item in user_cart.get('items', [])
+                            if item['pricelistId'] == line['pricelistId']), None)
+        
+        if existing_item:
+            existing_item['quantity'] += line['quantity']
+        else:
+            user_cart.setdefault('items', []).append(dict(line))
+    
+    await db.cart.replace_one(
+        {"userId": user_id},
+        user_cart,
+        upsert=True
+    )
+
+
+async def _add_from_favorite(request: AddFromFavoriteRequest, current_user: dict,
+                             preloaded: Optional[Dict[str, Any]] = None) -> AddFromFavoriteResponse:
+    """add-from-favorite for one favorite.
+    
+    `preloaded` (batch): favorite, its core's supplier_items, total_active,
+    company_map; the cart line goes to preloaded['cart_lines'] instead of db.cart.
     """
-    import logging
     import uuid
-    import json
-    
-    logger = logging.getLogger(__name__)
     
     # Generate unique request_id for tracing
     request_id = str(uuid.uuid4())[:8]
     
+    # Sampled, queue-backed request logger (see log_pipeline)
+    logger = hot_logger('add_from_favorite', __name__, request_id=request_id)
+    
     try:
         # Step 1: Get favorite from DB
-        logger.info(f"🔍 ADD_FROM_FAVORITE [request_id={request_id}]: Looking for favorite_id={request.favorite_id}, userId={current_user['id']}")
-        favorite = await db.favorites.find_one({"id": request.favorite_id, "userId": current_user['id']}, {"_id": 0})
+        logger.info("🔍 ADD_FROM_FAVORITE [request_id=%s]: Looking for favorite_id=%s, userId=%s", request_id, request.favorite_id, current_user['id'])
+        if preloaded is not None:
+            favorite = preloaded['favorite']
+        else:
+            favorite = await db.favorites.find_one({"id": request.favorite_id, "userId": current_user['id']}, {"_id": 0})
+        lap('load_favorite')
         
         if not favorite:
-            logger.warning(f"❌ ADD_FROM_FAVORITE: Favorite not found: {request.favorite_id}")
+            logger.warning("❌ ADD_FROM_FAVORITE: Favorite not found: %s", request.favorite_id)
             # Check if favorite exists with different userId
             any_fav = await db.favorites.find_one({"id": request.favorite_id}, {"_id": 0, "userId": 1})
             if any_fav:
-                logger.warning(f"   Favorite exists but with different userId: {any_fav.get('userId')}")
+                logger.warning("   Favorite exists but with different userId: %s", any_fav.get('userId'))
             return AddFromFavoriteResponse(
                 status="not_found",
                 message="Favorite not found"
@@ -4558,7 +4643,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             geo_as_brand = True
             brand_critical = True
             brand_id = geo_filter_value
-            logger.info(f"   🌍 GEO_AS_BRAND: {geo_filter_type}='{geo_filter_value}' → brand_critical=True (was brand_id='{original_brand_id}')")
+            logger.info("   🌍 GEO_AS_BRAND: %s='%s' → brand_critical=True (was brand_id='%s')", geo_filter_type, geo_filter_value, original_brand_id)
         
         # Legacy alias for backward compatibility
         country_as_brand = geo_as_brand and geo_filter_type == 'country'
@@ -4573,14 +4658,14 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             'pack': pack_size
         }
         
-        logger.info(f"🎯 ADD_FROM_FAVORITE:")
-        logger.info(f"   favorite_id={request.favorite_id}")
-        logger.info(f"   reference_name='{reference_name[:50]}'")
-        logger.info(f"   brand_critical={brand_critical}, brand_id={brand_id}")
+        logger.info("🎯 ADD_FROM_FAVORITE:")
+        logger.info("   favorite_id=%s", request.favorite_id)
+        logger.info("   reference_name='%s'", reference_name[:50])
+        logger.info("   brand_critical=%s, brand_id=%s", brand_critical, brand_id)
         
         # P0: Parse reference pack using unit_normalizer
         ref_pack_info = parse_pack_from_text(reference_name)
-        logger.info(f"   ref_pack: type={ref_pack_info.unit_type.value}, qty={ref_pack_info.base_qty}, conf={ref_pack_info.confidence}")
+        logger.info("   ref_pack: type=%s, qty=%s, conf=%s", ref_pack_info.unit_type.value, ref_pack_info.base_qty, ref_pack_info.confidence)
         
         if origin_country:
             origin_str = origin_country
@@ -4588,15 +4673,23 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 origin_str += f"/{origin_region}"
             if origin_city:
                 origin_str += f"/{origin_city}"
-            logger.info(f"   origin={origin_str}")
-        logger.info(f"   unit={unit_norm}, pack={pack_size}, qty={request.qty}")
+            logger.info("   origin=%s", origin_str)
+        logger.info("   unit=%s, pack=%s, qty=%s", unit_norm, pack_size, request.qty)
+        
+        lap('prepare_reference')
         
         # Step 4: Get all SUPPLIER_ITEMS (candidates) - ПРАВИЛЬНАЯ КОЛЛЕКЦИЯ!
         # Using {"active": True} as offer_status field is not populated yet
-        supplier_items_cursor = db.supplier_items.find({"active": True}, {"_id": 0})
-        supplier_items = await supplier_items_cursor.to_list(length=None)
+        # Only the fields the candidate dicts below are built from
+        if preloaded is not None:
+            # Batch: only this favorite's product_core, loaded once for the whole batch
+            supplier_items = preloaded['supplier_items']
+        else:
+            supplier_items_cursor = db.supplier_items.find({"active": True}, offer_projection(ADD_FROM_FAVORITE_FIELDS))
+            supplier_items = await supplier_items_cursor.to_list(length=None)
+        lap('mongo_load_candidates')
         
-        logger.info(f"   📊 Loaded {len(supplier_items)} ACTIVE supplier_items")
+        logger.info("   📊 Loaded %s ACTIVE supplier_items", len(supplier_items))
         
         # Build candidates from supplier_items
         candidates = []
@@ -4623,14 +4716,18 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             }
             candidates.append(candidate)
         
-        logger.info(f"   Total candidates: {len(candidates)}")
+        logger.info("   Total candidates: %s", len(candidates))
         
         # Step 5: Get company map for supplier names
-        companies = await db.companies.find({}, {"_id": 0}).to_list(1000)
-        company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
+        if preloaded is not None:
+            company_map = preloaded['company_map']
+        else:
+            companies = await db.companies.find({}, {"_id": 0}).to_list(1000)
+            company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
+        lap('build_candidates')
         
         # Step 6: ПРОСТОЙ ПОИСК С ДЕТАЛЬНЫМ ЛОГИРОВАНИЕМ
-        logger.info(f"🔍 НАЧАЛО ПОИСКА")
+        logger.info("🔍 НАЧАЛО ПОИСКА")
         
         # Detect super_class using UNIVERSAL mapper
         from universal_super_class_mapper import detect_super_class
@@ -4655,7 +4752,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         # P1: Detect product_core for reference (after super_class)
         from product_core_classifier import detect_product_core as classify_core
         ref_product_core, ref_core_conf = classify_core(reference_name, ref_super_class)
-        logger.info(f"   ref_product_core: {ref_product_core} (conf={ref_core_conf:.2f})")
+        lap('classify')
+        logger.info("   ref_product_core: %s (conf=%.2f)", ref_product_core, ref_core_conf)
         
         # Set context
         search_logger.set_context(
@@ -4666,7 +4764,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         )
         
         if not ref_super_class:
-            logger.warning(f"⚠️ super_class не определён для '{reference_name}' (confidence={confidence:.2f})")
+            logger.warning("⚠️ super_class не определён для '%s' (confidence=%.2f)", reference_name, confidence)
             search_logger.set_outcome('insufficient_data', 'INSUFFICIENT_CLASSIFICATION')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -4674,12 +4772,12 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 message="Категория продукта не определена"
             )
         
-        logger.info(f"   super_class: {ref_super_class} (confidence={confidence:.2f})")
+        logger.info("   super_class: %s (confidence=%.2f)", ref_super_class, confidence)
         search_logger.set_context(ref_super_class=ref_super_class, confidence=confidence)
         
         # Step 7: Filter candidates step-by-step with DETAILED LOGGING
-        total_candidates = len(candidates)
-        logger.info(f"   Total candidates: {total_candidates}")
+        total_candidates = preloaded['total_active'] if preloaded is not None else len(candidates)
+        logger.info("   Total candidates: %s", total_candidates)
         
         # Filter 1: Product Core Match (P1 STRICT MATCHING - NO FALLBACK)
         # Rule: Match ONLY by product_core_id
@@ -4687,7 +4785,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         
         if not ref_product_core or ref_core_conf < 0.3:
             # Cannot determine product_core reliably
-            logger.error(f"❌ Cannot determine product_core for '{reference_name}' (conf={ref_core_conf:.2f})")
+            logger.error("❌ Cannot determine product_core for '%s' (conf=%.2f)", reference_name, ref_core_conf)
             search_logger.set_outcome('not_found', 'CORE_NOT_DETECTED')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -4713,13 +4811,13 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             if c.get('product_core_id') == ref_product_core
             and c.get('price', 0) > 0
         ]
-        logger.info(f"   После product_core filter (STRICT, core={ref_product_core}): {len(step1)}")
+        logger.info("   После product_core filter (STRICT, core=%s): %s", ref_product_core, len(step1))
         search_logger.set_count('after_product_core_strict', len(step1))
         
         # If no matches by core → NOT_FOUND (no fallback!)
         if len(step1) == 0:
-            logger.error(f"❌ NO CANDIDATES for product_core={ref_product_core}")
-            logger.error(f"   Available cores in catalog: {list(set(c.get('product_core_id') for c in candidates if c.get('product_core_id')))[:10]}")
+            logger.error("❌ NO CANDIDATES for product_core=%s", ref_product_core)
+            logger.error("   Available cores in catalog: %s", list(set(c.get('product_core_id') for c in candidates if c.get('product_core_id')))[:10])
             search_logger.set_outcome('not_found', 'CORE_NO_CANDIDATES')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -4742,7 +4840,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         
         # P0.2 FALLBACK: Если не найдено по super_class, пробуем 'other' с keyword matching  
         if len(step1) == 0:
-            logger.warning(f"   ⚠️ Пробуем fallback на 'other' категорию с keyword matching...")
+            logger.warning("   ⚠️ Пробуем fallback на 'other' категорию с keyword matching...")
             
             # Try matching within 'other' category by keywords
             import re
@@ -4762,16 +4860,16 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             
             if step1_fallback:
                 step1 = step1_fallback
-                logger.info(f"   ✅ Fallback 'other': найдено {len(step1)} кандидатов")
+                logger.info("   ✅ Fallback 'other': найдено %s кандидатов", len(step1))
             else:
-                logger.error(f"   ❌ Fallback failed: нет совпадений")
+                logger.error("   ❌ Fallback failed: нет совпадений")
         
         if len(step1) == 0:
-            logger.error(f"❌ NO CANDIDATES after super_class filter")
-            logger.error(f"   Reference super_class: {ref_super_class}")
-            logger.error(f"   Total active: {sum(1 for si in supplier_items if si.get('active') == True)}")
-            logger.error(f"   With super_class: {sum(1 for c in candidates if c.get('super_class'))}")
-            logger.error(f"   Sample super_classes: {list(set(c.get('super_class') for c in candidates if c.get('super_class')))[:10]}")
+            logger.error("❌ NO CANDIDATES after super_class filter")
+            logger.error("   Reference super_class: %s", ref_super_class)
+            logger.error("   Total active: %s", sum(1 for si in supplier_items if si.get('active') == True))
+            logger.error("   With super_class: %s", sum(1 for c in candidates if c.get('super_class')))
+            logger.error("   Sample super_classes: %s", list(set(c.get('super_class') for c in candidates if c.get('super_class')))[:10])
             search_logger.set_outcome('not_found', 'NO_MATCHING_SUPER_CLASS')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -4784,6 +4882,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }
             )
         
+        lap('core_filter')
+        
         # Filter 2: GUARDS (FORBIDDEN + REQUIRED ANCHORS + SEED_DICT + CATEGORY + ATTRIBUTES) - Applied to CANDIDATE!
         step2_guards = []
         rejected_forbidden = 0
@@ -4800,21 +4900,21 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             cat_match, cat_reason = check_category_mismatch(reference_name, candidate_name, ref_super_class)
             if not cat_match:
                 rejected_category += 1
-                logger.debug(f"   ❌ CATEGORY_MISMATCH: '{candidate_name[:40]}' - {cat_reason}")
+                logger.debug("   ❌ CATEGORY_MISMATCH: '%s' - %s", candidate_name[:40], cat_reason)
                 continue
             
             # Check 0.5 (CRITICAL P0): Attribute compatibility - с хвостом vs без хвоста
             attr_match, attr_reason = check_attribute_compatibility(reference_name, candidate_name)
             if not attr_match:
                 rejected_attributes += 1
-                logger.debug(f"   ❌ ATTRIBUTE_MISMATCH: '{candidate_name[:40]}' - {attr_reason}")
+                logger.debug("   ❌ ATTRIBUTE_MISMATCH: '%s' - %s", candidate_name[:40], attr_reason)
                 continue
             
             # Check 1: Forbidden tokens (e.g., растительн, веган, сырник)
             has_forbidden, forbidden_word = has_negative_keywords(candidate_name, ref_super_class)
             if has_forbidden:
                 rejected_forbidden += 1
-                logger.debug(f"   ❌ FORBIDDEN: '{candidate_name[:40]}' contains '{forbidden_word}'")
+                logger.debug("   ❌ FORBIDDEN: '%s' contains '%s'", candidate_name[:40], forbidden_word)
                 continue
             
             # Check 2: Required anchors (e.g., васаби must contain васаби/wasabi)
@@ -4822,7 +4922,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             has_anchor, found_anchor = has_required_anchors(candidate_name, ref_super_class, reference_name)
             if not has_anchor:
                 rejected_anchors += 1
-                logger.debug(f"   ❌ MISSING_ANCHOR: '{candidate_name[:40]}' missing required anchor '{found_anchor}' for {ref_super_class}")
+                logger.debug("   ❌ MISSING_ANCHOR: '%s' missing required anchor '%s' for %s", candidate_name[:40], found_anchor, ref_super_class)
                 continue
             
             # Check 3: seed_dict_rules attributes (fat%, grade, size)
@@ -4830,13 +4930,13 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             seed_match, seed_reason = check_seed_dict_match(reference_name, candidate_name)
             if not seed_match:
                 rejected_seed_dict += 1
-                logger.debug(f"   ❌ SEED_DICT_MISMATCH: '{candidate_name[:40]}' - {seed_reason}")
+                logger.debug("   ❌ SEED_DICT_MISMATCH: '%s' - %s", candidate_name[:40], seed_reason)
                 continue
             
             # Passed all guards
             step2_guards.append(c)
         
-        logger.info(f"   После guards filter: {len(step2_guards)} (rejected: category={rejected_category}, attributes={rejected_attributes}, forbidden={rejected_forbidden}, anchor={rejected_anchors}, seed_dict={rejected_seed_dict})")
+        logger.info("   После guards filter: %s (rejected: category=%s, attributes=%s, forbidden=%s, anchor=%s, seed_dict=%s)", len(step2_guards), rejected_category, rejected_attributes, rejected_forbidden, rejected_anchors, rejected_seed_dict)
         search_logger.set_count('after_guards', len(step2_guards))
         search_logger.set_count('rejected_by_category_mismatch', rejected_category)
         search_logger.set_count('rejected_by_attribute_mismatch', rejected_attributes)
@@ -4845,7 +4945,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         search_logger.set_count('rejected_by_seed_dict', rejected_seed_dict)
         
         if len(step2_guards) == 0:
-            logger.error(f"❌ NO CANDIDATES after guards filter")
+            logger.error("❌ NO CANDIDATES after guards filter")
             search_logger.set_outcome('not_found', 'REJECTED_BY_GUARDS')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -4865,6 +4965,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }
             )
         
+        lap('guards')
+        
         # Filter 3: Brand (if brand_critical=ON) - STRICT + TEXT FALLBACK
         # P0 NEW: COUNTRY_AS_BRAND mode - фильтрация по стране вместо бренда
         if brand_critical and brand_id:
@@ -4873,7 +4975,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             # Check if we're in GEO_AS_BRAND mode (city/region/country cascade)
             if geo_as_brand:
                 # GEO_AS_BRAND: фильтруем по соответствующему географическому полю
-                logger.info(f"   🌍 GEO_AS_BRAND mode: filtering by {geo_filter_field}='{geo_filter_value}'")
+                logger.info("   🌍 GEO_AS_BRAND mode: filtering by %s='%s'", geo_filter_field, geo_filter_value)
                 
                 step3_brand = []
                 for c in step2_guards:
@@ -4881,7 +4983,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                     if cand_geo_value == geo_filter_value:
                         step3_brand.append(c)
                 
-                logger.info(f"   После geo filter ({geo_filter_type}='{geo_filter_value}'): {len(step3_brand)}")
+                logger.info("   После geo filter (%s='%s'): %s", geo_filter_type, geo_filter_value, len(step3_brand))
                 search_logger.set_count('after_geo_filter', len(step3_brand))
                 
                 # Geo diagnostics if no matches
@@ -4895,8 +4997,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                     geo_type_labels = {'city': 'Город', 'region': 'Регион', 'country': 'Страна'}
                     geo_label = geo_type_labels.get(geo_filter_type, 'Локация')
                     
-                    logger.warning(f"   ❌ {geo_label} '{geo_filter_value}' не найден среди кандидатов")
-                    logger.warning(f"   Available {geo_filter_type}s: {available_values}")
+                    logger.warning("   ❌ %s '%s' не найден среди кандидатов", geo_label, geo_filter_value)
+                    logger.warning("   Available %ss: %s", geo_filter_type, available_values)
                     search_logger.set_brand_diagnostics(
                         requested_brand_id=f"{geo_filter_type.upper()}:{geo_filter_value}",
                         available_brands_id=available_values,
@@ -4906,12 +5008,12 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 # Standard brand matching
                 # Step A: Strict brand_id filter
                 step3_brand_strict = [c for c in step2_guards if c.get('brand_id') == brand_id]
-                logger.info(f"   После brand_id filter (strict, brand_id={brand_id}): {len(step3_brand_strict)}")
+                logger.info("   После brand_id filter (strict, brand_id=%s): %s", brand_id, len(step3_brand_strict))
                 search_logger.set_count('after_brand_id_strict', len(step3_brand_strict))
                 
                 # Step B: Text fallback если strict дал 0
                 if len(step3_brand_strict) == 0:
-                    logger.warning(f"   ⚠️ Пробуем brand text fallback...")
+                    logger.warning("   ⚠️ Пробуем brand text fallback...")
                     
                     brand_aliases = load_brand_aliases()
                     step3_brand_fallback = []
@@ -4924,7 +5026,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                         if brand_from_text == brand_id:
                             step3_brand_fallback.append(c)
                     
-                    logger.info(f"   После brand text fallback: {len(step3_brand_fallback)}")
+                    logger.info("   После brand text fallback: %s", len(step3_brand_fallback))
                     search_logger.set_count('after_brand_text_fallback', len(step3_brand_fallback))
                     
                     step3_brand = step3_brand_fallback
@@ -4940,9 +5042,9 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                     brands_by_text = [c.get('_brand_from_text') for c in step2_guards if c.get('_brand_from_text')]
                     top_brands_text = list(set(brands_by_text))[:5]
                     
-                    logger.warning(f"   Бренд '{brand_id}' не найден")
-                    logger.warning(f"   Available brands (by ID): {top_brands_id}")
-                    logger.warning(f"   Available brands (by text): {top_brands_text}")
+                    logger.warning("   Бренд '%s' не найден", brand_id)
+                    logger.warning("   Available brands (by ID): %s", top_brands_id)
+                    logger.warning("   Available brands (by text): %s", top_brands_text)
                     
                     search_logger.set_brand_diagnostics(
                         requested_brand_id=brand_id,
@@ -4955,7 +5057,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                     # This handles cases where the brand is unique or not in the brand master
                     
                     if len(step2_guards) > 0:
-                        logger.warning(f"   🔄 BRAND_FALLBACK: Бренд '{brand_id}' не найден, ищем по названию товара...")
+                        logger.warning("   🔄 BRAND_FALLBACK: Бренд '%s' не найден, ищем по названию товара...", brand_id)
                         
                         # Extract product type from reference name (remove brand)
                         ref_name_without_brand = reference_name.lower()
@@ -4985,17 +5087,17 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                         # Sort by similarity score
                         brand_fallback_candidates.sort(key=lambda x: x.get('_brand_fallback_score', 0), reverse=True)
                         
-                        logger.info(f"   После brand_fallback (name similarity >= 70%): {len(brand_fallback_candidates)}")
+                        logger.info("   После brand_fallback (name similarity >= 70%%): %s", len(brand_fallback_candidates))
                         search_logger.set_count('after_brand_fallback', len(brand_fallback_candidates))
                         
                         if brand_fallback_candidates:
                             step3_brand = brand_fallback_candidates
-                            logger.info(f"   ✅ BRAND_FALLBACK успешно: найдено {len(step3_brand)} похожих товаров")
+                            logger.info("   ✅ BRAND_FALLBACK успешно: найдено %s похожих товаров", len(step3_brand))
             
             search_logger.set_count('after_brand_filter', len(step3_brand))
         else:
             step3_brand = step2_guards
-            logger.info(f"   Brand filter: SKIP (brand_critical={brand_critical})")
+            logger.info("   Brand filter: SKIP (brand_critical=%s)", brand_critical)
             search_logger.set_count('after_brand_filter', len(step3_brand))
         
         if len(step3_brand) == 0:
@@ -5031,6 +5133,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }
             )
         
+        lap('brand_filter')
+        
         # Filter 4: Unit Compatibility + Pack Calculation (P0 NEW LOGIC)
         # Added: pack_outlier rule (reject if packs_needed > 20)
         # Added: price_sanity rule (reject if price is absurdly low)
@@ -5060,13 +5164,13 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             # Check for UNIT_MISMATCH (critical rejection)
             if "UNIT_MISMATCH" in calc_reason:
                 unit_mismatch_count += 1
-                logger.debug(f"   ❌ UNIT_MISMATCH: {candidate_name[:40]} - {calc_reason}")
+                logger.debug("   ❌ UNIT_MISMATCH: %s - %s", candidate_name[:40], calc_reason)
                 continue  # REJECT this candidate
             
             # Check for pack_outlier (>20 упаковок)
             if packs_needed and packs_needed > PACK_OUTLIER_THRESHOLD:
                 pack_outlier_count += 1
-                logger.debug(f"   ❌ PACK_OUTLIER: {candidate_name[:40]} - packs_needed={packs_needed} > {PACK_OUTLIER_THRESHOLD}")
+                logger.debug("   ❌ PACK_OUTLIER: %s - packs_needed=%s > %s", candidate_name[:40], packs_needed, PACK_OUTLIER_THRESHOLD)
                 continue  # REJECT this candidate
             
             # NEW: Price sanity check
@@ -5082,7 +5186,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 )
                 if not price_sane:
                     price_sanity_rejected += 1
-                    logger.debug(f"   ❌ PRICE_INSANE: {candidate_name[:40]} - {price_reason}")
+                    logger.debug("   ❌ PRICE_INSANE: %s - %s", candidate_name[:40], price_reason)
                     continue  # REJECT this candidate
             
             # Store pack calculation info
@@ -5100,9 +5204,9 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             if packs_needed:
                 pack_calculated_count += 1
         
-        logger.info(f"   После unit compatibility filter: {len(step4_unit_compatible)}")
-        logger.info(f"   Rejected: {unit_mismatch_count} unit_mismatch, {pack_outlier_count} pack_outlier")
-        logger.info(f"   Pack calculated: {pack_calculated_count}")
+        logger.info("   После unit compatibility filter: %s", len(step4_unit_compatible))
+        logger.info("   Rejected: %s unit_mismatch, %s pack_outlier", unit_mismatch_count, pack_outlier_count)
+        logger.info("   Pack calculated: %s", pack_calculated_count)
         search_logger.set_count('after_unit_filter', len(step4_unit_compatible))
         search_logger.set_count('rejected_unit_mismatch', unit_mismatch_count)
         search_logger.set_count('rejected_pack_outlier', pack_outlier_count)
@@ -5142,6 +5246,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }
             )
         
+        lap('unit_pack_filter')
+        
         # P0.5: Sort by TOTAL_COST with min_order_qty consideration
         # Formula: total_cost = ceil(user_qty / min_order_qty) * min_order_qty * price
         # 1. Товары с известным packs_needed → по total_cost
@@ -5178,7 +5284,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             return (adjusted_cost, penalty, price)
         
         step4_unit_compatible.sort(key=sort_key)
-        logger.info(f"   Отсортировано по total_cost (P0.5) с учётом min_order_qty, user_qty={user_qty}")
+        logger.info("   Отсортировано по total_cost (P0.5) с учётом min_order_qty, user_qty=%s", user_qty)
         
         winner = step4_unit_compatible[0]
         
@@ -5211,11 +5317,11 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         # Determine threshold based on brand_critical
         required_threshold = THRESHOLD_BRAND_CRITICAL if brand_critical else THRESHOLD_BRAND_NOT_CRITICAL
         
-        logger.info(f"   💯 Match check: name_sim={name_similarity}%, prelim_match={prelim_match_percent}%, threshold={required_threshold}% (brand_critical={brand_critical})")
+        logger.info("   💯 Match check: name_sim=%s%%, prelim_match=%s%%, threshold=%s%% (brand_critical=%s)", name_similarity, prelim_match_percent, required_threshold, brand_critical)
         
         # Check if match meets threshold
         if prelim_match_percent < required_threshold:
-            logger.warning(f"   ⚠️ LOW_MATCH: {prelim_match_percent}% < {required_threshold}% - Will return original favorite")
+            logger.warning("   ⚠️ LOW_MATCH: %s%% < %s%% - Will return original favorite", prelim_match_percent, required_threshold)
             
             # Try to find original favorite item (STICK WITH FAVORITE logic)
             original_supplier_id = favorite.get('originalSupplierId')
@@ -5252,7 +5358,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }, {'_id': 0})
             
             if original_item:
-                logger.info(f"   ✅ STICK_WITH_FAVORITE: Returning original item: {original_item.get('name_raw', '')[:50]}")
+                logger.info("   ✅ STICK_WITH_FAVORITE: Returning original item: %s", original_item.get('name_raw', '')[:50])
                 winner = original_item
                 winner['_stick_with_favorite'] = True
                 winner['_low_match_fallback'] = True
@@ -5265,7 +5371,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 prelim_match_percent = 100
             else:
                 # No original found - keep current winner but warn
-                logger.warning(f"   ⚠️ Original item not found by any strategy. Keeping best match with {prelim_match_percent}% confidence")
+                logger.warning("   ⚠️ Original item not found by any strategy. Keeping best match with %s%% confidence", prelim_match_percent)
                 # Mark as low-confidence match
                 winner['_low_match_warning'] = True
                 winner['_match_below_threshold'] = True
@@ -5274,8 +5380,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         # EXCEPTION: If stick_with_favorite is active, skip this check (original item is trusted)
         winner_product_core = winner.get('product_core_id')
         if winner_product_core != ref_product_core and not winner.get('_stick_with_favorite'):
-            logger.error(f"❌ CORE_MISMATCH: ref={ref_product_core} vs winner={winner_product_core}")
-            logger.error(f"   Winner name: {winner.get('name_raw', '')[:60]}")
+            logger.error("❌ CORE_MISMATCH: ref=%s vs winner=%s", ref_product_core, winner_product_core)
+            logger.error("   Winner name: %s", winner.get('name_raw', '')[:60])
             search_logger.set_outcome('not_found', 'CORE_MISMATCH')
             search_logger.log()
             return AddFromFavoriteResponse(
@@ -5302,7 +5408,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 }
             )
         elif winner.get('_stick_with_favorite') and winner_product_core != ref_product_core:
-            logger.info(f"   ⚠️ CORE_MISMATCH bypassed for stick_with_favorite (trusted original item)")
+            logger.info("   ⚠️ CORE_MISMATCH bypassed for stick_with_favorite (trusted original item)")
         
         # ==================== P0 FIX: STICK WITH FAVORITE LOGIC ====================
         # If the found winner is MORE EXPENSIVE than the original favorite item,
@@ -5336,8 +5442,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 
                 # If winner is more expensive → stick with original
                 if winner_total_cost > original_total_cost:
-                    logger.info(f"   🔄 STICK_WITH_FAVORITE: winner_cost={winner_total_cost:.2f} > original_cost={original_total_cost:.2f}")
-                    logger.info(f"   Returning original item: {original_item.get('name_raw', '')[:40]}")
+                    logger.info("   🔄 STICK_WITH_FAVORITE: winner_cost=%.2f > original_cost=%.2f", winner_total_cost, original_total_cost)
+                    logger.info("   Returning original item: %s", original_item.get('name_raw', '')[:40])
                     
                     # Replace winner with original item
                     winner = original_item
@@ -5348,32 +5454,30 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                     winner['_stick_with_favorite'] = True
                     stick_with_favorite = True
                 else:
-                    logger.info(f"   ✅ Found cheaper alternative: winner_cost={winner_total_cost:.2f} < original_cost={original_total_cost:.2f}")
+                    logger.info("   ✅ Found cheaper alternative: winner_cost=%.2f < original_cost=%.2f", winner_total_cost, original_total_cost)
+        
+        lap('scoring')
         
         # КРИТИЧНО: Определяем supplier_id СРАЗУ после winner
         supplier_id = winner.get('supplier_company_id')
         
-        # Get supplier names
-        companies = await db.companies.find({}, {"_id": 0}).to_list(1000)
-        company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
-        
         if not supplier_id:
-            logger.error(f"❌ supplier_company_id is None in winner!")
-            logger.error(f"   Winner keys: {list(winner.keys())}")
+            logger.error("❌ supplier_company_id is None in winner!")
+            logger.error("   Winner keys: %s", list(winner.keys()))
             return AddFromFavoriteResponse(
                 status="error",
                 message="Internal error: supplier_company_id missing"
             )
         
-        logger.info(f"✅ НАЙДЕНО: {len(step4_unit_compatible)} кандидатов")
-        logger.info(f"   Победитель: {winner.get('name_raw', '')[:40]}")
-        logger.info(f"   Цена: {winner.get('price')}₽")
-        logger.info(f"   Packs needed: {winner.get('_packs_needed')}")
-        logger.info(f"   Total cost mult: {winner.get('_total_cost_mult')}")
-        logger.info(f"   Pack explanation: {winner.get('_pack_explanation')}")
-        logger.info(f"   Бренд: {winner.get('brand_id', 'NONE')}")
-        logger.info(f"   Supplier ID: {supplier_id}")
-        logger.info(f"   Pack penalty: {winner.get('_pack_score_penalty', 0)}")
+        logger.info("✅ НАЙДЕНО: %s кандидатов", len(step4_unit_compatible))
+        logger.info("   Победитель: %s", winner.get('name_raw', '')[:40])
+        logger.info("   Цена: %s₽", winner.get('price'))
+        logger.info("   Packs needed: %s", winner.get('_packs_needed'))
+        logger.info("   Total cost mult: %s", winner.get('_total_cost_mult'))
+        logger.info("   Pack explanation: %s", winner.get('_pack_explanation'))
+        logger.info("   Бренд: %s", winner.get('brand_id', 'NONE'))
+        logger.info("   Supplier ID: %s", supplier_id)
+        logger.info("   Pack penalty: %s", winner.get('_pack_score_penalty', 0))
         
         # ==================== IMPROVED MATCH_PERCENT CALCULATION ====================
         # Updated scoring logic with name similarity for more accurate percentages
@@ -5419,8 +5523,8 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
             
             match_percent = max(0, min(100, int(base_score - pack_penalty)))
             
-            logger.info(f"   📊 Match score breakdown: name_sim={name_similarity}%, core_match={winner.get('product_core_id') == ref_product_core}, brand_match={winner.get('brand_id') == brand_id if brand_critical else 'N/A'}")
-            logger.info(f"   📊 Final match_percent: {match_percent}%")
+            logger.info("   📊 Match score breakdown: name_sim=%s%%, core_match=%s, brand_match=%s", name_similarity, winner.get('product_core_id') == ref_product_core, winner.get('brand_id') == brand_id if brand_critical else 'N/A')
+            logger.info("   📊 Final match_percent: %s%%", match_percent)
         
         # P0.5: Calculate actual total_cost with min_order_qty
         min_order_qty = winner.get('min_order_qty', 1) or 1
@@ -5515,42 +5619,29 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
                 'match_percent': match_percent,
                 'pack_explanation': winner.get('_pack_explanation', '')
             }
-            logger.info(f"SEARCH_SUMMARY: {json.dumps(log_summary, ensure_ascii=False)}")
+            logger.summary('SEARCH_SUMMARY', log_summary)
         except Exception as log_err:
-            logger.warning(f"Log summary failed: {log_err}")  # SAFE
+            logger.warning("Log summary failed: %s", log_err)  # SAFE
+        
+        lap('build_result')
         
         # Step 8: Return response
         if result_status == "ok":
             # Add to cart
-            user_cart = await db.cart.find_one({"userId": current_user['id']}, {"_id": 0})
-            
-            if not user_cart:
-                user_cart = {
-                    "userId": current_user['id'],
-                    "items": []
-                }
-            
-            # Check if item already in cart
-            existing_item = next((item for item in user_cart.get('items', []) 
-                                if item['pricelistId'] == result.supplier_item_id), None)
-            
-            if existing_item:
-                existing_item['quantity'] += request.qty
+            cart_line = {
+                "pricelistId": result.supplier_item_id,
+                "productName": result.name_raw,
+                "quantity": request.qty,
+                "price": result.price,
+                "supplierId": result.supplier_id,
+                "supplierName": result.supplier_name
+            }
+            if preloaded is not None:
+                # Batch writes db.cart once, after all favorites are resolved
+                preloaded['cart_lines'].append(cart_line)
             else:
-                user_cart.setdefault('items', []).append({
-                    "pricelistId": result.supplier_item_id,
-                    "productName": result.name_raw,
-                    "quantity": request.qty,
-                    "price": result.price,
-                    "supplierId": result.supplier_id,
-                    "supplierName": result.supplier_name
-                })
-            
-            await db.cart.replace_one(
-                {"userId": current_user['id']},
-                user_cart,
-                upsert=True
-            )
+                await _add_lines_to_cart(current_user['id'], [cart_line])
+            lap('save_cart')
             
             # Build SelectedOffer for response with P0 unit fields
             cand_pack = winner.get('_pack_info')
@@ -5665,7 +5756,7 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
     
     except Exception as e:
         import traceback
-        logger.error(f"❌ ADD_FROM_FAVORITE error: {str(e)}")
+        logger.error("❌ ADD_FROM_FAVORITE error: %s", str(e))
         logger.error(traceback.format_exc())
         
         return AddFromFavoriteResponse(
@@ -5674,6 +5765,115 @@ async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_use
         )
 
 
+@api_router.post("/cart/add-from-favorite", response_model=AddFromFavoriteResponse)
+@profiled('add_from_favorite')
+async def add_from_favorite_to_cart(request: AddFromFavoriteRequest, current_user: dict = Depends(get_current_user)):
+    """Add item from favorites to cart with ENHANCED BEST PRICE SEARCH
+    
+    VERSION 4.0 (P0 Guards Fix):
+    - Guards applied to CANDIDATE, not reference
+    - Fixed active filter: offer_status="ACTIVE"
+    - Diagnostic fields: build_sha, request_id, counts, guards_applied
+    - SEARCH_SUMMARY log for tracing
+    
+    CRITICAL RULES:
+    1. NEVER use supplier_item_id from favorite directly
+    2. ALWAYS run full search
+    3. Guards check CANDIDATE.name_raw (forbidden + required_anchors)
+    4. brand_critical=false: brand COMPLETELY IGNORED
+    5. brand_critical=true: filter by brand_id
+    6. Pack must be in range: ±20% of reference
+    7. Return structured response (never 500)
+    """
+    return await _add_from_favorite(request, current_user)
+
+
+class AddFromFavoriteBatchRequest(BaseModel):
+    """Several favorites added to the cart in one call"""
+    items: List[AddFromFavoriteRequest] = Field(..., min_length=1, max_length=CART_BATCH_MAX_REFERENCES)
+
+
+@api_router.post("/cart/add-from-favorite:batch", response_model=List[AddFromFavoriteResponse])
+@profiled('add_from_favorite_batch')
+async def add_from_favorite_batch(request: AddFromFavoriteBatchRequest, current_user: dict = Depends(get_current_user)):
+    """Batch /cart/add-from-favorite: one response per favorite, in request order.
+    
+    Favorites are read with one $in query and classified up front; active
+    supplier_items are loaded once for all distinct product_core_ids of the
+    batch (instead of every active item per favorite). The guard/score
+    pipeline then runs for all favorites concurrently, and the found offers
+    are written to the cart in a single update.
+    """
+    from universal_super_class_mapper import detect_super_class
+    from product_core_classifier import detect_product_core as classify_core
+    
+    try:
+        favorite_ids = list(dict.fromkeys(item.favorite_id for item in request.items))
+        favorites = await db.favorites.find(
+            {"id": {"$in": favorite_ids}, "userId": current_user['id']}, {"_id": 0}
+        ).to_list(len(favorite_ids))
+        favorites_by_id = {f['id']: f for f in favorites}
+        lap('load_favorites')
+        
+        # Same classification as the single pipeline: super_class → product_core
+        core_by_favorite = {}
+        for favorite_id, favorite in favorites_by_id.items():
+            reference_name = favorite.get('reference_name') or favorite.get('productName', '')
+            ref_super_class, _ = detect_super_class(reference_name)
+            if not ref_super_class:
+                continue
+            ref_product_core, ref_core_conf = classify_core(reference_name, ref_super_class)
+            if ref_product_core and ref_core_conf >= 0.3:
+                core_by_favorite[favorite_id] = ref_product_core
+        lap('classify')
+        
+        cores = sorted(set(core_by_favorite.values()))
+        items_by_core: Dict[str, List[dict]] = {core: [] for core in cores}
+        if cores:
+            supplier_items = await db.supplier_items.find(
+                {"active": True, "product_core_id": {"$in": cores}}, offer_projection(ADD_FROM_FAVORITE_FIELDS)
+            ).to_list(length=None)
+            for si in supplier_items:
+                items_by_core[si['product_core_id']].append(si)
+        total_active = await db.supplier_items.count_documents({"active": True})
+        companies = await db.companies.find({}, {"_id": 0}).to_list(1000)
+        company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
+        lap('mongo_load_candidates')
+    except Exception as e:
+        logging.getLogger(__name__).error("❌ ADD_FROM_FAVORITE batch load error: %s", str(e))
+        return [AddFromFavoriteResponse(status="error", message=f"Error: {str(e)}") for _ in request.items]
+    
+    cart_lines: List[dict] = []
+    
+    def preload(item: AddFromFavoriteRequest) -> Optional[Dict[str, Any]]:
+        favorite = favorites_by_id.get(item.favorite_id)
+        if favorite is None:
+            return None  # not found: the single path reports it
+        return {
+            'favorite': favorite,
+            'supplier_items': items_by_core.get(core_by_favorite.get(item.favorite_id), []),
+            'total_active': total_active,
+            'company_map': company_map,
+            'cart_lines': cart_lines,
+        }
+    
+    responses = await asyncio.gather(*(
+        _add_from_favorite(item, current_user, preload(item)) for item in request.items
+    ))
+    
+    if cart_lines:
+        try:
+            await _add_lines_to_cart(current_user['id'], cart_lines)
+        except Exception as e:
+            logging.getLogger(__name__).error("❌ ADD_FROM_FAVORITE batch cart write error: %s", str(e))
+            return [
+                AddFromFavoriteResponse(status="error", message=f"Error: {str(e)}") if r.status == "ok" else r
+                for r in responses
+            ]
+        lap('save_cart')
+    return responses
+
+
 @api_router.post("/favorites/order")
 async def order_from_favorites(data: dict, current_user: dict = Depends(get_current_user)):
     """Create orders from favorites with HYBRID MATCHER + MVP minimum order logic
@@ -5697,8 +5897,8 @@ async def order_from_favorites(data: dict, current_user: dict = Depends(get_curr
     if not company_id:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    # Load ALL supplier_items for matching
-    all_supplier_items = await db.supplier_items.find({"active": True}, {"_id": 0}).to_list(15000)
+    # ALL active supplier_items for matching (shared compact table)
+    table = await _favorites_match_table()
     
     # Load company names map
     all_companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
@@ -5733,7 +5933,8 @@ async def order_from_favorites(data: dict, current_user: dict = Depends(get_curr
             winner = find_best_match_hybrid(
                 query_product_name=original_product['name'],
                 original_price=original_price,
-                all_items=all_supplier_items
+                all_items=table['items'],
+                item_features=table['features']
             )
             
             if winner:
@@ -5778,7 +5979,7 @@ async def order_from_favorites(data: dict, current_user: dict = Depends(get_curr
     # OPTIMIZE: Apply minimum order logic with +10% top-up
     optimized_orders, opt_stats = optimize_order_with_minimums(
         orders_by_supplier,
-        all_supplier_items,
+        table['items'],
         supplier_names
     )
     
@@ -5842,12 +6043,7 @@ async def order_from_favorites(data: dict, current_user: dict = Depends(get_curr
 
 # ==================== SUPPLIER RESTAURANT MANAGEMENT ====================
 
-# Whitelist: fields of restaurant (customer) company visible to supplier (always, not link-dependent)
-REQUISITES_WHITELIST = {
-    "companyName", "inn", "ogrn", "legalAddress", "actualAddress",
-    "phone", "email", "contactPersonName", "contactPersonPosition", "contactPersonPhone",
-    "deliveryAddresses", "edoNumber", "guid"
-}
+# REQUISITES_WHITELIST (restaurant fields visible to supplier) lives in supplier_links
 REQUISITES_PREVIEW_FIELDS = ("companyName", "inn", "phone", "email")
 
 
@@ -5891,41 +6087,22 @@ async def get_supplier_restaurant_documents(current_user: dict = Depends(get_cur
         company_id = company['id'] if company else None
     if not company_id:
         return []
-    proj = {"_id": 0, "id": 1, "companyName": 1, "inn": 1}
-    for k in REQUISITES_WHITELIST:
-        proj[k] = 1
-    customers = await db.companies.find({"type": "customer"}, proj).to_list(500)
-    links = await db.supplier_restaurant_settings.find(
-        {"supplierId": company_id},
-        {"_id": 0, "restaurantId": 1, "contract_accepted": 1}
-    ).to_list(500)
-    link_map = {l['restaurantId']: l for l in links}
-    docs = await db.documents.find({"companyId": {"$in": [c['id'] for c in customers]}}, {"_id": 0}).to_list(2000)
-    docs_by_company = {}
-    for d in docs:
-        cid = d.get('companyId')
-        if cid not in docs_by_company:
-            docs_by_company[cid] = {}
-        # Dedupe by type: keep newest per (companyId, type)
-        doc_type = d.get('type', 'Документ')
-        entry = {"id": d.get('id'), "type": doc_type, "uploadedAt": d.get('createdAt', ''), "status": d.get('status', 'uploaded')}
-        existing = docs_by_company[cid].get(doc_type)
-        if not existing or (d.get('createdAt', '') or '') > (existing.get('uploadedAt', '') or ''):
-            docs_by_company[cid][doc_type] = entry
-    for cid in docs_by_company:
-        docs_by_company[cid] = list(docs_by_company[cid].values())
+    # Denormalized per-supplier view (documents deduped newest-per-type at write time)
+    await ensure_supplier_view(db, company_id)
+    rows = await db.supplier_restaurant_view.find({"supplierId": company_id}, {"_id": 0}).to_list(None)
     result = []
-    for c in customers:
-        link = link_map.get(c['id'])
-        contract_status = "accepted" if (link and link.get("contract_accepted")) else "pending"
+    for row in rows:
+        c = row.get('restaurant') or {}
+        accepted = bool(row.get("contract_accepted"))
+        contract_status = "accepted" if accepted else "pending"
         preview = _build_requisites_preview(c)
         # Full requisites only for accepted (contract_accepted) restaurants
-        full = _build_requisites(c) if (link and link.get("contract_accepted")) else None
+        full = _build_requisites(c) if accepted else None
         item = {
-            "restaurantId": c['id'],
+            "restaurantId": row['restaurantId'],
             "restaurantName": c.get('companyName', c.get('name', 'N/A')),
             "inn": c.get('inn', ''),
-            "documents": docs_by_company.get(c['id'], []),
+            "documents": row.get('documents', []),
             "contractStatus": contract_status,
             "restaurantRequisitesPreview": preview if preview else None,
             "restaurantRequisitesFull": full if full else None
@@ -5962,6 +6139,7 @@ async def accept_contract(data: dict, current_user: dict = Depends(get_current_u
         }},
         upsert=True
     )
+    await sync_view(db, supplier_id=company_id, restaurant_id=restaurant_id)
     return {"contractStatus": "accepted", "restaurantId": restaurant_id}
 
 
@@ -5977,30 +6155,32 @@ async def get_supplier_restaurants(current_user: dict = Depends(get_current_user
         company_id = company['id'] if company else None
     if not company_id:
         return []
-    links = await db.supplier_restaurant_settings.find(
+    await ensure_supplier_view(db, company_id)
+    rows = await db.supplier_restaurant_view.find(
         {"supplierId": company_id, "contract_accepted": True},
-        {"_id": 0}
-    ).to_list(500)
-    orders = await db.orders.find({"supplierCompanyId": company_id}, {"_id": 0, "customerCompanyId": 1}).to_list(1000)
-    order_counts = {}
-    for o in orders:
-        cid = o.get('customerCompanyId')
-        order_counts[cid] = order_counts.get(cid, 0) + 1
+        {"_id": 0, "documents": 0}
+    ).to_list(None)
+    order_counts = {
+        g['_id']: g['count']
+        async for g in db.orders.aggregate([
+            {"$match": {"supplierCompanyId": company_id}},
+            {"$group": {"_id": "$customerCompanyId", "count": {"$sum": 1}}},
+        ])
+    }
     restaurants = []
-    for link in links:
-        rest_id = link.get('restaurantId')
-        restaurant = await db.companies.find_one({"id": rest_id}, {"_id": 0})
-        if restaurant:
-            restaurants.append({
-                "id": restaurant['id'],
-                "name": restaurant.get('companyName', restaurant.get('name', 'N/A')),
-                "inn": restaurant.get('inn', ''),
-                "contract_status": "accepted",
-                "is_paused": bool(link.get('is_paused')),
-                "orderCount": order_counts.get(rest_id, 0),
-                "ordersEnabled": link.get('ordersEnabled', True),
-                "unavailabilityReason": link.get('unavailabilityReason')
-            })
+    for row in rows:
+        rest_id = row['restaurantId']
+        restaurant = row.get('restaurant') or {}
+        restaurants.append({
+            "id": rest_id,
+            "name": restaurant.get('companyName', restaurant.get('name', 'N/A')),
+            "inn": restaurant.get('inn', ''),
+            "contract_status": "accepted",
+            "is_paused": bool(row.get('is_paused')),
+            "orderCount": order_counts.get(rest_id, 0),
+            "ordersEnabled": row.get('ordersEnabled', True),
+            "unavailabilityReason": row.get('unavailabilityReason')
+        })
     return restaurants
 
 @api_router.patch("/suppliers/me/restaurants/{restaurant_id}")
@@ -6024,6 +6204,7 @@ async def patch_restaurant_pause(
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Restaurant not found or contract not accepted")
+    await sync_view(db, supplier_id=company_id, restaurant_id=restaurant_id)
     return {"is_paused": data.is_paused}
 
 
@@ -6061,6 +6242,7 @@ async def update_restaurant_availability(
             {"supplierId": company_id, "restaurantId": restaurant_id},
             {"$set": update}
         )
+    await sync_view(db, supplier_id=company_id, restaurant_id=restaurant_id)
     
     return {
         "message": "Restaurant availability updated",
@@ -6069,9 +6251,11 @@ async def update_restaurant_availability(
 
 # ==================== FAVORITES V2 MIGRATION ====================
 
-@api_router.post("/admin/favorites/migrate-v2")
-async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)):
-    """Migrate all favorites to v2 schema
+FAVORITES_MIGRATION_PROGRESS_EVERY = 100
+
+
+def _migrate_favorites_v2_job(ctx) -> Dict[str, Any]:
+    """Migrate all favorites to v2 schema (admin job, sync pymongo via ctx.db)
     
     V2 schema adds:
     - source_item_id (from productId -> pricelist lookup)
@@ -6083,7 +6267,8 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
     - schema_version = 2
     - broken (true if migration failed)
     
-    Does NOT delete old data, only enriches.
+    Does NOT delete old data, only enriches. Progress is saved every
+    FAVORITES_MIGRATION_PROGRESS_EVERY favorites; cancellation stops between favorites.
     """
     import logging
     from pipeline.normalizer import normalize_name
@@ -6095,7 +6280,7 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
     bm = get_brand_master()
     
     # Get all favorites
-    favorites = await db.favorites.find({}, {"_id": 0}).to_list(10000)
+    favorites = list(ctx.db.favorites.find({}, {"_id": 0}).limit(10000))
     logger.info(f"📋 Migrating {len(favorites)} favorites to v2 schema")
     
     stats = {
@@ -6106,7 +6291,9 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
         "errors": 0
     }
     
-    for fav in favorites:
+    for i, fav in enumerate(favorites):
+        if i % FAVORITES_MIGRATION_PROGRESS_EVERY == 0:
+            ctx.progress(processed=i, **stats)
         try:
             # Skip if already v2
             if fav.get('schema_version') == 2:
@@ -6120,11 +6307,11 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
             # Get product
             product = None
             if fav.get('productId'):
-                product = await db.products.find_one({"id": fav['productId']}, {"_id": 0})
+                product = ctx.db.products.find_one({"id": fav['productId']}, {"_id": 0})
             
             if product:
                 # Get source_item_id from pricelist
-                pricelist = await db.pricelists.find_one({"productId": product['id']}, {"_id": 0})
+                pricelist = ctx.db.pricelists.find_one({"productId": product['id']}, {"_id": 0})
                 if pricelist:
                     update_data["source_item_id"] = pricelist['id']
                 
@@ -6174,7 +6361,7 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
                 stats["migrated"] += 1
             
             # Update favorite
-            await db.favorites.update_one(
+            ctx.db.favorites.update_one(
                 {"id": fav['id']},
                 {"$set": update_data}
             )
@@ -6183,7 +6370,7 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
             logger.error(f"Error migrating favorite {fav.get('id')}: {e}")
             stats["errors"] += 1
             # Mark as broken
-            await db.favorites.update_one(
+            ctx.db.favorites.update_one(
                 {"id": fav['id']},
                 {"$set": {"schema_version": 2, "broken": True}}
             )
@@ -6197,6 +6384,18 @@ async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)
     }
 
 
+@api_router.post("/admin/favorites/migrate-v2")
+async def migrate_favorites_to_v2(current_user: dict = Depends(get_current_user)):
+    """Migrate all favorites to v2 schema in the background
+    
+    Returns the admin job id; stats are in the job result:
+        GET /api/v12/admin/jobs/{job_id}
+    """
+    job = await get_job_runner(db.delegate).submit(
+        'favorites_migrate_v2', _migrate_favorites_v2_job, user_id=current_user.get('id'))
+    return {"success": True, **admin_job_response(job)}
+
+
 @api_router.get("/favorites/{favorite_id}/enriched")
 async def get_enriched_favorite(favorite_id: str, current_user: dict = Depends(get_current_user)):
     """Get favorite with enriched data for debugging
@@ -6239,38 +6438,34 @@ async def get_enriched_favorite(favorite_id: str, current_user: dict = Depends(g
 # ==================== SEARCH QUALITY REPORTS ====================
 
 @api_router.get("/admin/search/quality-report")
-async def get_search_quality_report(current_user: dict = Depends(get_current_user)):
-    """Generate search quality report
+async def get_search_quality_report(refresh: bool = False, current_user: dict = Depends(get_current_user)):
+    """Search quality report, answered from the stored brand report (brand_jobs.py)
     
     Returns:
     - Brand coverage by supplier
     - Overall brand statistics
     - Sample products without brand
-    """
-    from search_engine import generate_brand_quality_report
     
-    # Load data
-    all_products = await db.products.find({}, {"_id": 0}).to_list(20000)
-    all_pricelists = await db.pricelists.find({}, {"_id": 0}).to_list(30000)
+    The report is rebuilt in the background (streamed over pricelists) when it is
+    missing, older than BRAND_REPORT_MAX_AGE_SEC or refresh=true; brand backfill
+    updates it incrementally.
+    """
+    doc = await asyncio.to_thread(load_brand_report, db.delegate)
+    if doc is None or refresh or brand_report_is_stale(doc):
+        # The report itself lives in brand_quality_reports; the job keeps only the build time
+        await _start_brand_job(BRAND_REPORT_JOB, lambda db_: {"build_sec": run_brand_report_job(db_)["build_sec"]})
+    if doc is None:
+        return {"status": "building", "job": await asyncio.to_thread(job_status, db.delegate, BRAND_REPORT_JOB)}
     
     # Get supplier names
     companies = await db.companies.find({}, {"_id": 0, "id": 1, "companyName": 1, "name": 1}).to_list(100)
     company_map = {c['id']: c.get('companyName') or c.get('name', 'Unknown') for c in companies}
     
-    # Generate report
-    report = generate_brand_quality_report(all_products, all_pricelists)
-    
-    # Add supplier names to by_supplier stats
-    by_supplier_with_names = {}
-    for supplier_id, stats in report['by_supplier'].items():
-        by_supplier_with_names[supplier_id] = {
-            **stats,
-            'supplier_name': company_map.get(supplier_id, 'Unknown')
-        }
-    
-    report['by_supplier'] = by_supplier_with_names
-    
-    return report
+    return {
+        **format_brand_report(doc, company_map),
+        "stale": brand_report_is_stale(doc),
+        "rebuilding": await _brand_job_active(BRAND_REPORT_JOB),
+    }
 
 
 @api_router.get("/admin/brands/families")
@@ -6609,6 +6804,34 @@ async def cleanup_test_fixtures(current_user: dict = Depends(get_current_user)):
     
     return {"success": True, "message": "Test fixtures removed"}
 
+# Brand jobs run as admin jobs (bestprice_v12/job_runner.py); the brand_jobs checkpoint
+# keeps the last progress/result for /admin/brands/backfill/status and the report
+def _brand_job(job_id: str, job_fn, *args, with_progress: bool = False, **kwargs):
+    def run(ctx):
+        if with_progress:
+            kwargs["progress"] = ctx.progress
+        try:
+            return job_fn(ctx.db, *args, **kwargs)
+        except JobCancelled:
+            save_checkpoint(ctx.db, job_id, {"status": "cancelled"})
+            raise
+        except Exception as e:
+            save_checkpoint(ctx.db, job_id, {"status": "failed", "error": str(e)})
+            raise
+    return run
+
+
+async def _start_brand_job(job_id: str, job_fn, *args, user_id: Optional[str] = None,
+                           **kwargs) -> Dict[str, Any]:
+    """Submit job_fn(db, *args) unless the same job is already queued/running (then that job is returned)."""
+    return await get_job_runner(db.delegate).submit(
+        job_id, _brand_job(job_id, job_fn, *args, **kwargs), user_id=user_id)
+
+
+async def _brand_job_active(job_id: str) -> bool:
+    return await asyncio.to_thread(get_job_runner(db.delegate).active, job_id) is not None
+
+
 @api_router.post("/admin/brands/backfill")
 async def backfill_brands_endpoint(current_user: dict = Depends(get_current_user)):
     """Backfill brand_id for all products using the new brand dictionary
@@ -6618,90 +6841,38 @@ async def backfill_brands_endpoint(current_user: dict = Depends(get_current_user
     - Updates brand_id and brand_strict in products collection
     - Does NOT reload pricelists
     
-    Returns statistics about the backfill.
+    Runs as an admin job (brand_jobs.run_brand_backfill: cursor batches +
+    bulk_write). Progress and the final statistics:
+        GET /api/v12/admin/jobs/{job_id}
+        GET /api/admin/brands/backfill/status
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Force reload brand master to use new file
-    from brand_master import BrandMaster
-    bm = BrandMaster.reload()
+    # Force reload brand master to use new file (swaps the reference_data snapshot)
+    from brand_master import reload_brand_master
+    bm = reload_brand_master()
     
     stats = bm.get_stats()
     logger.info(f"📋 Brand dictionary: {stats['total_brands']} brands, {stats['total_aliases']} aliases")
     
-    # Get all products
-    products = await db.products.find({}, {"_id": 0}).to_list(20000)
-    logger.info(f"📦 Found {len(products)} products to process")
-    
-    # Statistics
-    result_stats = {
-        'total_products': len(products),
-        'branded': 0,
-        'strict': 0,
-        'no_brand': 0,
-        'updated': 0,
-        'errors': 0,
-        'brand_counts': {}
-    }
-    
-    # Process each product
-    for i, product in enumerate(products):
-        product_id = product.get('id')
-        product_name = product.get('name', '')
-        
-        # Detect brand using new master
-        brand_id, brand_strict = bm.detect_brand(product_name)
-        
-        if brand_id:
-            result_stats['branded'] += 1
-            if brand_strict:
-                result_stats['strict'] += 1
-            # Track brand counts
-            result_stats['brand_counts'][brand_id] = result_stats['brand_counts'].get(brand_id, 0) + 1
-        else:
-            result_stats['no_brand'] += 1
-        
-        # Update if changed
-        old_brand = product.get('brand_id')
-        if brand_id != old_brand or product.get('brand_strict') != brand_strict:
-            try:
-                await db.products.update_one(
-                    {"id": product_id},
-                    {"$set": {
-                        "brand_id": brand_id,
-                        "brand_strict": brand_strict
-                    }}
-                )
-                result_stats['updated'] += 1
-            except Exception as e:
-                result_stats['errors'] += 1
-                logger.error(f"Error updating {product_id}: {e}")
-    
-    # Get top 20 brands by count
-    top_brands = sorted(
-        result_stats['brand_counts'].items(),
-        key=lambda x: -x[1]
-    )[:20]
-    
-    logger.info(f"✅ Backfill complete: {result_stats['updated']} updated, {result_stats['branded']} branded")
+    job = await _start_brand_job(BRAND_BACKFILL_JOB, run_brand_backfill, bm.detect_brand,
+                                 dictionary_stats=stats, with_progress=True, user_id=current_user.get('id'))
     
     return {
         "success": True,
-        "message": f"Backfill complete. Updated {result_stats['updated']} products.",
-        "stats": {
-            "total_products": result_stats['total_products'],
-            "branded": result_stats['branded'],
-            "strict_branded": result_stats['strict'],
-            "no_brand": result_stats['no_brand'],
-            "updated": result_stats['updated'],
-            "errors": result_stats['errors'],
-            "brand_dictionary": stats
-        },
-        "top_brands": [{"brand_id": b[0], "count": b[1]} for b in top_brands]
+        **admin_job_response(job),
+        "message": "Backfill is already running" if job.get('deduplicated') else "Backfill started",
+        "brand_dictionary": stats
     }
 
 
+@api_router.get("/admin/brands/backfill/status")
+async def backfill_brands_status(current_user: dict = Depends(get_current_user)):
+    """Progress of the last brand backfill and its result (stats + top brands)"""
+    status = await asyncio.to_thread(job_status, db.delegate, BRAND_BACKFILL_JOB)
+    if not status:
+        return {"status": "never_run", "job_id": BRAND_BACKFILL_JOB}
+    return {**status, "running": await _brand_job_active(BRAND_BACKFILL_JOB)}
+
+
 @api_router.get("/admin/brands/stats")
 async def get_brand_stats(current_user: dict = Depends(get_current_user)):
     """Get statistics about brand dictionary and product brands"""
@@ -6842,6 +7013,59 @@ async def run_validation():
         "stats": _validation_report.stats
     }
 
+# ============================================================
+# STAGE PROFILING METRICS (request_profiler)
+# ============================================================
+
+@api_router.get("/debug/metrics/stages")
+async def get_stage_latency_metrics(endpoint: Optional[str] = None):
+    """Per-stage latency histograms (in-process, since start or last reset)"""
+    return get_stage_metrics(prefix=endpoint)
+
+@api_router.get("/debug/metrics/traces")
+async def get_sampled_traces(limit: int = 20):
+    """Recent full traces (sampled via X-Profile-Trace header or PROFILE_TRACE_SAMPLE_RATE)"""
+    return {"traces": get_recent_traces(limit=min(max(limit, 1), 100))}
+
+@api_router.get("/debug/metrics/logging")
+async def get_logging_pipeline_metrics():
+    """Async log pipeline counters: queue depth, drops, per-request budget truncations"""
+    return get_log_pipeline_stats()
+
+@api_router.get("/debug/metrics/plan-cache")
+async def get_plan_cache_metrics():
+    """/v12/cart/plan memoization: hit ratio, miss reasons, optimizer time saved"""
+    return get_plan_memo_metrics()
+
+@api_router.get("/debug/indexes")
+async def get_index_catalog_status():
+    """Result of applying the managed index catalog at startup"""
+    return _index_catalog_report or {"status": "not_applied"}
+
+@api_router.get("/debug/indexes/audit")
+async def audit_index_coverage():
+    """explain() of recorded hot query shapes: reports COLLSCAN and in-memory SORT"""
+    return await asyncio.to_thread(audit_query_shapes, db.delegate)
+
+@api_router.get("/debug/reference-data")
+async def get_reference_data_status():
+    """Reference data snapshots of this worker: versions, sizes, load times"""
+    return reference_registry.status()
+
+@api_router.post("/debug/reference-data/{source}/bump")
+async def bump_reference_data(source: str):
+    """Bump a reference data source version: every worker reloads it on its next poll"""
+    await db[VERSIONS_COLLECTION].update_one(*version_bump_update(source), upsert=True)
+    reloaded = await asyncio.to_thread(reference_registry.poll_once)
+    return {"status": "bumped", "source": source, "reloaded_here": reloaded}
+
+@api_router.post("/debug/metrics/reset")
+async def reset_stage_latency_metrics():
+    """Reset stage histograms, trace buffer and plan cache counters"""
+    reset_stage_metrics()
+    reset_plan_memo_metrics()
+    return {"status": "reset"}
+
 # BestPrice v12 Router - include BEFORE app.include_router
 try:
     from bestprice_v12.routes import router as v12_router
@@ -6884,6 +7108,8 @@ async def validation_exception_handler(request, exc: RequestValidationError):
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(ProfileTraceMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -6896,6 +7122,8 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+# Root handlers move behind a queue: request threads never block on log I/O
+setup_async_logging()
 logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
@@ -6915,6 +7143,86 @@ async def startup_validation():
     except Exception as e:
         logger.error(f"❌ Validation failed with error: {e}")
 
+@app.on_event("startup")
+async def ensure_supplier_link_indexes():
+    """Indexes for supplier_restaurant_settings and the per-supplier view"""
+    try:
+        await ensure_view_indexes(db)
+    except Exception as e:
+        logger.warning(f"supplier link indexes not created: {e}")
+
+_index_catalog_report = None
+
+@app.on_event("startup")
+async def apply_managed_indexes():
+    """Create missing indexes from the managed index catalog (idempotent)"""
+    global _index_catalog_report
+    try:
+        _index_catalog_report = await asyncio.to_thread(apply_index_catalog, db.delegate)
+        if _index_catalog_report['conflicts'] or _index_catalog_report['failed']:
+            logger.warning("Index catalog issues: conflicts=%s failed=%s",
+                           _index_catalog_report['conflicts'], _index_catalog_report['failed'])
+    except Exception as e:
+        logger.warning(f"index catalog not applied: {e}")
+
+@app.on_event("startup")
+async def migrate_publication_flags():
+    """Set publishable on supplier_items written before ingestion-time validation (or by older rules).
+    
+    Read paths filter on the flag, so rows without it would be hidden; only
+    rows with a stale publish_v are scanned, a no-op once the flags are current.
+    """
+    try:
+        flags = await asyncio.to_thread(refresh_publication_flags, db.delegate)
+        if flags['updated']:
+            logger.info("Publication flags migrated: %s", flags)
+    except Exception as e:
+        logger.warning(f"publication flags not migrated: {e}")
+
+@app.on_event("startup")
+async def migrate_order_history_projection():
+    """Copy orders missing from order_history_v12 (pre-projection, legacy, failed checkout writes).
+    
+    /v12/orders reads only the projection; the copy is idempotent ($setOnInsert by id).
+    """
+    try:
+        stats = await asyncio.to_thread(migrate_legacy_orders, db.delegate, False)
+        if any(stats[source]['inserted'] for source in ('orders_v12', 'orders')):
+            logger.info("Order history migrated: %s", stats)
+    except Exception as e:
+        logger.warning(f"order history not migrated: {e}")
+
+@app.on_event("startup")
+async def fail_interrupted_admin_jobs():
+    """Admin jobs left queued/running by a previous process (no heartbeat / same worker) are marked failed"""
+    try:
+        worker = get_job_runner(db.delegate).worker
+        failed = await asyncio.to_thread(fail_stale_jobs, db.delegate, worker=worker)
+        if failed:
+            logger.warning("Marked %d stale admin jobs as failed", failed)
+    except Exception as e:
+        logger.warning(f"stale admin jobs not checked: {e}")
+
+@app.on_event("startup")
+async def load_reference_data():
+    """Load reference data snapshots concurrently and start polling their versions"""
+    try:
+        timings = await asyncio.to_thread(reference_registry.load_all)
+        logger.info("Reference data loaded: %s", timings)
+    except Exception as e:
+        logger.warning(f"reference data preload failed (will load on first use): {e}")
+    reference_registry.start_polling()
+
+@app.on_event("startup")
+async def start_shared_catalog_publisher():
+    """Keep the shared offer snapshot on the current catalog version (one publisher at a time via flock)"""
+    if _shared_catalog_publisher and _shared_catalog_publisher.start(SHARED_CATALOG_PUBLISH_SEC):
+        logger.info("Shared catalog publisher started for %s (every %ss)", SHARED_CATALOG_DIR, SHARED_CATALOG_PUBLISH_SEC)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    reference_registry.stop_polling()
+    if _shared_catalog_publisher:
+        _shared_catalog_publisher.stop()
     client.close()
+    stop_async_logging()
@@ -0,0 +1,396 @@
+"""
+Shared Catalog - общий снимок активных офферов для всех воркеров uvicorn
+=======================================================================
+
+Каждый воркер сам читал все активные supplier_items для hybrid matcher
+(favorites v2, add-from-favorite, /orders) и держал свою копию: память
+росла линейно с числом воркеров, и каждый прогревался отдельно.
+
+Снимок каталога - каталог файлов NumPy (.npy) на диске:
+- числовые поля - float64 (NaN = нет значения);
+- флаги - int8 (-1 = нет значения);
+- категориальные поля (поставщик, единицы, super_class, ядро, бренд, ...)
+  - int32-коды + словарь в meta.json (-1 = нет значения);
+- строки (id, name_raw, артикул, product_id) - один UTF-8 буфер + offsets.
+
+Воркеры открывают файлы через np.load(mmap_mode='r'): страницы общие
+в page cache ОС, в процессе - только словари категорий. Строка снимка -
+SharedOffer, read-only Mapping как CompactOffer (get / []).
+
+Публикация атомарная: новая версия пишется во временный каталог,
+переименовывается, затем указатель CURRENT заменяется через os.replace.
+SharedCatalogReader проверяет CURRENT не чаще раза в CHECK_INTERVAL_SEC
+и подменяет снимок без перезапуска воркера; запросы, уже держащие старый
+снимок, дочитывают его (отображение живо и после удаления файлов).
+
+Сервер использует снимок, если задан SHARED_CATALOG_DIR и версия снимка
+(meta.version) совпадает с catalog_change_version; пока снимок отстаёт от
+catalog_change_log (импорт прошёл, снимок не переопубликован) - прежний
+OfferStore из Mongo в каждом воркере. Отставание короткое: воркеры сервера
+запускают SharedCatalogPublisher, который раз в PUBLISH_INTERVAL_SEC сверяет
+версии и переопубликовывает снимок; публикует один воркер за раз (flock на
+root/.publish.lock), остальные видят уже свежий CURRENT.
+
+Запуск:
+    python shared_catalog.py --root /var/lib/bestprice/catalog
+    python shared_catalog.py --root /var/lib/bestprice/catalog --keep 3
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import threading
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bestprice_v12.offer_store import INTERNED_FIELDS, MATCH_FIELDS, offer_projection
+from bestprice_v12.offer_validator import catalog_change_version
+
+logger = logging.getLogger(__name__)
+
+CURRENT_POINTER = 'CURRENT'
+META_FILE = 'meta.json'
+KEEP_VERSIONS = 2
+CHECK_INTERVAL_SEC = 5.0
+PUBLISH_INTERVAL_SEC = 30.0
+PUBLISH_LOCK_FILE = '.publish.lock'
+
+NUMERIC_FIELDS = ('price', 'price_per_base_unit', 'net_weight_kg')
+FLAG_FIELDS = ('base_price_unknown', 'brand_strict', 'bulk_package')
+TEXT_FIELDS = ('id', 'supplier_item_code', 'product_id', 'name_raw')
+CATEGORY_FIELDS = tuple(f for f in MATCH_FIELDS if f in INTERNED_FIELDS)
+
+_KIND = {
+    **{f: 'num' for f in NUMERIC_FIELDS},
+    **{f: 'flag' for f in FLAG_FIELDS},
+    **{f: 'text' for f in TEXT_FIELDS},
+    **{f: 'cat' for f in CATEGORY_FIELDS},
+}
+assert set(_KIND) == set(MATCH_FIELDS), 'every MATCH_FIELDS field needs a column kind'
+
+
+# === WRITE ===
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def write_catalog(docs: Iterable[Mapping], root: str, version: Optional[str] = None,
+                  keep: int = KEEP_VERSIONS) -> Dict[str, Any]:
+    """
+    Пишет снимок офферов в новый каталог под root и атомарно делает его текущим.
+
+    Returns: {'name', 'count', 'version', 'bytes'}
+    """
+    numeric: Dict[str, List[float]] = {f: [] for f in NUMERIC_FIELDS}
+    flags: Dict[str, List[int]] = {f: [] for f in FLAG_FIELDS}
+    codes: Dict[str, List[int]] = {f: [] for f in CATEGORY_FIELDS}
+    vocab: Dict[str, Dict[Any, int]] = {f: {} for f in CATEGORY_FIELDS}
+    texts: Dict[str, List[bytes]] = {f: [] for f in TEXT_FIELDS}
+
+    count = 0
+    for doc in docs:
+        count += 1
+        for f in NUMERIC_FIELDS:
+            numeric[f].append(_as_float(doc.get(f)))
+        for f in FLAG_FIELDS:
+            value = doc.get(f)
+            flags[f].append(-1 if value is None else int(bool(value)))
+        for f in CATEGORY_FIELDS:
+            value = doc.get(f)
+            codes[f].append(-1 if value is None else vocab[f].setdefault(value, len(vocab[f])))
+        for f in TEXT_FIELDS:
+            value = doc.get(f)
+            texts[f].append(b'' if value is None else str(value).encode('utf-8'))
+
+    os.makedirs(root, exist_ok=True)
+    name = f"catalog-{time.time_ns():020d}-{uuid.uuid4().hex[:6]}"
+    tmp = os.path.join(root, f'.{name}.tmp')
+    os.makedirs(tmp)
+    try:
+        for f in NUMERIC_FIELDS:
+            np.save(os.path.join(tmp, f'num.{f}.npy'), np.asarray(numeric[f], dtype=np.float64))
+        for f in FLAG_FIELDS:
+            np.save(os.path.join(tmp, f'flag.{f}.npy'), np.asarray(flags[f], dtype=np.int8))
+        for f in CATEGORY_FIELDS:
+            np.save(os.path.join(tmp, f'cat.{f}.npy'), np.asarray(codes[f], dtype=np.int32))
+        for f in TEXT_FIELDS:
+            lengths = np.fromiter((len(b) for b in texts[f]), dtype=np.int64, count=count)
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            np.save(os.path.join(tmp, f'text.{f}.offsets.npy'), offsets)
+            np.save(os.path.join(tmp, f'text.{f}.data.npy'), np.frombuffer(b''.join(texts[f]), dtype=np.uint8))
+        meta = {
+            'name': name, 'version': version, 'count': count, 'built_at': time.time(),
+            'vocab': {f: list(vocab[f]) for f in CATEGORY_FIELDS},
+        }
+        with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as fh:
+            json.dump(meta, fh, ensure_ascii=False)
+        os.rename(tmp, os.path.join(root, name))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(root, f'.{CURRENT_POINTER}.{uuid.uuid4().hex[:6]}')
+    with open(pointer_tmp, 'w', encoding='utf-8') as fh:
+        fh.write(name)
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_POINTER))
+
+    prune_catalogs(root, keep)
+    size = sum(e.stat().st_size for e in os.scandir(os.path.join(root, name)))
+    logger.info("Shared catalog %s published: %d offers, %d bytes (version=%s)", name, count, size, version)
+    return {'name': name, 'count': count, 'version': version, 'bytes': size}
+
+
+def prune_catalogs(root: str, keep: int = KEEP_VERSIONS) -> List[str]:
+    """Удаляет старые снимки, кроме текущего и keep-1 предыдущих."""
+    current = read_current_name(root)
+    names = sorted((e.name for e in os.scandir(root) if e.is_dir() and e.name.startswith('catalog-')),
+                   reverse=True)
+    stale = [n for n in names[max(keep, 1):] if n != current]
+    for n in stale:
+        shutil.rmtree(os.path.join(root, n), ignore_errors=True)
+    return stale
+
+
+def publish_catalog(db, root: str, keep: int = KEEP_VERSIONS) -> Dict[str, Any]:
+    """Снимок активных supplier_items (MATCH_FIELDS) из Mongo."""
+    version = catalog_change_version(db)
+    docs = db.supplier_items.find({'active': True}, offer_projection())
+    return write_catalog(docs, root, version=version, keep=keep)
+
+
+def publish_if_behind(db, root: str, keep: int = KEEP_VERSIONS) -> Optional[Dict[str, Any]]:
+    """
+    publish_catalog, если текущий снимок собран не на catalog_change_version.
+
+    Публикатор на root один (flock): пока другой процесс пишет снимок - None.
+    Returns: результат write_catalog или None (снимок актуален / занято)
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, PUBLISH_LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        name = read_current_name(root)
+        if name and read_meta(os.path.join(root, name)).get('version') == catalog_change_version(db):
+            return None
+        return publish_catalog(db, root, keep=keep)
+
+
+class SharedCatalogPublisher:
+    """Фоновый поток: переопубликовывает снимок, когда catalog_change_version уходит вперёд."""
+
+    def __init__(self, db, root: str, keep: int = KEEP_VERSIONS):
+        self.db = db
+        self.root = root
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def publish_once(self) -> Optional[Dict[str, Any]]:
+        return publish_if_behind(self.db, self.root, keep=self.keep)
+
+    def _loop(self, interval: float) -> None:
+        while True:
+            try:
+                self.publish_once()
+            except Exception as e:
+                logger.warning("Shared catalog publish failed: %s", e)
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval: float = PUBLISH_INTERVAL_SEC) -> bool:
+        if self._thread is not None or interval <= 0:
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                        name='shared-catalog-publisher', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+
+# === READ ===
+
+def read_current_name(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_POINTER), encoding='utf-8') as fh:
+            return fh.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_meta(path: str) -> Dict[str, Any]:
+    """meta.json снимка; нечитаемый (удалён при prune, битый) - {}."""
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+class SharedOffer(Mapping):
+    """Строка снимка; поля читаются из отображённых колонок по запросу."""
+
+    __slots__ = ('_catalog', '_row')
+
+    def __init__(self, catalog: 'SharedCatalog', row: int):
+        self._catalog = catalog
+        self._row = row
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._catalog.value(self._row, key)
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._catalog.value(self._row, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in _KIND and self._catalog.value(self._row, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key in MATCH_FIELDS if key in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"SharedOffer(id={self.get('id')!r}, name_raw={self.get('name_raw')!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self[key] for key in self}
+
+
+class SharedCatalog(Sequence):
+    """Read-only снимок, отображённый в память (np.load mmap_mode='r')."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as fh:
+            meta = json.load(fh)
+        self.path = path
+        self.name: str = meta['name']
+        self.version: Optional[str] = meta['version']
+        self.count: int = meta['count']
+
+        def load(filename):
+            return np.load(os.path.join(path, filename), mmap_mode='r')
+
+        self._numeric = {f: load(f'num.{f}.npy') for f in NUMERIC_FIELDS}
+        self._flags = {f: load(f'flag.{f}.npy') for f in FLAG_FIELDS}
+        self._codes = {f: load(f'cat.{f}.npy') for f in CATEGORY_FIELDS}
+        self._vocab = {
+            f: [sys.intern(v) if isinstance(v, str) else v for v in meta['vocab'][f]] for f in CATEGORY_FIELDS
+        }
+        self._text = {f: (load(f'text.{f}.offsets.npy'), load(f'text.{f}.data.npy')) for f in TEXT_FIELDS}
+
+    def value(self, row: int, key: str) -> Any:
+        kind = _KIND.get(key)
+        if kind == 'cat':
+            code = int(self._codes[key][row])
+            return self._vocab[key][code] if code >= 0 else None
+        if kind == 'num':
+            value = float(self._numeric[key][row])
+            return None if value != value else value
+        if kind == 'text':
+            offsets, data = self._text[key]
+            start, end = int(offsets[row]), int(offsets[row + 1])
+            return bytes(data[start:end]).decode('utf-8') if end > start else None
+        if kind == 'flag':
+            value = int(self._flags[key][row])
+            return None if value < 0 else bool(value)
+        return None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [SharedOffer(self, row) for row in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return SharedOffer(self, i)
+
+    def __iter__(self) -> Iterator[SharedOffer]:
+        return (SharedOffer(self, row) for row in range(self.count))
+
+    def __repr__(self) -> str:
+        return f"SharedCatalog({self.name}, {self.count} offers)"
+
+
+class SharedCatalogReader:
+    """Текущий снимок под root; новая версия подхватывается без перезапуска."""
+
+    def __init__(self, root: str, check_interval: float = CHECK_INTERVAL_SEC):
+        self.root = root
+        self.check_interval = check_interval
+        self._catalog: Optional[SharedCatalog] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[SharedCatalog]:
+        """None, пока снимок не опубликован."""
+        now = time.monotonic()
+        if self._catalog is not None and now - self._checked_at < self.check_interval:
+            return self._catalog
+        with self._lock:
+            self._checked_at = now
+            name = read_current_name(self.root)
+            if name and (self._catalog is None or self._catalog.name != name):
+                try:
+                    self._catalog = SharedCatalog(os.path.join(self.root, name))
+                    logger.info("Shared catalog mapped: %s (%d offers)", name, self._catalog.count)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning("Shared catalog %s not readable, keeping previous: %s", name, e)
+            return self._catalog
+
+    def current_for(self, version: Optional[str]) -> Optional[SharedCatalog]:
+        """Текущий снимок, если он собран на этой версии каталога; отставший - None."""
+        catalog = self.current()
+        if catalog is not None and catalog.version != version:
+            logger.debug("Shared catalog %s is behind (version %s, catalog %s)", catalog.name, catalog.version, version)
+            return None
+        return catalog
+
+
+if __name__ == '__main__':
+    import argparse
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Publish a memory-mapped snapshot of active supplier_items')
+    parser.add_argument('--root', default=os.environ.get('SHARED_CATALOG_DIR'), help='Snapshot directory')
+    parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help='Snapshots to keep on disk')
+    args = parser.parse_args()
+    if not args.root:
+        parser.error('--root or SHARED_CATALOG_DIR is required')
+
+    client = MongoClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'test_database')]
+
+    print(json.dumps(publish_catalog(db, args.root, keep=args.keep), ensure_ascii=False, indent=2))
@@ -0,0 +1,259 @@
+"""
+Supplier ↔ Restaurant Links - bulk-линковка и денормализованная витрина
+======================================================================
+
+supplier_restaurant_settings остаётся источником истины по связям
+(contract_accepted, is_paused, ordersEnabled, unavailabilityReason).
+
+1. Линковка - один unordered bulk_write на всех контрагентов вместо
+   update_one на каждую пару. При регистрации поставщика/ресторана
+   запускается фоновой задачей: время регистрации не растёт с числом
+   ресторанов.
+
+2. Витрина supplier_restaurant_view - одна строка на пару
+   (supplierId, restaurantId): реквизиты ресторана (whitelist), его
+   документы (последний на тип) и состояние связи. /supplier/restaurants и
+   /supplier/restaurant-documents читают её одним find по supplierId
+   вместо полного скана companies + documents.
+
+   Обновление точечное:
+     - связь изменилась (accept / pause / availability)  → sync_view(supplier, restaurant)
+     - ресторан загрузил документ / сменил реквизиты     → refresh_restaurant_in_view
+     - новый поставщик / ресторан                        → sync_view(supplier=...) / (restaurant=...)
+   Полная сборка поставщика отмечается в supplier_restaurant_view_state
+   (builtAt). Строки, созданные точечными sync_view(restaurant=...), витрину
+   не «достраивают»: без отметки ensure_supplier_view собирает её целиком
+   при чтении (старая БД, компании из seed-скриптов).
+
+3. Регистрация ресторана связей не создаёт (как и раньше): ресторан только
+   добавляется в витрины поставщиков как pending (add_restaurant_to_view).
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+LINKS_COLLECTION = 'supplier_restaurant_settings'
+VIEW_COLLECTION = 'supplier_restaurant_view'
+VIEW_STATE_COLLECTION = 'supplier_restaurant_view_state'
+
+# Whitelist: fields of restaurant (customer) company visible to supplier (always, not link-dependent)
+REQUISITES_WHITELIST = {
+    "companyName", "inn", "ogrn", "legalAddress", "actualAddress",
+    "phone", "email", "contactPersonName", "contactPersonPosition", "contactPersonPhone",
+    "deliveryAddresses", "edoNumber", "guid"
+}
+
+# Поля ресторана, которые кладём в витрину
+RESTAURANT_VIEW_FIELDS = REQUISITES_WHITELIST | {"id", "name"}
+
+# Состояние связи, копируемое из supplier_restaurant_settings
+LINK_STATE_FIELDS = ("contract_accepted", "is_paused", "ordersEnabled", "unavailabilityReason")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ============================================================================
+# VIEW ROW BUILDERS (чистые функции)
+# ============================================================================
+
+def restaurant_payload(company: Dict) -> Dict:
+    return {k: company[k] for k in RESTAURANT_VIEW_FIELDS if company.get(k) is not None}
+
+
+def latest_documents_by_type(docs: Iterable[Dict]) -> Dict[str, List[Dict]]:
+    """companyId → документы, по одному (самому свежему) на тип."""
+    by_company: Dict[str, Dict[str, Dict]] = {}
+    for d in docs:
+        cid = d.get('companyId')
+        doc_type = d.get('type', 'Документ')
+        entry = {
+            "id": d.get('id'),
+            "type": doc_type,
+            "uploadedAt": d.get('createdAt', ''),
+            "status": d.get('status', 'uploaded'),
+        }
+        per_type = by_company.setdefault(cid, {})
+        existing = per_type.get(doc_type)
+        if not existing or (d.get('createdAt', '') or '') > (existing.get('uploadedAt', '') or ''):
+            per_type[doc_type] = entry
+    return {cid: list(per_type.values()) for cid, per_type in by_company.items()}
+
+
+def build_view_row(supplier_id: str, restaurant: Dict, link: Optional[Dict], documents: List[Dict]) -> Dict:
+    return {
+        "supplierId": supplier_id,
+        "restaurantId": restaurant['id'],
+        "restaurant": restaurant_payload(restaurant),
+        "documents": documents,
+        "linked": link is not None,
+        "contract_accepted": bool(link and link.get("contract_accepted")),
+        "is_paused": bool(link and link.get("is_paused")),
+        "ordersEnabled": link.get("ordersEnabled", True) if link else True,
+        "unavailabilityReason": link.get("unavailabilityReason") if link else None,
+        "viewUpdatedAt": _now(),
+    }
+
+
+def link_upsert_ops(pairs: Iterable, set_fields: Dict, set_on_insert: Optional[Dict] = None) -> List[UpdateOne]:
+    update = {"$set": set_fields}
+    if set_on_insert:
+        update["$setOnInsert"] = set_on_insert
+    return [
+        UpdateOne({"supplierId": s, "restaurantId": r}, update, upsert=True)
+        for s, r in pairs
+    ]
+
+
+# ============================================================================
+# VIEW SYNC
+# ============================================================================
+
+async def sync_view(db, supplier_id: Optional[str] = None, restaurant_id: Optional[str] = None) -> int:
+    """
+    Пересобрать строки витрины для поставщика и/или ресторана
+    (без аргумента - для всех поставщиков или всех ресторанов соответственно).
+    Один find на каждую коллекцию + один unordered bulk_write.
+    """
+    restaurant_query = {"type": "customer"}
+    if restaurant_id:
+        restaurant_query["id"] = restaurant_id
+    proj = {"_id": 0}
+    proj.update({k: 1 for k in RESTAURANT_VIEW_FIELDS})
+    restaurants = await db.companies.find(restaurant_query, proj).to_list(None)
+    if not restaurants:
+        return 0
+
+    if supplier_id:
+        supplier_ids = [supplier_id]
+    else:
+        suppliers = await db.companies.find({"type": "supplier"}, {"_id": 0, "id": 1}).to_list(None)
+        supplier_ids = [s['id'] for s in suppliers]
+    if not supplier_ids:
+        return 0
+
+    link_query = {}
+    if supplier_id:
+        link_query["supplierId"] = supplier_id
+    if restaurant_id:
+        link_query["restaurantId"] = restaurant_id
+    links = await db[LINKS_COLLECTION].find(
+        link_query, {"_id": 0, "supplierId": 1, "restaurantId": 1, **{k: 1 for k in LINK_STATE_FIELDS}}
+    ).to_list(None)
+    link_map = {(l['supplierId'], l['restaurantId']): l for l in links}
+
+    restaurant_ids = [r['id'] for r in restaurants]
+    docs = await db.documents.find({"companyId": {"$in": restaurant_ids}}, {"_id": 0}).to_list(None)
+    docs_by_company = latest_documents_by_type(docs)
+
+    ops = []
+    for sid in supplier_ids:
+        for r in restaurants:
+            row = build_view_row(sid, r, link_map.get((sid, r['id'])), docs_by_company.get(r['id'], []))
+            ops.append(UpdateOne({"supplierId": sid, "restaurantId": r['id']}, {"$set": row}, upsert=True))
+    await db[VIEW_COLLECTION].bulk_write(ops, ordered=False)
+    if not restaurant_id:
+        # Собрана вся витрина этих поставщиков (все рестораны)
+        await _mark_view_built(db, supplier_ids)
+    return len(ops)
+
+
+async def _mark_view_built(db, supplier_ids: List[str]) -> None:
+    built_at = _now()
+    await db[VIEW_STATE_COLLECTION].bulk_write([
+        UpdateOne({"supplierId": sid}, {"$set": {"builtAt": built_at}}, upsert=True)
+        for sid in supplier_ids
+    ], ordered=False)
+
+
+async def add_restaurant_to_view(db, restaurant_id: str) -> int:
+    """Новый ресторан → строки во всех витринах (pending, связи не создаются)."""
+    return await sync_view(db, restaurant_id=restaurant_id)
+
+
+async def refresh_restaurant_in_view(db, restaurant_id: str) -> None:
+    """Реквизиты/документы ресторана изменились → одна update_many по всем поставщикам."""
+    proj = {"_id": 0}
+    proj.update({k: 1 for k in RESTAURANT_VIEW_FIELDS})
+    restaurant = await db.companies.find_one({"id": restaurant_id, "type": "customer"}, proj)
+    if not restaurant:
+        return
+    docs = await db.documents.find({"companyId": restaurant_id}, {"_id": 0}).to_list(None)
+    await db[VIEW_COLLECTION].update_many(
+        {"restaurantId": restaurant_id},
+        {"$set": {
+            "restaurant": restaurant_payload(restaurant),
+            "documents": latest_documents_by_type(docs).get(restaurant_id, []),
+            "viewUpdatedAt": _now(),
+        }}
+    )
+
+
+async def ensure_supplier_view(db, supplier_id: str) -> None:
+    """Собрать витрину поставщика целиком, если полной сборки ещё не было."""
+    if not await db[VIEW_STATE_COLLECTION].find_one({"supplierId": supplier_id}, {"_id": 1}):
+        await sync_view(db, supplier_id=supplier_id)
+
+
+async def ensure_view_indexes(db) -> None:
+    await db[VIEW_COLLECTION].create_index([("supplierId", 1), ("restaurantId", 1)], unique=True)
+    await db[VIEW_COLLECTION].create_index([("restaurantId", 1)])
+    await db[LINKS_COLLECTION].create_index([("supplierId", 1), ("restaurantId", 1)])
+    await db[LINKS_COLLECTION].create_index([("restaurantId", 1)])
+    await db[VIEW_STATE_COLLECTION].create_index([("supplierId", 1)], unique=True)
+
+
+# ============================================================================
+# BULK LINKING
+# ============================================================================
+
+async def link_supplier_to_all_restaurants(db, supplier_id: str) -> int:
+    """Создать pending-связи нового поставщика со всеми ресторанами (один bulk_write)."""
+    restaurants = await db.companies.find({"type": "customer"}, {"_id": 0, "id": 1}).to_list(None)
+    ops = link_upsert_ops(
+        ((supplier_id, r['id']) for r in restaurants),
+        {"updatedAt": _now()},
+        {"contract_accepted": False, "is_paused": False},
+    )
+    if ops:
+        await db[LINKS_COLLECTION].bulk_write(ops, ordered=False)
+    await sync_view(db, supplier_id=supplier_id)
+    return len(ops)
+
+
+async def link_restaurant_to_all_suppliers(db, restaurant_id: str, accept: bool = False) -> int:
+    """
+    Связать ресторан со всеми поставщиками (один bulk_write).
+    accept=False - pending-связи (существующие не трогаем);
+    accept=True  - принять договор со всеми (dev auto-accept).
+    """
+    suppliers = await db.companies.find({"type": "supplier"}, {"_id": 0, "id": 1}).to_list(None)
+    pairs = ((s['id'], restaurant_id) for s in suppliers)
+    if accept:
+        ops = link_upsert_ops(pairs, {
+            "contract_accepted": True,
+            "is_paused": False,
+            "ordersEnabled": True,
+            "updatedAt": _now(),
+        })
+    else:
+        ops = link_upsert_ops(pairs, {"updatedAt": _now()}, {"contract_accepted": False, "is_paused": False})
+    if ops:
+        await db[LINKS_COLLECTION].bulk_write(ops, ordered=False)
+    await sync_view(db, restaurant_id=restaurant_id)
+    return len(ops)
+
+
+async def run_link_job(job_fn, db, company_id: str, **kwargs) -> None:
+    """Обёртка для фонового запуска: ошибки логируются, а не теряются."""
+    try:
+        count = await job_fn(db, company_id, **kwargs)
+        logger.info("Link job %s(%s): %d links", job_fn.__name__, company_id, count)
+    except Exception as e:
+        logger.error("Link job %s(%s) failed: %s", job_fn.__name__, company_id, e)
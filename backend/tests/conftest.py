@@ -0,0 +1,697 @@
+"""
+Общий in-memory MongoDB для backend-тестов
+==========================================
+
+FakeDB / FakeCollection / FakeCursor с семантикой pymongo в объёме, который
+использует backend: фильтры (сравнения, $in/$nin/$ne, $exists, $type, $regex,
+$all, $elemMatch, $or/$and/$nor, точечные пути с раскрытием массивов),
+проекции, sort/skip/limit, обновления ($set/$setOnInsert/$unset/$inc/$push/
+$pull/$addToSet, позиционный `$`), upsert, bulk_write и уникальные (в том
+числе partial) индексы. AsyncFakeDB - тот же движок с API motor.
+
+Тестам, которым нужно больше (aggregate, explain), достаточно унаследоваться
+от FakeCollection / FakeCursor (новые методы - с @collection_method):
+
+    from conftest import FakeDB, FakeCollection
+"""
+
+import copy
+import functools
+import operator
+import re
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+_MISSING = object()
+
+
+# ============================================================================
+# ЗНАЧЕНИЯ ПО ТОЧЕЧНОМУ ПУТИ
+# ============================================================================
+
+def _lookup(value, parts):
+    """Все значения по пути; массивы по дороге раскрываются, как в MongoDB."""
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return _lookup(value[head], rest) if head in value else []
+    if isinstance(value, list):
+        if head.isdigit():
+            index = int(head)
+            return _lookup(value[index], rest) if index < len(value) else []
+        return [found for element in value for found in _lookup(element, parts)]
+    return []
+
+
+def _first(doc, path):
+    found = _lookup(doc, path.split('.'))
+    return found[0] if found else None
+
+
+def _get(doc, path, default=None):
+    for part in path.split('.'):
+        if isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        elif isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        else:
+            return default
+    return doc
+
+
+def _set(doc, path, value):
+    *parents, last = path.split('.')
+    for part in parents:
+        doc = doc[int(part)] if isinstance(doc, list) else doc.setdefault(part, {})
+    if isinstance(doc, list):
+        doc[int(last)] = value
+    else:
+        doc[last] = value
+
+
+def _unset(doc, path):
+    *parents, last = path.split('.')
+    parent = _get(doc, '.'.join(parents)) if parents else doc
+    if isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+# ============================================================================
+# ПОРЯДОК И ТИПЫ BSON
+# ============================================================================
+
+def _rank(value):
+    """Порядок типов при сортировке/сравнении (null < числа < строки < ...)."""
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+_ORDERED = {1, 2, 3, 7, 8, 9}
+
+
+def _sort_key(value):
+    rank = _rank(value)
+    return (rank, value) if rank in _ORDERED else (rank, repr(value))
+
+
+def _comparable(a, b):
+    return _rank(a) == _rank(b) and _rank(a) in _ORDERED - {1}
+
+
+_TYPES = {
+    'double': lambda v: isinstance(v, float),
+    'string': lambda v: isinstance(v, str),
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'objectId': lambda v: isinstance(v, ObjectId),
+    'bool': lambda v: isinstance(v, bool),
+    'date': lambda v: isinstance(v, datetime),
+    'null': lambda v: v is None,
+    'int': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'long': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+}
+
+_COMPARE = {'$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt, '$lte': operator.le}
+
+_REGEX_FLAGS = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}
+
+
+# ============================================================================
+# ФИЛЬТРЫ
+# ============================================================================
+
+def _is_operator(cond):
+    return isinstance(cond, dict) and bool(cond) and all(k.startswith('$') for k in cond)
+
+
+def _same(a, b):
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def _equals(found, candidates, value):
+    if isinstance(value, re.Pattern):
+        return any(isinstance(c, str) and value.search(c) for c in candidates)
+    if value is None:
+        return not found or any(c is None for c in candidates)
+    return any(_same(c, value) for c in candidates)
+
+
+def _regex(pattern, options=''):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for flag in options:
+        flags |= _REGEX_FLAGS[flag]
+    return re.compile(pattern, flags)
+
+
+def _element_matches(element, cond):
+    """Условие $elemMatch / $pull для одного элемента массива."""
+    if _is_operator(cond):
+        return _condition_matches([element], cond)
+    if isinstance(cond, dict):
+        return isinstance(element, dict) and matches(element, cond)
+    return _same(element, cond)
+
+
+def _condition_matches(found, cond):
+    candidates = found + [el for value in found if isinstance(value, list) for el in value]
+    if not _is_operator(cond):
+        return _equals(found, candidates, cond)
+    for op, arg in cond.items():
+        if op == '$eq':
+            ok = _equals(found, candidates, arg)
+        elif op == '$ne':
+            ok = not _equals(found, candidates, arg)
+        elif op == '$in':
+            ok = any(_equals(found, candidates, v) for v in arg)
+        elif op == '$nin':
+            ok = not any(_equals(found, candidates, v) for v in arg)
+        elif op in _COMPARE:
+            ok = any(_comparable(c, arg) and _COMPARE[op](c, arg) for c in candidates)
+        elif op == '$exists':
+            ok = bool(found) == bool(arg)
+        elif op == '$type':
+            aliases = arg if isinstance(arg, list) else [arg]
+            ok = any(_TYPES[alias](c) for alias in aliases for c in candidates)
+        elif op == '$regex':
+            pattern = _regex(arg, cond.get('$options', ''))
+            ok = any(isinstance(c, str) and pattern.search(c) for c in candidates)
+        elif op == '$options':
+            ok = True
+        elif op == '$all':
+            ok = all(_equals(found, candidates, v) for v in arg)
+        elif op == '$elemMatch':
+            ok = any(isinstance(v, list) and any(_element_matches(el, arg) for el in v) for v in found)
+        elif op == '$size':
+            ok = any(isinstance(v, list) and len(v) == arg for v in found)
+        elif op == '$not':
+            ok = not _condition_matches(found, arg)
+        else:
+            raise NotImplementedError(f'FakeCollection: оператор {op} не поддержан')
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    """Документ проходит фильтр find() (семантика MongoDB)."""
+    for key, cond in (query or {}).items():
+        if key == '$or':
+            ok = any(matches(doc, branch) for branch in cond)
+        elif key == '$and':
+            ok = all(matches(doc, branch) for branch in cond)
+        elif key == '$nor':
+            ok = not any(matches(doc, branch) for branch in cond)
+        elif key.startswith('$'):
+            raise NotImplementedError(f'FakeCollection: оператор {key} не поддержан')
+        else:
+            ok = _condition_matches(_lookup(doc, key.split('.')), cond)
+        if not ok:
+            return False
+    return True
+
+
+# ============================================================================
+# ПРОЕКЦИИ И ОБНОВЛЕНИЯ
+# ============================================================================
+
+def project(doc, projection):
+    """Копия документа с проекцией find() ({'a': 1} / {'a': 0} / список полей)."""
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = [k for k, v in projection.items() if v and k != '_id']
+    if not include:
+        excluded = {k for k, v in projection.items() if not v}
+        return copy.deepcopy({k: v for k, v in doc.items() if k not in excluded})
+    result = {'_id': doc['_id']} if projection.get('_id', 1) and '_id' in doc else {}
+    for path in include:
+        value = _get(doc, path, _MISSING)
+        if value is not _MISSING:
+            _set(result, path, value)
+    return copy.deepcopy(result)
+
+
+def _positional(doc, path, query):
+    """'rows.$.n' -> 'rows.<i>.n': индекс первого элемента, совпавшего с фильтром."""
+    parts = path.split('.')
+    if '$' not in parts:
+        return path
+    at = parts.index('$')
+    head = '.'.join(parts[:at])
+    for key, cond in query.items():
+        if key.startswith(head + '.'):
+            rest = key[len(head) + 1:].split('.')
+            for index, element in enumerate(_get(doc, head) or []):
+                if _condition_matches(_lookup(element, rest), cond):
+                    parts[at] = str(index)
+                    return '.'.join(parts)
+    raise WriteError(f'The positional operator did not find the match needed from the query: {path}', 2)
+
+
+def apply_update(doc, update, query=None, inserting=False):
+    """Применяет операторы обновления к документу на месте."""
+    for op, fields in update.items():
+        if op == '$setOnInsert' and not inserting:
+            continue
+        for path, arg in fields.items():
+            path = _positional(doc, path, query or {})
+            if op in ('$set', '$setOnInsert'):
+                _set(doc, path, copy.deepcopy(arg))
+            elif op == '$unset':
+                _unset(doc, path)
+            elif op == '$inc':
+                _set(doc, path, _get(doc, path, 0) + arg)
+            elif op in ('$min', '$max'):
+                current = _get(doc, path, _MISSING)
+                better = operator.lt if op == '$min' else operator.gt
+                if current is _MISSING or better(arg, current):
+                    _set(doc, path, arg)
+            elif op in ('$push', '$addToSet'):
+                each = arg['$each'] if isinstance(arg, dict) and '$each' in arg else [arg]
+                value = list(_get(doc, path, []))
+                for item in copy.deepcopy(each):
+                    if op == '$push' or item not in value:
+                        value.append(item)
+                if isinstance(arg, dict) and '$slice' in arg:
+                    value = value[:arg['$slice']] if arg['$slice'] >= 0 else value[arg['$slice']:]
+                _set(doc, path, value)
+            elif op == '$pull':
+                value = _get(doc, path, _MISSING)
+                if isinstance(value, list):
+                    _set(doc, path, [el for el in value if not _element_matches(el, arg)])
+            else:
+                raise NotImplementedError(f'FakeCollection: оператор {op} не поддержан')
+
+
+def _upsert_seed(query):
+    """Поля-равенства фильтра - начальный документ для upsert."""
+    doc = {}
+    for key, cond in query.items():
+        if key == '$and':
+            for branch in cond:
+                doc.update(_upsert_seed(branch))
+        elif key.startswith('$'):
+            continue
+        elif _is_operator(cond):
+            if '$eq' in cond:
+                _set(doc, key, copy.deepcopy(cond['$eq']))
+        else:
+            _set(doc, key, copy.deepcopy(cond))
+    return doc
+
+
+def _sort_spec(key_or_list, direction=1):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction)]
+    return [tuple(item) for item in key_or_list]
+
+
+def _index_key(doc, fields):
+    return [_first(doc, f) if '.' in f else doc.get(f) for f in fields]
+
+
+def _sorted(docs, spec):
+    docs = list(docs)
+    for key, direction in reversed(spec or []):
+        docs.sort(key=lambda d: _sort_key(_first(d, key)), reverse=direction < 0)
+    return docs
+
+
+class FakeResult:
+    """InsertOneResult / UpdateResult / DeleteResult / BulkWriteResult в одном."""
+
+    def __init__(self, **fields):
+        self.inserted_id = None
+        self.upserted_id = None
+        self.inserted_count = self.matched_count = self.modified_count = 0
+        self.deleted_count = self.upserted_count = 0
+        self.__dict__.update(fields)
+
+
+# ============================================================================
+# CURSOR / COLLECTION / DB
+# ============================================================================
+
+class FakeCursor:
+    """Результат find(): sort/skip/limit цепочкой, проекция - при чтении."""
+
+    def __init__(self, collection, filter, docs, projection=None):
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self.sort_spec = None
+        self._docs = list(docs)
+        self._skip = self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self.sort_spec = _sort_spec(key_or_list, direction)
+        self._docs = _sorted(self._docs, self.sort_spec)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def hint(self, index):
+        return self
+
+    def close(self):
+        pass
+
+    def _results(self):
+        docs = self._docs[self._skip:]
+        if self._limit:
+            docs = docs[:abs(self._limit)]
+        return [project(d, self.projection) for d in docs]
+
+    def __iter__(self):
+        return iter(self._results())
+
+    def __getitem__(self, index):
+        return self._results()[index]
+
+
+def collection_method(method):
+    """Публичный метод коллекции: запись в calls и блокировка (тесты гоняют её из потоков)."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            self.calls.append((method.__name__, args[0] if args else kwargs.get('filter')))
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class FakeCollection:
+    """
+    Коллекция pymongo в памяти.
+
+    docs - хранимые документы (тесты читают их напрямую); calls - журнал
+    вызовов (метод, первый аргумент); bulk_writes - размер каждого bulk_write;
+    fail_ids - _id, запись которых падает WriteError (отказ одной операции).
+    """
+
+    cursor_class = FakeCursor
+
+    def __init__(self, docs=()):
+        self.docs = []
+        self.calls = []
+        self.bulk_writes = []
+        self.fail_ids = set()
+        self.indexes = {'_id_': {'key': [('_id', 1)], 'v': 2}}
+        self._lock = threading.RLock()
+        for doc in docs:
+            self._insert(dict(doc))
+
+    def call_count(self, *methods):
+        return sum(1 for name, _ in self.calls if name in methods)
+
+    # --- внутреннее: методы ниже не пишут в calls и зовут друг друга свободно
+
+    def _matching(self, filter, sort=None):
+        docs = self.docs
+        if filter and '_id' in filter and not _is_operator(filter['_id']):
+            docs = [d for d in docs if d.get('_id') == filter['_id']]     # точечный доступ по _id
+        return _sorted((d for d in docs if matches(d, filter)), sort)
+
+    def _check_unique(self, doc, ignore=None):
+        if ignore is None and any(other.get('_id') == doc['_id'] for other in self.docs):
+            raise DuplicateKeyError(f'E11000 duplicate key error index: _id_ dup key: {doc["_id"]}', 11000)
+        for name, info in self.indexes.items():
+            if not info.get('unique'):
+                continue
+            partial = info.get('partialFilterExpression')
+            if partial and not matches(doc, partial):
+                continue
+            fields = [field for field, _ in info['key']]
+            if info.get('sparse') and not any(_lookup(doc, f.split('.')) for f in fields):
+                continue
+            key = _index_key(doc, fields)
+            for other in self.docs:
+                if other is ignore or other is doc or (partial and not matches(other, partial)):
+                    continue
+                if _index_key(other, fields) == key:
+                    raise DuplicateKeyError(f'E11000 duplicate key error index: {name} dup key: {key}', 11000)
+
+    def _insert(self, doc):
+        doc.setdefault('_id', ObjectId())       # как pymongo: _id проставляется в переданный dict
+        stored = copy.deepcopy(doc)
+        self._check_unique(stored)
+        self.docs.append(stored)
+        return doc['_id']
+
+    def _update(self, filter, update, upsert=False, multi=False, replace=False):
+        targets = self._matching(filter)
+        if not multi:
+            targets = targets[:1]
+        modified = 0
+        for doc in targets:
+            if doc.get('_id') in self.fail_ids:
+                raise WriteError(f'injected failure for _id {doc["_id"]}', 2)
+            if replace:
+                new = {'_id': doc['_id'], **copy.deepcopy(update)}
+            else:
+                new = copy.deepcopy(doc)
+                apply_update(new, update, filter)
+            if new != doc:
+                self._check_unique(new, ignore=doc)
+                doc.clear()
+                doc.update(new)
+                modified += 1
+        upserted_id = None
+        if not targets and upsert:
+            seed = _upsert_seed(filter)
+            if replace:
+                new = {**({'_id': seed['_id']} if '_id' in seed else {}), **copy.deepcopy(update)}
+            else:
+                new = seed
+                apply_update(new, update, filter, inserting=True)
+            upserted_id = self._insert(new)
+        return FakeResult(matched_count=len(targets), modified_count=modified, upserted_id=upserted_id)
+
+    def _delete(self, filter, multi):
+        targets = self._matching(filter)
+        if not multi:
+            targets = targets[:1]
+        self.docs = [d for d in self.docs if not any(d is t for t in targets)]
+        return FakeResult(deleted_count=len(targets))
+
+    # --- чтение
+
+    @collection_method
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, **kwargs):
+        cursor = self.cursor_class(self, filter or {}, self._matching(filter), projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    @collection_method
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        found = self._matching(filter, _sort_spec(sort) if sort else None)
+        return project(found[0], projection) if found else None
+
+    @collection_method
+    def count_documents(self, filter, **kwargs):
+        found = self._matching(filter)[kwargs.get('skip', 0):]
+        return len(found[:kwargs['limit']] if kwargs.get('limit') else found)
+
+    @collection_method
+    def estimated_document_count(self, **kwargs):
+        return len(self.docs)
+
+    @collection_method
+    def distinct(self, key, filter=None, **kwargs):
+        values = []
+        for doc in self._matching(filter):
+            for value in _lookup(doc, key.split('.')):
+                for item in (value if isinstance(value, list) else [value]):
+                    if not any(_same(item, seen) for seen in values):
+                        values.append(item)
+        return values
+
+    # --- запись
+
+    @collection_method
+    def insert_one(self, document, **kwargs):
+        return FakeResult(inserted_id=self._insert(document), inserted_count=1)
+
+    @collection_method
+    def insert_many(self, documents, ordered=True, **kwargs):
+        ids = [self._insert(doc) for doc in documents]
+        return FakeResult(inserted_ids=ids, inserted_count=len(ids))
+
+    @collection_method
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert)
+
+    @collection_method
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert, multi=True)
+
+    @collection_method
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return self._update(filter, replacement, upsert, replace=True)
+
+    @collection_method
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=False, **kwargs):
+        found = self._matching(filter, _sort_spec(sort) if sort else None)
+        before = copy.deepcopy(found[0]) if found else None
+        if found:
+            self._update({**filter, '_id': found[0]['_id']}, update)
+            after = next(d for d in self.docs if d['_id'] == found[0]['_id'])
+        elif upsert:
+            after = next(d for d in self.docs if d['_id'] == self._update(filter, update, True).upserted_id)
+        else:
+            return None
+        doc = after if return_document else before
+        return project(doc, projection) if doc is not None else None
+
+    @collection_method
+    def delete_one(self, filter, **kwargs):
+        return self._delete(filter, multi=False)
+
+    @collection_method
+    def delete_many(self, filter, **kwargs):
+        return self._delete(filter, multi=True)
+
+    @collection_method
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        self.bulk_writes.append(len(requests))
+        result, errors = FakeResult(upserted_ids={}), []
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result.inserted_count += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    done = self._update(request._filter, request._doc, request._upsert,
+                                        multi=isinstance(request, UpdateMany),
+                                        replace=isinstance(request, ReplaceOne))
+                    result.matched_count += done.matched_count
+                    result.modified_count += done.modified_count
+                    if done.upserted_id is not None:
+                        result.upserted_count += 1
+                        result.upserted_ids[index] = done.upserted_id
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result.deleted_count += self._delete(request._filter, isinstance(request, DeleteMany)).deleted_count
+                else:
+                    raise TypeError(f'{request!r} is not a valid request')
+            except WriteError as exc:
+                errors.append({'index': index, 'code': exc.code, 'errmsg': str(exc)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': result.inserted_count,
+                'nUpserted': result.upserted_count, 'nMatched': result.matched_count,
+                'nModified': result.modified_count, 'nRemoved': result.deleted_count, 'upserted': [],
+            })
+        return result
+
+    # --- индексы
+
+    @collection_method
+    def create_index(self, keys, **options):
+        keys = [(keys, 1)] if isinstance(keys, str) else [tuple(k) for k in keys]
+        name = options.pop('name', None) or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        self.indexes.setdefault(name, {'key': keys, 'v': 2, **options})
+        return name
+
+    @collection_method
+    def drop_index(self, name):
+        self.indexes.pop(name)
+
+    @collection_method
+    def index_information(self):
+        return copy.deepcopy(self.indexes)
+
+
+class FakeDB(dict):
+    """База: коллекции создаются при первом обращении (db['x'] и db.x)."""
+
+    collection_class = FakeCollection
+
+    def __missing__(self, name):
+        self[name] = self.collection_class()
+        return self[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+# ============================================================================
+# MOTOR
+# ============================================================================
+
+class AsyncFakeCursor(FakeCursor):
+    async def to_list(self, length=None):
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncFakeCollection(FakeCollection):
+    """FakeCollection с API motor: find() синхронный, остальное - корутины."""
+
+    cursor_class = AsyncFakeCursor
+
+
+def _coroutine(name):
+    sync = getattr(FakeCollection, name)
+
+    @functools.wraps(sync)
+    async def method(self, *args, **kwargs):
+        return sync(self, *args, **kwargs)
+    return method
+
+
+for _name in ('find_one', 'count_documents', 'estimated_document_count', 'distinct', 'insert_one',
+              'insert_many', 'update_one', 'update_many', 'replace_one', 'find_one_and_update',
+              'delete_one', 'delete_many', 'bulk_write', 'create_index', 'drop_index', 'index_information'):
+    setattr(AsyncFakeCollection, _name, _coroutine(_name))
+
+
+class AsyncFakeDB(FakeDB):
+    collection_class = AsyncFakeCollection
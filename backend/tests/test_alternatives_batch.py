@@ -0,0 +1,154 @@
+"""
+Batch Alternatives Unit Tests
+=============================
+
+POST /v12/items/alternatives:batch (routes.get_items_alternatives_batch):
+для каждого товара та же выдача strict/similar, что у
+/item/{item_id}/alternatives, но кандидаты ядра читаются один раз на ядро,
+а поставщики - одним запросом на весь batch.
+
+Запуск: pytest /app/backend/tests/test_alternatives_batch.py -v
+"""
+
+import asyncio
+import json
+import sys
+sys.path.insert(0, '/app/backend')
+
+import pytest
+
+from bestprice_v12 import routes
+from conftest import FakeCollection, FakeDB
+
+
+def _offer(item_id, name, core, supplier, price, **extra):
+    return {'id': item_id, 'name_raw': name, 'product_core_id': core, 'supplier_company_id': supplier,
+            'price': price, 'active': True, 'publishable': True, 'unit_type': 'WEIGHT', **extra}
+
+
+OFFERS = [
+    _offer('sh1', 'Креветки тигровые 16/20 с/г с/м 1 кг', 'seafood.shrimp', 's1', 1200),
+    _offer('sh2', 'Креветки тигровые 16/20 с/г с/м 1 кг Agama', 'seafood.shrimp', 's2', 1100),
+    _offer('sh3', 'Креветки ваннамей 16/20 очищенные с/м 1 кг', 'seafood.shrimp', 's3', 1000),
+    _offer('sh4', 'Креветки тигровые 31/40 с/г с/м 1 кг', 'seafood.shrimp', 's1', 800),
+    _offer('ff1', 'Филе трески без кожи с/м 1 кг', 'seafood.cod_fillet', 's1', 700),
+    _offer('ff2', 'Филе трески без кожи с/м 1 кг Норвегия', 'seafood.cod_fillet', 's2', 650),
+    _offer('ff3', 'Филе трески на коже с/м 1 кг', 'seafood.cod_fillet', 's4', 600),
+    _offer('r1', 'Рис басмати 1 кг', 'staples.rice', 's1', 300),
+    _offer('r2', 'Рис басмати Mistral 1 кг', 'staples.rice', 's2', 280),
+    _offer('r3', 'Рис жасмин 1 кг', 'staples.rice', 's3', 250),
+    _offer('nc', 'Товар без ядра', None, 's1', 10),
+]
+COMPANIES = [
+    {'id': 's1', 'companyName': 'Альфа', 'min_order_amount': 5000},
+    {'id': 's2', 'name': 'Бета'},
+    {'id': 's3', 'companyName': 'Гамма', 'min_order_amount': 3000},
+]
+ITEM_IDS = ['sh1', 'sh2', 'ff1', 'r1', 'r2', 'nc', 'missing', 'sh1']
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    fake['supplier_items'] = FakeCollection(OFFERS)
+    fake['companies'] = FakeCollection(COMPANIES)
+    monkeypatch.setattr(routes, 'get_db', lambda: fake)
+    return fake
+
+
+def _body(response):
+    return json.loads(response.body)
+
+
+def _single(item_id, mode):
+    return _body(asyncio.run(routes.get_item_alternatives(item_id, limit=10, mode=mode, include_similar=False, ts=None)))
+
+
+def _batch(item_ids, mode):
+    request = routes.AlternativesBatchRequest(item_ids=item_ids, limit=10, mode=mode)
+    return _body(asyncio.run(routes.get_items_alternatives_batch(request)))
+
+
+def _strip(result):
+    return {k: v for k, v in result.items() if k not in ('debug_id', 'item_id')}
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+@pytest.mark.parametrize('mode', ['strict', 'similar'])
+def test_batch_matches_single_endpoint(db, mode):
+    batch = _batch(ITEM_IDS, mode)
+    assert [r['item_id'] for r in batch['results']] == list(dict.fromkeys(ITEM_IDS))
+    assert batch['count'] == 7 and batch['cores'] == 3
+
+    for result in batch['results']:
+        assert _strip(result) == _strip(_single(result['item_id'], mode)), result['item_id']
+
+    by_id = {r['item_id']: r for r in batch['results']}
+    assert by_id['missing']['source'] is None
+    assert by_id['nc']['reason'] == 'no_product_core_id'
+    assert by_id['sh1']['npc_domain'] == 'SHRIMP'
+    assert 'sh4' not in [a['id'] for a in by_id['sh1']['strict']]
+
+
+@pytest.mark.parametrize('mode', ['strict', 'similar'])
+def test_batch_matches_single_endpoint_over_candidates_limit(db, monkeypatch, mode):
+    # Ядро больше topK; в коллекции офферы лежат не по цене
+    extra = [_offer(f'rx{i:03d}', f'Рис басмати {i} 1 кг', 'staples.rice', f's{i % 3 + 1}', 200 + (i * 37) % 150)
+             for i in range(routes.ALTERNATIVES_CANDIDATES_LIMIT + 20)]
+    db['supplier_items'] = FakeCollection(extra[::-1] + OFFERS)
+    core = sorted(extra + OFFERS[7:10], key=lambda o: (o['price'], o['id']))
+    item_ids = [core[0]['id'], core[5]['id'], 'r1']
+
+    candidates = []
+    original = routes._item_alternatives
+
+    def capturing(db, source_item, raw_candidates, *args, **kwargs):
+        candidates.append((source_item['id'], [c['id'] for c in raw_candidates]))
+        return original(db, source_item, raw_candidates, *args, **kwargs)
+
+    monkeypatch.setattr(routes, '_item_alternatives', capturing)
+    batch = _batch(item_ids, mode)
+    for result in batch['results']:
+        assert _strip(result) == _strip(_single(result['item_id'], mode)), result['item_id']
+
+    # topK - самые дешёвые офферы ядра без самого товара, одинаково в batch и single
+    batch_candidates, single_candidates = candidates[:3], candidates[3:]
+    assert batch_candidates == single_candidates
+    for item_id, ids in batch_candidates:
+        expected = [o['id'] for o in core if o['id'] != item_id][:routes.ALTERNATIVES_CANDIDATES_LIMIT]
+        assert ids == expected, item_id
+
+
+def test_batch_reads_each_core_and_suppliers_once(db):
+    _batch(ITEM_IDS, 'similar')
+    items_calls = db['supplier_items'].calls
+    # Исходные товары + по одному запросу кандидатов на ядро
+    assert len(items_calls) == 1 + 3 and all(kind == 'find' for kind, _ in items_calls)
+    assert sorted(q['product_core_id'] for _, q in items_calls[1:]) == [
+        'seafood.cod_fillet', 'seafood.shrimp', 'staples.rice']
+    # Поставщики (включая отсутствующего s4) - один запрос, без find_one на карточку
+    [(kind, query)] = db['companies'].calls
+    assert kind == 'find' and sorted(query['id']['$in']) == ['s1', 's2', 's3', 's4']
+
+
+def test_signatures_are_extracted_once_per_core(db, monkeypatch):
+    from bestprice_v12 import npc_matching_v9
+    extracted = []
+    original = npc_matching_v9.extract_npc_signature
+
+    def counting(item):
+        extracted.append(item.get('id'))
+        return original(item)
+
+    monkeypatch.setattr(npc_matching_v9, 'extract_npc_signature', counting)
+    for item_id in ('sh1', 'sh2', 'sh3'):
+        _single(item_id, 'similar')
+    # sh4 - только кандидат: по карточке подписывается на каждый запрос, в batch - один раз
+    assert extracted.count('sh4') == 3
+
+    extracted.clear()
+    _batch(['sh1', 'sh2', 'sh3'], 'similar')
+    assert extracted.count('sh4') == 1
@@ -0,0 +1,99 @@
+"""
+Batch Audit Job Unit Tests
+==========================
+
+Индексы кандидатов полного аудита должны давать тот же результат,
+что и прямой перебор каталога (как было в сэмплирующей версии).
+
+Запуск: pytest /app/backend/tests/test_batch_audit_job.py -v
+"""
+
+import re
+import sys
+sys.path.insert(0, '/app/backend')
+
+from batch_audit_job import (
+    ClassCandidates, TokenBlockingIndex, simulate_match, diff_summaries,
+    GUARD_OK, GUARD_FORBIDDEN, GUARD_ANCHOR,
+)
+
+
+ITEMS = [
+    {'id': 'a', 'name_raw': 'Сыр Моцарелла 1кг', 'super_class': 'dairy.сыр', 'price': 500},
+    {'id': 'b', 'name_raw': 'Сырники замороженные', 'super_class': 'dairy.сыр', 'price': 100},
+    {'id': 'c', 'name_raw': 'Сыр Гауда 1кг', 'super_class': 'dairy.сыр', 'price': 450},
+    {'id': 'd', 'name_raw': 'Сыр Чеддер 1кг', 'super_class': 'dairy.сыр', 'price': 450},
+    {'id': 'e', 'name_raw': 'Масса творожная', 'super_class': 'dairy.сыр', 'price': 90},
+    {'id': 'o1', 'name_raw': 'Соус терияки классический', 'super_class': 'other', 'price': 200},
+    {'id': 'o2', 'name_raw': 'Соус терияки острый классический', 'super_class': 'other', 'price': 150},
+    {'id': 'o3', 'name_raw': 'Салфетки бумажные', 'super_class': 'other', 'price': 50},
+]
+
+STATUSES = [GUARD_OK, GUARD_FORBIDDEN, GUARD_OK, GUARD_OK, GUARD_ANCHOR]
+
+
+def _naive_candidates(ref):
+    candidates = [
+        c for c, status in zip(ITEMS[:5], STATUSES)
+        if c['id'] != ref['id'] and status == GUARD_OK
+    ]
+    candidates.sort(key=lambda x: x.get('price', 999999))
+    return candidates
+
+
+def test_class_candidates_excludes_reference():
+    bucket = ClassCandidates(ITEMS[:5], STATUSES)
+    for ref in ITEMS[:5]:
+        winner, count, forbidden, anchor = bucket.for_reference(ref['id'])
+        naive = _naive_candidates(ref)
+        assert winner is naive[0]
+        assert count == len(naive)
+        assert forbidden == (0 if ref['id'] == 'b' else 1)
+        assert anchor == (0 if ref['id'] == 'e' else 1)
+
+
+def test_class_candidates_price_ties_keep_catalog_order():
+    bucket = ClassCandidates(ITEMS[:5], STATUSES)
+    winner, _, _, _ = bucket.for_reference('x')
+    assert winner['id'] == 'c'
+
+
+def test_token_blocking_matches_bruteforce():
+    others = [c for c in ITEMS if c['super_class'] == 'other']
+    index = TokenBlockingIndex(others)
+    ref_name = 'Соус ТЕРИЯКИ классический 1л'
+    ref_keywords = {w for w in re.findall(r'\w+', ref_name.lower()) if len(w) >= 4}
+    brute = [
+        c for c in others
+        if c['id'] != 'o1'
+        and len({w for w in re.findall(r'\w+', c['name_raw'].lower())} & ref_keywords) >= 2
+    ]
+    assert index.candidates(ref_name, 'o1') == brute
+    assert [c['id'] for c in brute] == ['o2']
+
+
+def test_simulate_match_falls_back_to_other():
+    index = TokenBlockingIndex([c for c in ITEMS if c['super_class'] == 'other'])
+    ref = {'id': 'r', 'name_raw': 'Соус терияки классический'}
+    result = simulate_match(ref, 'condiments.sauce', 0.5, {}, index, len(ITEMS))
+    assert result['status'] == 'ok'
+    assert result['selected_name'] == 'Соус терияки острый классический'
+    assert result['candidates_after_super_class_guards'] == 2
+
+
+def test_simulate_match_flags_bad_match():
+    bucket = ClassCandidates(ITEMS[:2], [GUARD_OK, GUARD_OK])
+    index = TokenBlockingIndex([])
+    result = simulate_match(ITEMS[0], 'dairy.сыр', 0.9, {'dairy.сыр': bucket}, index, 2)
+    assert result['is_bad_match'] is True
+    assert result['bad_match_reason'] == 'сыр→сырники'
+
+
+def test_diff_summaries_reports_changed_metrics_only():
+    prev = {'timestamp': '1', 'total_items': 10, 'matching_quality': {'ok': 5, 'not_found': 5}}
+    curr = {'timestamp': '2', 'total_items': 12, 'matching_quality': {'ok': 5, 'bad_matches': 1}}
+    assert diff_summaries(prev, curr) == {
+        'matching_quality.bad_matches': {'prev': 0, 'curr': 1, 'delta': 1},
+        'matching_quality.not_found': {'prev': 5, 'curr': 0, 'delta': -5},
+        'total_items': {'prev': 10, 'curr': 12, 'delta': 2},
+    }
@@ -0,0 +1,153 @@
+"""
+Best Price Engine Unit Tests
+============================
+
+Set-based пересчёт catalog_references (bestprice_v12/best_price_engine.py):
+совпадение с get_best_price_for_reference, запись только изменений,
+стабильный reference_id и инкрементальный режим по catalog_change_log.
+
+Запуск: pytest /app/backend/tests/test_best_price_engine.py -v
+"""
+
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.catalog import (
+    get_best_price_for_reference, offer_pack_fields, get_offer_pack, extract_pack_from_name,
+)
+from bestprice_v12.best_price_engine import (
+    generate_references, recompute_best_prices, recompute_incremental, record_catalog_change,
+    CHANGE_LOG_COLLECTION,
+)
+from conftest import FakeCollection, FakeDB
+
+
+def _item(item_id, core, price, name, supplier='s1', unit_type='WEIGHT', **extra):
+    return {'id': item_id, 'product_core_id': core, 'unit_type': unit_type, 'price': price,
+            'name_raw': name, 'supplier_company_id': supplier, 'active': True, 'publishable': True, **extra}
+
+
+@pytest.fixture
+def db():
+    fake = FakeDB()
+    fake['supplier_items'] = FakeCollection([
+        _item('a1', 'rice', 300.0, 'Рис 5 кг', 's1'),
+        _item('a2', 'rice', 250.0, 'Рис 5кг', 's2'),
+        _item('a3', 'rice', 60.0, 'Рис 1 кг', 's3'),
+        _item('a4', 'rice', 240.0, 'Рис 5 кг', 's3', min_order_qty=2),
+        _item('a5', 'rice', 250.0, 'Рис 5 кг', 's4'),                     # та же цена, позже в курсоре
+        _item('b1', 'oil', 150.0, 'Масло 1л', 's1', unit_type='VOLUME'),
+        _item('b2', 'oil', 700.0, 'Масло', 's2', unit_type='VOLUME', pack_qty=5),
+        _item('c1', 'salt', 20.0, 'Соль 1 кг', 's2'),
+        _item('c2', 'salt', 15.0, 'Соль 1 кг', 's3', active=False),
+        _item('d1', 'flour', 80.0, 'Мука 2 кг', 's1'),
+    ])
+    return fake
+
+
+def _refs(db):
+    return {(r['product_core_id'], r['unit_type']): r for r in db['catalog_references'].docs}
+
+
+# ============================================================================
+# PACK FIELDS
+# ============================================================================
+
+def test_precomputed_pack_matches_name_parsing():
+    offer = {'name_raw': 'Масло 0,5 л', 'pack_qty': 1, 'unit_type': 'VOLUME'}
+    assert get_offer_pack(offer) == (0.5, 'л')
+    assert get_offer_pack({**offer, **offer_pack_fields('Масло 0,5 л', 1, 'VOLUME')}) == (0.5, 'л')
+    # pack_qty > 1 важнее названия
+    assert offer_pack_fields('Масло 0,5 л', 6, 'VOLUME')['offer_pack_value'] == 6.0
+    # Устаревшая версия полей игнорируется
+    assert get_offer_pack({**offer, 'offer_pack_value': 9.0, 'offer_pack_unit': 'кг', 'offer_pack_v': 0}) == (0.5, 'л')
+
+
+# ============================================================================
+# GENERATE + FULL RECOMPUTE
+# ============================================================================
+
+def test_generate_is_single_scan_with_stable_reference_ids(db):
+    stats = generate_references(db)
+    assert stats['total_groups'] == 4 and stats['inserted'] == 4
+    assert db['supplier_items'].call_count('find') == 1
+    refs = _refs(db)
+    assert refs[('rice', 'WEIGHT')]['anchor_supplier_item_id'] == 'a3'
+    assert (refs[('rice', 'WEIGHT')]['pack_value'], refs[('rice', 'WEIGHT')]['pack_unit']) == extract_pack_from_name('Рис 1 кг')
+    ids = {k: r['reference_id'] for k, r in refs.items()}
+
+    stats = generate_references(db, limit=1)
+    assert stats['inserted'] == 0
+    assert {k: r['reference_id'] for k, r in _refs(db).items()} == ids
+
+
+def test_full_recompute_matches_per_reference_lookup(db):
+    generate_references(db)
+    # Карточка с фасовкой 5 кг - победитель считается только среди 5 кг
+    pack_value, pack_unit = extract_pack_from_name('Рис 5 кг')
+    db['catalog_references'].insert_one({
+        'reference_id': 'ref_rice_5', 'product_core_id': 'rice', 'unit_type': 'WEIGHT',
+        'pack_value': pack_value, 'pack_unit': pack_unit,
+    })
+    db['catalog_references'].insert_one({
+        'reference_id': 'ref_oil_5', 'product_core_id': 'oil', 'unit_type': 'VOLUME',
+        'pack_value': 5.0, 'pack_unit': 'л',
+    })
+    expected = {
+        r['reference_id']: get_best_price_for_reference(
+            db, r['product_core_id'], r['unit_type'], r.get('pack_value'), r.get('pack_unit'))
+        for r in db['catalog_references'].docs
+    }
+
+    stats = recompute_best_prices(db)
+    assert stats['updated'] == stats['total'] == 6
+
+    for ref in db['catalog_references'].docs:
+        best_price, supplier_id, offer = expected[ref['reference_id']]
+        assert ref['best_price'] == best_price
+        assert ref['best_supplier_id'] == supplier_id
+        assert ref['anchor_supplier_item_id'] == offer['id']
+
+    # Первый минимум выигрывает: a2 (250) раньше a5 (250); a4 - 240 * 2 по минималке
+    assert next(r for r in db['catalog_references'].docs if r['reference_id'] == 'ref_rice_5')['best_supplier_id'] == 's2'
+
+
+def test_recompute_writes_only_changed_references(db):
+    generate_references(db)
+    recompute_best_prices(db)
+    ops_before = sum(db['catalog_references'].bulk_writes)
+    stats = recompute_best_prices(db)
+    assert stats['written'] == 0
+    assert sum(db['catalog_references'].bulk_writes) == ops_before
+
+
+# ============================================================================
+# INCREMENTAL
+# ============================================================================
+
+def test_incremental_recomputes_only_logged_cores(db):
+    generate_references(db)
+    recompute_best_prices(db)
+    assert recompute_incremental(db)['changes'] == 0
+
+    # Импорт s2: соль подешевела; мука (только у s1) тоже, но s1 в логе не отмечен
+    next(d for d in db['supplier_items'].docs if d['id'] == 'c1')['price'] = 10.0
+    next(d for d in db['supplier_items'].docs if d['id'] == 'd1')['price'] = 1.0
+    record_catalog_change(db, 'price_list_import', supplier_id='s2')
+
+    stats = recompute_incremental(db)
+    assert stats['changes'] == 1
+    assert stats['cores'] == 3            # rice, oil, salt у s2
+    refs = _refs(db)
+    assert refs[('salt', 'WEIGHT')]['best_price'] == 10.0
+    assert refs[('flour', 'WEIGHT')]['best_price'] == 80.0
+
+    # Явный список ядер (удаление прайса / переклассификация)
+    record_catalog_change(db, 'backfill', product_core_ids=['flour'])
+    stats = recompute_incremental(db)
+    assert stats['cores'] == 1 and stats['written'] == 1
+    assert refs[('flour', 'WEIGHT')]['best_price'] == 1.0
+
+    assert all(e['consumed_at'] is not None for e in db[CHANGE_LOG_COLLECTION].docs)
+    assert recompute_incremental(db)['changes'] == 0
@@ -0,0 +1,137 @@
+"""
+Brand Jobs Unit Tests
+=====================
+
+Потоковый backfill брендов и отчёт о покрытии брендами (brand_jobs.py):
+отчёт совпадает с generate_brand_quality_report, backfill пишет только
+изменившиеся продукты батчами bulk_write, сохранённый отчёт обновляется
+инкрементально без полного пересчёта.
+
+Запуск: pytest /app/backend/tests/test_brand_jobs.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import brand_jobs
+from brand_jobs import (
+    run_brand_backfill, build_brand_quality_report, refresh_brand_report, format_brand_report,
+    load_brand_report, job_status, BRAND_BACKFILL_JOB,
+)
+from search_engine import generate_brand_quality_report
+from conftest import FakeCollection, FakeDB
+
+
+BRANDS = {'knorr': ('knorr', False), 'mutti': ('mutti', True), 'heinz': ('heinz', False)}
+
+
+def detect_brand(name):
+    for alias, result in BRANDS.items():
+        if alias in name.lower():
+            return result
+    return None, False
+
+
+def _db():
+    db = FakeDB()
+    names = ['Бульон Knorr', 'Томаты Mutti', 'Кетчуп Heinz', 'Рис', 'Соль', 'Сахар', 'Мука', 'Knorr соус']
+    db['products'] = FakeCollection([
+        {'_id': i, 'id': f'p{i}', 'name': name, **({'brand_id': 'knorr', 'brand_strict': False} if i == 0 else {})}
+        for i, name in enumerate(names)
+    ])
+    db['pricelists'] = FakeCollection([
+        {'_id': i, 'id': f'pl{i}', 'supplierId': f's{i % 3}', 'productId': f'p{i % 9}'}  # p8 - нет в products
+        for i in range(30)
+    ])
+    return db
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def _legacy(db):
+    return generate_brand_quality_report(db['products'].docs, db['pricelists'].docs)
+
+
+def test_report_matches_in_memory_generator():
+    db = _db()
+    doc = build_brand_quality_report(db, batch_size=7)
+    report = format_brand_report(doc, {'s0': 'Поставщик 0'})
+    legacy = _legacy(db)
+    assert report['overall'] == legacy['overall']
+    for supplier_id, stats in legacy['by_supplier'].items():
+        assert report['by_supplier'][supplier_id] == {
+            **stats, 'supplier_name': 'Поставщик 0' if supplier_id == 's0' else 'Unknown'}
+    assert len(report['sample_without_brand']) == 20
+    assert load_brand_report(db)['rows'] == doc['rows']
+    # Продукты читаются одним $in на батч pricelists, а не целиком
+    assert db['products'].call_count('find') == 5
+
+
+def test_backfill_writes_changed_products_in_batches():
+    db = _db()
+    result = run_brand_backfill(db, detect_brand, batch_size=3)
+    assert result['stats']['total_products'] == 8
+    assert result['stats']['branded'] == 4 and result['stats']['strict_branded'] == result['stats']['strict'] == 1
+    assert result['stats']['brand_counts'] == {'knorr': 2, 'mutti': 1, 'heinz': 1}
+    assert result['stats']['updated'] == 7                # p0 уже размечен knorr
+    assert result['top_brands'][0] == {'brand_id': 'knorr', 'count': 2}
+    assert db['products'].bulk_writes == [2, 3, 2]
+
+    status = job_status(db, BRAND_BACKFILL_JOB)
+    assert status['status'] == 'completed' and status['progress']['total_products'] == 8
+    assert result['report_refreshed'] is False            # отчёт ещё не строился
+
+    again = run_brand_backfill(db, detect_brand, batch_size=3)
+    assert again['stats']['updated'] == 0 and db['products'].bulk_writes == [2, 3, 2]
+
+
+def test_report_refreshed_incrementally_after_backfill():
+    db = _db()
+    build_brand_quality_report(db)
+    finds_before = db['pricelists'].call_count('find')
+    result = run_brand_backfill(db, detect_brand, batch_size=100)
+    assert result['report_refreshed'] is True and result['brand_flips'] == 3
+
+    # Инкремент читает только строки прайсов изменившихся продуктов
+    assert db['pricelists'].call_count('find') == finds_before + 1
+
+    refreshed = format_brand_report(load_brand_report(db))
+    rebuilt = format_brand_report(build_brand_quality_report(FakeDB(products=db['products'], pricelists=db['pricelists'])))
+    assert refreshed['overall'] == rebuilt['overall'] == _legacy(db)['overall']
+    assert refreshed['by_supplier'] == rebuilt['by_supplier']
+    assert all(s['product_id'] not in ('p1', 'p2', 'p7') for s in refreshed['sample_without_brand'])
+
+
+def test_refresh_without_stored_report_is_noop():
+    db = _db()
+    assert refresh_brand_report(db, {'p1': True}) is None
+    assert load_brand_report(db) is None
+
+
+def test_failed_writes_do_not_change_report():
+    db = _db()
+    build_brand_quality_report(db)
+    before = format_brand_report(load_brand_report(db))
+    db['products'].fail_ids = {1}                        # p1 (Mutti) не записывается
+    result = run_brand_backfill(db, detect_brand, batch_size=100)
+    assert result['stats']['errors'] == 1 and result['brand_flips'] == 2
+
+    refreshed = format_brand_report(load_brand_report(db))
+    rebuilt = format_brand_report(build_brand_quality_report(FakeDB(products=db['products'], pricelists=db['pricelists'])))
+    assert refreshed['overall'] == rebuilt['overall'] != before['overall']
+
+
+def test_refresh_skips_report_rebuilt_meanwhile(monkeypatch):
+    db = _db()
+    stale = build_brand_quality_report(db)
+    for product in db['products'].docs:
+        product['brand_id'], product['brand_strict'] = detect_brand(product['name'])
+    # Полный пересчёт прошёл между чтением отчёта и инкрементом - новые бренды уже учтены
+    rebuilt = build_brand_quality_report(db)
+    db['brand_quality_reports'].docs[0]['built_at'] = 'rebuilt'
+    monkeypatch.setattr(brand_jobs, 'load_brand_report', lambda db_: stale)
+
+    refresh_brand_report(db, {'p1': True, 'p2': True, 'p7': True})
+    assert db['brand_quality_reports'].docs[0]['rows'] == rebuilt['rows']
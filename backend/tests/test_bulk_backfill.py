@@ -0,0 +1,134 @@
+"""
+Bulk Backfill Framework Unit Tests
+==================================
+
+Тесты для bulk_backfill.py: стадии, diff изменений, батчи по _id и чекпоинты.
+
+Запуск: pytest /app/backend/tests/test_bulk_backfill.py -v
+"""
+
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bulk_backfill import (
+    STAGES, resolve_stages, apply_stages, diff_fields, process_batch,
+    run_backfill, load_checkpoint,
+)
+from conftest import FakeCollection, FakeDB
+
+
+@pytest.fixture
+def db():
+    fake = FakeDB()
+    fake['supplier_items'] = FakeCollection([
+        {'_id': i, 'name_raw': name, 'super_class': sc}
+        for i, (name, sc) in enumerate([
+            ('Молоко Простоквашино 3,2% 1л', 'dairy.milk'),
+            ('Сливки 33% 1л', 'dairy.cream'),
+            ('Филе лосося охл', 'seafood.salmon'),
+            ('Тушка форели с/м', 'seafood.trout'),
+            ('Салфетки бумажные', 'disposables.napkins'),
+        ], start=1)
+    ])
+    return fake
+
+
+# ============================================================================
+# STAGES
+# ============================================================================
+
+def test_builtin_stages_registered():
+    for name in ('reclassify', 'lemma_tokens', 'search_tokens', 'geography', 'critical_attrs', 'offer_pack',
+                 'brand'):
+        assert name in STAGES
+
+
+def test_resolve_unknown_stage_raises():
+    with pytest.raises(ValueError):
+        resolve_stages(['no_such_stage'])
+
+
+def test_diff_fields_drops_unchanged():
+    assert diff_fields({'cut': 'fillet', 'fat_pct': 3.2}, {'cut': 'fillet', 'fat_pct': 3.5}) == {'fat_pct': 3.5}
+
+
+def test_critical_attrs_stage():
+    stages = resolve_stages(['critical_attrs'])
+    changes, touched = apply_stages({'name_raw': 'Сливки 33% 1л', 'super_class': 'dairy.cream'}, stages)
+    assert changes == {'fat_pct': 33.0}
+    assert touched == ['critical_attrs']
+
+    changes, _ = apply_stages({'name_raw': 'Филе лосося', 'super_class': 'seafood.salmon', 'cut': 'fillet'}, stages)
+    assert changes == {}
+
+
+def test_offer_pack_stage_skips_up_to_date_docs():
+    stages = resolve_stages(['offer_pack'])
+    doc = {'name_raw': 'Томаты 800г', 'pack_qty': 1, 'unit_type': 'WEIGHT'}
+    changes, _ = apply_stages(doc, stages)
+    assert changes['offer_pack_value'] == 0.8 and changes['offer_pack_unit'] == 'кг'
+    assert apply_stages({**doc, **changes}, stages) == ({}, [])
+
+
+def test_brand_stage_uses_current_brand_master(monkeypatch):
+    import brand_master
+
+    class _Brands:
+        def detect_brand(self, name):
+            return ('mistral', True) if 'mistral' in name.lower() else (None, False)
+
+    monkeypatch.setattr(brand_master, 'get_brand_master', lambda: _Brands())
+    stages = resolve_stages(['brand'])
+    changes, _ = apply_stages({'name_raw': 'Рис Mistral 1 кг'}, stages)
+    assert changes == {'brand_id': 'mistral', 'brand_strict': True}
+    assert apply_stages({'name_raw': 'Рис 1 кг', 'brand_id': None, 'brand_strict': False}, stages) == ({}, [])
+
+
+def test_process_batch_counts_per_stage():
+    docs = [
+        {'_id': 1, 'name_raw': 'Сливки 33% 1л', 'super_class': 'dairy.cream'},
+        {'_id': 2, 'name_raw': 'Салфетки', 'super_class': 'disposables.napkins'},
+    ]
+    results, counts, errors = process_batch(['critical_attrs'], docs)
+    assert results == [(1, {'fat_pct': 33.0})]
+    assert counts == {'critical_attrs': 1}
+    assert errors == 0
+
+
+# ============================================================================
+# RUNNER
+# ============================================================================
+
+def test_dry_run_writes_nothing(db):
+    stats = run_backfill(db, ['critical_attrs'], batch_size=2, dry_run=True)
+    assert stats['processed'] == 5
+    assert stats['changed'] == 4
+    assert db['supplier_items'].bulk_writes == []
+    assert load_checkpoint(db, 'critical_attrs') is None
+
+
+def test_apply_writes_bulk_and_completes(db):
+    stats = run_backfill(db, ['critical_attrs'], batch_size=2, dry_run=False)
+    items = db['supplier_items']
+    assert items.find_one({'_id': 1})['fat_pct'] == 3.2
+    assert items.find_one({'_id': 3})['cut'] == 'fillet'
+    assert items.find_one({'_id': 4})['cut'] == 'whole'
+    assert 'cut' not in items.find_one({'_id': 5})
+    assert stats['modified'] == 4
+    assert load_checkpoint(db, 'critical_attrs')['status'] == 'completed'
+
+
+def test_resume_from_checkpoint(db):
+    db['backfill_checkpoints'].update_one(
+        {'job_id': 'critical_attrs'},
+        {'$set': {'status': 'running', 'last_id': 3, 'processed': 3, 'changed': 3}},
+        upsert=True
+    )
+    stats = run_backfill(db, ['critical_attrs'], batch_size=2, dry_run=False)
+    items = db['supplier_items']
+    # Документы до last_id не трогаем
+    assert 'fat_pct' not in items.find_one({'_id': 1})
+    assert items.find_one({'_id': 4})['cut'] == 'whole'
+    assert stats['processed'] == 5
+    assert stats['changed'] == 4
@@ -0,0 +1,132 @@
+"""
+Batch Cart Mutations Unit Tests
+===============================
+
+Пакетное изменение корзины (bestprice_v12/cart_batch.py,
+POST /v12/cart/intents:batch): add / update / remove проверяются по общим
+чтениям с $in, пишутся одним ordered bulk_write, невалидные операции
+возвращаются с кодом и не мешают остальным, cart_hash считается один раз.
+
+Запуск: pytest /app/backend/tests/test_cart_batch.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.cart_batch import apply_cart_operations
+from bestprice_v12.plan_snapshot import compute_cart_hash
+from conftest import FakeCollection, FakeDB
+
+
+def _offer(item_id, core, supplier, price, **extra):
+    return {'id': item_id, 'name_raw': f'Товар {item_id}', 'product_core_id': core, 'unit_type': 'WEIGHT',
+            'supplier_company_id': supplier, 'price': price, 'active': True, 'publishable': True, **extra}
+
+
+def _db():
+    db = FakeDB()
+    db['supplier_items'] = FakeCollection([
+        _offer('o1', 'rice', 's1', 300, unique_key='s1:A1'),
+        _offer('o2', 'rice', 's2', 250),
+        _offer('o3', 'salt', 's1', 50),
+        _offer('free', 'salt', 's2', 0),
+        _offer('gone', 'oil', 's2', 500, active=False, publishable=False),
+        _offer('oil2', 'oil', 's3', 450),
+    ])
+    db['companies'] = FakeCollection([
+        {'id': 's1', 'companyName': 'Альфа'},
+        {'id': 's2', 'name': 'Бета'},
+    ])
+    db['favorites_v12'] = FakeCollection([
+        {'reference_id': 'fav-rice', 'product_name': 'Рис', 'unit_type': 'WEIGHT', 'anchor_supplier_item_id': 'o1',
+         'product_core_id': 'rice', 'brand_id': 'mistral'},
+        {'reference_id': 'fav-oil', 'product_name': 'Масло', 'unit_type': 'WEIGHT', 'anchor_supplier_item_id': 'gone',
+         'product_core_id': 'oil'},
+    ])
+    db['catalog_references'] = FakeCollection([
+        {'reference_id': 'ref-salt', 'name': 'Соль', 'unit_type': 'WEIGHT', 'best_supplier_id': 'o3'},
+    ])
+    db['cart_intents'] = FakeCollection([
+        {'user_id': 'u1', 'supplier_item_id': 'o2', 'reference_id': 'direct_o2', 'qty': 1, 'locked': True},
+        {'user_id': 'u2', 'supplier_item_id': 'o2', 'reference_id': 'direct_o2', 'qty': 9, 'locked': True},
+    ])
+    return db
+
+
+def _intents(db, user_id='u1'):
+    return {d['supplier_item_id']: d for d in db['cart_intents'].docs if d['user_id'] == user_id}
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_adds_resolve_like_single_intent_endpoint():
+    db = _db()
+    result = apply_cart_operations(db, 'u1', [
+        {'op': 'add', 'supplier_item_id': 'o3', 'qty': 2},
+        {'op': 'add', 'supplier_item_id': 's1:A1', 'qty': 1, 'lock_offer': False},  # по unique_key
+        {'op': 'add', 'reference_id': 'fav-rice', 'qty': 3},                        # anchor активен
+        {'op': 'add', 'reference_id': 'fav-oil', 'qty': 1},                         # anchor неактивен → замена
+        {'op': 'add', 'reference_id': 'ref-salt', 'qty': 4},                        # catalog_references
+    ])
+    assert result['applied'] == 5 and result['failed'] == 0
+    intents = _intents(db)
+    assert set(intents) == {'o1', 'o2', 'o3', 'oil2'}
+
+    # fav-rice и прямое добавление o1 - одна строка (upsert по supplier_item_id), последняя побеждает
+    assert intents['o1']['reference_id'] == 'fav-rice' and intents['o1']['qty'] == 3
+    assert intents['o1']['brand_id'] == 'mistral' and intents['o1']['supplier_name'] == 'Альфа'
+    assert intents['o3']['reference_id'] == 'ref-salt' and intents['o3']['qty'] == 4
+    assert intents['oil2']['supplier_name'] == 'Unknown' and intents['oil2']['price'] == 450
+
+    fav_oil = next(f for f in db['favorites_v12'].docs if f['reference_id'] == 'fav-oil')
+    assert fav_oil['anchor_supplier_item_id'] == 'oil2' and fav_oil['best_supplier_id'] == 's3'
+    assert result['results'][1]['supplier_name'] == 'Альфа'
+
+
+def test_invalid_operations_are_reported_and_skipped():
+    db = _db()
+    result = apply_cart_operations(db, 'u1', [
+        {'op': 'add', 'supplier_item_id': 'nope', 'qty': 1},
+        {'op': 'add', 'supplier_item_id': 'free', 'qty': 1},
+        {'op': 'add', 'reference_id': 'unknown-ref', 'qty': 1},
+        {'op': 'add', 'qty': 1},
+        {'op': 'update', 'item_id': 'o3', 'qty': 2},
+        {'op': 'remove', 'item_id': 'missing'},
+        {'op': 'update', 'item_id': 'o2', 'qty': 5},
+    ])
+    codes = [(r['status'], r.get('code')) for r in result['results']]
+    assert codes == [('error', 404), ('error', 400), ('error', 404), ('error', 400),
+                     ('error', 404), ('error', 404), ('ok', None)]
+    assert result['applied'] == 1 and result['failed'] == 6
+    assert _intents(db)['o2']['qty'] == 5
+    assert _intents(db, 'u2')['o2']['qty'] == 9
+
+
+def test_operations_apply_in_order_with_one_bulk_write():
+    db = _db()
+    result = apply_cart_operations(db, 'u1', [
+        {'op': 'add', 'supplier_item_id': 'o3', 'qty': 1},
+        {'op': 'update', 'item_id': 'o3', 'qty': 6},         # intent из этого же пакета
+        {'op': 'remove', 'item_id': 'direct_o2'},             # по reference_id
+        {'op': 'add', 'reference_id': 'fav-rice', 'qty': 2},
+        {'op': 'remove', 'item_id': 'fav-rice'},
+        {'op': 'update', 'item_id': 'fav-rice', 'qty': 1},    # уже удалён в пакете
+    ])
+    assert [r['status'] for r in result['results']] == ['ok'] * 5 + ['error']
+    assert set(_intents(db)) == {'o3'} and _intents(db)['o3']['qty'] == 6
+
+    assert db['cart_intents'].bulk_writes == [5]
+    # Офферы - один запрос, поставщики - один запрос
+    assert [name for name, _ in db['supplier_items'].calls] == ['find']
+    assert [name for name, _ in db['companies'].calls] == ['find']
+    assert result['cart_hash'] == compute_cart_hash(db, 'u1')
+
+
+def test_nothing_written_when_all_operations_fail():
+    db = _db()
+    before = compute_cart_hash(db, 'u1')
+    result = apply_cart_operations(db, 'u1', [{'op': 'remove', 'item_id': 'o3'}])
+    assert result['applied'] == 0 and result['cart_hash'] == before
+    assert db['cart_intents'].bulk_writes == []
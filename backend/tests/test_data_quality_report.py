@@ -0,0 +1,225 @@
+"""
+Data Quality Report Unit Tests
+==============================
+
+Отчёт /v12/admin/data-quality одной $facet-агрегацией
+(bestprice_v12/offer_validator.py): счётчики совпадают с прежними
+count_documents, разбивка по поставщикам, кэш до записи в catalog_change_log.
+
+Агрегация исполняется мини-интерпретатором ниже (только операторы,
+которые использует data_quality_pipeline).
+
+Запуск: pytest /app/backend/tests/test_data_quality_report.py -v
+"""
+
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12 import offer_validator
+from bestprice_v12.offer_validator import (
+    get_data_quality_report, mark_invalid_offers, invalidate_data_quality_report,
+)
+from bestprice_v12.best_price_engine import record_catalog_change, CHANGE_LOG_COLLECTION
+from conftest import FakeCollection, FakeDB, collection_method
+
+_MISSING = object()
+
+
+# ============================================================================
+# MINI AGGREGATION INTERPRETER
+# ============================================================================
+
+def _bson_type(value):
+    if value is _MISSING:
+        return 'missing'
+    if value is None:
+        return 'null'
+    return type(value).__name__
+
+
+def _eval(expr, doc):
+    if isinstance(expr, str) and expr.startswith('$'):
+        return doc.get(expr[1:], _MISSING)
+    if isinstance(expr, list):
+        return [_eval(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    (op, args), = expr.items()
+    if op == '$and':
+        return all(_eval(a, doc) for a in args)
+    if op == '$or':
+        return any(_eval(a, doc) for a in args)
+    if op == '$cond':
+        return _eval(args[1], doc) if _eval(args[0], doc) else _eval(args[2], doc)
+    if op == '$type':
+        return _bson_type(_eval(args, doc))
+    if op == '$isNumber':
+        value = _eval(args, doc)
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if op == '$ifNull':
+        value = _eval(args[0], doc)
+        return _eval(args[1], doc) if value is None or value is _MISSING else value
+    a, b = _eval(args[0], doc), _eval(args[1], doc)
+    a = None if a is _MISSING else a
+    return {'$in': lambda: a in b, '$eq': lambda: a == b, '$ne': lambda: a != b,
+            '$lte': lambda: a <= b, '$gt': lambda: a > b}[op]()
+
+
+def _run(docs, pipeline):
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == '$match':
+            docs = [d for d in docs if all(d.get(k) == v for k, v in spec.items())]
+        elif op == '$limit':
+            docs = docs[:spec]
+        elif op == '$project':
+            docs = [{k: (d[k] if v == 1 else _eval(v, d)) for k, v in spec.items()
+                     if k != '_id' and (v != 1 or k in d)} for d in docs]
+        elif op == '$group':
+            groups = {}
+            for d in docs:
+                key = _eval(spec['_id'], d)
+                key = None if key is _MISSING else key
+                row = groups.setdefault(key, {'_id': key, **{k: 0 for k in spec if k != '_id'}})
+                for k, acc in spec.items():
+                    if k != '_id':
+                        row[k] += _eval(acc['$sum'], d)
+            docs = list(groups.values())
+        elif op == '$facet':
+            docs = [{name: _run(docs, sub) for name, sub in spec.items()}]
+    return docs
+
+
+# ============================================================================
+# IN-MEMORY PYMONGO COLLECTION + aggregate
+# ============================================================================
+
+class AggregatingCollection(FakeCollection):
+    @collection_method
+    def aggregate(self, pipeline, allowDiskUse=False):
+        return iter(_run([dict(d) for d in self.docs], pipeline))
+
+
+class AggregatingDB(FakeDB):
+    collection_class = AggregatingCollection
+
+
+# ============================================================================
+# ЭТАЛОН: прежние count_documents (семантика find по полям)
+# ============================================================================
+
+def _num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _legacy_no_price(d):
+    return d.get('price') is None or (_num(d['price']) and d['price'] <= 0)
+
+
+def _legacy_no_unit(d):
+    return d.get('unit_type') in (None, '')
+
+
+def _legacy_wv_no_pack(d):
+    return d.get('unit_type') in ('WEIGHT', 'VOLUME') and (
+        d.get('pack_qty') is None or (_num(d['pack_qty']) and d['pack_qty'] <= 0))
+
+
+def _legacy_publishable(d):
+    return (_num(d.get('price')) and d['price'] > 0
+            and 'unit_type' in d and d['unit_type'] != ''
+            and 'supplier_company_id' in d and d['supplier_company_id'] != ''
+            and 'id' in d and d['id'] != ''
+            and ((d['unit_type'] in ('WEIGHT', 'VOLUME') and _num(d.get('pack_qty')) and d['pack_qty'] > 0)
+                 or d['unit_type'] == 'PIECE'))
+
+
+def _legacy_invalid(d):
+    return (_legacy_no_price(d) or _legacy_no_unit(d) or d.get('supplier_company_id') is None
+            or _legacy_wv_no_pack(d))
+
+
+@pytest.fixture
+def db():
+    invalidate_data_quality_report()
+    fake = AggregatingDB()
+    items = []
+    values = {
+        'price': [_MISSING, None, 0, -5, 10.0, '12', 99],
+        'unit_type': [_MISSING, None, '', 'WEIGHT', 'VOLUME', 'PIECE', 'BOX'],
+        'pack_qty': [_MISSING, None, 0, 1.5, '2'],
+        'supplier_company_id': [_MISSING, None, '', 's1', 's2'],
+    }
+    i = 0
+    for price in values['price']:
+        for unit in values['unit_type']:
+            for pack in values['pack_qty']:
+                for supplier in values['supplier_company_id']:
+                    doc = {'_id': i, 'id': f'o{i}', 'name_raw': f'Товар {i}', 'active': i % 11 != 0}
+                    for key, value in (('price', price), ('unit_type', unit), ('pack_qty', pack),
+                                       ('supplier_company_id', supplier)):
+                        if value is not _MISSING:
+                            doc[key] = value
+                    items.append(doc)
+                    i += 1
+    fake['supplier_items'] = AggregatingCollection(items)
+    fake['companies'] = FakeCollection([{'id': 's1', 'companyName': 'Поставщик 1'}])
+    return fake
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_counters_match_legacy_count_documents(db):
+    active = [d for d in db['supplier_items'].docs if d['active']]
+    report = get_data_quality_report(db)
+    assert db['supplier_items'].call_count('aggregate') == 1
+    assert report['total_active'] == len(active)
+    assert report['publishable'] == sum(map(_legacy_publishable, active))
+    assert report['issues'] == {
+        'missing_or_invalid_price': sum(map(_legacy_no_price, active)),
+        'missing_unit_type': sum(map(_legacy_no_unit, active)),
+        'weight_volume_without_pack': sum(map(_legacy_wv_no_pack, active)),
+    }
+    assert report['cleanup']['would_mark_inactive'] == sum(map(_legacy_invalid, active))
+    assert len(report['invalid_samples']) == 20
+    assert {s['supplier_name'] for s in report['invalid_samples']} <= {'Поставщик 1', 'Unknown'}
+
+
+def test_supplier_breakdown_sums_to_totals(db):
+    report = get_data_quality_report(db)
+    rows = {r['supplier_id']: r for r in report['by_supplier']}
+    assert set(rows) == {None, '', 's1', 's2'}
+    assert rows['s1']['supplier_name'] == 'Поставщик 1'
+    assert sum(r['total_active'] for r in rows.values()) == report['total_active']
+    assert sum(r['hidden'] for r in rows.values()) == report['hidden']
+    s1 = [d for d in db['supplier_items'].docs if d['active'] and d.get('supplier_company_id') == 's1']
+    assert rows['s1']['publishable'] == sum(map(_legacy_publishable, s1))
+
+
+def test_report_cached_until_catalog_change(db):
+    first = get_data_quality_report(db)
+    second = get_data_quality_report(db)
+    assert (first['cached'], second['cached']) == (False, True)
+    assert db['supplier_items'].call_count('aggregate') == 1
+
+    record_catalog_change(db, 'price_list_import', supplier_id='s1')
+    assert get_data_quality_report(db)['cached'] is False
+    assert get_data_quality_report(db, refresh=True)['cached'] is False
+    assert db['supplier_items'].call_count('aggregate') == 3
+
+
+def test_cleanup_dry_run_reuses_report_and_apply_logs_suppliers(db):
+    report = get_data_quality_report(db)
+    dry = mark_invalid_offers(db, dry_run=True)
+    assert db['supplier_items'].call_count('aggregate') == 1
+    assert dry['would_mark_inactive'] == report['cleanup']['would_mark_inactive']
+    assert len(dry['samples']) == offer_validator.CLEANUP_SAMPLE_LIMIT
+
+    applied = mark_invalid_offers(db, dry_run=False)
+    assert applied['marked_inactive'] == dry['would_mark_inactive']
+    assert db['supplier_items'].call_count('aggregate') == 1  # поставщики - distinct, без второго $facet
+    assert {e['supplier_id'] for e in db[CHANGE_LOG_COLLECTION].docs} == {'s1', 's2'}
+    assert get_data_quality_report(db)['cleanup']['would_mark_inactive'] == 0
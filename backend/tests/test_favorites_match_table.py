@@ -0,0 +1,81 @@
+"""
+Favorites Match Table Unit Tests
+================================
+
+Предразобранная таблица кандидатов для /api/favorites/v2
+(matching/hybrid_matcher.py: build_item_features): find_best_match_hybrid
+с таблицей выбирает того же победителя, что и с разбором названий на
+каждый вызов.
+
+Запуск: pytest /app/backend/tests/test_favorites_match_table.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import pytest
+
+from brand_master import BrandMaster
+from reference_data import reference_registry
+from matching import hybrid_matcher
+from matching.hybrid_matcher import find_best_match_hybrid, build_item_features, item_match_features
+from pipeline.enricher import extract_super_class, extract_caliber, extract_weights
+
+NAMES = [
+    'Бульон куриный Knorr 2 кг', 'Бульон грибной Knorr 2 кг', 'Бульон говяжий Кнорр 1.8 кг',
+    'Соус соевый Kikkoman 1 л', 'Соус терияки Heinz 1 кг', 'Соус унаги Tamaki 1.8 кг',
+    'Рис басмати 1 кг', 'Рис жасмин 1 кг', 'Рис для суши 1 кг', 'Рис арборио 1 кг',
+    'Мед липовый 1 кг', 'Мед цветочный 1 кг', 'Шоколад молочный 1 кг', 'Шоколад горький 1 кг',
+    'Котлета куриная с сыром 1 кг', 'Сыр моцарелла 1 кг', 'Креветки 16/20 с/м 1 кг',
+    'Креветки 21/25 с/м 1 кг', 'Лапша удон 1 кг', 'Лапша соба 1 кг', 'Филе тилапии с/м 1 кг',
+    'Филе судака с/м 1 кг',
+]
+
+
+@pytest.fixture(autouse=True, scope='module')
+def brand_dictionary():
+    # Словарь брендов из xlsx без обращения реестра к Mongo за версиями
+    reference_registry.install('brand_master', BrandMaster.load_fresh())
+
+
+def _items():
+    items = []
+    for i, name in enumerate(NAMES * 3):
+        weight = extract_weights(name).get('net_weight_kg')
+        items.append({
+            'id': f'si{i}', 'name_raw': name, 'price': 100 + (i * 37) % 400,
+            'price_per_base_unit': 100 + (i * 53) % 400, 'super_class': extract_super_class(name.lower()),
+            'base_unit': 'kg' if weight else 'pcs', 'net_weight_kg': weight, 'caliber': extract_caliber(name),
+        })
+    return items
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_table_is_parsed_once_per_item():
+    items = _items()
+    features = build_item_features(items)
+    assert len(features) == len(items)
+    assert features[0] == item_match_features(items[0]['name_raw'])
+    assert 'курин' in features[0]['identifiers']
+
+
+def test_winner_matches_per_call_parsing(monkeypatch):
+    items = _items()
+    features = build_item_features(items)
+    for name in NAMES:
+        for price in (float('inf'), 400):
+            for strict in (False, True):
+                expected = find_best_match_hybrid(name, price, items, strict_brand_override=strict)
+                got = find_best_match_hybrid(name, price, items, strict_brand_override=strict,
+                                             item_features=features)
+                assert got is expected, name
+
+    # С таблицей названия кандидатов больше не разбираются
+    calls = []
+    real = hybrid_matcher.extract_key_identifiers
+    monkeypatch.setattr(hybrid_matcher, 'extract_key_identifiers', lambda n: calls.append(n) or real(n))
+    find_best_match_hybrid(NAMES[0], float('inf'), items, item_features=features)
+    assert calls == [NAMES[0]]
@@ -0,0 +1,124 @@
+"""
+Incremental Optimizer Unit Tests
+================================
+
+Повторная оптимизация поверх состояния прошлого решения
+(bestprice_v12/optimizer.py, optimize_cart_incremental): план совпадает с
+полным пересчётом, в каталог ходят только новые строки.
+
+Запуск: pytest /app/backend/tests/test_incremental_optimizer.py -v
+"""
+
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.optimizer import (
+    optimize_cart, optimize_cart_incremental, get_optimizer_state, drop_optimizer_state, plan_to_dict,
+)
+from conftest import FakeCollection, FakeDB
+
+
+def _item(item_id, supplier, core, price, unit_type='WEIGHT', **extra):
+    return {'id': item_id, 'supplier_company_id': supplier, 'product_core_id': core, 'unit_type': unit_type,
+            'price': price, 'active': True, 'publishable': True, 'name_raw': item_id, **extra}
+
+
+def _intent(item_id, supplier, qty, price, unit_type='WEIGHT'):
+    return {'user_id': 'u1', 'reference_id': f'ref_{item_id}', 'supplier_item_id': item_id,
+            'supplier_id': supplier, 'qty': qty, 'price': price, 'unit_type': unit_type,
+            'product_name': item_id}
+
+
+@pytest.fixture
+def db():
+    drop_optimizer_state()
+    fake = FakeDB()
+    fake['companies'] = FakeCollection([
+        {'id': 's1', 'type': 'supplier', 'companyName': 'Поставщик 1', 'min_order_amount': 1000},
+        {'id': 's2', 'type': 'supplier', 'companyName': 'Поставщик 2', 'min_order_amount': 1000},
+        {'id': 's3', 'type': 'supplier', 'companyName': 'Поставщик 3', 'min_order_amount': 800},
+    ])
+    fake['supplier_items'] = FakeCollection([
+        _item('rice1', 's1', 'rice', 100.0),
+        _item('rice2', 's2', 'rice', 95.0),
+        _item('rice3', 's3', 'rice', 90.0),
+        _item('oil1', 's1', 'oil', 200.0, 'VOLUME'),
+        _item('oil3', 's3', 'oil', 180.0, 'VOLUME', step_qty=2),
+        _item('salt2', 's2', 'salt', 30.0, min_order_qty=5),
+        _item('salt3', 's3', 'salt', 28.0),
+        _item('flour1', 's1', 'flour', 60.0),
+    ])
+    fake['cart_intents'] = FakeCollection([
+        _intent('rice1', 's1', 8, 100.0),
+        _intent('oil3', 's3', 1, 180.0, 'VOLUME'),
+        _intent('salt2', 's2', 3, 30.0),
+    ])
+    return fake
+
+
+def _assert_same_as_full(db):
+    incremental = plan_to_dict(optimize_cart_incremental(db, 'u1', 'v1'))
+    full = plan_to_dict(optimize_cart(db, 'u1'))
+    assert incremental == full
+    return incremental
+
+
+def _intent_doc(db, item_id):
+    return next(i for i in db['cart_intents'].docs if i['supplier_item_id'] == item_id)
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_deltas_match_full_recompute(db):
+    plan = _assert_same_as_full(db)
+    # Все поставщики под минималкой - перераспределение собирает строки у s3
+    assert [s['supplier_id'] for s in plan['suppliers']] == ['s3']
+
+    _intent_doc(db, 'rice1')['qty'] = 12                       # qty
+    _assert_same_as_full(db)
+
+    db['cart_intents'].insert_one(_intent('flour1', 's1', 4, 60.0))  # новая строка
+    _assert_same_as_full(db)
+
+    _intent_doc(db, 'oil3')['qty'] = 6                         # s3 снова выходит на минималку
+    plan = _assert_same_as_full(db)
+    assert [s['supplier_id'] for s in plan['suppliers']] == ['s1', 's3']
+
+    db['cart_intents'].docs.remove(_intent_doc(db, 'salt2'))   # удаление строки
+    _assert_same_as_full(db)
+
+    db['cart_intents'].docs.clear()
+    assert _assert_same_as_full(db)['suppliers'] == []
+
+
+def test_qty_change_does_not_touch_catalog(db):
+    optimize_cart_incremental(db, 'u1', 'v1')
+    items_reads = db['supplier_items'].call_count('find', 'find_one')
+
+    _intent_doc(db, 'rice1')['qty'] = 9
+    optimize_cart_incremental(db, 'u1', 'v1')
+    assert get_optimizer_state('u1', 'v1').db_reads == 0
+    assert db['supplier_items'].call_count('find', 'find_one') == items_reads
+
+    db['cart_intents'].insert_one(_intent('flour1', 's1', 4, 60.0))
+    optimize_cart_incremental(db, 'u1', 'v1')
+    assert get_optimizer_state('u1', 'v1').db_reads == 1        # только supplier_items новой строки
+
+
+def test_removed_lines_are_pruned_and_catalog_version_resets_state(db):
+    optimize_cart_incremental(db, 'u1', 'v1')
+    state = get_optimizer_state('u1', 'v1')
+    assert 'salt2' in state.items
+
+    db['cart_intents'].docs.remove(_intent_doc(db, 'salt2'))
+    optimize_cart_incremental(db, 'u1', 'v1')
+    assert 'salt2' not in state.items
+
+    # Каталог изменился - офферы читаются заново, а не из прошлого решения
+    next(i for i in db['supplier_items'].docs if i['id'] == 'rice2')['price'] = 10.0
+    plan = plan_to_dict(optimize_cart_incremental(db, 'u1', 'v2'))
+    assert get_optimizer_state('u1', 'v2') is not state
+    assert plan == plan_to_dict(optimize_cart(db, 'u1'))
@@ -0,0 +1,158 @@
+"""
+Index Catalog Unit Tests
+========================
+
+Управляемый каталог индексов (index_catalog.py): идемпотентное создание,
+совпадение с ensure_*_indexes, покрытие всех записанных форм запросов и
+разбор explain() (COLLSCAN / SORT в памяти).
+
+Запуск: pytest /app/backend/tests/test_index_catalog.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+from index_catalog import (
+    INDEX_CATALOG, QUERY_SHAPES, IndexSpec, apply_index_catalog, audit_query_shapes, plan_stages,
+)
+from bestprice_v12.best_price_engine import ensure_engine_indexes
+from bestprice_v12.plan_snapshot import ensure_plan_indexes
+from bestprice_v12.order_history import ORDER_HISTORY_COLLECTION, ensure_order_history_indexes
+from bestprice_v12.job_runner import ensure_job_indexes
+from search_utils import ensure_search_indexes
+from conftest import FakeCollection, FakeCursor, FakeDB
+
+
+# ============================================================================
+# IN-MEMORY PYMONGO + упрощённый планировщик для explain
+# ============================================================================
+
+def _index_plan(keys, filter_, sort):
+    """
+    IXSCAN, если первое поле индекса есть в фильтре (или в сортировке при
+    пустом фильтре); SORT не нужен, если после полей-равенств ($in тоже)
+    идут поля сортировки в том же (или полностью обратном) направлении.
+    """
+    fields = [k for k, _ in keys]
+    if not (fields[0] in filter_ or (not filter_ and sort and fields[0] == sort[0][0])):
+        return None
+    if not sort:
+        return False
+    i = 0
+    # $in по префиксу планировщик раскладывает в SORT_MERGE точечных сканов
+    while i < len(fields) and fields[i] in filter_ and (
+            not isinstance(filter_[fields[i]], dict) or '$in' in filter_[fields[i]]):
+        i += 1
+    tail = list(keys[i:i + len(sort)])
+    ok = tail == list(sort) or tail == [(k, -d) for k, d in sort]
+    return not ok
+
+
+class PlannerCursor(FakeCursor):
+    def _branch(self, filter_):
+        best = None
+        for name, info in self.collection.indexes.items():
+            needs_sort = _index_plan(info['key'], filter_, self.sort_spec)
+            if needs_sort is None:
+                continue
+            if best is None or (best[1] and not needs_sort):
+                best = (name, needs_sort)
+        if best is None:
+            stage = {'stage': 'COLLSCAN'}
+            return ({'stage': 'SORT', 'inputStage': stage} if self.sort_spec else stage), False
+        ixscan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': best[0]}}
+        return ixscan, best[1]
+
+    def explain(self):
+        if '$or' in self.filter:
+            branches = [self._branch(b) for b in self.filter['$or']]
+            plan = {'stage': 'SORT_MERGE', 'inputStages': [p for p, _ in branches]}
+            if any(s for _, s in branches):
+                plan = {'stage': 'SORT', 'inputStage': plan}
+        else:
+            plan, needs_sort = self._branch(self.filter)
+            if needs_sort:
+                plan = {'stage': 'SORT', 'inputStage': plan}
+        # Формат SBE (MongoDB 5+)
+        return {'queryPlanner': {'winningPlan': {'queryPlan': plan, 'slotBasedPlan': {}}}}
+
+
+class PlannerCollection(FakeCollection):
+    cursor_class = PlannerCursor
+
+
+class PlannerDB(FakeDB):
+    collection_class = PlannerCollection
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_apply_is_idempotent():
+    db = PlannerDB()
+    report = apply_index_catalog(db)
+    assert len(report['created']) == len(INDEX_CATALOG)
+    assert report['conflicts'] == [] and report['failed'] == []
+    assert len({f'{s.collection}.{s.index_name}' for s in INDEX_CATALOG}) == len(INDEX_CATALOG)
+
+    again = apply_index_catalog(db)
+    assert again == {'created': [], 'present': len(INDEX_CATALOG), 'conflicts': [], 'failed': []}
+
+
+def test_existing_indexes_are_reused_or_reported():
+    db = PlannerDB()
+    db['supplier_items'].create_index([('unique_key', 1)], name='legacy_unique_key')   # другое имя
+    db['supplier_items'].create_index([('id', 1), ('active', 1)], name='id_1')          # другие ключи
+    report = apply_index_catalog(db, groups=('core',))
+    assert 'supplier_items.unique_key_1' not in report['created']
+    assert 'supplier_items.id_1' in report['conflicts']
+    assert all(spec.group == 'core' for spec in INDEX_CATALOG
+               if f'{spec.collection}.{spec.index_name}' in report['created'])
+
+
+def test_ensure_functions_are_declared_in_catalog():
+    db = PlannerDB()
+    ensure_engine_indexes(db)
+    ensure_plan_indexes(db)
+    ensure_order_history_indexes(db)
+    ensure_job_indexes(db)
+    assert ensure_search_indexes(db)['indexes_created']
+    created_elsewhere = {(c, n) for c, col in db.items() for n in col.indexes if n != '_id_'}
+    catalog = {(s.collection, s.index_name) for s in INDEX_CATALOG}
+    assert created_elsewhere <= catalog
+    # Ни одного конфликта имён/опций с индексами, созданными ensure_*
+    report = apply_index_catalog(db)
+    assert report['conflicts'] == [] and report['present'] == len(created_elsewhere)
+
+
+def test_every_recorded_shape_is_served_by_an_index():
+    db = PlannerDB()
+    apply_index_catalog(db)
+    audit = audit_query_shapes(db)
+    assert audit['checked'] == len(QUERY_SHAPES)
+    assert audit['ok'], [s for s in audit['shapes'] if s['problems']]
+    shapes = {s['shape']: s for s in audit['shapes']}
+    assert shapes['offer_candidates']['indexes'] == ['publishable_core_unit_price']
+    assert shapes['favorite_replacement']['stages'] == ['FETCH', 'IXSCAN']
+
+
+def test_audit_reports_collscan_and_in_memory_sort():
+    db = PlannerDB()
+    audit = audit_query_shapes(db)
+    assert not audit['ok'] and len(audit['failing']) == len(QUERY_SHAPES)
+    shapes = {s['shape']: s for s in audit['shapes']}
+    assert shapes['orders_history']['problems'] == ['COLLSCAN', 'IN_MEMORY_SORT']
+
+    # Индекс без поля сортировки - IXSCAN, но SORT в памяти
+    db[ORDER_HISTORY_COLLECTION].create_index([('customer_user_id', 1)])
+    shapes = {s['shape']: s for s in audit_query_shapes(db)['shapes']}
+    assert shapes['orders_history']['problems'] == ['IN_MEMORY_SORT']
+
+
+def test_plan_stages_walks_classic_explain():
+    plan = {'stage': 'LIMIT', 'inputStage': {'stage': 'SORT', 'inputStage': {
+        'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN', 'indexName': 'a_1'}, {'stage': 'COLLSCAN'}],
+    }}}
+    assert plan_stages(plan) == [('LIMIT', None), ('SORT', None), ('OR', None), ('IXSCAN', 'a_1'), ('COLLSCAN', None)]
+    assert IndexSpec('c', (('a', 1), ('b', -1))).index_name == 'a_1_b_-1'
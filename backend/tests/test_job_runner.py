@@ -0,0 +1,247 @@
+"""
+Admin Job Runner Unit Tests
+===========================
+
+Фоновые админские задачи (bestprice_v12/job_runner.py): статус и прогресс
+пишутся в admin_jobs, результат и ошибка сохраняются, exclusive-вид не
+запускается дважды, отмена снимает задачу из очереди сразу, а выполняющуюся -
+на ближайшем progress(); зависшие после рестарта задачи помечаются failed -
+при старте и при submit того же exclusive-вида.
+
+Запуск: pytest /app/backend/tests/test_job_runner.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+from bestprice_v12.job_runner import (
+    ADMIN_JOBS_COLLECTION, EXCLUSIVE_KIND_FIELD, STALE_JOB_SEC, JobRunner, admin_job_response,
+    ensure_job_indexes, fail_stale_jobs,
+)
+from conftest import FakeDB
+
+
+def _db():
+    db = FakeDB()
+    ensure_job_indexes(db)          # уникальный partial-индекс по exclusive_kind
+    return db
+
+
+async def _wait(runner, job_id, statuses=('succeeded', 'failed', 'cancelled')):
+    for _ in range(500):
+        job = runner.get(job_id)
+        if job['status'] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {runner.get(job_id)['status']}")
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_job_succeeds_with_progress_and_result():
+    db = _db()
+    runner = JobRunner(db)
+
+    def job(ctx, total):
+        for i in range(total):
+            ctx.progress(processed=i + 1, total=total)
+        return {'processed': total}
+
+    async def scenario():
+        submitted = await runner.submit('demo', job, 3, params={'total': 3}, user_id='u1')
+        assert submitted['status'] == 'queued' and not submitted.get('deduplicated')
+        return await _wait(runner, submitted['id'])
+
+    done = asyncio.run(scenario())
+    assert done['status'] == 'succeeded' and done['result'] == {'processed': 3}
+    assert done['progress'] == {'processed': 3, 'total': 3}
+    assert done['params'] == {'total': 3} and done['user_id'] == 'u1'
+    assert done['started_at'] and done['finished_at'] and done['error'] is None
+    assert runner.list(kind='demo')[0]['id'] == done['id']
+
+    response = admin_job_response(done)
+    assert response['status_url'] == f"/api/v12/admin/jobs/{done['id']}"
+
+
+def test_exclusive_kind_returns_the_running_job():
+    db = _db()
+    runner = JobRunner(db)
+    release = threading.Event()
+
+    async def scenario():
+        first = await runner.submit('backfill', lambda ctx: release.wait(5) and 'ok')
+        await _wait(runner, first['id'], statuses=('running',))
+        second = await runner.submit('backfill', lambda ctx: 'never')
+        assert second['id'] == first['id'] and second['deduplicated'] is True
+        assert runner.active('backfill')['id'] == first['id']
+
+        # exclusive=False ставит отдельную задачу того же вида (ждёт лимит вида)
+        third = await runner.submit('backfill', lambda ctx: 'third', exclusive=False)
+        assert third['id'] != first['id']
+        release.set()
+        return await _wait(runner, first['id']), await _wait(runner, third['id'])
+
+    first, third = asyncio.run(scenario())
+    assert first['result'] == 'ok' and third['result'] == 'third'
+    assert len(db[ADMIN_JOBS_COLLECTION].docs) == 2
+    assert runner.active('backfill') is None
+    assert not any(EXCLUSIVE_KIND_FIELD in d for d in db[ADMIN_JOBS_COLLECTION].docs)
+
+
+def test_exclusive_kind_is_shared_across_runners():
+    # Два воркера (у каждого свой раннер) над одной admin_jobs
+    db = _db()
+    release = threading.Event()
+
+    async def scenario():
+        first = await JobRunner(db).submit('generate', lambda ctx: release.wait(5) and 'ok')
+        second = await JobRunner(db).submit('generate', lambda ctx: 'never')
+        assert second['id'] == first['id'] and second['deduplicated'] is True
+        release.set()
+        return await _wait(JobRunner(db), first['id'])
+
+    assert asyncio.run(scenario())['result'] == 'ok'
+    assert len(db[ADMIN_JOBS_COLLECTION].docs) == 1
+
+
+def test_queued_job_gets_heartbeat(monkeypatch):
+    from bestprice_v12 import job_runner
+    monkeypatch.setattr(job_runner, 'HEARTBEAT_SEC', 0.01)
+    db = _db()
+    runner = JobRunner(db, concurrency=1)
+    release = threading.Event()
+
+    async def scenario():
+        blocker = await runner.submit('generate', lambda ctx: release.wait(5))
+        await _wait(runner, blocker['id'], statuses=('running',))
+        queued = await runner.submit('cleanup', lambda ctx: 'done')
+        queued_at = runner.get(queued['id'])['updated_at']
+        await asyncio.sleep(0.1)
+        waiting = runner.get(queued['id'])
+        release.set()
+        await _wait(runner, queued['id'])
+        return queued_at, waiting
+
+    queued_at, waiting = asyncio.run(scenario())
+    assert waiting['status'] == 'queued' and waiting['updated_at'] > queued_at
+
+
+def test_failure_is_recorded():
+    db = _db()
+    runner = JobRunner(db)
+
+    def job(ctx):
+        ctx.progress(step='load')
+        raise ValueError('price list is empty')
+
+    async def scenario():
+        return await _wait(runner, (await runner.submit('demo', job))['id'])
+
+    done = asyncio.run(scenario())
+    assert done['status'] == 'failed' and done['error'] == 'price list is empty'
+    assert done['progress'] == {'step': 'load'} and done['result'] is None
+
+
+def test_cancel_queued_job_never_runs():
+    db = _db()
+    runner = JobRunner(db, concurrency=1)
+    release = threading.Event()
+    ran = []
+
+    async def scenario():
+        blocker = await runner.submit('generate', lambda ctx: release.wait(5))
+        await _wait(runner, blocker['id'], statuses=('running',))
+        queued = await runner.submit('cleanup', lambda ctx: ran.append(1))
+        await asyncio.sleep(0.05)
+        assert runner.get(queued['id'])['status'] == 'queued'
+
+        cancelled = runner.cancel(queued['id'])
+        release.set()
+        await _wait(runner, blocker['id'])
+        await asyncio.sleep(0.05)
+        return cancelled, runner.get(queued['id'])
+
+    cancelled, final = asyncio.run(scenario())
+    assert cancelled['status'] == 'cancelled' and cancelled['cancel_requested'] is True
+    assert final['status'] == 'cancelled' and final['started_at'] is None
+    assert ran == []
+
+
+def test_cancel_running_job_stops_at_progress():
+    db = _db()
+    runner = JobRunner(db)
+    steps = []
+
+    def job(ctx):
+        for i in range(1000):
+            steps.append(i)
+            ctx.progress(processed=i)
+            threading.Event().wait(0.005)
+        return 'finished'
+
+    async def scenario():
+        job_doc = await runner.submit('migrate', job)
+        await _wait(runner, job_doc['id'], statuses=('running',))
+        while not steps:
+            await asyncio.sleep(0.01)
+        runner.cancel(job_doc['id'])
+        return await _wait(runner, job_doc['id'])
+
+    done = asyncio.run(scenario())
+    assert done['status'] == 'cancelled' and done['result'] is None
+    assert 0 < len(steps) < 1000
+    # Повторная отмена завершённой задачи ничего не меняет
+    assert runner.cancel(done['id'])['status'] == 'cancelled'
+
+
+def test_stale_active_jobs_are_failed_on_startup():
+    db = _db()
+    jobs = db[ADMIN_JOBS_COLLECTION]
+    jobs.insert_one({'id': 'old', 'status': 'running', 'updated_at': '2020-01-01T00:00:00+00:00'})
+    jobs.insert_one({'id': 'queued', 'status': 'queued', 'updated_at': '2020-01-01T00:00:00+00:00'})
+    jobs.insert_one({'id': 'done', 'status': 'succeeded', 'updated_at': '2020-01-01T00:00:00+00:00'})
+    jobs.insert_one({'id': 'fresh', 'status': 'running', 'updated_at': '2999-01-01T00:00:00+00:00'})
+
+    assert fail_stale_jobs(db) == 2
+    status = {d['id']: d['status'] for d in jobs.docs}
+    assert status == {'old': 'failed', 'queued': 'failed', 'done': 'succeeded', 'fresh': 'running'}
+
+    # Задачи этого же воркера (тот же hostname:pid после рестарта контейнера) - failed сразу
+    jobs.insert_one({'id': 'mine', 'status': 'running', 'worker': 'host:1', 'updated_at': '2999-01-01T00:00:00+00:00'})
+    assert fail_stale_jobs(db, worker='host:1') == 1
+    assert {d['id']: d['status'] for d in jobs.docs}['mine'] == 'failed'
+
+
+def test_submit_right_after_restart_replaces_interrupted_job():
+    db = _db()
+    jobs = db[ADMIN_JOBS_COLLECTION]
+    runner = JobRunner(db)
+    recent = datetime.now(timezone.utc).isoformat()
+    old = (datetime.now(timezone.utc) - timedelta(seconds=STALE_JOB_SEC + 1)).isoformat()
+    # Прерваны рестартом: задача этого же воркера (heartbeat ещё свежий) и другого воркера без heartbeat
+    jobs.insert_one({'id': 'own', 'kind': 'generate', 'status': 'running', 'worker': runner.worker,
+                     'updated_at': recent, EXCLUSIVE_KIND_FIELD: 'generate'})
+    jobs.insert_one({'id': 'other', 'kind': 'backfill', 'status': 'queued', 'worker': 'gone:1',
+                     'updated_at': old, EXCLUSIVE_KIND_FIELD: 'backfill'})
+    # Живая задача другого воркера остаётся активной
+    jobs.insert_one({'id': 'alive', 'kind': 'cleanup', 'status': 'running', 'worker': 'peer:2',
+                     'updated_at': recent, EXCLUSIVE_KIND_FIELD: 'cleanup'})
+
+    async def scenario():
+        submitted = {kind: await runner.submit(kind, lambda ctx: 'ok') for kind in ('generate', 'backfill', 'cleanup')}
+        for kind in ('generate', 'backfill'):
+            await _wait(runner, submitted[kind]['id'])
+        return submitted
+
+    submitted = asyncio.run(scenario())
+    assert not submitted['generate'].get('deduplicated') and not submitted['backfill'].get('deduplicated')
+    assert submitted['cleanup']['id'] == 'alive' and submitted['cleanup']['deduplicated'] is True
+    status = {d['id']: d['status'] for d in jobs.docs}
+    assert status['own'] == 'failed' and status['other'] == 'failed' and status['alive'] == 'running'
+    assert runner.get(submitted['generate']['id'])['result'] == 'ok'
@@ -0,0 +1,132 @@
+"""
+Log Pipeline Unit Tests
+=======================
+
+Сэмплирование по эндпоинтам, ленивое форматирование, лимит байт на запрос
+и неблокирующая очередь.
+
+Запуск: pytest /app/backend/tests/test_log_pipeline.py -v
+"""
+
+import logging
+import queue
+import sys
+sys.path.insert(0, '/app/backend')
+
+import log_pipeline
+from log_pipeline import (
+    HotLogger, StructuredEvent, LazyQueueHandler, BudgetedQueueListener,
+    hot_logger, current_request_logger, _parse_sample_rates,
+)
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _CountingStr:
+    """Аргумент, считающий, сколько раз его форматировали."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return 'x'
+
+
+def _logger(name):
+    log = logging.getLogger(f'test_log_pipeline.{name}')
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    capture = _Capture()
+    log.handlers = [capture]
+    return log, capture
+
+
+# ============================================================================
+# SAMPLING / LAZY FORMAT
+# ============================================================================
+
+def test_parse_sample_rates_overrides_and_clamps():
+    rates = _parse_sample_rates('alternatives=0.5, add_from_favorite=7,bad,select_offer=x')
+    assert rates['alternatives'] == 0.5
+    assert rates['add_from_favorite'] == 1.0
+    assert rates['select_offer'] == log_pipeline.DEFAULT_SAMPLE_RATES['select_offer']
+
+
+def test_unsampled_request_skips_info_but_keeps_warnings():
+    log, capture = _logger('unsampled')
+    arg = _CountingStr()
+    hot = HotLogger('ep', log, sampled=False)
+    hot.info('candidate %s', arg)
+    hot.debug('candidate %s', arg)
+    hot.event('decision', item=arg)
+    hot.warning('warn %s', arg)
+    assert [r.levelno for r in capture.records] == [logging.WARNING]
+    assert arg.calls == 0  # ничего не отформатировано в потоке запроса
+
+
+def test_sampled_request_records_carry_request_id_and_caller():
+    log, capture = _logger('sampled')
+    hot = HotLogger('ep', log, request_id='rid1', sampled=True)
+    hot.info('value=%s', 5)
+    record = capture.records[0]
+    assert record.getMessage() == 'value=5'
+    assert record.request_id == 'rid1'
+    assert record.endpoint == 'ep'
+    assert record.funcName == 'test_sampled_request_records_carry_request_id_and_caller'
+
+
+def test_summary_is_always_written_as_lazy_json():
+    log, capture = _logger('summary')
+    hot = HotLogger('ep', log, sampled=False)
+    hot.summary('SEARCH_LOG', {'outcome': 'ok', 'name': 'Сыр'})
+    assert isinstance(capture.records[0].msg, StructuredEvent)
+    assert capture.records[0].getMessage() == 'SEARCH_LOG: {"outcome": "ok", "name": "Сыр"}'
+
+
+def test_hot_logger_becomes_current():
+    hot = hot_logger('ep', request_id='rid2')
+    assert current_request_logger() is hot
+
+
+# ============================================================================
+# QUEUE + BYTE BUDGET
+# ============================================================================
+
+def test_queue_handler_does_not_format_and_drops_when_full():
+    handler = LazyQueueHandler(queue.Queue(maxsize=1))
+    arg = _CountingStr()
+    record = logging.makeLogRecord({'msg': 'a %s', 'args': (arg,)})
+    dropped_before = log_pipeline._stats.dropped
+    handler.handle(record)
+    handler.handle(logging.makeLogRecord({'msg': 'b'}))  # очередь полна - без исключения
+    assert arg.calls == 0
+    assert handler.queue.get_nowait() is record
+    assert log_pipeline._stats.dropped == dropped_before + 1
+
+
+def test_listener_enforces_bytes_per_request():
+    capture = _Capture()
+    listener = BudgetedQueueListener(queue.Queue(), capture, max_bytes=25)
+
+    def rec(msg, request_id):
+        return logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO, 'request_id': request_id, 'endpoint': 'ep'})
+
+    listener.handle(rec('0123456789', 'r1'))
+    listener.handle(rec('0123456789', 'r1'))
+    listener.handle(rec('0123456789', 'r1'))   # превышение → маркер
+    listener.handle(rec('0123456789', 'r1'))   # дальше - тишина
+    listener.handle(rec('0123456789', 'r2'))   # другой запрос - свой бюджет
+    listener.handle(logging.makeLogRecord({'msg': 'no request', 'levelno': logging.INFO}))
+
+    messages = [r.getMessage() for r in capture.records]
+    assert messages[:2] == ['0123456789', '0123456789']
+    assert messages[2].startswith('LOG_BUDGET_EXCEEDED: request_id=r1 endpoint=ep limit=25')
+    assert messages[3:] == ['0123456789', 'no request']
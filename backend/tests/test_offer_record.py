@@ -0,0 +1,85 @@
+"""
+Offer Record Unit Tests
+=======================
+
+Слой запроса над офферами (bestprice_v12/offer_record.py): OfferOverlay
+пишет вычисленные поля только в свой слой, поисковые движки и оптимизатор
+работают с общим снимком каталога без мутаций.
+
+Запуск: pytest /app/backend/tests/test_offer_record.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import copy
+import dataclasses
+
+import pytest
+
+from bestprice_v12.offer_record import OfferOverlay, overlay
+from bestprice_v12.optimizer import Offer
+from search_engine import EnhancedSearchEngine
+from search_engine_v12 import SearchEngineV12
+
+
+def _catalog():
+    base = {
+        'product_core_id': 'молоко', 'unit_norm': 'l', 'unit_type': 'VOLUME',
+        'offer_status': 'ACTIVE', 'price_status': 'VALID', 'active': True,
+    }
+    return [
+        {**base, 'id': 'a', 'name_raw': 'Молоко 3,2% 1л', 'price': 90.0, 'pack_value': 1.0, 'supplierId': 's1'},
+        {**base, 'id': 'b', 'name_raw': 'Молоко 3,2% 1л', 'price': 80.0, 'pack_value': 1.0, 'supplierId': 's2'},
+        {**base, 'id': 'c', 'name_raw': 'Молоко 3,2% 0,9л', 'price': 70.0, 'pack_value': 0.9, 'supplierId': 's3'},
+    ]
+
+
+# ============================================================================
+# OVERLAY
+# ============================================================================
+
+def test_overlay_is_copy_on_write():
+    record = {'id': 'a', 'price': 10.0}
+    first, second = overlay(record), overlay(record)
+    first['_pack_value'] = 2.0
+    first['price'] = 12.0                     # перекрытие - только в слое
+    assert first['price'] == 12.0 and first.get('_pack_value') == 2.0
+    assert second.get('_pack_value') is None and second['price'] == 10.0
+    assert dict(record) == {'id': 'a', 'price': 10.0}
+
+    assert list(first) == ['id', 'price', '_pack_value'] and len(first) == 3
+    assert first.to_dict() == {'id': 'a', 'price': 12.0, '_pack_value': 2.0}
+    assert first.pop('price') == 12.0 and first['price'] == 10.0
+    assert isinstance(overlay({'id': 'x'}), OfferOverlay)
+
+
+# ============================================================================
+# CONSUMERS
+# ============================================================================
+
+def test_search_engines_do_not_mutate_shared_snapshot():
+    catalog = _catalog()
+    before = copy.deepcopy(catalog)
+    reference = {'name_raw': 'Молоко 3,2% 1л', 'product_core_id': 'молоко', 'pack_value': 1.0, 'unit_norm': 'l'}
+
+    v12 = SearchEngineV12()
+    for _ in range(2):                        # повторный запрос по тому же снимку
+        result = v12.search(reference, catalog, requested_qty=2)
+        assert result.status == 'ok' and result.supplier_item_id == 'b'
+
+    enhanced = EnhancedSearchEngine(brand_master=False)
+    result = enhanced.search(reference, catalog, requested_qty=2)
+    assert result.status == 'ok' and result.selected_offer['supplier_item_id'] == 'c'   # дешевле за литр
+
+    assert catalog == before
+    assert not any(k.startswith('_') for doc in before for k in doc)
+
+
+def test_optimizer_offer_is_frozen():
+    offer = Offer(supplier_item_id='a', supplier_id='s1', supplier_name='S', product_core_id='c',
+                  unit_type='WEIGHT', price=100.0, pack_value=2.0, price_per_base_unit=50.0)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        offer.price = 1.0
+    assert not hasattr(offer, '__dict__')
+    assert offer == dataclasses.replace(offer) and hash(offer) == hash(dataclasses.replace(offer))
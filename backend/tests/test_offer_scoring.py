@@ -0,0 +1,143 @@
+"""
+Vectorized Offer Scoring Unit Tests
+===================================
+
+Векторный pick_best_offer (optimizer.py) и find_best_candidate (cart.py)
+поверх OfferTable: тот же оффер, те же флаги и тот же tie-breaking,
+что у прежних циклов Python.
+
+Запуск: pytest /app/backend/tests/test_offer_scoring.py -v
+"""
+
+import random
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.optimizer import (
+    CartIntent, Offer, OptFlag, pick_best_offer, check_critical_attrs, check_pack_tolerance,
+)
+from bestprice_v12.cart import find_best_candidate
+from bestprice_v12.catalog import calculate_effective_qty, calculate_line_total
+from bestprice_v12.offer_table import OfferTable
+
+
+# ============================================================================
+# ЭТАЛОН: прежние реализации циклами
+# ============================================================================
+
+def _loop_pick(intent, candidates, prefer_supplier_id=None):
+    if not candidates:
+        return None, [OptFlag.NO_OFFER_FOUND.value]
+    flags = []
+    valid = [o for o in candidates if check_critical_attrs(intent, o)[0]]
+    if not valid:
+        return None, [OptFlag.NO_OFFER_FOUND.value]
+    pack_ok = [o for o in valid if check_pack_tolerance(intent.pack_value, o.pack_value, intent.unit_type)]
+    if pack_ok:
+        valid = pack_ok
+    else:
+        flags.append(OptFlag.PACK_TOLERANCE_USED.value)
+    if intent.price and intent.price > 0:
+        price_ok = [o for o in valid if intent.price * 0.5 <= o.price <= intent.price * 2.0]
+        if price_ok:
+            valid = price_ok
+        else:
+            flags.append(OptFlag.PRICE_TOLERANCE_EXCEEDED.value)
+            valid = sorted(valid, key=lambda o: abs(o.price - intent.price))[:3]
+    if intent.brand_id:
+        brand = [o for o in valid if o.brand_id == intent.brand_id]
+        if brand:
+            valid = brand
+        else:
+            flags.append(OptFlag.BRAND_REPLACED.value)
+    if prefer_supplier_id:
+        preferred = [o for o in valid if o.supplier_id == prefer_supplier_id]
+        if preferred:
+            valid = preferred
+    return min(valid, key=lambda o: o.price), flags
+
+
+def _loop_best_candidate(candidates, user_qty):
+    best, best_total = None, None
+    for c in candidates:
+        total = calculate_line_total(calculate_effective_qty(user_qty, c.get('min_order_qty', 1)), c['price'])
+        if best_total is None or total < best_total:
+            best, best_total = c, total
+    return best, best_total
+
+
+def _random_offers(rng, n):
+    offers = []
+    for i in range(n):
+        offers.append(Offer(
+            supplier_item_id=f'o{i}',
+            supplier_id=rng.choice(['s1', 's2', 's3', '']),
+            supplier_name='',
+            product_core_id='core',
+            unit_type='WEIGHT',
+            price=float(rng.choice([50, 80, 100, 100, 120, 300, 1000])),   # много равных цен
+            pack_value=rng.choice([None, 0, 0.5, 1.0, 1.1, 2.0, 5.0]),
+            brand_id=rng.choice([None, '', 'b1', 'b2']),
+            min_order_qty=rng.choice([1, 2, 5]),
+            step_qty=rng.choice([1, 2]),
+            fat_pct=rng.choice([None, 5.0, 9.0, 9.5, 15.0]),
+            cut=rng.choice([None, '', 'Филе', 'филе', 'тушка']),
+        ))
+    return offers
+
+
+def _random_intent(rng):
+    return CartIntent(
+        reference_id='r', qty=3,
+        unit_type=rng.choice(['WEIGHT', 'PIECE']),
+        price=rng.choice([0, 20.0, 100.0, 5000.0]),
+        pack_value=rng.choice([None, 1.0, 3.0]),
+        brand_id=rng.choice([None, 'b1', 'b9']),
+        fat_pct=rng.choice([None, 9.0]),
+        cut=rng.choice([None, 'ФИЛЕ', 'стейк']),
+    )
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_pick_best_offer_matches_loop_implementation():
+    rng = random.Random(35)
+    for _ in range(3000):
+        offers = _random_offers(rng, rng.randint(0, 25))
+        intent = _random_intent(rng)
+        prefer = rng.choice([None, 's1', 's9'])
+        expected = _loop_pick(intent, offers, prefer)
+        got = pick_best_offer(intent, offers, prefer)
+        assert got[1] == expected[1]
+        assert got[0] is expected[0]
+
+
+def test_supplier_filters_keep_order_and_reuse_columns():
+    rng = random.Random(7)
+    table = OfferTable(_random_offers(rng, 40))
+    columns = table.columns
+    only = table.only_suppliers({'s1', ''})
+    assert list(only) == [o for o in table if o.supplier_id in {'s1', ''}]
+    assert list(table.exclude_suppliers({'s1'})) == [o for o in table if o.supplier_id != 's1']
+    assert only.columns.supplier_codes is columns.supplier_codes
+    intent = _random_intent(rng)
+    assert pick_best_offer(intent, only)[0] is _loop_pick(intent, list(only))[0]
+
+
+def test_find_best_candidate_matches_loop_implementation():
+    rng = random.Random(11)
+    for _ in range(2000):
+        candidates = [
+            {'id': f'c{i}', 'price': rng.choice([10, 10.5, 20, 33.3]), 'min_order_qty': rng.choice([1, 2, 3, 10])}
+            for i in range(rng.randint(1, 15))
+        ]
+        if rng.random() < 0.3:
+            del candidates[0]['min_order_qty']
+        qty = rng.choice([1, 2.5, 3, 7, 10])
+        best, total = find_best_candidate(candidates, qty)
+        expected_best, expected_total = _loop_best_candidate(candidates, qty)
+        assert best is expected_best
+        assert total == expected_total
+    assert find_best_candidate([], 1) == (None, None)
@@ -0,0 +1,87 @@
+"""
+Offer Store Unit Tests
+======================
+
+Компактное хранилище офферов (bestprice_v12/offer_store.py): CompactOffer
+читается как dict, хранит только MATCH_FIELDS, интернирует категориальные
+строки, а hybrid matcher на OfferStore выбирает того же победителя, что и
+на полных документах.
+
+Запуск: pytest /app/backend/tests/test_offer_store.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import asyncio
+
+import pytest
+
+from bestprice_v12.offer_store import MATCH_FIELDS, CompactOffer, OfferStore, offer_projection
+from matching.hybrid_matcher import build_item_features, find_best_match_hybrid
+from pipeline.enricher import extract_caliber, extract_super_class, extract_weights
+from conftest import AsyncFakeCollection
+
+NAMES = [
+    'Бульон куриный Knorr 2 кг', 'Бульон грибной Knorr 2 кг', 'Соус соевый Kikkoman 1 л',
+    'Рис басмати 1 кг', 'Рис жасмин 1 кг', 'Креветки 16/20 с/м 1 кг', 'Креветки 21/25 с/м 1 кг',
+    'Филе тилапии с/м 1 кг', 'Филе судака с/м 1 кг',
+]
+
+
+def _doc(i, name):
+    weight = extract_weights(name).get('net_weight_kg')
+    return {
+        'id': f'si{i}', 'name_raw': name, 'price': 100 + (i * 37) % 400,
+        'price_per_base_unit': 100 + (i * 53) % 400, 'super_class': extract_super_class(name.lower()),
+        'base_unit': 'kg' if weight else 'pcs', 'net_weight_kg': weight, 'caliber': extract_caliber(name),
+        'supplier_company_id': ''.join(['sup', str(i % 3)]),      # не литерал - проверяем intern
+        # служебные поля - в store не попадают
+        'name_norm': name.lower(), 'lemma_tokens': name.lower().split(), 'updated_at': '2026-01-01',
+    }
+
+
+def _docs():
+    return [_doc(i, name) for i, name in enumerate(NAMES * 3)]
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_compact_offer_reads_like_dict():
+    doc = _docs()[0]
+    offer = CompactOffer(doc)
+    assert offer['id'] == 'si0' and offer.get('price') == doc['price']
+    assert offer.get('brand_id') is None and offer.get('brand_id', 'x') == 'x'
+    assert offer.get('name_norm') is None and 'name_norm' not in offer
+    with pytest.raises(KeyError):
+        offer['trim_grade']
+    assert set(offer) <= set(MATCH_FIELDS) and offer.to_dict() == {k: doc[k] for k in offer}
+    assert {**offer}['name_raw'] == doc['name_raw']
+
+    with pytest.raises(AttributeError):
+        offer.price = 1
+    assert not hasattr(offer, '__dict__')
+
+
+def test_categorical_strings_are_interned():
+    store = OfferStore.from_docs(_docs())
+    by_supplier = {}
+    for offer in store:
+        by_supplier.setdefault(offer['supplier_company_id'], []).append(offer['supplier_company_id'])
+    for values in by_supplier.values():
+        assert all(v is values[0] for v in values)
+    assert offer_projection(('id', 'price')) == {'_id': 0, 'id': 1, 'price': 1}
+
+
+def test_hybrid_matcher_picks_same_winner_on_store():
+    docs = _docs()
+    store = asyncio.run(OfferStore.from_cursor(AsyncFakeCollection(docs).find({})))
+    assert len(store) == len(docs) and store[3]['id'] == docs[3]['id']
+    features = build_item_features(store)
+    for name in NAMES:
+        for price in (float('inf'), 400):
+            expected = find_best_match_hybrid(name, price, docs)
+            got = find_best_match_hybrid(name, price, store, item_features=features)
+            assert (got and got['id']) == (expected and expected['id']), name
@@ -0,0 +1,114 @@
+"""
+Order History Read Model Unit Tests
+===================================
+
+Проекция истории заказов (bestprice_v12/order_history.py): запись при
+checkout с именем поставщика, страницы по курсору (created_at, id) без
+пропусков и дублей, разовая миграция orders_v12 / legacy orders.
+
+Запуск: pytest /app/backend/tests/test_order_history.py -v
+"""
+
+import pytest
+import sys
+from datetime import datetime
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.order_history import (
+    ORDER_HISTORY_COLLECTION, record_orders, list_order_history, count_order_history,
+    get_history_entry, decode_cursor, migrate_legacy_orders,
+)
+from conftest import FakeCollection, FakeDB
+
+
+@pytest.fixture
+def db():
+    fake = FakeDB()
+    fake['companies'] = FakeCollection([
+        {'id': 's1', 'companyName': 'Поставщик 1'},
+        {'id': 's2', 'name': 'Поставщик 2'},
+    ])
+    return fake
+
+
+def _order(i, created_at, user='u1', supplier='s1'):
+    return {'id': f'o{i:02d}', 'customer_user_id': user, 'supplier_company_id': supplier,
+            'amount': 100.0 + i, 'status': 'pending', 'items': [{'productName': 'x'}] * (i % 3 + 1),
+            'created_at': created_at, 'delivery_address_id': None}
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_checkout_records_denormalized_entries(db):
+    orders = [_order(1, '2025-01-01T10:00:00+00:00'), _order(2, '2025-01-01T10:00:00+00:00', supplier='s2')]
+    assert record_orders(db, orders, {'s1': 'Из плана'}) == 2
+    entry = get_history_entry(db, 'o02')
+    assert entry['supplier_name'] == 'Поставщик 2'           # дочитано из companies
+    assert entry['items_count'] == 3 and 'customer_user_id' not in entry
+    assert get_history_entry(db, 'o01')['supplier_name'] == 'Из плана'
+    assert db['companies'].call_count('find') == 1
+
+    # Повторная запись того же заказа не плодит дубли
+    record_orders(db, orders[:1], {'s1': 'Из плана'})
+    assert count_order_history(db, 'u1') == 2
+
+
+def test_cursor_pages_cover_history_without_gaps(db):
+    # Несколько заказов одного checkout имеют одинаковый created_at
+    orders = [_order(i, f'2025-01-{1 + i // 3:02d}T10:00:00+00:00') for i in range(10)]
+    orders.append(_order(99, '2025-02-01T10:00:00+00:00', user='u2'))
+    record_orders(db, orders)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = list_order_history(db, 'u1', limit=4, cursor=cursor)
+        seen.extend(o['id'] for o in page)
+        if cursor is None:
+            break
+    expected = sorted(orders[:10], key=lambda o: (o['created_at'], o['id']), reverse=True)
+    assert seen == [o['id'] for o in expected]
+    assert count_order_history(db, 'u1') == 10
+
+    page, cursor = list_order_history(db, 'u1', limit=10)
+    assert len(page) == 10 and cursor is None
+
+    # Без limit - вся история (фронтенд курсор не использует)
+    page, cursor = list_order_history(db, 'u1', limit=None)
+    assert [o['id'] for o in page] == [o['id'] for o in expected] and cursor is None
+
+
+def test_invalid_cursor_rejected(db):
+    with pytest.raises(ValueError):
+        decode_cursor('не-курсор')
+    with pytest.raises(ValueError):
+        list_order_history(db, 'u1', cursor='eyJ4Ijp9')
+
+
+def test_migration_is_idempotent_and_prefers_orders_v12(db):
+    db['orders_v12'] = FakeCollection([_order(1, '2025-01-02T09:00:00+00:00'),
+                                       _order(2, '2025-01-03T09:00:00+00:00', supplier='s2')])
+    db['orders'] = FakeCollection([
+        {**_order(1, '2024-01-01T00:00:00+00:00'), 'amount': 1.0},                 # тот же id
+        {**_order(3, datetime(2024, 5, 1, 12, 0)), 'id': None},                    # без id
+        {'id': 'no-user', 'created_at': '2024-01-01T00:00:00+00:00'},              # не v12
+    ])
+    record_orders(db, [{**_order(2, '2025-01-03T09:00:00+00:00', supplier='s2'), 'status': 'confirmed'}])
+
+    dry = migrate_legacy_orders(db, dry_run=True)
+    assert dry['orders_v12'] == {'scanned': 2, 'inserted': 0}
+    assert count_order_history(db, 'u1') == 1
+
+    stats = migrate_legacy_orders(db, dry_run=False, batch_size=1)
+    assert stats['orders_v12'] == {'scanned': 2, 'inserted': 1}
+    assert stats['orders'] == {'scanned': 2, 'inserted': 1}
+    assert get_history_entry(db, 'o01')['amount'] == 101.0
+    assert get_history_entry(db, 'o02')['status'] == 'confirmed'       # запись checkout не перезаписана
+    legacy = get_history_entry(db, '2024-05-01T12:00:00+00:00')
+    assert legacy['created_at'] == '2024-05-01T12:00:00+00:00'
+    assert set(db[ORDER_HISTORY_COLLECTION].indexes) - {'_id_'}
+
+    again = migrate_legacy_orders(db, dry_run=False)
+    assert again['orders_v12']['inserted'] == 0 and again['orders']['inserted'] == 0
+    assert count_order_history(db, 'u1') == 3
@@ -0,0 +1,109 @@
+"""
+Plan Memoization Unit Tests
+===========================
+
+Мемоизация /v12/cart/plan по cart_hash, хэшу минималок и версии каталога
+ядер корзины (bestprice_v12/plan_snapshot.py, routes.get_cart_plan).
+
+Запуск: pytest /app/backend/tests/test_plan_memo.py -v
+"""
+
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12 import routes, optimizer
+from bestprice_v12.optimizer import OptimizationResult
+from bestprice_v12.best_price_engine import record_catalog_change, CHANGE_LOG_COLLECTION
+from bestprice_v12.plan_snapshot import (
+    PLAN_MAX_AGE_MINUTES, compute_cart_hash, compute_plan_keys, get_plan_memo_metrics, reset_plan_memo_metrics,
+)
+from conftest import FakeCollection, FakeDB
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    fake['supplier_items'] = FakeCollection([
+        {'id': 'i1', 'product_core_id': 'rice', 'supplier_company_id': 's1'},
+        {'id': 'i2', 'product_core_id': 'rice', 'supplier_company_id': 's2'},
+        {'id': 'i3', 'product_core_id': 'salt', 'supplier_company_id': 's3'},
+    ])
+    fake['companies'] = FakeCollection([
+        {'id': 's1', 'type': 'supplier', 'min_order_amount': 5000},
+        {'id': 's2', 'type': 'supplier'},
+    ])
+    fake['cart_intents'] = FakeCollection([
+        {'user_id': 'u1', 'supplier_item_id': 'i1', 'supplier_id': 's1', 'qty': 2},
+    ])
+
+    calls = []
+    monkeypatch.setattr(routes, 'get_db', lambda: fake)
+    monkeypatch.setattr(optimizer, 'optimize_cart_incremental', lambda d, user_id, version: calls.append(user_id) or OptimizationResult(success=True))
+    monkeypatch.setattr(optimizer, 'plan_to_dict', lambda result: {'suppliers': [], 'n': len(calls)})
+    reset_plan_memo_metrics()
+    fake.optimizer_calls = calls
+    return fake
+
+
+def _plan(db):
+    return asyncio.run(routes.get_cart_plan(user_id='u1'))
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_plan_keys_cart_hash_matches_checkout_hash(db):
+    assert compute_plan_keys(db, 'u1')['cart_hash'] == compute_cart_hash(db, 'u1')
+
+
+def test_unchanged_cart_reuses_snapshot(db):
+    first = _plan(db)
+    second = _plan(db)
+    assert second['plan_id'] == first['plan_id']
+    assert len(db.optimizer_calls) == 1
+    assert len(db['cart_plans_v12'].docs) == 1
+    metrics = get_plan_memo_metrics()
+    assert (metrics['hits'], metrics['misses'], metrics['hit_ratio']) == (1, 1, 0.5)
+    assert metrics['miss_reasons'] == {'no_snapshot': 1}
+
+
+@pytest.mark.parametrize('change, reason', [
+    (lambda db: db['cart_intents'].docs[0].update(qty=3), 'cart_changed'),
+    (lambda db: db['companies'].docs[1].update(min_order_amount=1), 'min_order_changed'),
+    # s2 - конкурент по ядру корзины, хотя в корзине его оффера нет
+    (lambda db: record_catalog_change(db, 'price_list_import', supplier_id='s2'), 'catalog_changed'),
+    (lambda db: record_catalog_change(db, 'backfill', product_core_ids=['rice']), 'catalog_changed'),
+])
+def test_real_change_reoptimizes(db, change, reason):
+    first = _plan(db)
+    change(db)
+    second = _plan(db)
+    assert second['plan_id'] != first['plan_id']
+    assert len(db.optimizer_calls) == 2
+    assert get_plan_memo_metrics()['miss_reasons'][reason] == 1
+
+
+def test_unrelated_catalog_change_keeps_snapshot(db):
+    first = _plan(db)
+    record_catalog_change(db, 'price_list_import', supplier_id='s3')
+    record_catalog_change(db, 'backfill', product_core_ids=['salt'])
+    assert len(db[CHANGE_LOG_COLLECTION].docs) == 2
+    assert _plan(db)['plan_id'] == first['plan_id']
+    assert len(db.optimizer_calls) == 1
+
+
+def test_reuse_is_capped_by_plan_age(db):
+    first = _plan(db)
+    snapshot = db['cart_plans_v12'].docs[0]
+    snapshot['created_at'] = datetime.now(timezone.utc) - timedelta(minutes=PLAN_MAX_AGE_MINUTES - 5)
+    assert _plan(db)['plan_id'] == first['plan_id']
+    # Продление TTL не выходит за created_at + PLAN_MAX_AGE_MINUTES
+    assert snapshot['expires_at'] <= snapshot['created_at'] + timedelta(minutes=PLAN_MAX_AGE_MINUTES)
+
+    snapshot['created_at'] -= timedelta(minutes=10)
+    assert _plan(db)['plan_id'] != first['plan_id']
+    assert get_plan_memo_metrics()['miss_reasons']['max_age'] == 1
@@ -0,0 +1,170 @@
+"""
+Compact Plan Snapshot Unit Tests
+================================
+
+Компактный snapshot плана (id офферов + количества, цены зафиксированы),
+datetime expires_at под TTL-индексом и восстановление одним чтением
+(bestprice_v12/plan_snapshot.py).
+
+Запуск: pytest /app/backend/tests/test_plan_snapshot_compact.py -v
+"""
+
+import asyncio
+import json
+import pytest
+import sys
+from datetime import datetime, timedelta, timezone
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.optimizer import optimize_cart, plan_to_dict
+from bestprice_v12.plan_snapshot import (
+    save_plan_snapshot, load_plan_snapshot, compact_plan, rehydrate_plan, cleanup_expired_plans,
+    ensure_plan_indexes,
+)
+from conftest import FakeCollection, FakeDB
+
+
+def _item(item_id, supplier, core, price, **extra):
+    return {'id': item_id, 'supplier_company_id': supplier, 'product_core_id': core, 'unit_type': 'WEIGHT',
+            'price': price, 'active': True, 'publishable': True, 'name_raw': f'Товар {item_id}', **extra}
+
+
+@pytest.fixture
+def db():
+    fake = FakeDB()
+    fake['companies'] = FakeCollection([
+        {'id': 's1', 'type': 'supplier', 'companyName': 'Поставщик 1', 'min_order_amount': 500},
+        {'id': 's2', 'type': 'supplier', 'companyName': 'Поставщик 2', 'min_order_amount': 500},
+        {'id': 's9', 'type': 'supplier', 'companyName': 'Без товаров', 'min_order_amount': 1},
+    ])
+    fake['supplier_items'] = FakeCollection([
+        _item('a1', 's1', 'rice', 100.0),
+        _item('b2', 's2', 'oil', 70.0, step_qty=3),
+        _item('c1', 's1', 'salt', 30.0),
+    ])
+    fake['cart_intents'] = FakeCollection([
+        {'user_id': 'u1', 'reference_id': 'r1', 'supplier_item_id': 'a1', 'supplier_id': 's1', 'qty': 6,
+         'price': 100.0, 'unit_type': 'WEIGHT', 'product_name': 'Товар a1'},
+        {'user_id': 'u1', 'reference_id': 'r2', 'supplier_item_id': 'b2', 'supplier_id': 's2', 'qty': 7,
+         'price': 65.0, 'unit_type': 'WEIGHT', 'product_name': 'Масло из избранного'},
+        {'user_id': 'u1', 'reference_id': 'r3', 'supplier_item_id': 'gone', 'supplier_id': 's1', 'qty': 1,
+         'price': 10.0, 'unit_type': 'WEIGHT', 'product_name': 'Снят с продажи'},
+    ])
+    return fake
+
+
+def _save(db):
+    result = optimize_cart(db, 'u1')
+    min_map = {c['id']: c['min_order_amount'] for c in db['companies'].docs}
+    return result, save_plan_snapshot(db, 'u1', result, 'hash', min_map)
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_rehydrated_payload_equals_plan_to_dict(db):
+    result, plan_id = _save(db)
+    expected = plan_to_dict(result)
+    assert expected['unfulfilled'] and expected['suppliers']
+
+    finds = db['supplier_items'].call_count('find')
+    plan_data, error = load_plan_snapshot(db, plan_id, 'u1')
+    assert error is None
+    assert plan_data['plan_payload'] == expected
+    assert db['supplier_items'].call_count('find') == finds + 1                # одно batched чтение
+
+
+def test_snapshot_is_compact_with_datetime_ttl(db):
+    result, _ = _save(db)
+    doc = db['cart_plans_v12'].docs[0]
+    assert isinstance(doc['expires_at'], datetime)
+    ensure_plan_indexes(db)
+    assert db['cart_plans_v12'].indexes['expires_at_1']['expireAfterSeconds'] == 0
+    assert 'plan_payload' not in doc
+    assert set(doc['min_order_map']) == {'s1', 's2'}
+    # имя и единица - из плана, а не из текущего документа оффера
+    names = {line[0]: line[8:] for supplier in doc['plan']['suppliers'] for line in supplier[4]}
+    assert names == {'a1': ['Товар a1', 'WEIGHT'], 'b2': ['Масло из избранного', 'WEIGHT']}
+    assert len(json.dumps(doc['plan'], ensure_ascii=False)) < len(json.dumps(plan_to_dict(result), ensure_ascii=False)) / 2
+
+
+def test_prices_and_names_are_pinned(db):
+    result, _ = _save(db)
+    db['supplier_items'].docs[0].update(price=999.0, name_raw='Переименован')
+    payload, missing = rehydrate_plan(db, compact_plan(result))
+    assert missing == []
+    assert payload['suppliers'][0]['items'][0]['price'] == 100.0
+    assert payload['suppliers'][0]['items'][0]['product_name'] == 'Товар a1'
+
+
+def test_deleted_offer_marks_line_unavailable(db):
+    result, plan_id = _save(db)
+    expected = plan_to_dict(result)
+    db['supplier_items'].docs = [d for d in db['supplier_items'].docs if d['id'] != 'b2']
+
+    plan_data, error = load_plan_snapshot(db, plan_id, 'u1')
+    assert error is None and plan_data['missing_offer_ids'] == ['b2']
+    items = {i['supplier_item_id']: i for s in plan_data['plan_payload']['suppliers'] for i in s['items']}
+    assert 'unavailable' not in items['a1']
+    # цена, имя и единица - из плана
+    line = next(i for s in expected['suppliers'] for i in s['items'] if i['supplier_item_id'] == 'b2')
+    assert items['b2'] == {**line, 'unavailable': True, 'unavailable_reason_code': 'OFFER_INACTIVE'}
+
+
+def test_v1_snapshot_reads_name_from_offer(db):
+    _, plan_id = _save(db)
+    plan = db['cart_plans_v12'].docs[0]['plan']
+    plan['v'] = 1
+    for supplier in plan['suppliers']:
+        for line in supplier[4]:
+            del line[9]
+            if line[0] == 'a1':
+                line[8] = None
+    plan_data, error = load_plan_snapshot(db, plan_id, 'u1')
+    items = {i['supplier_item_id']: i for s in plan_data['plan_payload']['suppliers'] for i in s['items']}
+    assert items['a1']['product_name'] == 'Товар a1' and items['a1']['unit_type'] == 'WEIGHT'
+    assert items['b2']['product_name'] == 'Масло из избранного'
+
+
+def test_expired_and_legacy_snapshots(db):
+    _, plan_id = _save(db)
+    db['cart_plans_v12'].docs[0]['expires_at'] = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=1)
+    plan_data, error = load_plan_snapshot(db, plan_id, 'u1')
+    assert plan_data is None and 'устарел' in error
+
+    # Старый формат: ISO-строки и полный plan_payload
+    expired_iso = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    fresh_iso = (datetime.now(timezone.utc) + timedelta(minutes=30)).isoformat()
+    db['cart_plans_v12'] = FakeCollection([
+        {'plan_id': 'old', 'user_id': 'u1', 'expires_at': fresh_iso, 'cart_hash': 'h', 'plan_payload': {'success': True}},
+        {'plan_id': 'stale', 'user_id': 'u2', 'expires_at': expired_iso, 'plan_payload': {}},
+    ])
+    plan_data, error = load_plan_snapshot(db, 'old', 'u1')
+    assert error is None and plan_data['plan_payload'] == {'success': True}
+    assert cleanup_expired_plans(db) == 1
+    assert [d['plan_id'] for d in db['cart_plans_v12'].docs] == ['old']
+
+
+def test_checkout_skips_deleted_offer_lines(db, monkeypatch):
+    from bestprice_v12 import routes
+    from bestprice_v12.plan_snapshot import compute_cart_hash
+    monkeypatch.setattr(routes, 'get_db', lambda: db)
+    db['cart_intents'].docs = [d for d in db['cart_intents'].docs if d['supplier_item_id'] != 'gone']
+    db['cart_intents'].docs.append(
+        {'user_id': 'u1', 'reference_id': 'r4', 'supplier_item_id': 'c1', 'supplier_id': 's1', 'qty': 2,
+         'price': 30.0, 'unit_type': 'WEIGHT', 'product_name': 'Соль'})
+    result = optimize_cart(db, 'u1')
+    assert result.success
+    plan_id = save_plan_snapshot(db, 'u1', result, compute_cart_hash(db, 'u1'), {'s1': 500, 's2': 500})
+    db['supplier_items'].docs = [d for d in db['supplier_items'].docs if d['id'] != 'c1']
+
+    response = asyncio.run(routes.checkout_cart(routes.CheckoutRequest(plan_id=plan_id), user_id='u1'))
+    assert response['status'] == 'ok'
+    assert [i['supplier_item_id'] for i in response['unavailable_items']] == ['c1']
+    assert response['unavailable_items'][0]['product_name'] == 'Соль'
+    orders = {o['supplier_company_id']: o for o in db['orders_v12'].docs}
+    s1 = orders['s1']
+    assert [i['article'] for i in s1['items']] == ['a1']
+    assert s1['amount'] == sum(i['quantity'] * i['price'] for i in s1['items'])
+    assert response['total'] == sum(o['amount'] for o in orders.values())
@@ -0,0 +1,122 @@
+"""
+Publication Flag Unit Tests
+===========================
+
+Валидация при импорте (bestprice_v12/offer_validator.py): флаг publishable
+и коды причин пишутся один раз на строку, чтение фильтрует только по флагу
+(индекс publishable_core_unit_price), ремонтный пересчёт устаревших флагов.
+
+Запуск: pytest /app/backend/tests/test_publication_flags.py -v
+"""
+
+import itertools
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.offer_validator import (
+    publication_errors, publication_fields, refresh_publication_flags, get_publishable_query,
+    PUBLISH_RULES_VERSION,
+)
+from bestprice_v12.catalog import publishable_offer_query
+from bestprice_v12.best_price_engine import ensure_engine_indexes, CHANGE_LOG_COLLECTION
+from bulk_backfill import resolve_stages, apply_stages
+from conftest import FakeCollection, FakeDB
+
+_MISSING = object()
+
+
+# ============================================================================
+# ЭТАЛОН: прежний фильтр get_publishable_query на чтении
+# ============================================================================
+
+def _num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _legacy_read_filter(d):
+    return (_num(d.get('price')) and d['price'] > 0
+            and 'unit_type' in d and d['unit_type'] != ''
+            and 'id' in d and d['id'] != ''
+            and ((d['unit_type'] in ('WEIGHT', 'VOLUME') and _num(d.get('pack_qty')) and d['pack_qty'] > 0)
+                 or d['unit_type'] == 'PIECE'))
+
+
+def _grid():
+    values = {
+        'id': [_MISSING, '', 'o1'],
+        'supplier_company_id': [_MISSING, '', 's1'],
+        'price': [_MISSING, None, 0, -1, '10', 10.0],
+        'unit_type': [_MISSING, None, '', 'WEIGHT', 'VOLUME', 'PIECE', 'BOX'],
+        'pack_qty': [_MISSING, None, 0, '1', 1.5],
+    }
+    for combo in itertools.product(*values.values()):
+        yield {k: v for k, v in zip(values, combo) if v is not _MISSING}
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_flag_matches_legacy_read_filter():
+    for offer in _grid():
+        fields = publication_fields(offer)
+        assert fields['publish_v'] == PUBLISH_RULES_VERSION
+        assert fields['publishable'] == (not fields['publish_errors'])
+        if offer.get('supplier_company_id'):
+            assert fields['publishable'] == _legacy_read_filter(offer), offer
+        else:
+            assert 'MISSING_SUPPLIER' in fields['publish_errors']
+
+
+def test_reason_codes():
+    base = {'id': 'o1', 'supplier_company_id': 's1', 'price': 10.0, 'unit_type': 'WEIGHT', 'pack_qty': 1}
+    assert publication_errors(base) == []
+    assert publication_errors({**base, 'price': None}) == ['MISSING_PRICE']
+    assert publication_errors({**base, 'price': '10'}) == ['INVALID_PRICE']
+    assert publication_errors({**base, 'pack_qty': 0}) == ['MISSING_PACK_SIZE']
+    assert publication_errors({**base, 'unit_type': 'BOX'}) == ['UNSUPPORTED_UNIT_TYPE']
+    assert publication_errors({'unit_type': 'PIECE'}) == [
+        'MISSING_ID', 'MISSING_SUPPLIER', 'MISSING_PRICE',
+    ]
+
+
+def test_read_filter_uses_flag_and_index():
+    db = FakeDB()
+    ensure_engine_indexes(db)
+    name, info = list(db['supplier_items'].index_information().items())[-1]
+    assert name == 'publishable_core_unit_price'
+    assert info == {'key': [('publishable', 1), ('product_core_id', 1), ('unit_type', 1), ('price', 1)], 'v': 2}
+    assert get_publishable_query() == {'active': True, 'publishable': True}
+    assert publishable_offer_query(product_core_id='rice', unit_type='WEIGHT') == {
+        'active': True, 'publishable': True, 'product_core_id': 'rice', 'unit_type': 'WEIGHT',
+    }
+
+
+def test_refresh_rewrites_only_stale_rows_and_logs_visibility_changes():
+    ok = {'id': 'o1', 'supplier_company_id': 's1', 'price': 10.0, 'unit_type': 'PIECE'}
+    db = FakeDB()
+    db['supplier_items'] = FakeCollection([
+        {'_id': 1, **ok},                                                     # без флага (старая строка)
+        {'_id': 2, **ok, 'id': 'o2', **publication_fields(ok)},               # актуальный флаг
+        {'_id': 3, **ok, 'id': 'o3', 'supplier_company_id': 's2', 'price': 0,
+         'publishable': True, 'publish_v': 0},                                # устаревший и неверный
+        {'_id': 4, **ok, 'id': 'o4', 'publishable': True, 'publish_errors': [], 'publish_v': 0},
+    ])
+    stats = refresh_publication_flags(db, batch_size=2)
+    assert stats == {'checked': 3, 'updated': 3, 'suppliers_changed': 2}
+    docs = {d['_id']: d for d in db['supplier_items'].docs}
+    assert docs[1]['publishable'] is True and docs[3]['publishable'] is False
+    assert docs[3]['publish_errors'] == ['INVALID_PRICE']
+    # Запись в change log только там, где оффер появился/пропал из выдачи
+    assert sorted(e['supplier_id'] for e in db[CHANGE_LOG_COLLECTION].docs) == ['s1', 's2']
+
+    assert refresh_publication_flags(db) == {'checked': 0, 'updated': 0, 'suppliers_changed': 0}
+
+
+def test_bulk_backfill_stage_sets_flag():
+    stages = resolve_stages(['publishable'])
+    changes, touched = apply_stages({'_id': 1, 'id': 'o1', 'supplier_company_id': 's1', 'price': 5,
+                                     'unit_type': 'WEIGHT'}, stages)
+    assert touched == ['publishable']
+    assert changes == {'publishable': False, 'publish_errors': ['MISSING_PACK_SIZE'], 'publish_v': PUBLISH_RULES_VERSION}
+    assert 'product_core_id' in stages[0].fields
@@ -0,0 +1,158 @@
+"""
+Reference Data Registry Unit Tests
+==================================
+
+Снапшоты справочников, параллельная загрузка, горячая перезагрузка по
+версии источника и атомарная подмена (reference_data.py).
+
+Запуск: pytest /app/backend/tests/test_reference_data.py -v
+"""
+
+import os
+import pickle
+import threading
+import sys
+sys.path.insert(0, '/app/backend')
+
+from reference_data import (
+    ReferenceRegistry, ReferenceDataset, AliasIndex, match_alias, bump_version,
+    load_brand_aliases, load_seed_dict_rules, VERSIONS_COLLECTION,
+)
+from p0_hotfix_stabilization import extract_brand_from_text
+from conftest import FakeCollection, FakeDB
+
+
+def _registry(db, loader, **kwargs):
+    return ReferenceRegistry([ReferenceDataset('aliases', loader, sources=('brand_aliases',), **kwargs)], db=db)
+
+
+def _aliases_db(*pairs):
+    db = FakeDB()
+    db['brand_aliases'] = FakeCollection([{'alias_norm': a, 'brand_id': b} for a, b in pairs])
+    return db
+
+
+# ============================================================================
+# DERIVED STRUCTURES
+# ============================================================================
+
+def test_alias_index_matches_dict_path_and_pickles():
+    aliases = {'heinz': 'heinz', 'мираторг': 'miratorg', 'мираторг chef': 'miratorg_chef', 'ла': 'la'}
+    index = AliasIndex(aliases)
+    for name in ['Кетчуп HEINZ 800г', 'Говядина Мираторг Chef 1кг', 'Мираторг фарш', 'Соус ла 1л', 'Паланга']:
+        assert extract_brand_from_text(name, index) == extract_brand_from_text(name, dict(aliases))
+    assert match_alias(index, 'говядина мираторг chef') == 'miratorg_chef'
+    assert dict(pickle.loads(pickle.dumps(index))) == aliases
+
+
+def test_seed_dict_rules_snapshot_is_read_only():
+    db = FakeDB()
+    db['seed_dict_rules'] = FakeCollection([
+        {'type': 'grade', 'raw': 'Prime', 'action': 'оставить'},
+        {'type': 'grade', 'raw': 'junk', 'action': 'удалить'},
+    ])
+    rules = load_seed_dict_rules(db)
+    assert rules['grade'] == ('prime',)
+    assert rules['fat'] == ()
+    try:
+        rules['grade'] = ()
+        assert False, 'snapshot must be immutable'
+    except TypeError:
+        pass
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+def test_get_loads_lazily_once():
+    db = _aliases_db(('heinz', 'heinz'))
+    calls = []
+
+    def loader(d):
+        calls.append(1)
+        return load_brand_aliases(d)
+
+    registry = _registry(db, loader)
+    assert registry.get('aliases')['heinz'] == 'heinz'
+    assert registry.get('aliases')['heinz'] == 'heinz'
+    assert len(calls) == 1
+
+
+def test_load_all_runs_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def loader(db):
+        barrier.wait()  # оба набора должны грузиться одновременно, иначе timeout
+        return {}
+
+    registry = ReferenceRegistry([
+        ReferenceDataset('a', loader), ReferenceDataset('b', loader),
+        ReferenceDataset('lazy', loader, preload=False),
+    ], db=FakeDB())
+    assert set(registry.load_all()) == {'a', 'b'}
+    assert registry.status()['datasets']['lazy']['loaded'] is False
+
+
+def test_poll_reloads_only_after_version_bump():
+    db = _aliases_db(('heinz', 'heinz'))
+    registry = _registry(db, load_brand_aliases)
+    before = registry.get('aliases')
+
+    db['brand_aliases'].insert_one({'alias_norm': 'hochland', 'brand_id': 'hochland'})
+    assert registry.poll_once() == []
+    assert registry.get('aliases') is before          # без bump снапшот не меняется
+
+    bump_version(db, 'brand_aliases')
+    assert db[VERSIONS_COLLECTION].docs[0]['version'] == 1
+    assert registry.poll_once() == ['aliases']
+    after = registry.get('aliases')
+    assert after is not before and after['hochland'] == 'hochland'
+    assert 'hochland' not in before                   # старый снапшот не мутирован
+    assert registry.poll_once() == []
+
+
+def test_failed_reload_keeps_previous_snapshot():
+    db = _aliases_db(('heinz', 'heinz'))
+    state = {'fail': False}
+
+    def loader(d):
+        if state['fail']:
+            raise RuntimeError('mongo down')
+        return load_brand_aliases(d)
+
+    registry = _registry(db, loader)
+    good = registry.get('aliases')
+    state['fail'] = True
+    bump_version(db, 'brand_aliases')
+    registry.poll_once()
+    assert registry.get('aliases') is good
+
+
+def test_failed_first_load_returns_empty_and_retries():
+    state = {'fail': True}
+
+    def loader(d):
+        if state['fail']:
+            raise RuntimeError('mongo down')
+        return {'x': 1}
+
+    registry = _registry(FakeDB(), loader)
+    assert registry.get('aliases') == {}
+    assert registry.status()['datasets']['aliases']['error'] == 'mongo down'
+    state['fail'] = False
+    assert registry.poll_once() == ['aliases']
+    assert registry.get('aliases') == {'x': 1}
+
+
+def test_file_mtime_is_part_of_version(tmp_path):
+    path = tmp_path / 'brands.xlsx'
+    path.write_text('v1')
+    registry = ReferenceRegistry(
+        [ReferenceDataset('brands', lambda db: path.read_text(), files=(lambda: str(path),))], db=FakeDB()
+    )
+    assert registry.get('brands') == 'v1'
+    path.write_text('v2')
+    os.utime(path, (0, 12345))
+    assert registry.poll_once() == ['brands']
+    assert registry.get('brands') == 'v2'
@@ -0,0 +1,138 @@
+"""
+Request Profiler Unit Tests
+===========================
+
+Спаны/отметки стадий, гистограммы и сэмплирование трассы по заголовку.
+
+Запуск: pytest /app/backend/tests/test_request_profiler.py -v
+"""
+
+import asyncio
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+import request_profiler
+from request_profiler import (
+    StageHistogram, ProfileTraceMiddleware, profiled, profile_request, span, lap,
+    get_stage_metrics, get_recent_traces, reset_stage_metrics,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    reset_stage_metrics()
+    yield
+    reset_stage_metrics()
+
+
+# ============================================================================
+# HISTOGRAM
+# ============================================================================
+
+def test_histogram_quantiles_use_bucket_bounds():
+    hist = StageHistogram()
+    for ms in [0.5] * 90 + [40.0] * 9 + [700.0]:
+        hist.observe(ms)
+    assert hist.count == 100
+    assert hist.quantile(0.50) == 1.0       # верхняя граница бакета
+    assert hist.quantile(0.95) == 50.0
+    assert hist.quantile(0.999) == 700.0    # хвост - реальный max
+    assert sum(hist.to_dict()['buckets']) == 100
+
+
+# ============================================================================
+# SPANS
+# ============================================================================
+
+def test_span_and_lap_are_noop_outside_profile():
+    with span('orphan'):
+        pass
+    lap('orphan_lap')
+    assert get_stage_metrics()['stages'] == {}
+
+
+def test_profile_records_laps_spans_and_total():
+    with profile_request('ep'):
+        lap('load')
+        with span('guards'):
+            with span('inner'):
+                pass
+        lap('scoring')
+    stages = get_stage_metrics()['stages']
+    assert set(stages) == {'ep.load', 'ep.guards', 'ep.inner', 'ep.scoring', 'ep.total'}
+    assert all(s['count'] == 1 for s in stages.values())
+    # Без сэмплирования трасса не собирается
+    assert get_recent_traces() == []
+
+
+def test_prefix_filter():
+    with profile_request('a'):
+        lap('x')
+    with profile_request('b'):
+        lap('x')
+    assert list(get_stage_metrics(prefix='b')['stages']) == ['b.total', 'b.x']
+
+
+def test_profiled_decorator_keeps_signature_and_result():
+    @profiled('dec')
+    async def endpoint(item_id: str, limit: int = 10):
+        lap('work')
+        return item_id, limit
+
+    import inspect
+    assert list(inspect.signature(endpoint).parameters) == ['item_id', 'limit']
+    assert asyncio.run(endpoint('x', limit=3)) == ('x', 3)
+    assert 'dec.work' in get_stage_metrics()['stages']
+
+
+def test_sample_rate_collects_trace(monkeypatch):
+    monkeypatch.setattr(request_profiler, 'TRACE_SAMPLE_RATE', 1.0)
+    with profile_request('ep'):
+        with span('outer'):
+            lap('child')
+    trace = get_recent_traces()[0]
+    assert trace['endpoint'] == 'ep'
+    assert [(s['stage'], s['depth']) for s in trace['spans']] == [('child', 1), ('outer', 0)]
+
+
+# ============================================================================
+# MIDDLEWARE (X-Profile-Trace)
+# ============================================================================
+
+def _call(app, headers):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'headers': headers}
+    asyncio.run(ProfileTraceMiddleware(app)(scope, receive, send))
+    return dict(sent[0]['headers'])
+
+
+async def _profiled_app(scope, receive, send):
+    @profiled('mw')
+    async def handler():
+        lap('stage')
+
+    await handler()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def test_middleware_header_forces_trace():
+    headers = _call(_profiled_app, [(b'x-profile-trace', b'1')])
+    assert headers[b'server-timing'].startswith(b'stage;dur=')
+    assert b'mw.total;dur=' in headers[b'server-timing']
+    assert headers[b'x-profile-trace-id'].decode() == get_recent_traces()[0]['trace_id']
+
+
+def test_middleware_without_header_only_aggregates():
+    headers = _call(_profiled_app, [])
+    assert b'server-timing' not in headers
+    assert get_recent_traces() == []
+    assert get_stage_metrics()['stages']['mw.stage']['count'] == 1
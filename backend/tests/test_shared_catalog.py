@@ -0,0 +1,166 @@
+"""
+Shared Catalog Unit Tests
+=========================
+
+Снимок активных офферов в .npy (shared_catalog.py): строки снимка читаются
+так же, как CompactOffer, колонки отображаются read-only, новая версия
+публикуется атомарно и подхватывается читателем без перезапуска, а старый
+снимок остаётся читаемым у тех, кто его держит; публикатор переопубликовывает
+снимок, когда catalog_change_log уходит вперёд.
+
+Запуск: pytest /app/backend/tests/test_shared_catalog.py -v
+"""
+
+import sys
+sys.path.insert(0, '/app/backend')
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from bestprice_v12.offer_store import MATCH_FIELDS, CompactOffer
+from matching.hybrid_matcher import build_item_features, find_best_match_hybrid
+from shared_catalog import (
+    CURRENT_POINTER, PUBLISH_LOCK_FILE, SharedCatalog, SharedCatalogPublisher, SharedCatalogReader,
+    publish_catalog, publish_if_behind, read_current_name, write_catalog,
+)
+from conftest import FakeCollection, FakeDB
+
+NAMES = ['Бульон куриный Knorr 2 кг', 'Бульон грибной Knorr 2 кг', 'Рис басмати 1 кг',
+         'Креветки 16/20 с/м 1 кг', 'Соус соевый Kikkoman 1 л']
+
+
+def _docs(price_shift=0):
+    from pipeline.enricher import extract_caliber, extract_super_class, extract_weights
+    docs = []
+    for i, name in enumerate(NAMES * 4):
+        weight = extract_weights(name).get('net_weight_kg')
+        docs.append({
+            'id': f'si{i}', 'name_raw': name, 'price': 100 + (i * 37) % 400 + price_shift,
+            'price_per_base_unit': 100 + (i * 53) % 400, 'super_class': extract_super_class(name.lower()),
+            'base_unit': 'kg' if weight else 'pcs', 'net_weight_kg': weight, 'caliber': extract_caliber(name),
+            'supplier_company_id': f'sup{i % 3}', 'brand_id': 'knorr' if 'Knorr' in name else None,
+            'bulk_package': i % 5 == 0, 'lemma_tokens': ['x'],
+        })
+    return docs
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_rows_read_like_compact_offers(tmp_path):
+    docs = _docs()
+    info = write_catalog(docs, str(tmp_path), version='v1')
+    catalog = SharedCatalog(str(tmp_path / info['name']))
+    assert len(catalog) == info['count'] == len(docs) and catalog.version == 'v1'
+
+    for doc, row in zip(docs, catalog):
+        compact = CompactOffer(doc)
+        for key in MATCH_FIELDS:
+            assert row.get(key) == compact.get(key), key
+        assert 'lemma_tokens' not in row and row.get('lemma_tokens') is None
+    assert catalog[-1]['id'] == docs[-1]['id']
+    assert isinstance(catalog[0]['price'], float) and catalog[0]['bulk_package'] is True
+    with pytest.raises(KeyError):
+        catalog[2]['brand_id']
+
+    # Колонки отображены и доступны только на чтение
+    column = catalog._numeric['price']
+    assert isinstance(column, np.memmap)
+    with pytest.raises(ValueError):
+        column[0] = 1.0
+
+
+def test_hybrid_matcher_on_shared_snapshot(tmp_path):
+    docs = _docs()
+    catalog = SharedCatalog(str(tmp_path / write_catalog(docs, str(tmp_path))['name']))
+    features = build_item_features(catalog)
+    for name in NAMES:
+        expected = find_best_match_hybrid(name, float('inf'), docs)
+        got = find_best_match_hybrid(name, float('inf'), catalog, item_features=features)
+        assert (got and got['id']) == (expected and expected['id']), name
+
+
+def test_new_version_is_swapped_in_and_old_stays_readable(tmp_path):
+    root = str(tmp_path)
+    reader = SharedCatalogReader(root, check_interval=0)
+    assert reader.current() is None
+
+    first = write_catalog(_docs(), root, keep=1)
+    old = reader.current()
+    assert old.name == first['name'] and reader.current() is old
+    old_row = old[0]
+
+    second = write_catalog(_docs(price_shift=1000), root, keep=1)
+    new = reader.current()
+    assert new.name == second['name'] == read_current_name(root)
+    assert new[0]['price'] == old_row['price'] + 1000
+
+    # keep=1: каталог первой версии удалён, но отображение у старых читателей живо
+    assert not os.path.exists(os.path.join(root, first['name']))
+    assert old_row['name_raw'] == NAMES[0]
+    assert sorted(os.listdir(root)) == sorted([CURRENT_POINTER, second['name']])
+
+
+def test_publish_reads_active_offers_with_projection(tmp_path):
+    db = FakeDB()
+    db['supplier_items'] = FakeCollection([dict(d, active=i % 2 == 0) for i, d in enumerate(_docs())])
+    db['catalog_change_log'] = FakeCollection([{'id': 'chg-7'}])
+    info = publish_catalog(db, str(tmp_path))
+    catalog = SharedCatalogReader(str(tmp_path)).current()
+    assert info['version'] == catalog.version == 'chg-7'
+    assert len(catalog) == len(_docs()) // 2 and [o['id'] for o in catalog][:2] == ['si0', 'si2']
+
+
+def test_snapshot_behind_change_log_is_not_used(tmp_path):
+    root = str(tmp_path)
+    reader = SharedCatalogReader(root, check_interval=0)
+    write_catalog(_docs(), root, version='chg-7')
+    assert reader.current_for('chg-7').version == 'chg-7'
+    # Импорт записал chg-8, снимок ещё не переопубликован → читаем из Mongo
+    assert reader.current_for('chg-8') is None
+    write_catalog(_docs(), root, version='chg-8')
+    assert reader.current_for('chg-8').version == 'chg-8'
+
+
+def test_publish_if_behind_follows_change_log(tmp_path):
+    import fcntl
+    root = str(tmp_path)
+    db = FakeDB()
+    db['supplier_items'] = FakeCollection([dict(d, active=True) for d in _docs()])
+    db['catalog_change_log'] = FakeCollection([{'id': 'chg-7', 'created_at': '2025-01-01T00:00:00+00:00'}])
+    publisher = SharedCatalogPublisher(db, root)
+    first = publisher.publish_once()
+    assert first['version'] == 'chg-7' and first['count'] == len(_docs())
+    finds = db['supplier_items'].call_count('find')
+    assert publisher.publish_once() is None                       # снимок актуален
+    assert db['supplier_items'].call_count('find') == finds
+
+    db['catalog_change_log'].insert_one({'id': 'chg-8', 'created_at': '2025-01-02T00:00:00+00:00'})
+    # Другой воркер держит блокировку публикации - этот пропускает цикл
+    with open(os.path.join(root, PUBLISH_LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert publish_if_behind(db, root) is None
+    assert SharedCatalogReader(root).current_for('chg-8') is None
+
+    assert publish_if_behind(db, root)['version'] == 'chg-8'
+    assert SharedCatalogReader(root).current_for('chg-8').name != first['name']
+
+
+def test_publisher_thread_publishes_on_start(tmp_path):
+    db = FakeDB()
+    db['supplier_items'] = FakeCollection([dict(d, active=True) for d in _docs()])
+    db['catalog_change_log'] = FakeCollection([{'id': 'chg-1'}])
+    publisher = SharedCatalogPublisher(db, str(tmp_path))
+    assert publisher.start(interval=60) and not publisher.start(interval=60)
+    reader = SharedCatalogReader(str(tmp_path), check_interval=0)
+    for _ in range(200):
+        if reader.current_for('chg-1'):
+            break
+        time.sleep(0.01)
+    publisher.stop()
+    assert reader.current_for('chg-1').count == len(_docs())
+    assert not SharedCatalogPublisher(db, str(tmp_path)).start(interval=0)
@@ -0,0 +1,124 @@
+"""
+Supplier Links Unit Tests
+=========================
+
+Bulk-линковка поставщик↔ресторан и денормализованная витрина
+supplier_restaurant_view (supplier_links.py).
+
+Запуск: pytest /app/backend/tests/test_supplier_links.py -v
+"""
+
+import asyncio
+import pytest
+import sys
+sys.path.insert(0, '/app/backend')
+
+from supplier_links import (
+    latest_documents_by_type, link_supplier_to_all_restaurants, link_restaurant_to_all_suppliers,
+    sync_view, refresh_restaurant_in_view, ensure_supplier_view, add_restaurant_to_view,
+)
+from conftest import AsyncFakeCollection, AsyncFakeDB
+
+
+@pytest.fixture
+def db():
+    fake = AsyncFakeDB()
+    fake['companies'] = AsyncFakeCollection([
+        {'id': 's1', 'type': 'supplier', 'companyName': 'Поставщик 1'},
+        {'id': 's2', 'type': 'supplier', 'companyName': 'Поставщик 2'},
+        {'id': 'r1', 'type': 'customer', 'companyName': 'Ресторан 1', 'inn': '111', 'passwordHash': 'x'},
+        {'id': 'r2', 'type': 'customer', 'companyName': 'Ресторан 2', 'inn': '222'},
+    ])
+    fake['documents'] = AsyncFakeCollection([
+        {'id': 'd1', 'companyId': 'r1', 'type': 'Договор', 'createdAt': '2025-01-01'},
+        {'id': 'd2', 'companyId': 'r1', 'type': 'Договор', 'createdAt': '2025-02-01'},
+        {'id': 'd3', 'companyId': 'r1', 'type': 'Устав', 'createdAt': '2025-01-15'},
+    ])
+    return fake
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _row(db, supplier_id, restaurant_id):
+    return next(d for d in db['supplier_restaurant_view'].docs
+                if d['supplierId'] == supplier_id and d['restaurantId'] == restaurant_id)
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_latest_documents_by_type_keeps_newest():
+    docs = latest_documents_by_type([
+        {'id': 'a', 'companyId': 'c', 'type': 'T', 'createdAt': '1'},
+        {'id': 'b', 'companyId': 'c', 'type': 'T', 'createdAt': '2'},
+        {'id': 'c', 'companyId': 'c'},
+    ])
+    assert [d['id'] for d in docs['c']] == ['b', 'c']
+    assert docs['c'][1]['type'] == 'Документ'
+
+
+def test_supplier_linking_is_one_bulk_write_and_builds_view(db):
+    count = _run(link_supplier_to_all_restaurants(db, 's1'))
+    links = db['supplier_restaurant_settings']
+    assert count == 2
+    assert len(links.bulk_writes) == 1
+    assert {(l['supplierId'], l['restaurantId'], l['contract_accepted']) for l in links.docs} == {
+        ('s1', 'r1', False), ('s1', 'r2', False)
+    }
+    row = _row(db, 's1', 'r1')
+    assert row['contract_accepted'] is False
+    assert [d['id'] for d in row['documents']] == ['d2', 'd3']
+    assert 'passwordHash' not in row['restaurant']
+
+
+def test_relinking_keeps_accepted_contracts(db):
+    db['supplier_restaurant_settings'] = AsyncFakeCollection([
+        {'supplierId': 's1', 'restaurantId': 'r1', 'contract_accepted': True, 'is_paused': True},
+    ])
+    _run(link_supplier_to_all_restaurants(db, 's1'))
+    row = _row(db, 's1', 'r1')
+    assert row['contract_accepted'] is True
+    assert row['is_paused'] is True
+
+
+def test_restaurant_auto_accept_links_all_suppliers(db):
+    _run(link_restaurant_to_all_suppliers(db, 'r2', accept=True))
+    assert len(db['supplier_restaurant_settings'].bulk_writes) == 1
+    assert _row(db, 's1', 'r2')['contract_accepted'] is True
+    assert _row(db, 's2', 'r2')['ordersEnabled'] is True
+
+
+def test_sync_view_single_pair_after_pause(db):
+    _run(link_supplier_to_all_restaurants(db, 's1'))
+    link = next(l for l in db['supplier_restaurant_settings'].docs if l['restaurantId'] == 'r2')
+    link.update({'contract_accepted': True, 'is_paused': True})
+    assert _run(sync_view(db, supplier_id='s1', restaurant_id='r2')) == 1
+    assert _row(db, 's1', 'r2')['is_paused'] is True
+    assert _row(db, 's1', 'r1')['is_paused'] is False
+
+
+def test_refresh_restaurant_updates_documents_for_all_suppliers(db):
+    _run(sync_view(db, restaurant_id='r2'))
+    _run(db['documents'].insert_one({'id': 'd9', 'companyId': 'r2', 'type': 'Договор', 'createdAt': '2025-03-01'}))
+    _run(refresh_restaurant_in_view(db, 'r2'))
+    assert [d['id'] for d in _row(db, 's1', 'r2')['documents']] == ['d9']
+    assert [d['id'] for d in _row(db, 's2', 'r2')['documents']] == ['d9']
+
+
+def test_ensure_view_builds_supplier_after_restaurant_sync(db):
+    # Регистрация ресторана создаёт строки только для него - полной сборки ещё не было
+    _run(add_restaurant_to_view(db, 'r2'))
+    assert db['supplier_restaurant_settings'].docs == []
+    assert {d['restaurantId'] for d in db['supplier_restaurant_view'].docs} == {'r2'}
+
+    _run(ensure_supplier_view(db, 's1'))
+    assert _row(db, 's1', 'r1')['linked'] is False
+    assert _run(db['supplier_restaurant_view_state'].find_one({'supplierId': 's1'})) is not None
+
+    # Повторный вызов витрину не пересобирает
+    calls = len(db['supplier_restaurant_view'].bulk_writes)
+    _run(ensure_supplier_view(db, 's1'))
+    assert len(db['supplier_restaurant_view'].bulk_writes) == calls
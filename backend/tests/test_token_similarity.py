@@ -0,0 +1,84 @@
+"""
+Token Similarity Kernel Unit Tests
+==================================
+
+Kernel similarity score (bestprice_v12/token_similarity.py): точный путь
+совпадает с прежним SequenceMatcher-расчётом бит в бит, отсечение по
+верхним оценкам не меняет решение 85% guard.
+
+Запуск: pytest /app/backend/tests/test_token_similarity.py -v
+"""
+
+import random
+import sys
+sys.path.insert(0, '/app/backend')
+
+from bestprice_v12.token_similarity import (
+    token_similarity, token_profile, gated_similarity, reference_similarity,
+)
+from bestprice_v12.npc_matching_v9 import (
+    SIMILARITY_THRESHOLD, calculate_similarity, extract_semantic_tokens, explain_npc_match, load_npc_data,
+)
+from bestprice_v12 import npc_fish_fillet
+
+WORDS = ['лосось', 'семга', 'филе', 'тушка', 'мороженая', 'на', 'коже', 'без', 'кожи', 'чили',
+         'норвегия', 'премиум', 'атлантическая', 'ломтики', 'xl', 'кальмар', 'кольца']
+
+
+def _pairs(n, seed=3):
+    rng = random.Random(seed)
+    for _ in range(n):
+        source = rng.choices(WORDS, k=rng.randint(1, 6))
+        if rng.random() < 0.3:
+            candidate = rng.sample(source, len(source))            # те же слова, другой порядок
+        else:
+            candidate = rng.choices(WORDS, k=rng.randint(1, 6))
+        yield source, candidate
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_exact_path_matches_reference():
+    for source, candidate in _pairs(3000):
+        assert token_similarity(source, candidate) == reference_similarity(source, candidate)
+    assert token_similarity([], ['лосось']) == reference_similarity([], ['лосось']) == 0.0
+
+
+def test_threshold_pruning_keeps_decisions():
+    pruned = 0
+    for source, candidate in _pairs(3000, seed=11):
+        exact = reference_similarity(source, candidate)
+        gated = token_similarity(source, candidate, SIMILARITY_THRESHOLD)
+        score, is_bound = gated_similarity(source, candidate, SIMILARITY_THRESHOLD)
+        assert score == gated
+        assert (gated >= SIMILARITY_THRESHOLD) == (exact >= SIMILARITY_THRESHOLD)
+        if is_bound:
+            assert exact <= gated < SIMILARITY_THRESHOLD                      # верхняя оценка
+            pruned += 1
+        else:
+            assert gated == exact
+    assert pruned > 0
+
+
+def test_profiles_are_cached():
+    a = token_profile(['филе', 'лосось', 'филе'])
+    assert a is token_profile(['филе', 'лосось', 'филе'])
+    assert a.size == 2 and a.text == 'лосось филе филе'
+    assert a.tokens == frozenset({'филе', 'лосось'})
+
+
+def test_npc_modules_use_kernel():
+    load_npc_data()
+    tokens = extract_semantic_tokens('Лосось филе на коже с/м')
+    other = extract_semantic_tokens('Лосось филе без кожи премиум')
+    assert calculate_similarity(tokens, other) == reference_similarity(tokens, other)
+    assert npc_fish_fillet.calculate_similarity(tokens, other) == reference_similarity(tokens, other)
+
+    result = explain_npc_match('Треска филе с/м', 'Треска филе с/м премиум отборная атлантическая')
+    strict = result['strict_result']
+    assert strict['passed'] is False
+    assert 'SIMILARITY_TOO_LOW' in strict['block_reason']
+    # Отсечённая пара: в отчёте верхняя оценка, помеченная как оценка
+    assert strict['similarity_is_bound'] is ('<=' in strict['block_reason'])
@@ -10,23 +10,15 @@ UNIVERSAL Product Name → super_class Mapper
 3. Извлечение наиболее частого super_class среди matches
 4. Fallback на 'other' если не найдено
 """
-import os
 import re
-from pymongo import MongoClient
 from collections import Counter
 
-# Global cache
-_super_class_cache = None
-_db_connection = None
+from reference_data import reference_registry
+
 
 def get_db():
-    """Get MongoDB connection"""
-    global _db_connection
-    if _db_connection is None:
-        mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-        db_name = os.environ.get('DB_NAME', 'test_database')
-        _db_connection = MongoClient(mongo_url)[db_name]
-    return _db_connection
+    """Get MongoDB connection (shared reference_data registry client)"""
+    return reference_registry.db
 
 def normalize_text(text):
     """Normalize text for matching"""
@@ -50,12 +42,12 @@ def extract_key_terms(text):
     
     return key_terms
 
-def build_super_class_index():
+def build_super_class_index(db=None):
     """Build index of keywords → super_class from supplier_items
     
     Returns dict: {keyword: {super_class: count}}
     """
-    db = get_db()
+    db = db if db is not None else get_db()
     
     print("📚 Building super_class index from supplier_items...")
     
@@ -90,11 +82,8 @@ def build_super_class_index():
     return keyword_to_classes
 
 def get_super_class_index():
-    """Get or build super_class index"""
-    global _super_class_cache
-    if _super_class_cache is None:
-        _super_class_cache = build_super_class_index()
-    return _super_class_cache
+    """Get or build super_class index (reference_data registry snapshot)"""
+    return reference_registry.get('super_class_index')
 
 def detect_super_class(product_name, min_confidence=0.3):
     """Detect super_class from product name
@@ -0,0 +1,24 @@
+"""
+Shared helper for API tests that start admin jobs
+
+Long admin operations (brand backfill, favorites migration, ...) answer with
+a job id; tests poll /api/v12/admin/jobs/{job_id} until the job finishes.
+"""
+
+import pytest
+import requests
+import os
+import time
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://smart-match-engine.preview.emergentagent.com').rstrip('/')
+
+
+def wait_for_job(headers, job_id, timeout=300):
+    """Poll /api/v12/admin/jobs/{job_id} until the admin job finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = requests.get(f"{BASE_URL}/api/v12/admin/jobs/{job_id}", headers=headers).json()
+        if job.get("status") not in ("queued", "running"):
+            return job
+        time.sleep(2)
+    pytest.fail(f"Job {job_id} did not finish in {timeout}s")
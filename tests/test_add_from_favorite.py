@@ -18,6 +18,8 @@ import pytest
 import requests
 import os
 
+from tests.admin_jobs import wait_for_job
+
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://smart-match-engine.preview.emergentagent.com').rstrip('/')
 
 # Test credentials
@@ -216,6 +218,53 @@ class TestAddFromFavoriteOldFormat:
         return data
 
 
+class TestBatchEndpoints:
+    """Batch-варианты: по ответу на каждую ссылку, в порядке запроса, в схеме одиночного эндпоинта"""
+    
+    def test_select_offer_batch_matches_single(self, auth_headers):
+        """select-offer:batch возвращает то же, что /cart/select-offer по каждой ссылке"""
+        references = [
+            {"reference_item": {"name_raw": "Сибас охлажденный", "unit_norm": "kg", "brand_critical": False},
+             "match_threshold": 0.4, "required_volume": 1.0},
+            {"reference_item": {"name_raw": ""}},
+        ]
+        response = requests.post(f"{BASE_URL}/api/cart/select-offer:batch", headers=auth_headers,
+                                 json={"items": references})
+        assert response.status_code == 200, f"Request failed: {response.text}"
+        
+        batch = response.json()
+        assert len(batch) == 2
+        assert batch[1]["reason"] == "INSUFFICIENT_DATA"
+        
+        single = requests.post(f"{BASE_URL}/api/cart/select-offer", headers=auth_headers,
+                               json=references[0]).json()
+        assert batch[0]["reason"] == single["reason"]
+        assert (batch[0]["selected_offer"] or {}).get("supplier_item_id") == \
+            (single["selected_offer"] or {}).get("supplier_item_id")
+    
+    def test_add_from_favorite_batch(self, auth_headers):
+        """add-from-favorite:batch: статусы как у одиночного вызова, неизвестный favorite - not_found"""
+        response = requests.post(
+            f"{BASE_URL}/api/cart/add-from-favorite:batch",
+            headers=auth_headers,
+            json={"items": [
+                {"favorite_id": "FAV_TEST_1", "qty": 1},
+                {"favorite_id": "FAV_TEST_2", "qty": 1},
+                {"favorite_id": "FAV_DOES_NOT_EXIST", "qty": 1},
+            ]}
+        )
+        assert response.status_code == 200, f"Request failed: {response.text}"
+        
+        data = response.json()
+        assert len(data) == 3
+        assert [r["status"] != "error" for r in data[:2]] == [True, True], data
+        assert data[0]["debug_log"]["brand_critical"] == False
+        assert data[1]["debug_log"]["brand_critical"] == True
+        assert data[2]["status"] == "not_found"
+        # Ответы - в порядке запроса
+        assert [r["debug_log"].get("favorite_id") for r in data[:2]] == ["FAV_TEST_1", "FAV_TEST_2"]
+
+
 class TestDebugLogFields:
     """ТЕСТ E: debug_log должен содержать все необходимые поля"""
     
@@ -312,9 +361,13 @@ class TestMigrateV2Endpoint:
         data = response.json()
         
         assert data.get("success") == True, f"Migration failed: {data}"
-        assert "stats" in data, "No stats in response"
+        assert data.get("job_id"), "No job_id in response"
+        
+        job = wait_for_job(auth_headers, data["job_id"])
+        assert job["status"] == "succeeded", f"Migration job failed: {job}"
+        assert "stats" in job["result"], "No stats in job result"
         
-        stats = data["stats"]
+        stats = job["result"]["stats"]
         print(f"✅ ТЕСТ H: /api/admin/favorites/migrate-v2 работает")
         print(f"   Total: {stats.get('total')}")
         print(f"   Migrated: {stats.get('migrated')}")
@@ -15,6 +15,8 @@ import pytest
 import requests
 import os
 
+from tests.admin_jobs import wait_for_job
+
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://smart-match-engine.preview.emergentagent.com').rstrip('/')
 
 # Test credentials
@@ -126,10 +128,15 @@ class TestBrandBackfill:
         data = response.json()
         
         assert data.get("success") == True, "Backfill not successful"
-        assert "stats" in data, "No stats in response"
-        assert "top_brands" in data, "No top_brands in response"
+        assert data.get("job_id"), "No job_id in response"
+        
+        job = wait_for_job(auth_headers, data["job_id"])
+        assert job["status"] == "succeeded", f"Backfill job failed: {job}"
+        result = job["result"]
+        assert "stats" in result, "No stats in job result"
+        assert "top_brands" in result, "No top_brands in job result"
         
-        stats = data["stats"]
+        stats = result["stats"]
         assert "total_products" in stats
         assert "branded" in stats
         assert "no_brand" in stats